@@ -0,0 +1,49 @@
+import os
+from typing import Iterator, List
+
+import pytest
+
+# Console logging would dominate the timings of the fast tools
+os.environ.setdefault("CURSOR_AGENT_LOG_LEVEL", "WARNING")
+
+from benchmarks.synthetic_repo import generate_large_file, generate_repo  # noqa: E402
+
+DEFAULT_REPO_SIZES = "1000,100000"
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption(
+        "--repo-sizes",
+        default=os.environ.get("BENCHMARK_REPO_SIZES", DEFAULT_REPO_SIZES),
+        help=f"Comma-separated file counts of the generated repositories (default: {DEFAULT_REPO_SIZES})",
+    )
+
+
+def _repo_sizes(config: pytest.Config) -> List[int]:
+    return [int(size) for size in config.getoption("--repo-sizes").split(",") if size.strip()]
+
+
+def pytest_generate_tests(metafunc: pytest.Metafunc) -> None:
+    """Run benchmarks using the repo fixture once per repository size."""
+    if "repo_size" in metafunc.fixturenames:
+        sizes = _repo_sizes(metafunc.config)
+        metafunc.parametrize("repo_size", sizes, ids=[f"{size}files" for size in sizes], scope="session")
+
+
+@pytest.fixture(scope="session")
+def repo(repo_size: int, tmp_path_factory: pytest.TempPathFactory) -> str:
+    """A generated repository of repo_size files, created once per session."""
+    return generate_repo(str(tmp_path_factory.mktemp(f"repo_{repo_size}")), repo_size)
+
+
+@pytest.fixture
+def in_repo(repo: str, monkeypatch: pytest.MonkeyPatch) -> Iterator[str]:
+    """The generated repository as the working directory (the search tools search the cwd)."""
+    monkeypatch.chdir(repo)
+    yield repo
+
+
+@pytest.fixture(scope="session")
+def large_file(tmp_path_factory: pytest.TempPathFactory) -> str:
+    """A Python file of about 20,000 lines."""
+    return generate_large_file(str(tmp_path_factory.mktemp("large") / "large_module.py"), 20_000)
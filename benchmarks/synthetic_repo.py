@@ -0,0 +1,152 @@
+"""
+Deterministic synthetic repositories for the tool benchmarks.
+
+generate_repo() writes a tree of small Python, Markdown and JSON files that looks
+enough like a real project for the search tools: nested packages, imports,
+functions and classes with varied identifiers. The same seed and size always
+produce the same tree, so results of different runs can be compared.
+
+A few marker strings with known frequencies are planted in the files:
+
+- NEEDLE_RARE appears in about one file in a thousand
+- NEEDLE_COMMON appears in about one file in ten
+- files whose name contains FILE_MARKER exist once per thousand files
+"""
+
+import os
+import random
+from typing import List
+
+NEEDLE_RARE = "frobnicate_checkpoint"
+NEEDLE_COMMON = "resolve_handler"
+FILE_MARKER = "needle_module"
+
+# Files per directory, and directories per level, of the generated tree
+FILES_PER_DIR = 50
+DIRS_PER_LEVEL = 20
+
+_WORDS = (
+    "account", "buffer", "cache", "config", "cursor", "event", "handler", "index", "job",
+    "loader", "message", "model", "parser", "queue", "record", "request", "session",
+    "stream", "token", "user", "worker", "writer",
+)
+
+_PYTHON_TEMPLATE = '''"""{doc}"""
+
+import os
+from typing import Any, Dict, List
+
+from .{module} import {klass}
+
+
+class {name}({klass}):
+    """{doc}"""
+
+    def __init__(self, {arg}: Dict[str, Any]) -> None:
+        super().__init__()
+        self.{arg} = {arg}
+
+    def {method}(self, items: List[str]) -> List[str]:
+        result = []
+        for item in items:
+            if item.startswith("{word}"):
+                result.append(os.path.join(self.{arg}.get("root", ""), item))
+        return result
+{extra}
+'''
+
+
+def _python_file(rng: random.Random, index: int) -> str:
+    a, b, c = rng.sample(_WORDS, 3)
+    extra = ""
+    if index % 10 == 0:
+        extra += f"\n\ndef {NEEDLE_COMMON}(event: Dict[str, Any]) -> Any:\n    return event.get(\"{a}\")\n"
+    if index % 1000 == 1:
+        extra += f"\n\ndef {NEEDLE_RARE}() -> None:\n    pass\n"
+    return _PYTHON_TEMPLATE.format(
+        doc=f"{a.title()} {b} utilities ({index}).",
+        module=f"{b}_{c}",
+        klass=f"{b.title()}Base",
+        name=f"{a.title()}{b.title()}{index}",
+        arg=f"{c}_options",
+        method=f"collect_{a}s",
+        word=b,
+        extra=extra,
+    )
+
+
+def _text_file(rng: random.Random, index: int) -> str:
+    words = [rng.choice(_WORDS) for _ in range(60)]
+    if index % 10 == 0:
+        words.append(NEEDLE_COMMON)
+    return f"# Notes {index}\n\n" + "\n".join(" ".join(words[i:i + 12]) for i in range(0, len(words), 12)) + "\n"
+
+
+def _json_file(rng: random.Random, index: int) -> str:
+    keys = rng.sample(_WORDS, 5)
+    return "{\n" + ",\n".join(f'  "{key}": {rng.randint(0, 10_000)}' for key in keys) + f',\n  "id": {index}\n}}\n'
+
+
+def file_paths(size: int) -> List[str]:
+    """Relative paths of the files of a generated repository of the given size."""
+    paths = []
+    for index in range(size):
+        directory = index // FILES_PER_DIR
+        parts = []
+        while True:
+            parts.append(f"pkg_{directory % DIRS_PER_LEVEL}")
+            directory //= DIRS_PER_LEVEL
+            if not directory:
+                break
+        kind = index % 10
+        if index % 1000 == 3:
+            name = f"{FILE_MARKER}_{index}.py"
+        elif kind < 7:
+            name = f"module_{index}.py"
+        elif kind < 9:
+            name = f"notes_{index}.md"
+        else:
+            name = f"data_{index}.json"
+        paths.append(os.path.join("src", *reversed(parts), name))
+    return paths
+
+
+def generate_repo(root: str, size: int, seed: int = 0) -> str:
+    """
+    Write a synthetic repository of size files under root.
+
+    Args:
+        root: Directory to create the repository in
+        size: Number of files
+        seed: Seed of the file contents
+
+    Returns:
+        The root directory
+    """
+    rng = random.Random(seed)
+    for index, path in enumerate(file_paths(size)):
+        full_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if path.endswith(".py"):
+            content = _python_file(rng, index)
+        elif path.endswith(".md"):
+            content = _text_file(rng, index)
+        else:
+            content = _json_file(rng, index)
+        with open(full_path, "w", encoding="utf-8") as f:
+            f.write(content)
+    return root
+
+
+def generate_large_file(path: str, lines: int, seed: int = 0) -> str:
+    """Write a single Python file of about the given number of lines."""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        written = 0
+        index = 0
+        while written < lines:
+            chunk = _python_file(rng, index)
+            f.write(chunk)
+            written += chunk.count("\n")
+            index += 1
+    return path
@@ -0,0 +1,116 @@
+"""
+End-to-end benchmarks of agent turns against the local mock provider.
+
+Each agent class talks to a MockProviderServer through its real client library,
+so a turn covers request building, HTTP, response parsing, tool execution and
+the follow-up request. The server answers instantly; the timings are the
+client-side overhead of a turn.
+"""
+
+import asyncio
+import os
+from typing import Any, Callable, Dict, Iterator, List
+
+import pytest
+
+from cursor_agent_tools.base import BaseAgent
+from cursor_agent_tools.claude_agent import ClaudeAgent
+from cursor_agent_tools.mock_provider import MockProviderServer
+from cursor_agent_tools.ollama_agent import OllamaAgent
+from cursor_agent_tools.openai_agent import OpenAIAgent
+from cursor_agent_tools.permissions import PermissionOptions
+from cursor_agent_tools.qwen_agent import QwenAgent
+
+FINAL_TEXT = "The workspace contains a settings module and a README."
+
+
+def _claude(url: str, monkeypatch: pytest.MonkeyPatch) -> BaseAgent:
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", url)
+    return ClaudeAgent(api_key="sk-ant-dummy-benchmark", permission_options=PermissionOptions(yolo_mode=True))
+
+
+def _openai(url: str, monkeypatch: pytest.MonkeyPatch) -> BaseAgent:
+    monkeypatch.setenv("OPENAI_BASE_URL", f"{url}/v1")
+    return OpenAIAgent(api_key="sk-benchmark-0000000000000000", model="gpt-4o",
+                       permission_options=PermissionOptions(yolo_mode=True))
+
+
+def _qwen(url: str, monkeypatch: pytest.MonkeyPatch) -> BaseAgent:
+    return QwenAgent(api_key="sk-benchmark-0000000000000000", model="qwen-plus", base_url=f"{url}/v1",
+                     permission_options=PermissionOptions(yolo_mode=True))
+
+
+def _ollama(url: str, monkeypatch: pytest.MonkeyPatch) -> BaseAgent:
+    return OllamaAgent(model="llama3", host=url, permission_options=PermissionOptions(yolo_mode=True))
+
+
+AGENTS: Dict[str, Callable[[str, pytest.MonkeyPatch], BaseAgent]] = {
+    "claude": _claude,
+    "openai": _openai,
+    "qwen": _qwen,
+    "ollama": _ollama,
+}
+
+
+@pytest.fixture
+def workspace(tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> str:
+    """A small workspace the scripted tool calls work on."""
+    (tmp_path / "settings.py").write_text("".join(f"OPTION_{i} = {i}\n" for i in range(200)))
+    (tmp_path / "README.md").write_text("# Benchmark workspace\n")
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def loop() -> Iterator[asyncio.AbstractEventLoop]:
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def _tool_script(workspace: str) -> List[Dict[str, Any]]:
+    return [
+        {"tool_calls": [
+            {"name": "read_file", "arguments": {"target_file": os.path.join(workspace, "settings.py"),
+                                                "should_read_entire_file": True}},
+            {"name": "list_directory", "arguments": {"relative_workspace_path": workspace}},
+        ]},
+        {"text": FINAL_TEXT},
+    ]
+
+
+def _run_turns(benchmark: Any, agent: BaseAgent, loop: asyncio.AbstractEventLoop, message: str) -> Any:
+    def turn() -> Any:
+        # Every round is the first turn of a conversation, so rounds are comparable
+        agent.conversation_history = []
+        return loop.run_until_complete(agent.chat(message))
+
+    return benchmark(turn)
+
+
+@pytest.mark.parametrize("provider", list(AGENTS))
+def test_chat_text_turn(benchmark: Any, provider: str, workspace: str, loop: asyncio.AbstractEventLoop,
+                        monkeypatch: pytest.MonkeyPatch) -> None:
+    """A turn answered with text in one request."""
+    with MockProviderServer([{"text": FINAL_TEXT}]) as server:
+        agent = AGENTS[provider](server.url, monkeypatch)
+        agent.register_default_tools()
+
+        response = _run_turns(benchmark, agent, loop, "What is in this workspace?")
+
+    message = response if isinstance(response, str) else response["message"]
+    assert message == FINAL_TEXT
+
+
+@pytest.mark.parametrize("provider", list(AGENTS))
+def test_chat_tool_turn(benchmark: Any, provider: str, workspace: str, loop: asyncio.AbstractEventLoop,
+                        monkeypatch: pytest.MonkeyPatch) -> None:
+    """A turn with two tool calls and a follow-up request with their results."""
+    with MockProviderServer(_tool_script(workspace)) as server:
+        agent = AGENTS[provider](server.url, monkeypatch)
+        agent.register_default_tools()
+
+        response = _run_turns(benchmark, agent, loop, "What is in this workspace?")
+
+    assert [call["name"] for call in response["tool_calls"]] == ["read_file", "list_directory"]
+    assert response["message"] == FINAL_TEXT
@@ -0,0 +1,49 @@
+"""
+Import-time benchmarks: how long a fresh interpreter takes to load what the CLI,
+a web backend worker or a single provider needs.
+
+Each round starts a new Python process, so the timings include interpreter
+startup; the "interpreter" case measures that alone. "all_providers" imports
+every agent module, which is what importing the package cost before its
+attributes became lazy.
+"""
+
+import os
+import subprocess
+import sys
+from typing import Any
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_ROUNDS = 10
+
+STATEMENTS = {
+    "interpreter": "pass",
+    "package": "import cursor_agent_tools",
+    "tools": "import cursor_agent_tools.tools",
+    "cli": "from cursor_agent_tools import run_agent_interactive",
+    "web_worker": "import agent_workers",
+    "one_provider": "from cursor_agent_tools import OpenAIAgent",
+    "all_providers": "import cursor_agent_tools; cursor_agent_tools._agent_classes",
+}
+
+# Modules that only the agent classes and web search need
+PROVIDER_MODULES = ("anthropic", "openai", "ollama", "httpx", "requests", "bs4")
+
+
+def _python(statement: str) -> str:
+    """Run a statement in a fresh interpreter; returns the heavy modules it left loaded."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([REPO_ROOT, os.path.join(REPO_ROOT, "web_backend")]))
+    code = f"{statement}\nimport sys\nprint(','.join(m for m in {PROVIDER_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], env=env, cwd=REPO_ROOT,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+@pytest.mark.parametrize("case", list(STATEMENTS))
+def test_import_time(benchmark: Any, case: str) -> None:
+    loaded = benchmark.pedantic(_python, args=(STATEMENTS[case],), rounds=IMPORT_ROUNDS, iterations=1, warmup_rounds=1)
+    if case in ("package", "tools", "cli", "web_worker"):
+        assert loaded == ""
@@ -0,0 +1,88 @@
+"""
+Benchmarks of the file, search and terminal tools.
+
+The search tools walk the generated repositories (see conftest.py for the sizes);
+the file tools work on a single large file.
+"""
+
+from typing import Any, Dict
+
+import pytest
+
+from benchmarks.synthetic_repo import FILE_MARKER, NEEDLE_COMMON, NEEDLE_RARE
+from cursor_agent_tools.tools.file_tools import apply_line_based_edit, read_file
+from cursor_agent_tools.tools.search_tools import codebase_search, file_search, grep_search
+from cursor_agent_tools.tools.system_tools import run_terminal_command
+
+# Rounds of the tools that walk a whole repository, which take seconds on the large ones
+WALK_ROUNDS = 3
+
+
+def _walk(benchmark: Any, function: Any, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+    result = benchmark.pedantic(function, args=args, kwargs=kwargs, rounds=WALK_ROUNDS, iterations=1, warmup_rounds=1)
+    assert "error" not in result, result
+    return result
+
+
+@pytest.mark.parametrize("query", [NEEDLE_RARE, NEEDLE_COMMON])
+def test_codebase_search(benchmark: Any, repo: str, query: str) -> None:
+    result = _walk(benchmark, codebase_search, query, [repo])
+    assert result["results"]
+
+
+@pytest.mark.parametrize("query", [NEEDLE_RARE, NEEDLE_COMMON])
+def test_grep_search(benchmark: Any, in_repo: str, query: str) -> None:
+    result = _walk(benchmark, grep_search, query)
+    assert result["results"]
+
+
+def test_grep_search_no_match(benchmark: Any, in_repo: str) -> None:
+    """The worst case: every file is read and nothing stops the walk early."""
+    result = _walk(benchmark, grep_search, "no_such_identifier_anywhere")
+    assert result["results"] == []
+
+
+def test_file_search(benchmark: Any, in_repo: str) -> None:
+    result = _walk(benchmark, file_search, FILE_MARKER)
+    assert result["results"]
+
+
+def test_file_search_no_match(benchmark: Any, in_repo: str) -> None:
+    result = _walk(benchmark, file_search, "no_such_file_anywhere")
+    assert result["results"] == []
+
+
+def test_read_file_range(benchmark: Any, large_file: str) -> None:
+    result = benchmark(read_file, large_file, 10_000, 150)
+    assert result["start_line"] == 10_000
+
+
+def test_read_file_entire(benchmark: Any, large_file: str) -> None:
+    result = benchmark(read_file, large_file, should_read_entire_file=True)
+    assert result["total_lines"] >= 20_000
+
+
+@pytest.mark.parametrize("edits", [1, 100])
+def test_apply_line_based_edit(benchmark: Any, large_file: str, edits: int) -> None:
+    with open(large_file, encoding="utf-8") as f:
+        content = f.read()
+    step = 20_000 // edits
+    line_edits = {f"{start}-{start + 2}": f"# edited {start}\n" for start in range(1, 20_000, step)}
+
+    result = benchmark(apply_line_based_edit, content, line_edits)
+    assert "# edited 1\n" in result
+
+
+def test_run_terminal_command(benchmark: Any, tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    result = benchmark(run_terminal_command, "echo benchmark", require_user_approval=False)
+    assert result["stdout"] == "benchmark\n"
+
+
+def test_run_terminal_command_large_output(benchmark: Any, tmp_path: Any, monkeypatch: pytest.MonkeyPatch) -> None:
+    """A command writing about 1 MB, which is streamed through the output buffers."""
+    monkeypatch.chdir(tmp_path)
+    result = benchmark.pedantic(
+        run_terminal_command, args=("seq 1 150000",), kwargs={"require_user_approval": False}, rounds=10, iterations=1
+    )
+    assert "error" not in result, result
@@ -1,51 +1,82 @@
 import os
 import importlib
 import inspect
-from typing import List, Type, Any, Dict, Callable, Optional, Union, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List
 
-# Import core functionality directly
-from .base import BaseAgent
-from .factory import create_agent
-from .permissions import PermissionOptions
+# Public attributes and the modules defining them. They are imported on first
+# access (PEP 562), so importing the package, or one of its modules such as the
+# tools, doesn't load the provider SDKs (anthropic, openai, ollama, httpx).
+_LAZY_ATTRIBUTES = {
+    # Core functionality
+    "BaseAgent": ".base",
+    "create_agent": ".factory",
+    "PermissionOptions": ".permissions",
+    # Interact functions
+    "run_agent_interactive": ".interact",
+    "run_agent_chat": ".interact",
+    # Agent classes
+    "ClaudeAgent": ".claude_agent",
+    "OpenAIAgent": ".openai_agent",
+    "OllamaAgent": ".ollama_agent",
+    "QwenAgent": ".qwen_agent",
+}
 
-# Import interact functions
-from .interact import run_agent_interactive, run_agent_chat
+if TYPE_CHECKING:
+    from .base import BaseAgent
+    from .claude_agent import ClaudeAgent
+    from .factory import create_agent
+    from .interact import run_agent_chat, run_agent_interactive
+    from .ollama_agent import OllamaAgent
+    from .openai_agent import OpenAIAgent
+    from .permissions import PermissionOptions
+    from .qwen_agent import QwenAgent
 
-# Explicitly import agent classes for better type checking
-from .claude_agent import ClaudeAgent
-from .openai_agent import OpenAIAgent
-from .ollama_agent import OllamaAgent
-
-# Dynamic agent class discovery (keeping for backward compatibility)
-_agent_classes = {}
+# Agent module directory
+_current_dir = os.path.dirname(os.path.abspath(__file__))
 
 
 def _is_agent_class(obj: Any) -> bool:
+    from .base import BaseAgent as _BaseAgent
+
     return (
         inspect.isclass(obj)
-        and issubclass(obj, BaseAgent)
-        and obj is not BaseAgent
+        and issubclass(obj, _BaseAgent)
+        and obj is not _BaseAgent
     )
 
 
-# Agent module directory
-_current_dir = os.path.dirname(os.path.abspath(__file__))
+def _discover_agent_classes() -> Dict[str, Any]:
+    """Import every *_agent.py module and collect its agent classes (kept for backward compatibility)."""
+    agent_classes = {}
+    for file in sorted(os.listdir(_current_dir)):
+        if file.endswith('_agent.py') and not file.startswith('__'):
+            module_name = file[:-3]  # Remove .py extension
+            try:
+                module = importlib.import_module(f'.{module_name}', package=__name__)
+                # Find all agent classes in the module
+                for name, obj in inspect.getmembers(module, _is_agent_class):
+                    agent_classes[name] = obj
+            except ImportError as e:
+                print(f"Warning: Could not import {module_name}: {e}")
+    return agent_classes
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is not None:
+        value = getattr(importlib.import_module(module_name, package=__name__), name)
+    elif name == "_agent_classes":
+        # Dynamic agent class discovery, which imports every provider SDK
+        value = _discover_agent_classes()
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Cache it, later lookups don't go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
+
 
-# Load all Python files in the current directory that might contain agent implementations
-for _file in os.listdir(_current_dir):
-    if _file.endswith('_agent.py') and not _file.startswith('__'):
-        _module_name = _file[:-3]  # Remove .py extension
-        try:
-            _module = importlib.import_module(f'.{_module_name}', package='cursor_agent_tools')
-            # Find all agent classes in the module
-            for _name, _obj in inspect.getmembers(_module, _is_agent_class):
-                # Add to our agent classes dict
-                _agent_classes[_name] = _obj
-                # We no longer need to add to globals as we're explicitly importing
-        except ImportError as e:
-            print(f"Warning: Could not import {_module_name}: {e}")
-
-
-# Create __all__ list dynamically
-__all__ = ["BaseAgent", "create_agent", "PermissionOptions", "run_agent_interactive", "run_agent_chat",
-           "ClaudeAgent", "OpenAIAgent", "OllamaAgent"] + list(_agent_classes.keys())
+__all__ = list(_LAZY_ATTRIBUTES)
@@ -1,16 +1,54 @@
 """Base agent module for handling agent operations."""
 
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Callable, Union, TypedDict
+from typing import Any, Awaitable, Dict, List, Optional, Callable, Tuple, TypeVar, Union, TypedDict
+import asyncio
+import contextvars
+import functools
 import json
+import os
+import threading
+import time
 
 from .logger import get_logger
+from .metrics import MODEL_REQUEST_SECONDS, MODEL_TOKENS, TOOL_CALL_SECONDS
 from .permissions import PermissionManager, PermissionOptions, PermissionRequest, PermissionStatus
+from .profiling import ProfileConfig, TurnProfile, TurnProfileReport, turn_profile_name
+from .sandbox import ResourceLimits
+from .tracing import current_trace_id, start_span
+from .usage import UsageBudget, UsageReport, UsageTracker
 
 
 # Initialize logger
 logger = get_logger(__name__)
 
+# Built-in tools that never change the workspace. Any other tool bumps the agent's
+# workspace generation, invalidating cached command results; run_terminal_command
+# decides per command.
+READ_ONLY_TOOLS = frozenset({
+    "read_file", "list_directory", "codebase_search", "grep_search", "file_search",
+    "web_search", "trend_search", "query_images", "job_status", "job_output",
+    "run_terminal_command",
+})
+
+# Built-in tools that can run at the same time as other calls of a model turn:
+# they only read, and don't ask for permission
+CONCURRENT_TOOLS = frozenset({
+    "read_file", "list_directory", "codebase_search", "grep_search", "file_search",
+    "web_search", "trend_search", "job_status", "job_output",
+})
+
+# Built-in tools that ask for permission: the operation they request and the
+# arguments that make up its details, so the permissions of a whole model turn
+# can be requested up front (see BaseAgent._request_tool_permissions)
+TOOL_PERMISSIONS = {
+    "edit_file": ("edit_file", ("target_file", "instructions")),
+    "create_file": ("create_file", ("file_path",)),
+    "delete_file": ("delete_file", ("target_file",)),
+    "run_terminal_command": ("run_terminal_command", ("command", "explanation", "is_background")),
+    "query_images": ("read_image", ("query", "image_paths")),
+}
+
 
 class ToolCall(TypedDict):
     name: str
@@ -31,13 +69,94 @@ class AgentToolCall(TypedDict):
     thinking: Optional[str]
 
 
-class AgentResponse(TypedDict):
-    """TypedDict for representing the response from an agent"""
+class _AgentResponseBase(TypedDict):
     message: str
     tool_calls: List[AgentToolCall]
     thinking: Optional[str]
 
 
+class AgentResponse(_AgentResponseBase, total=False):
+    """TypedDict for representing the response from an agent"""
+    usage: UsageReport
+    profile: TurnProfileReport
+
+
+AgentEventCallback = Callable[[str, Dict[str, Any]], None]
+
+ChatMethod = TypeVar("ChatMethod", bound=Callable[..., Awaitable[Any]])
+
+
+def _payload_size(value: Any) -> int:
+    """Size of a tool argument or result as the model sees it, in characters."""
+    if isinstance(value, str):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(str(value))
+
+
+def _response_field(value: Any, *names: str) -> Any:
+    """The first of the named fields set on a provider response object or dict."""
+    for name in names:
+        field = value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+        if field is not None:
+            return field
+    return None
+
+
+class AgentCancelledError(Exception):
+    """Raised when a tool is invoked after the current chat turn was cancelled."""
+
+
+def agent_turn(chat: ChatMethod) -> ChatMethod:
+    """
+    Decorator for agent ``chat`` implementations that tracks the in-flight turn.
+
+    It records the task running the turn so that ``BaseAgent.cancel`` can cancel it
+    (which also aborts any pending provider HTTP request), and rolls the conversation
+    history back to its state before the turn if the turn is cancelled, so that no
+    half-finished exchange (e.g. a tool call without its result) is left behind.
+    The turn runs in an ``agent.chat`` span, the parent of its model request and
+    tool spans.
+
+    A turn is refused with BudgetExceededError if the session has used up its
+    usage budget; dict responses get the turn's and the session's usage attached.
+    If the agent profiles its turns, the turn runs under the profiler and dict
+    responses also get the turn's timing breakdown.
+    """
+    @functools.wraps(chat)
+    async def wrapper(self: "BaseAgent", *args: Any, **kwargs: Any) -> Any:
+        self.usage.check_budget()
+        message = kwargs.get("message", args[0] if args else None)
+        with start_span(f"agent.{chat.__name__}", {
+            "agent.class": type(self).__name__,
+            "gen_ai.request.model": self.model,
+            "agent.message_length": len(message) if isinstance(message, str) else None,
+        }):
+            history_mark = self._begin_turn()
+            profile = self._start_turn_profile() if self.profile_config is not None else None
+            try:
+                response = await chat(self, *args, **kwargs)
+            except asyncio.CancelledError:
+                self._rollback_turn(history_mark)
+                raise
+            finally:
+                self._turn_task = None
+                if profile is not None:
+                    profile.stop()
+                    self._turn_profile = None
+            if isinstance(response, dict):
+                response["usage"] = self.usage.report()
+                if profile is not None:
+                    response["profile"] = profile.report(response["usage"]["turn"]["latency"], profile.write())
+            elif profile is not None:
+                profile.write()
+            return response
+
+    return wrapper  # type: ignore[return-value]
+
+
 class BaseAgent(ABC):
     """
     Base abstract class for AI agents that use function calling capabilities.
@@ -51,6 +170,7 @@ class BaseAgent(ABC):
         permission_options: Optional[PermissionOptions] = None,
         permission_callback: Optional[Callable[[PermissionRequest], PermissionStatus]] = None,
         default_tool_timeout: int = 300,
+        profile: Union[bool, str, ProfileConfig, None] = None,
     ):
         """
         Initialize the agent.
@@ -61,6 +181,9 @@ class BaseAgent(ABC):
             permission_options: Configuration options for permissions
             permission_callback: Optional callback for handling permission requests
             default_tool_timeout: Default timeout for tool calls in seconds (default: 300s)
+            profile: Profile every chat turn: True or "sample" for the sampling profiler,
+                     "cprofile", a ProfileConfig, False to disable, or None to follow the
+                     CURSOR_AGENT_PROFILE environment variable (see profiling.py)
         """
         self.api_key: Optional[str] = api_key
         self.model: Optional[str] = model
@@ -77,6 +200,41 @@ class BaseAgent(ABC):
         # Default timeout for tool executions
         self.default_tool_timeout = default_tool_timeout
 
+        # Optional listener for progress events (tool start/end etc.), e.g. a web transport
+        self.event_callback: Optional[AgentEventCallback] = None
+
+        # Cancellation state for the in-flight chat turn
+        self._cancel_event = threading.Event()
+        self._cancel_hooks: List[Callable[[], None]] = []
+        self._cancel_hooks_lock = threading.Lock()
+        self._turn_task: Optional["asyncio.Task[Any]"] = None
+
+        # Tokens, latency and estimated cost of model requests, per turn and per session
+        self.usage = UsageTracker()
+
+        # Run terminal commands in one long-lived shell so cwd, env vars and venv activation
+        # persist between calls (opt-in via CURSOR_AGENT_PERSISTENT_SHELL=1)
+        self.persistent_shell: bool = os.environ.get("CURSOR_AGENT_PERSISTENT_SHELL", "").lower() in ("1", "true", "yes")
+
+        # Optional CPU/memory/file/process limits for terminal commands
+        # (CURSOR_AGENT_LIMIT_* environment variables; None means unlimited)
+        self.resource_limits: Optional[ResourceLimits] = ResourceLimits.from_env()
+
+        # Serve repeated read-only commands (git status, ls, ...) from a cache
+        # (opt-in via CURSOR_AGENT_COMMAND_CACHE=1)
+        self.cache_read_only_commands: bool = os.environ.get("CURSOR_AGENT_COMMAND_CACHE", "").lower() in ("1", "true", "yes")
+
+        # Incremented whenever a tool may have changed the workspace; part of the
+        # fingerprint of cached command results
+        self.workspace_generation = 0
+
+        # Cleanup callbacks for resources owned by tools (shell sessions etc.), run by close()
+        self._close_hooks: List[Callable[[], None]] = []
+
+        # Per-turn profiling (None when disabled) and the profile of the turn in progress
+        self.profile_config: Optional[ProfileConfig] = ProfileConfig.resolve(profile)
+        self._turn_profile: Optional[TurnProfile] = None
+
         logger.debug(f"Initialized {self.__class__.__name__} with default tool timeout: {default_tool_timeout}s")
 
     @abstractmethod
@@ -174,6 +332,428 @@ class BaseAgent(ABC):
         """
         pass
 
+    def set_event_callback(self, callback: Optional[AgentEventCallback]) -> None:
+        """
+        Set a listener that receives progress events emitted while the agent works.
+
+        The callback is invoked as ``callback(event_type, data)`` and may be called
+        from a worker thread, so it must be thread-safe.
+
+        Args:
+            callback: The event listener, or None to remove the current one
+        """
+        self.event_callback = callback
+
+    def _emit_event(self, event_type: str, data: Dict[str, Any]) -> None:
+        """
+        Forward a progress event to the registered event callback, if any.
+
+        Errors raised by the callback are logged and swallowed so that a broken
+        listener never interrupts the agent.
+
+        Args:
+            event_type: Type of the event (e.g. 'tool_start', 'tool_end')
+            data: JSON-serializable event payload
+        """
+        if self.event_callback is None:
+            return
+        try:
+            self.event_callback(event_type, data)
+        except Exception as e:
+            logger.warning(f"Event callback failed for {event_type}: {str(e)}")
+
+    @property
+    def is_cancelled(self) -> bool:
+        """Whether the current chat turn has been cancelled."""
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> bool:
+        """
+        Cancel the in-flight chat turn.
+
+        Safe to call from any thread. Cancels the task running the turn (aborting a
+        pending provider request), runs the registered cancel hooks (e.g. terminating
+        running subprocesses) and makes further tool invocations in this turn fail.
+
+        Returns:
+            True if there was something to cancel, False otherwise
+        """
+        self._cancel_event.set()
+
+        with self._cancel_hooks_lock:
+            hooks = list(self._cancel_hooks)
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.warning(f"Cancel hook failed: {str(e)}")
+
+        task = self._turn_task
+        if task is not None and not task.done():
+            logger.info(f"Cancelling in-flight turn of {self.__class__.__name__}")
+            task.get_loop().call_soon_threadsafe(task.cancel)
+            return True
+        return bool(hooks)
+
+    def add_cancel_hook(self, hook: Callable[[], None]) -> None:
+        """
+        Register a callable to run when the current turn is cancelled.
+
+        Args:
+            hook: Callable taking no arguments, e.g. one that terminates a subprocess
+        """
+        with self._cancel_hooks_lock:
+            self._cancel_hooks.append(hook)
+
+    def remove_cancel_hook(self, hook: Callable[[], None]) -> None:
+        """
+        Unregister a cancel hook previously added with add_cancel_hook.
+
+        Args:
+            hook: The callable to remove
+        """
+        with self._cancel_hooks_lock:
+            if hook in self._cancel_hooks:
+                self._cancel_hooks.remove(hook)
+
+    def add_close_hook(self, hook: Callable[[], None]) -> None:
+        """
+        Register a callable to run when the agent is closed.
+
+        Args:
+            hook: Callable taking no arguments that releases a resource, e.g. a shell process
+        """
+        with self._cancel_hooks_lock:
+            self._close_hooks.append(hook)
+
+    def mark_workspace_changed(self) -> None:
+        """Invalidate cached tool results after the workspace may have been modified."""
+        self.workspace_generation += 1
+
+    def close(self) -> None:
+        """
+        Release resources held by the agent's tools (persistent shell sessions etc.).
+
+        Cancels the in-flight turn first. The agent can still be used afterwards;
+        resources are recreated on demand.
+        """
+        self.cancel()
+        with self._cancel_hooks_lock:
+            hooks = list(self._close_hooks)
+            self._close_hooks.clear()
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.warning(f"Close hook failed: {str(e)}")
+
+    def _begin_turn(self) -> int:
+        """
+        Mark the start of a chat turn.
+
+        Returns:
+            The length of the conversation history before the turn
+        """
+        self._cancel_event.clear()
+        self.usage.begin_turn()
+        try:
+            self._turn_task = asyncio.current_task()
+        except RuntimeError:
+            self._turn_task = None
+        return len(self.conversation_history)
+
+    def get_usage(self) -> UsageReport:
+        """
+        Get the usage of the current (or last) turn and of the whole session.
+
+        Returns:
+            The turn and session totals, the turn's model requests and the budget state
+        """
+        return self.usage.report()
+
+    def set_usage_budget(self, budget: Optional[UsageBudget]) -> None:
+        """
+        Limit the tokens, cost or model time the session may use.
+
+        Once the budget is used up, model requests (including those of a turn in
+        progress) raise BudgetExceededError and new turns are refused.
+
+        Args:
+            budget: The limits, or None to remove them
+        """
+        self.usage.budget = budget
+
+    def _start_turn_profile(self) -> TurnProfile:
+        """Start profiling the turn beginning in the calling thread."""
+        assert self.profile_config is not None
+        profile = TurnProfile(self.profile_config, turn_profile_name(type(self).__name__, current_trace_id()))
+        profile.start()
+        self._turn_profile = profile
+        return profile
+
+    def _rollback_turn(self, history_mark: int) -> None:
+        """
+        Drop the messages a cancelled turn added to the conversation history.
+
+        Args:
+            history_mark: The history length returned by _begin_turn
+        """
+        dropped = len(self.conversation_history) - history_mark
+        if dropped > 0:
+            del self.conversation_history[history_mark:]
+        logger.info(f"Turn cancelled, rolled back {max(dropped, 0)} conversation messages")
+
+    def _invoke_tool(self, name: str, arguments: Dict[str, Any]) -> Any:
+        """
+        Call a registered tool function, emitting 'tool_start' and 'tool_end' events.
+
+        Args:
+            name: Name of the registered tool
+            arguments: Keyword arguments for the tool function
+
+        Returns:
+            Whatever the tool function returns
+
+        Raises:
+            AgentCancelledError: If the current turn has been cancelled
+        """
+        if self.is_cancelled:
+            raise AgentCancelledError(f"Turn cancelled, not running tool '{name}'")
+
+        function = self.available_tools[name]["function"]
+        profile = self._turn_profile
+        with start_span("tool.call", {"tool.name": name}) as span:
+            if span.recording:
+                span.set_attribute("tool.arguments_size", _payload_size(arguments))
+            self._emit_event("tool_start", {"name": name, "parameters": arguments})
+            start_time = time.time()
+            if profile is not None:
+                profile.enter_thread()
+            try:
+                result = function(**arguments)
+            except Exception as e:
+                if name not in READ_ONLY_TOOLS:
+                    self.mark_workspace_changed()
+                duration = time.time() - start_time
+                TOOL_CALL_SECONDS.observe(duration, (name, "error"))
+                if profile is not None:
+                    profile.record_tool(name, duration, error=True)
+                self._emit_event("tool_end", {
+                    "name": name,
+                    "duration": duration,
+                    "error": str(e),
+                })
+                raise
+            finally:
+                if profile is not None:
+                    profile.exit_thread()
+            if name not in READ_ONLY_TOOLS:
+                self.mark_workspace_changed()
+            duration = time.time() - start_time
+            error = result.get("error") if isinstance(result, dict) else None
+            TOOL_CALL_SECONDS.observe(duration, (name, "error" if error else "ok"))
+            if profile is not None:
+                profile.record_tool(name, duration, error=bool(error))
+            if span.recording:
+                span.set_attribute("tool.result_size", _payload_size(result))
+                if error:
+                    span.set_status(False, str(error))
+            self._emit_event("tool_end", {
+                "name": name,
+                "duration": duration,
+                "error": error,
+            })
+            return result
+
+    async def _run_tool_calls(self, tool_calls: Any) -> List[Dict[str, Any]]:
+        """
+        Execute tool calls off the event loop.
+
+        Tools are synchronous (file I/O, subprocesses, blocking permission prompts),
+        so they run in the default executor to keep the event loop responsive, in a
+        copy of the current context so their spans join the turn's trace.
+
+        Args:
+            tool_calls: Tool calls in the format provided by the specific model
+
+        Returns:
+            List of tool call results, as returned by _execute_tool_calls
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, context.run, self._execute_tool_calls_batched, tool_calls)
+
+    async def _model_request(self, request: Awaitable[Any]) -> Any:
+        """
+        Await a provider request in a ``model.request`` span recording the model and token usage.
+
+        The latency and token counts are also recorded in the model request metrics
+        and in the agent's usage.
+
+        Raises:
+            BudgetExceededError: If the session has used up its usage budget
+
+        Args:
+            request: The provider call, e.g. ``self.client.messages.create(...)``
+
+        Returns:
+            The provider response
+        """
+        provider, model = self.provider_name, str(self.model)
+        try:
+            self.usage.check_budget()
+        except BaseException:
+            # Don't leave the un-awaited request coroutine behind
+            close = getattr(request, "close", None)
+            if close is not None:
+                close()
+            raise
+        with start_span("model.request", {
+            "gen_ai.system": provider,
+            "gen_ai.request.model": self.model,
+        }, kind="client") as span:
+            start_time = time.perf_counter()
+            try:
+                response = await request
+            except BaseException:
+                latency = time.perf_counter() - start_time
+                MODEL_REQUEST_SECONDS.observe(latency, (provider, model, "error"))
+                self.usage.record(provider, model, {}, latency)
+                raise
+            latency = time.perf_counter() - start_time
+            MODEL_REQUEST_SECONDS.observe(latency, (provider, model, "ok"))
+            usage = self._response_usage(response)
+            for kind, count in usage.items():
+                MODEL_TOKENS.inc((provider, model, kind[:-len("_tokens")]), count)
+            self.usage.record(provider, model, usage, latency)
+            if span.recording:
+                response_model = _response_field(response, "model")
+                span.set_attributes({
+                    "gen_ai.response.model": response_model if isinstance(response_model, str) else None,
+                    "gen_ai.usage.input_tokens": usage.get("input_tokens"),
+                    "gen_ai.usage.output_tokens": usage.get("output_tokens"),
+                })
+            return response
+
+    @property
+    def provider_name(self) -> str:
+        """Short name of the model provider, e.g. "claude" for ClaudeAgent."""
+        name = type(self).__name__
+        return (name[:-len("Agent")] if name.endswith("Agent") else name).lower()
+
+    @staticmethod
+    def _response_usage(response: Any) -> Dict[str, int]:
+        """
+        Get the token usage of a provider response.
+
+        Understands Anthropic (input_tokens/output_tokens and cache tokens),
+        OpenAI-compatible (prompt_tokens/completion_tokens, cached_tokens) and
+        Ollama (prompt_eval_count/eval_count) responses, as objects or dicts.
+        Cached input tokens are counted separately from input_tokens.
+
+        Returns:
+            Dict with input_tokens, output_tokens, cache_read_tokens and
+            cache_creation_tokens, for the counts the response reports
+        """
+        usage = _response_field(response, "usage")
+        if usage is not None and isinstance(_response_field(usage, "input_tokens"), int):
+            counts = {
+                "input_tokens": _response_field(usage, "input_tokens"),
+                "output_tokens": _response_field(usage, "output_tokens"),
+                "cache_read_tokens": _response_field(usage, "cache_read_input_tokens"),
+                "cache_creation_tokens": _response_field(usage, "cache_creation_input_tokens"),
+            }
+        elif usage is not None:
+            # prompt_tokens includes the cached tokens
+            prompt_tokens = _response_field(usage, "prompt_tokens")
+            details = _response_field(usage, "prompt_tokens_details")
+            cached = _response_field(details, "cached_tokens") if details is not None else None
+            if isinstance(prompt_tokens, int) and isinstance(cached, int):
+                prompt_tokens -= cached
+            counts = {
+                "input_tokens": prompt_tokens,
+                "output_tokens": _response_field(usage, "completion_tokens"),
+                "cache_read_tokens": cached,
+            }
+        else:
+            counts = {
+                "input_tokens": _response_field(response, "prompt_eval_count"),
+                "output_tokens": _response_field(response, "eval_count"),
+            }
+        return {key: value for key, value in counts.items() if isinstance(value, int)}
+
+    def _execute_tool_calls_batched(self, tool_calls: Any) -> List[Dict[str, Any]]:
+        """Ask for the permissions of all tool calls in one interaction, then execute them."""
+        if len(tool_calls) < 2:
+            return self._execute_tool_calls(tool_calls)
+        self._request_tool_permissions(tool_calls)
+        try:
+            return self._execute_tool_calls(tool_calls)
+        finally:
+            self.permission_manager.clear_batch()
+
+    @staticmethod
+    def _parse_tool_call(call: Any) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Get the tool name and arguments of a tool call in any provider's format.
+
+        Returns:
+            (name, arguments), or None if the call can't be parsed
+        """
+        function = getattr(call, "function", None)
+        if function is None and isinstance(call, dict):
+            function = call.get("function")
+        if function is not None:
+            # OpenAI-style: arguments are a JSON string
+            name = getattr(function, "name", None) or (function.get("name") if isinstance(function, dict) else None)
+            arguments = getattr(function, "arguments", None)
+            if arguments is None and isinstance(function, dict):
+                arguments = function.get("arguments")
+            if isinstance(arguments, str):
+                try:
+                    arguments = json.loads(arguments)
+                except json.JSONDecodeError:
+                    return None
+        elif isinstance(call, dict):
+            # Claude ("input") and Ollama ("parameters")
+            name = call.get("name")
+            arguments = call.get("input", call.get("parameters"))
+        else:
+            return None
+        if not name or not isinstance(arguments, dict):
+            return None
+        return name, arguments
+
+    def _request_tool_permissions(self, tool_calls: Any) -> None:
+        """
+        Request the permissions a model turn's tool calls need as one batch.
+
+        The answers are consumed when the tools request their permissions, so the
+        user approves all, none or some of the calls in a single interaction
+        instead of once per call.
+        """
+        requests = []
+        for call in tool_calls:
+            parsed = self._parse_tool_call(call)
+            if parsed is None or parsed[0] not in self.available_tools or parsed[0] not in TOOL_PERMISSIONS:
+                continue
+            name, arguments = parsed
+            operation, keys = TOOL_PERMISSIONS[name]
+            details = {key: arguments[key] for key in keys if key in arguments}
+            if name == "run_terminal_command":
+                # Blocked commands are refused without asking
+                if not isinstance(details.get("command"), str) or self.permission_manager.blocked_command(details["command"]):
+                    continue
+                details.setdefault("explanation", None)
+                details.setdefault("is_background", False)
+            requests.append(PermissionRequest(operation=operation, details=details))
+        if len(requests) > 1:
+            try:
+                self.permission_manager.request_permissions(requests)
+            except Exception as e:
+                # Each tool still asks for its own permission
+                logger.warning(f"Batched permission request failed: {str(e)}")
+
     def request_permission(
         self, operation_type: str, details: Dict[str, Any]
     ) -> bool:
@@ -4,9 +4,10 @@ from typing import Any, Dict, List, Optional, Callable, Union
 
 from anthropic import APIError, AsyncAnthropic, AuthenticationError, BadRequestError, RateLimitError
 
-from .base import BaseAgent, AgentResponse, AgentToolCall
-from .logger import get_logger
+from .base import BaseAgent, AgentResponse, AgentToolCall, agent_turn
+from .logger import get_logger, lazy
 from .permissions import PermissionOptions, PermissionRequest, PermissionStatus
+from .profiling import ProfileConfig
 from .tools.register_tools import register_default_tools
 
 # Initialize logger
@@ -27,6 +28,7 @@ class ClaudeAgent(BaseAgent):
         permission_callback: Optional[Callable[[PermissionRequest], PermissionStatus]] = None,
         permission_options: Optional[PermissionOptions] = None,
         default_tool_timeout: int = 300,
+        profile: Union[bool, str, ProfileConfig, None] = None,
         **kwargs
     ):
         """
@@ -40,6 +42,7 @@ class ClaudeAgent(BaseAgent):
             permission_callback: Optional callback for permission requests
             permission_options: Permission configuration options
             default_tool_timeout: Default timeout in seconds for tool calls (default: 300s)
+            profile: Profile every chat turn (see BaseAgent); None follows CURSOR_AGENT_PROFILE
             **kwargs: Additional parameters to pass to the model
         """
         logger.info(f"Initializing Claude agent with model {model}")
@@ -49,7 +52,8 @@ class ClaudeAgent(BaseAgent):
             model=model,
             permission_options=permission_options,
             permission_callback=permission_callback,
-            default_tool_timeout=default_tool_timeout
+            default_tool_timeout=default_tool_timeout,
+            profile=profile,
         )
 
         self.temperature = temperature
@@ -213,7 +217,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
             arguments = call.get("input", {})
 
             logger.debug(f"Executing tool: {tool_name} (id: {tool_id})")
-            logger.debug(f"Tool arguments: {json.dumps(arguments)}")
+            logger.debug("Tool arguments: %s", lazy(json.dumps, arguments))
 
             # Format for user message with tool_result as required by the Claude API
             result_message = {"role": "user", "content": []}
@@ -232,10 +236,9 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
                 )
             else:
                 try:
-                    function = self.available_tools[tool_name]["function"]
                     # Convert input to the expected format for the function
                     logger.debug(f"Calling function for tool: {tool_name}")
-                    result = function(**arguments)
+                    result = self._invoke_tool(tool_name, arguments)
 
                     # Format the result based on whether it's a string or a JSON-serializable object
                     content = result if isinstance(result, str) else json.dumps(result)
@@ -270,6 +273,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
         logger.info(f"Completed {len(tool_results)} tool call results")
         return tool_results
 
+    @agent_turn
     async def chat(self, message: str, user_info: Optional[Dict[str, Any]] = None) -> Union[str, AgentResponse]:
         """
         Send a message to Claude and get a response.
@@ -344,7 +348,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
 
             # Make the API call
             logger.debug("Initiating API call to Claude")
-            response = await self.client.messages.create(**api_params)  # type: ignore
+            response = await self._model_request(self.client.messages.create(**api_params))  # type: ignore
             logger.info("Received response from Claude API")
 
             # Process any tool calls
@@ -377,7 +381,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
                 logger.info(f"Extracted {len(tool_calls)} tool calls from response")
 
                 # Execute tool calls
-                tool_results = self._execute_tool_calls(tool_calls)
+                tool_results = await self._run_tool_calls(tool_calls)
 
                 # Process and track tool calls for the structured response
                 for idx, tool_call in enumerate(tool_calls):
@@ -418,13 +422,13 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
 
                     # Make a follow-up API call with the tool results
                     logger.debug(f"Making follow-up call with {len(follow_up_messages)} messages")
-                    follow_up_response = await self.client.messages.create(  # type: ignore
+                    follow_up_response = await self._model_request(self.client.messages.create(  # type: ignore
                         model=self.model if self.model else "claude-3-5-sonnet-latest",
                         system=self.system_prompt,  # System prompt as a separate parameter
                         messages=follow_up_messages,
                         max_tokens=4096,
                         temperature=self.temperature,
-                    )
+                    ))
                     logger.info("Received follow-up response from Claude API")
 
                     # Add the assistant's follow-up response to the conversation history
@@ -552,14 +556,14 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
 
         try:
             # Create a message to the Claude API
-            response = await self.client.messages.create(
+            response = await self._model_request(self.client.messages.create(
                 model=model_to_use,
                 max_tokens=2000,
                 system=self.system_prompt,
                 messages=[{"role": "user", "content": prompt}],
                 tools=[structured_output_tool],
                 temperature=0
-            )
+            ))
 
             # Process the response content
             if response.content:
@@ -690,7 +694,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
             # Call the Claude API
             logger.debug(f"Calling Claude API for image analysis with model: {self.model}")
 
-            response = await self.client.messages.create(
+            response = await self._model_request(self.client.messages.create(
                 model=self.model,
                 system=image_system_prompt,
                 max_tokens=1024,
@@ -701,7 +705,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
                         "content": content_blocks
                     }
                 ]
-            )
+            ))
 
             # Extract and return the assistant's response
             if response.content and len(response.content) > 0:
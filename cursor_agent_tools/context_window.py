@@ -0,0 +1,192 @@
+"""
+Fitting a conversation into a model's context window.
+
+Local models have small context windows (Ollama's default is 4096 tokens), and a
+server that gets a longer prompt silently drops its beginning. Servers such as
+Ollama also keep the evaluated prompt in a KV cache and only evaluate what
+follows the longest prefix shared with the previous request, so a prompt whose
+beginning changes every turn is evaluated from scratch every turn.
+
+ContextShaper keeps the prompt within a token budget while keeping its prefix
+stable:
+
+- tool results longer than a share of the budget are shortened (keeping their
+  beginning and end), the same way every time;
+- once the whole history no longer fits, the oldest exchanges are dropped in one
+  block, at a user message, so that the rest fills at most LOW_WATER of the
+  budget. A short summary of the dropped messages is added to the system
+  message. The cut then stays where it is while later turns are appended, so
+  the system message and the kept history are the same prefix turn after turn,
+  until the history outgrows the budget again.
+
+The current turn (from the last user message on) is never dropped.
+
+Token counts are estimates (see estimate_tokens); budgets leave room for the
+error.
+"""
+
+import json
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+from .logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Characters per token of ASCII text (English prose is ~4, code ~3.5)
+CHARS_PER_TOKEN = 3.5
+
+# Tokens of role markers and separators around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Share of the budget the kept history fills after dropping old messages
+LOW_WATER = 0.6
+
+# Share of the budget a single tool result may take
+MAX_TOOL_RESULT_SHARE = 0.25
+
+Message = Dict[str, Any]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the tokens of a text without the model's tokenizer.
+
+    ASCII text counts CHARS_PER_TOKEN characters per token, other characters
+    (CJK, emoji, ...) one token each.
+    """
+    if text.isascii():
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return math.ceil(ascii_chars / CHARS_PER_TOKEN) + (len(text) - ascii_chars)
+
+
+def message_tokens(message: Message) -> int:
+    """Estimate the tokens of a chat message, including its tool calls."""
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(str(message.get("content") or ""))
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(json.dumps(message["tool_calls"], default=str))
+    return tokens
+
+
+def shorten(text: str, max_tokens: int) -> str:
+    """Shorten a text to about max_tokens, keeping its beginning and end."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Estimate the characters to keep from the text's own ratio
+    keep = max(0, int(len(text) * max_tokens / estimate_tokens(text)) - 20)
+    head, tail = text[:keep * 2 // 3], text[len(text) - keep // 3:]
+    return f"{head}\n... [{len(text) - len(head) - len(tail)} characters omitted] ...\n{tail}"
+
+
+class ContextShaper:
+    """
+    Keeps a conversation within a context window with a stable prefix.
+
+    One shaper belongs to one conversation: it remembers where old messages
+    were cut, so that the prompts of consecutive turns share their prefix.
+
+    Args:
+        low_water: Share of the budget the kept history fills after a cut
+        max_tool_result_share: Share of the budget a single tool result may take
+    """
+
+    def __init__(self, low_water: float = LOW_WATER, max_tool_result_share: float = MAX_TOOL_RESULT_SHARE):
+        self.low_water = low_water
+        self.max_tool_result_share = max_tool_result_share
+        # Index of the first kept history message, and that message, to notice
+        # when the history is replaced or rolled back
+        self.cut = 0
+        self._cut_message: Optional[Message] = None
+        self._summary = ""
+
+    def reset(self) -> None:
+        self.cut = 0
+        self._cut_message = None
+        self._summary = ""
+
+    def shape(self, system_prompt: str, history: Sequence[Message], budget: int) -> List[Message]:
+        """
+        The messages of a request: the system message and as much history as fits.
+
+        Args:
+            system_prompt: Content of the system message
+            history: The conversation, oldest message first
+            budget: Tokens the messages may take
+
+        Returns:
+            The messages to send
+        """
+        if self.cut and (self.cut >= len(history) or history[self.cut] is not self._cut_message):
+            # The history was cleared, replaced or rolled back past the cut
+            self.reset()
+
+        max_tool_tokens = max(1, int(budget * self.max_tool_result_share))
+        messages = [self._fit_message(message, max_tool_tokens) for message in history]
+        tokens = [message_tokens(message) for message in messages]
+
+        if self._total(system_prompt, tokens[self.cut:]) > budget:
+            self._move_cut(system_prompt, history, tokens, budget)
+            total = self._total(system_prompt, tokens[self.cut:])
+            if total > budget:
+                logger.warning(f"Conversation needs about {total} tokens even after dropping old messages, "
+                               f"more than the context budget of {budget}")
+
+        system = system_prompt + self._summary
+        return [{"role": "system", "content": system}] + messages[self.cut:]
+
+    def _total(self, system_prompt: str, tokens: Sequence[int]) -> int:
+        return message_tokens({"content": system_prompt + self._summary}) + sum(tokens)
+
+    def _move_cut(self, system_prompt: str, history: Sequence[Message], tokens: List[int], budget: int) -> None:
+        """Drop old messages up to a user message, so the rest fills at most low_water of the budget."""
+        user_indices = [
+            i for i, message in enumerate(history)
+            if i > self.cut and message.get("role") == "user" and isinstance(message.get("content"), str)
+        ]
+        if not user_indices:
+            return
+        target = budget * self.low_water
+        # Without a fitting cut, keep only the current turn
+        cut = user_indices[-1]
+        for index in user_indices:
+            summary = self._summarize(history[:index])
+            kept = sum(tokens[index:]) + message_tokens({"content": system_prompt + summary})
+            if kept <= target:
+                cut = index
+                break
+        self.cut, self._cut_message = cut, history[cut]
+        self._summary = self._summarize(history[:cut])
+        logger.info(f"Dropped the {cut} oldest messages of the conversation to fit the context window")
+
+    @staticmethod
+    def _summarize(dropped: Sequence[Message]) -> str:
+        """A short, deterministic summary of dropped messages, appended to the system prompt."""
+        if not dropped:
+            return ""
+        requests = [
+            shorten(str(message.get("content") or ""), 50).replace("\n", " ")
+            for message in dropped if message.get("role") == "user"
+        ]
+        tool_counts: Dict[str, int] = {}
+        for message in dropped:
+            if message.get("role") == "tool":
+                name = str(message.get("tool_name") or message.get("name") or "tool")
+                tool_counts[name] = tool_counts.get(name, 0) + 1
+        lines = [f"\n\n<earlier_conversation>\n{len(dropped)} earlier messages were removed to fit the context window."]
+        if requests:
+            lines.append("The user's requests in them:")
+            lines.extend(f"- {request}" for request in requests[-10:])
+        if tool_counts:
+            lines.append("Tools called: " + ", ".join(f"{name} ({count})" for name, count in sorted(tool_counts.items())))
+        lines.append("</earlier_conversation>")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _fit_message(message: Message, max_tokens: int) -> Message:
+        """Shorten a long tool result (the same way every time, so the prefix stays stable)."""
+        content = message.get("content")
+        if message.get("role") != "tool" or not isinstance(content, str) or estimate_tokens(content) <= max_tokens:
+            return message
+        return dict(message, content=shorten(content, max_tokens))
@@ -2,17 +2,16 @@
 Factory for creating different types of AI agents.
 
 This module provides a unified API for creating various agents (OpenAI, Claude, etc.)
-with consistent configuration.
+with consistent configuration. The agent classes, and with them the provider SDKs,
+are imported when an agent of their provider is first created, so a process only
+loads the SDK it uses.
 """
 
 import os
 from typing import Optional, Callable, Any
 
 from cursor_agent_tools.base import BaseAgent
-from cursor_agent_tools.claude_agent import ClaudeAgent
 from cursor_agent_tools.logger import get_logger
-from cursor_agent_tools.openai_agent import OpenAIAgent
-from cursor_agent_tools.ollama_agent import OllamaAgent
 from cursor_agent_tools.permissions import PermissionOptions, PermissionRequest, PermissionStatus
 
 # Initialize logger
@@ -104,9 +103,11 @@ def create_agent(
     if model.startswith("ollama-"):
         logger.debug("Detected Ollama model")
         # Ollama doesn't require an API key but uses a local server
-        host = kwargs.get("host") or os.getenv("OLLAMA_HOST") or "http://localhost:11434"
+        host = kwargs.pop("host", None) or os.getenv("OLLAMA_HOST") or "http://localhost:11434"
         logger.debug(f"Using Ollama host: {host}")
 
+        from cursor_agent_tools.ollama_agent import OllamaAgent
+
         logger.info(f"Creating OllamaAgent with model {model}")
         return OllamaAgent(
             model=model,
@@ -131,6 +132,8 @@ def create_agent(
             else:
                 logger.debug("Using OpenAI API key from environment")
 
+        from cursor_agent_tools.openai_agent import OpenAIAgent
+
         logger.info(f"Creating OpenAIAgent with model {model}")
         return OpenAIAgent(
             model=model,
@@ -155,6 +158,8 @@ def create_agent(
             else:
                 logger.debug("Using Anthropic API key from environment")
 
+        from cursor_agent_tools.claude_agent import ClaudeAgent
+
         logger.info(f"Creating ClaudeAgent with model {model}")
         return ClaudeAgent(
             model=model,
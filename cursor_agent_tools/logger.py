@@ -2,18 +2,54 @@
 Logger module for cursor-agent.
 
 This module provides a standardized logging configuration for all cursor-agent components.
+
+All loggers created with get_logger share one handler pipeline, configured from
+the environment or with configure_logging():
+
+- CURSOR_AGENT_LOG_LEVEL: log level (default INFO)
+- CURSOR_AGENT_LOG_FORMAT: "text" (colored, default) or "json" (one object per line)
+- CURSOR_AGENT_LOG_QUEUE: "1" to hand records to a background thread
+  (QueueHandler/QueueListener), so formatting and I/O don't block the caller
+- CURSOR_AGENT_LOG_MAX_FIELD: maximum length of the message and of each
+  structured field; longer values are truncated (default 4000, 0 disables)
+- CURSOR_AGENT_LOG_SAMPLING: per-module sampling of DEBUG/INFO records, e.g.
+  "cursor_agent_tools.tools.file_tools=0.1,web_backend=0.5" keeps 1 in 10 and
+  1 in 2 of them; warnings and errors are never dropped
+
+Pass expensive values as arguments instead of formatting them eagerly, so they
+are only rendered when the record is emitted; wrap values that are expensive to
+compute in lazy():
+
+    logger.debug("Permission details: %s", lazy(json.dumps, details))
+
+Structured fields go in extra and become top-level keys in JSON output:
+
+    logger.info("Tool finished", extra={"tool": name, "duration": duration})
 """
 
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
-from typing import Optional
+import threading
+from typing import Any, Callable, Dict, List, Optional, TextIO
 
 # Default log format includes timestamp, level, and message
 DEFAULT_LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
 # Environment variable to control log level
 LOG_LEVEL_ENV_VAR = "CURSOR_AGENT_LOG_LEVEL"
+LOG_FORMAT_ENV_VAR = "CURSOR_AGENT_LOG_FORMAT"
+LOG_QUEUE_ENV_VAR = "CURSOR_AGENT_LOG_QUEUE"
+LOG_MAX_FIELD_ENV_VAR = "CURSOR_AGENT_LOG_MAX_FIELD"
+LOG_SAMPLING_ENV_VAR = "CURSOR_AGENT_LOG_SAMPLING"
+
+# Default maximum length of a logged message or structured field
+DEFAULT_MAX_FIELD_LENGTH = 4000
 
 # Color codes for terminal outpu
 COLORS = {
@@ -25,6 +61,41 @@ COLORS = {
     "CRITICAL": "\033[35m",  # Magenta
 }
 
+# Attributes every LogRecord has; anything else was passed in extra
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class lazy:
+    """
+    A log argument computed only if the record is actually emitted.
+
+    Args:
+        function: Callable producing the value
+        *args: Arguments for the callable
+    """
+
+    __slots__ = ("function", "args")
+
+    def __init__(self, function: Callable[..., Any], *args: Any):
+        self.function = function
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.function(*self.args))
+
+    __repr__ = __str__
+
+
+_TRUNCATED_MARKER = "... [truncated "
+
+
+def truncate(value: str, max_length: int) -> str:
+    """Shorten a string to max_length characters, noting how much was cut."""
+    # Values already truncated to the same length (by an earlier stage) are left alone
+    if max_length <= 0 or len(value) <= max_length or value.startswith(_TRUNCATED_MARKER, max_length):
+        return value
+    return f"{value[:max_length]}{_TRUNCATED_MARKER}{len(value) - max_length} chars]"
+
 
 class ColoredFormatter(logging.Formatter):
     """Logging formatter that adds color to terminal output."""
@@ -32,10 +103,294 @@ class ColoredFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         levelname = record.levelname
         if levelname in COLORS:
+            # Restore the level name afterwards: other handlers format the same record
             record.levelname = f"{COLORS[levelname]}{levelname}{COLORS['RESET']}"
+            try:
+                return super().format(record)
+            finally:
+                record.levelname = levelname
         return super().format(record)
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    Logging formatter writing one JSON object per record.
+
+    Fields passed in extra become top-level keys; values that are not JSON
+    serializable are converted with str(), and long values are truncated.
+
+    Args:
+        max_field_length: Maximum length of each field (0 disables truncation)
+    """
+
+    def __init__(self, max_field_length: int = DEFAULT_MAX_FIELD_LENGTH):
+        super().__init__()
+        self.max_field_length = max_field_length
+
+    def _field(self, value: Any) -> Any:
+        if isinstance(value, (bool, int, float)) or value is None:
+            return value
+        if not isinstance(value, str):
+            try:
+                text = json.dumps(value, default=str)
+            except (TypeError, ValueError):
+                text = str(value)
+            if self.max_field_length <= 0 or len(text) <= self.max_field_length:
+                return value if isinstance(value, (dict, list)) else text
+            value = text
+        return truncate(value, self.max_field_length)
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage(), self.max_field_length),
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = self._field(value)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of the DEBUG and INFO records of some modules.
+
+    Sampling is deterministic (every n-th record of a logger), which is cheaper
+    than drawing random numbers and keeps the output evenly spread.
+
+    Args:
+        rates: Logger name prefix -> fraction of records to keep (0 to 1);
+               the longest matching prefix applies
+        max_level: Records above this level are always kept
+    """
+
+    def __init__(self, rates: Dict[str, float], max_level: int = logging.INFO):
+        super().__init__()
+        self.rates = dict(rates)
+        self.max_level = max_level
+        self._intervals: Dict[str, int] = {}
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _interval(self, name: str) -> int:
+        interval = self._intervals.get(name)
+        if interval is None:
+            prefixes = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + ".")]
+            rate = self.rates[max(prefixes, key=len)] if prefixes else 1.0
+            # 0 drops everything; otherwise keep 1 in round(1 / rate)
+            interval = 0 if rate <= 0 else max(1, round(1 / min(rate, 1.0)))
+            self._intervals[name] = interval
+        return interval
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        interval = self._interval(record.name)
+        if interval == 1:
+            return True
+        if interval == 0:
+            return False
+        with self._lock:
+            count = self._counters.get(record.name, 0)
+            self._counters[record.name] = count + 1
+        return count % interval == 0
+
+
+class _BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+
+    The stock QueueHandler formats the whole line in the calling thread; this one
+    only merges the arguments into the message (they may be mutated after the
+    call) and truncates it, which is all that has to happen synchronously.
+    """
+
+    def __init__(self, record_queue: Any, max_field_length: int):
+        super().__init__(record_queue)
+        self.max_field_length = max_field_length
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = truncate(record.getMessage(), self.max_field_length)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _TruncatingFilter(logging.Filter):
+    """Truncate the message of records handled synchronously."""
+
+    def __init__(self, max_field_length: int):
+        super().__init__()
+        self.max_field_length = max_field_length
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.max_field_length <= 0:
+            return True
+        if record.args:
+            # Merge the arguments once; the formatter then uses the message as is
+            record.msg = truncate(record.getMessage(), self.max_field_length)
+            record.args = None
+        elif isinstance(record.msg, str) and len(record.msg) > self.max_field_length:
+            record.msg = truncate(record.msg, self.max_field_length)
+        return True
+
+
+def _env_level() -> int:
+    env_level = os.environ.get(LOG_LEVEL_ENV_VAR)
+    if env_level:
+        level = getattr(logging, env_level.upper(), None)
+        if isinstance(level, int):
+            return level
+    return logging.INFO
+
+
+def _parse_sampling(spec: str) -> Dict[str, float]:
+    rates = {}
+    for entry in spec.split(","):
+        name, _, rate = entry.partition("=")
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            continue
+    return rates
+
+
+class _Pipeline:
+    """The handlers shared by all cursor-agent loggers."""
+
+    def __init__(
+        self,
+        json_format: bool,
+        use_queue: bool,
+        max_field_length: int,
+        sampling: Dict[str, float],
+        log_file: Optional[str],
+        stream: Optional[TextIO],
+    ):
+        formatter: logging.Formatter = JsonFormatter(max_field_length) if json_format else ColoredFormatter(DEFAULT_LOG_FORMAT)
+        console_handler = logging.StreamHandler(stream or sys.stdout)
+        console_handler.setFormatter(formatter)
+        self.handlers: List[logging.Handler] = [console_handler]
+        if log_file:
+            file_handler = logging.FileHandler(log_file)
+            file_handler.setFormatter(JsonFormatter(max_field_length) if json_format else logging.Formatter(DEFAULT_LOG_FORMAT))
+            self.handlers.append(file_handler)
+
+        # Sampling runs first, in the calling thread, before a record is merged, queued or formatted
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        if use_queue:
+            record_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+            front: logging.Handler = _BackgroundQueueHandler(record_queue, max_field_length)
+            if sampling:
+                front.addFilter(SamplingFilter(sampling))
+            self.listener = logging.handlers.QueueListener(record_queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+            self.front = [front]
+        else:
+            self.front = list(self.handlers)
+            truncating_filter = _TruncatingFilter(max_field_length)
+            for handler in self.front:
+                # One filter per handler: a shared one would advance its counters once per
+                # handler for each record, so the handlers would keep different records
+                if sampling:
+                    handler.addFilter(SamplingFilter(sampling))
+                handler.addFilter(truncating_filter)
+
+    def stop(self) -> None:
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        for handler in self.handlers:
+            try:
+                handler.flush()
+                if isinstance(handler, logging.FileHandler):
+                    handler.close()
+            except (OSError, ValueError):
+                # The stream may already be closed at interpreter exit
+                pass
+
+
+_pipeline: Optional[_Pipeline] = None
+_pipeline_lock = threading.Lock()
+# Names of the loggers attached to the pipeline, re-attached when it is reconfigured
+_pipeline_loggers: List[str] = []
+
+
+def configure_logging(
+    json_format: Optional[bool] = None,
+    use_queue: Optional[bool] = None,
+    max_field_length: Optional[int] = None,
+    sampling: Optional[Dict[str, float]] = None,
+    log_file: Optional[str] = None,
+    stream: Optional[TextIO] = None,
+) -> None:
+    """
+    (Re)configure the handler pipeline shared by all loggers from get_logger.
+
+    Arguments left as None are read from the environment (see the module docstring).
+
+    Args:
+        json_format: Write JSON lines instead of colored text
+        use_queue: Format and write records in a background thread
+        max_field_length: Maximum length of messages and structured fields (0: unlimited)
+        sampling: Logger name prefix -> fraction of DEBUG/INFO records to keep
+        log_file: Also write records to this file
+        stream: Console stream (default: sys.stdout)
+    """
+    global _pipeline
+    if json_format is None:
+        json_format = os.environ.get(LOG_FORMAT_ENV_VAR, "text").lower() == "json"
+    if use_queue is None:
+        use_queue = os.environ.get(LOG_QUEUE_ENV_VAR, "0").lower() in ("1", "true", "yes")
+    if max_field_length is None:
+        try:
+            max_field_length = int(os.environ.get(LOG_MAX_FIELD_ENV_VAR, DEFAULT_MAX_FIELD_LENGTH))
+        except ValueError:
+            max_field_length = DEFAULT_MAX_FIELD_LENGTH
+    if sampling is None:
+        sampling = _parse_sampling(os.environ.get(LOG_SAMPLING_ENV_VAR, ""))
+
+    with _pipeline_lock:
+        old = _pipeline
+        _pipeline = _Pipeline(json_format, use_queue, max_field_length, sampling, log_file, stream)
+        for name in _pipeline_loggers:
+            logger = logging.getLogger(name)
+            for handler in (old.front if old else []):
+                logger.removeHandler(handler)
+            for handler in _pipeline.front:
+                logger.addHandler(handler)
+    if old is not None:
+        old.stop()
+
+
+def _get_pipeline() -> _Pipeline:
+    if _pipeline is None:
+        configure_logging()
+    assert _pipeline is not None
+    return _pipeline
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the background thread, if any."""
+    with _pipeline_lock:
+        if _pipeline is not None:
+            _pipeline.stop()
+
+
+atexit.register(shutdown_logging)
+
+
 def get_logger(name: str, level: Optional[int] = None) -> logging.Logger:
     """
     Get a logger instance configured with standardized settings.
@@ -52,27 +407,13 @@ def get_logger(name: str, level: Optional[int] = None) -> logging.Logger:
     # Only configure the logger if it hasn't been configured ye
     if not logger.handlers:
         # Determine the log level (from environment variable or default)
-        if level is None:
-            env_level = os.environ.get(LOG_LEVEL_ENV_VAR)
-            if env_level:
-                try:
-                    level = getattr(logging, env_level.upper())
-                except AttributeError:
-                    level = logging.INFO
-            else:
-                level = logging.INFO
-
-        logger.setLevel(level)
-
-        # Create console handler with color formatting
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(level)
-
-        # Use colored output for terminal
-        formatter = ColoredFormatter(DEFAULT_LOG_FORMAT)
-        console_handler.setFormatter(formatter)
+        logger.setLevel(level if level is not None else _env_level())
 
-        logger.addHandler(console_handler)
+        pipeline = _get_pipeline()
+        with _pipeline_lock:
+            for handler in pipeline.front:
+                logger.addHandler(handler)
+            _pipeline_loggers.append(name)
 
     return logger
 
@@ -90,14 +431,7 @@ def setup_logging(level: Optional[int] = None, log_file: Optional[str] = None) -
 
     # Determine the log level
     if level is None:
-        env_level = os.environ.get(LOG_LEVEL_ENV_VAR)
-        if env_level:
-            try:
-                level = getattr(logging, env_level.upper())
-            except AttributeError:
-                level = logging.INFO
-        else:
-            level = logging.INFO
+        level = _env_level()
 
     root_logger.setLevel(level)
 
@@ -105,15 +439,17 @@ def setup_logging(level: Optional[int] = None, log_file: Optional[str] = None) -
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
 
+    json_format = os.environ.get(LOG_FORMAT_ENV_VAR, "text").lower() == "json"
+
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(level)
-    console_handler.setFormatter(ColoredFormatter(DEFAULT_LOG_FORMAT))
+    console_handler.setFormatter(JsonFormatter() if json_format else ColoredFormatter(DEFAULT_LOG_FORMAT))
     root_logger.addHandler(console_handler)
 
     # File handler (if requested)
     if log_file:
         file_handler = logging.FileHandler(log_file)
         file_handler.setLevel(level)
-        file_handler.setFormatter(logging.Formatter(DEFAULT_LOG_FORMAT))
+        file_handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(DEFAULT_LOG_FORMAT))
         root_logger.addHandler(file_handler)
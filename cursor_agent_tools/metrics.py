@@ -0,0 +1,365 @@
+"""
+Metrics module for cursor-agent.
+
+In-process counters, histograms and gauges, rendered in the Prometheus text
+exposition format (the web backend serves them at /metrics).
+
+Recording takes no lock: every thread updates its own shard of a metric, which
+only that thread writes to, and the shards are summed when the metrics are
+collected. Shards of threads that have exited are folded into a single total
+on the next collection. Gauges are computed by a function at collection time,
+so they cost nothing between scrapes.
+
+Usage:
+
+    TOOL_CALLS = REGISTRY.counter("tool_calls_total", "Tool calls", ("tool",))
+    TOOL_CALLS.inc(("edit_file",))
+
+    with TOOL_CALL_SECONDS.time(("edit_file", "ok")):
+        ...
+"""
+
+import bisect
+import contextlib
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union, cast
+
+# Default histogram buckets in seconds, from fast tool calls to slow model requests
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+GaugeValue = Union[float, Dict[Labels, float]]
+
+# A metric's values by label values, as returned by MetricsRegistry.snapshot(): counters
+# map to numbers, histograms to [count per bucket (the last one is +Inf)..., sum]
+Snapshot = Dict[str, Dict[Labels, Any]]
+
+
+class _ShardedMetric:
+    """Base class for metrics whose values are kept in per-thread shards."""
+
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Dict[Labels, Any]]] = []
+        self._retired: Dict[Labels, Any] = {}
+
+    def _shard(self) -> Dict[Labels, Any]:
+        """The calling thread's shard, created on its first update."""
+        try:
+            existing: Dict[Labels, Any] = self._local.shard
+            return existing
+        except AttributeError:
+            shard: Dict[Labels, Any] = {}
+            with self._registry._lock:
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+            return shard
+
+    def _merge(self, total: Dict[Labels, Any], values: Dict[Labels, Any]) -> None:
+        raise NotImplementedError
+
+    def collect(self) -> Dict[Labels, Any]:
+        """Sum the shards of all threads."""
+        with self._registry._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    # The thread can no longer write to its shard; keep its values in one place
+                    self._merge(self._retired, dict(shard))
+            self._shards = live
+            total: Dict[Labels, Any] = {}
+            self._merge(total, self._retired)
+            for _, shard in live:
+                self._merge(total, dict(shard))
+        return total
+
+    def _check_labels(self, labels: Labels) -> None:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+
+
+class Counter(_ShardedMetric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        """
+        Increase the count.
+
+        Args:
+            labels: Label values, in the order of the metric's label names
+            amount: Non-negative amount to add
+        """
+        shard = self._shard()
+        try:
+            shard[labels] += amount
+        except KeyError:
+            self._check_labels(labels)
+            shard[labels] = amount
+
+    def _merge(self, total: Dict[Labels, Any], values: Dict[Labels, Any]) -> None:
+        for labels, value in values.items():
+            total[labels] = total.get(labels, 0) + value
+
+
+class Histogram(_ShardedMetric):
+    """
+    A distribution of observed values in cumulative buckets, with their sum and count.
+
+    Args:
+        buckets: Upper bounds of the buckets, in increasing order (+Inf is implied)
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        registry: "MetricsRegistry",
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+        if list(self.buckets) != sorted(set(self.buckets)):
+            raise ValueError(f"Buckets of {name} must be increasing")
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        """
+        Record an observation.
+
+        Args:
+            value: The observed value, e.g. a duration in seconds
+            labels: Label values, in the order of the metric's label names
+        """
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            self._check_labels(labels)
+            # One count per bucket plus +Inf, then the sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, labels: Labels = ()) -> Iterator[None]:
+        """Observe the duration of a block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels)
+
+    def _merge(self, total: Dict[Labels, Any], values: Dict[Labels, Any]) -> None:
+        for labels, counts in values.items():
+            merged = total.get(labels)
+            if merged is None:
+                total[labels] = list(counts)
+            else:
+                for i, count in enumerate(counts):
+                    merged[i] += count
+
+
+class Gauge:
+    """
+    A value computed when the metrics are collected.
+
+    Args:
+        function: Returns the value, or for a labelled gauge a dict of values by label values
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], function: Callable[[], GaugeValue]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+
+    def collect(self) -> Dict[Labels, float]:
+        value = self.function()
+        if isinstance(value, dict):
+            return value
+        return {(): value}
+
+
+Metric = Union[Counter, Histogram, Gauge]
+MetricT = TypeVar("MetricT", bound=Metric)
+
+
+class MetricsRegistry:
+    """
+    A set of metrics that are collected and rendered together.
+
+    Snapshots of other processes (see snapshot()) can be added with
+    add_snapshot_source(); their values are summed into the matching metrics.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+        self._snapshot_sources: List[Callable[[], List[Snapshot]]] = []
+
+    def _register(self, metric: MetricT) -> MetricT:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered with another type or labels")
+                return cast(MetricT, existing)
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Get or create a counter."""
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Get or create a histogram."""
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        function: Callable[[], GaugeValue],
+        labelnames: Sequence[str] = (),
+    ) -> Gauge:
+        """Register a gauge computed by function; registering the name again replaces the function."""
+        gauge = self._register(Gauge(name, documentation, labelnames, function))
+        gauge.function = function
+        return gauge
+
+    def get(self, name: str) -> Optional[Metric]:
+        """The metric registered under name, if any."""
+        return self._metrics.get(name)
+
+    def add_snapshot_source(self, source: Callable[[], List[Snapshot]]) -> None:
+        """Add a function returning snapshots (e.g. of worker processes) to include in collections."""
+        with self._lock:
+            self._snapshot_sources.append(source)
+
+    def snapshot(self) -> Snapshot:
+        """The current values of all counters and histograms, e.g. to send to another process."""
+        return {
+            name: metric.collect()
+            for name, metric in list(self._metrics.items())
+            if isinstance(metric, _ShardedMetric)
+        }
+
+    def collect(self) -> List[Tuple[Metric, Dict[Labels, Any]]]:
+        """Collect every metric, including the values of added snapshots."""
+        snapshots: List[Snapshot] = []
+        for source in list(self._snapshot_sources):
+            snapshots.extend(source())
+
+        collected = []
+        for metric in list(self._metrics.values()):
+            values = metric.collect()
+            if isinstance(metric, _ShardedMetric):
+                for snapshot in snapshots:
+                    if metric.name in snapshot:
+                        metric._merge(values, snapshot[metric.name])
+            collected.append((metric, values))
+        return collected
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric, values in self.collect():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in sorted(values.items()):
+                label_pairs = list(zip(metric.labelnames, labels))
+                if isinstance(metric, Histogram):
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (math.inf,), value):
+                        cumulative += count
+                        bucket_labels = _format_labels(label_pairs + [("le", _format_number(bound))])
+                        lines.append(f"{metric.name}_bucket{bucket_labels} {_format_number(cumulative)}")
+                    lines.append(f"{metric.name}_sum{_format_labels(label_pairs)} {_format_number(value[-1])}")
+                    lines.append(f"{metric.name}_count{_format_labels(label_pairs)} {_format_number(cumulative)}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(label_pairs)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs: List[Tuple[str, Any]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# The registry used by cursor-agent
+REGISTRY = MetricsRegistry()
+
+MODEL_REQUEST_SECONDS = REGISTRY.histogram(
+    "cursor_agent_model_request_duration_seconds",
+    "Latency of model provider requests",
+    ("provider", "model", "status"),
+)
+MODEL_TOKENS = REGISTRY.counter(
+    "cursor_agent_model_tokens_total",
+    "Tokens used by model provider requests",
+    ("provider", "model", "type"),
+)
+TOOL_CALL_SECONDS = REGISTRY.histogram(
+    "cursor_agent_tool_call_duration_seconds",
+    "Duration of tool calls; status is ok or error",
+    ("tool", "status"),
+)
+PERMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "cursor_agent_permission_wait_seconds",
+    "Time spent waiting for the answer to a permission request",
+    ("source",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+OLLAMA_MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    "cursor_agent_ollama_model_load_seconds",
+    "Time Ollama spent loading the model for a request (its load_duration)",
+    ("model",),
+)
+OLLAMA_COLD_LOADS = REGISTRY.counter(
+    "cursor_agent_ollama_cold_loads_total",
+    "Ollama requests that had to wait for their model to be loaded into memory",
+    ("model",),
+)
@@ -0,0 +1,667 @@
+"""
+Mock model provider for benchmarks and load tests.
+
+MockProviderServer is a local stand-in for the Anthropic Messages API
+(POST /v1/messages), the OpenAI Chat Completions API (POST /v1/chat/completions)
+and the Ollama chat API (POST /api/chat, GET /api/tags, GET /api/ps,
+POST /api/show), including streaming responses and tool calls. Point the clients at it with:
+
+- Anthropic: ANTHROPIC_BASE_URL=http://127.0.0.1:<port>
+- OpenAI: OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+- Ollama: OLLAMA_HOST=http://127.0.0.1:<port>
+
+Answers come from a script, a list of steps. A step is {"text": "..."},
+{"tokens": 200} (that many tokens of filler text) or
+{"tool_calls": [{"name": "read_file", "arguments": {...}}, ...]}, optionally
+with text as well. Which step answers a request is derived from the request
+itself: the number of assistant messages after the last message typed by the
+user. A turn therefore starts at step 0, each tool round moves it one step
+further, and requests past the end of the script get a plain text answer. No
+state is kept between requests, so any number of concurrent sessions can share
+one server.
+
+Timing and failures can be shaped to resemble a real provider:
+
+- latency: time to the first token, a LatencyDistribution or its spec string
+  such as "0.5", "uniform:0.2,1.0", "normal:0.8,0.2", "lognormal:0.8,0.5"
+  (median, sigma) or "exponential:0.5" (mean)
+- tokens_per_second: output rate; responses take output_tokens / rate longer,
+  and streamed tokens are paced at that rate
+- error_rate / rate_limit_rate: fractions of requests answered with a 500 or a
+  429 (with a Retry-After header) in the provider's error format
+- model_load_time: seconds an Ollama request waits for its model to be loaded
+  if it isn't; loaded models stay in memory for the request's keep_alive
+  (default 5 minutes), are listed by GET /api/ps, and responses report the
+  wait as load_duration. A chat without messages only loads the model.
+- num_ctx: the context window models are loaded with, unless a request's
+  num_ctx option sets it (reported by GET /api/ps)
+
+With a seed, latencies and injected failures are the same on every run for
+the same sequence of requests.
+
+Run it from the command line:
+
+    python -m cursor_agent_tools.mock_provider --port 8090 --latency lognormal:0.8,0.5 \\
+        --tokens-per-second 50 --rate-limit-rate 0.02 --script script.json
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from .ollama_models import keep_alive_seconds
+
+Step = Dict[str, Any]
+
+DEFAULT_TEXT = "Done."
+
+LATENCY_KINDS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+_FILLER = (
+    "The", "change", "updates", "the", "handler", "so", "that", "each", "request", "is",
+    "parsed", "once", "and", "the", "result", "is", "cached", "for", "later", "calls.",
+)
+
+_TOKEN_PATTERN = re.compile(r"\s*\S+\s*|\s+")
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    """
+    A distribution of delays in seconds; samples are never negative.
+
+    Args:
+        kind: One of LATENCY_KINDS
+        params: fixed: (seconds,); uniform: (low, high); normal: (mean, stddev);
+            lognormal: (median, sigma); exponential: (mean,)
+    """
+    kind: str = "fixed"
+    params: Tuple[float, ...] = (0.0,)
+
+    def __post_init__(self) -> None:
+        arity = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}
+        if self.kind not in arity:
+            raise ValueError(f"Unknown latency distribution '{self.kind}', expected one of {LATENCY_KINDS}")
+        if len(self.params) != arity[self.kind]:
+            raise ValueError(f"The {self.kind} distribution takes {arity[self.kind]} parameter(s), got {self.params}")
+
+    @classmethod
+    def parse(cls, spec: Union[str, float, "LatencyDistribution"]) -> "LatencyDistribution":
+        """Parse a spec such as "0.5", "fixed:0.5" or "lognormal:0.8,0.5"."""
+        if isinstance(spec, LatencyDistribution):
+            return spec
+        if isinstance(spec, (int, float)):
+            return cls("fixed", (float(spec),))
+        kind, _, params = spec.partition(":")
+        if not params:
+            return cls("fixed", (float(kind),))
+        return cls(kind.strip().lower(), tuple(float(value) for value in params.split(",")))
+
+    def sample(self, rng: random.Random) -> float:
+        a = self.params[0]
+        if self.kind == "fixed":
+            value = a
+        elif self.kind == "uniform":
+            value = rng.uniform(a, self.params[1])
+        elif self.kind == "normal":
+            value = rng.gauss(a, self.params[1])
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(a), self.params[1]) if a > 0 else 0.0
+        else:
+            value = rng.expovariate(1.0 / a) if a > 0 else 0.0
+        return max(0.0, value)
+
+
+class MockProviderServer:
+    """
+    A scripted Anthropic/OpenAI/Ollama HTTP server running in a background thread.
+
+    Args:
+        script: Steps to answer with, see the module docstring
+        latency: Time to the first token (seconds, spec string or LatencyDistribution)
+        tokens_per_second: Output rate; None for instant responses
+        error_rate: Fraction of requests answered with a 500
+        rate_limit_rate: Fraction of requests answered with a 429
+        retry_after: Seconds sent in the Retry-After header of 429 responses
+        seed: Seed of the latency and failure sampling
+        ollama_models: Models listed by GET /api/tags
+        model_load_time: Seconds an Ollama request waits if its model isn't loaded
+        num_ctx: Context window of loaded Ollama models, unless requests set one
+        host: Interface to listen on
+        port: Port to listen on, 0 for any free port
+    """
+
+    def __init__(
+        self,
+        script: Optional[List[Step]] = None,
+        latency: Union[float, str, LatencyDistribution] = 0.0,
+        tokens_per_second: Optional[float] = None,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None,
+        ollama_models: Sequence[str] = ("llama3",),
+        model_load_time: float = 0.0,
+        num_ctx: int = 4096,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.script = list(script or [])
+        self.latency = LatencyDistribution.parse(latency)
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.ollama_models = list(ollama_models)
+        self.model_load_time = model_load_time
+        self.num_ctx = num_ctx
+        # Loaded Ollama model -> time.monotonic() it is unloaded at, and its context window
+        self._loaded: Dict[str, float] = {}
+        self._context_lengths: Dict[str, int] = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {}
+        self.reset_stats()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.provider = self  # type: ignore[attr-defined]
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server, e.g. http://127.0.0.1:54321"""
+        host, port = self._server.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode()
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockProviderServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.1}, name="mock-provider", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockProviderServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def step(self, messages: List[Dict[str, Any]]) -> Step:
+        """The script step answering a request with the given messages."""
+        last_user = max(
+            (i for i, message in enumerate(messages) if message.get("role") == "user" and isinstance(message.get("content"), str)),
+            default=-1,
+        )
+        index = sum(1 for message in messages[last_user + 1:] if message.get("role") == "assistant")
+        if index < len(self.script):
+            return self.script[index]
+        return {"text": DEFAULT_TEXT}
+
+    def stats(self) -> Dict[str, Any]:
+        """Requests served by API and by status, and the output tokens generated."""
+        with self._lock:
+            return copy.deepcopy(self._stats)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {"requests": 0, "streamed": 0, "by_api": {}, "by_status": {}, "output_tokens": 0}
+
+    def _plan(self) -> Tuple[Optional[int], float]:
+        """Sample the fate of a request: an injected status (or None) and the first-token delay."""
+        with self._lock:
+            roll = self._rng.random()
+            delay = self.latency.sample(self._rng)
+        if roll < self.rate_limit_rate:
+            return 429, 0.0
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, delay
+        return None, delay
+
+    def _record(self, api: str, status: int, streamed: bool = False, output_tokens: int = 0) -> None:
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["streamed"] += int(streamed)
+            self._stats["by_api"][api] = self._stats["by_api"].get(api, 0) + 1
+            self._stats["by_status"][str(status)] = self._stats["by_status"].get(str(status), 0) + 1
+            self._stats["output_tokens"] += output_tokens
+
+    def _load_model(self, model: str, keep_alive: Any, num_ctx: Optional[int] = None) -> float:
+        """Load an Ollama model for a request; returns the seconds it takes (0 if it is loaded)."""
+        name = model if ":" in model else f"{model}:latest"
+        now = time.monotonic()
+        try:
+            seconds = keep_alive_seconds(keep_alive)
+        except ValueError:
+            seconds = keep_alive_seconds(None)
+        with self._lock:
+            # Like Ollama, another context window means loading the model again
+            loaded = self._loaded.get(name, 0.0) > now and self._context_lengths.get(name) == (num_ctx or self.num_ctx)
+            self._context_lengths[name] = num_ctx or self.num_ctx
+            if seconds > 0:
+                self._loaded[name] = now + seconds
+            else:
+                self._loaded.pop(name, None)
+        return 0.0 if loaded else self.model_load_time
+
+    def loaded_models(self) -> List[Dict[str, Any]]:
+        """The loaded Ollama models, as GET /api/ps lists them."""
+        now, wall_now = time.monotonic(), datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            loaded = sorted((name, expires) for name, expires in self._loaded.items() if expires > now)
+            context_lengths = dict(self._context_lengths)
+        models = []
+        for name, expires in loaded:
+            # Like Ollama, models that are never unloaded expire far in the future
+            remaining = min(expires - now, 300 * 365 * 86400.0)
+            expires_at = wall_now + datetime.timedelta(seconds=remaining)
+            models.append({"name": name, "model": name, "size": 0, "digest": "",
+                           "expires_at": expires_at.isoformat(), "size_vram": 0,
+                           "context_length": context_lengths.get(name, self.num_ctx)})
+        return models
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+
+# ==================== Responses ====================
+
+
+class _Output:
+    """A step rendered as the text and tool calls of a response, split into tokens."""
+
+    def __init__(self, step: Step):
+        text = step.get("text") or ""
+        if not text and "tokens" in step:
+            text = " ".join(_FILLER[i % len(_FILLER)] for i in range(int(step["tokens"])))
+        elif not text and not step.get("tool_calls"):
+            text = DEFAULT_TEXT
+        self.text = text
+        self.text_tokens = _TOKEN_PATTERN.findall(text)
+        self.tool_calls = [
+            {
+                "id": uuid.uuid4().hex[:24],
+                "name": call["name"],
+                "arguments": call.get("arguments", {}),
+                "json": json.dumps(call.get("arguments", {})),
+            }
+            for call in step.get("tool_calls", [])
+        ]
+
+    @property
+    def output_tokens(self) -> int:
+        return len(self.text_tokens) + sum(len(_json_tokens(call["json"])) for call in self.tool_calls)
+
+
+def _json_tokens(text: str) -> List[str]:
+    """Tool call arguments in pieces of about one token (four characters)."""
+    return [text[i:i + 4] for i in range(0, len(text), 4)] or [""]
+
+
+def _input_tokens(request: Dict[str, Any]) -> int:
+    """A rough prompt size: four bytes of JSON per token."""
+    prompt = [request.get("system"), request.get("messages", []), request.get("tools")]
+    return max(1, len(json.dumps(prompt, default=str)) // 4)
+
+
+def _anthropic_message(output: _Output, request: Dict[str, Any]) -> Dict[str, Any]:
+    content: List[Dict[str, Any]] = []
+    if output.text:
+        content.append({"type": "text", "text": output.text})
+    for call in output.tool_calls:
+        content.append({"type": "tool_use", "id": f"toolu_{call['id']}", "name": call["name"], "input": call["arguments"]})
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": request.get("model", ""),
+        "content": content,
+        "stop_reason": "tool_use" if output.tool_calls else "end_turn",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": _input_tokens(request),
+            "output_tokens": output.output_tokens,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0,
+        },
+    }
+
+
+def _anthropic_stream(output: _Output, request: Dict[str, Any]) -> Iterator[Tuple[bytes, int]]:
+    """Server-sent events of a streamed message; yields (event, tokens it carries)."""
+    message = _anthropic_message(output, request)
+
+    def event(data: Dict[str, Any], tokens: int = 0) -> Tuple[bytes, int]:
+        return f"event: {data['type']}\ndata: {json.dumps(data)}\n\n".encode("utf-8"), tokens
+
+    yield event({
+        "type": "message_start",
+        "message": {**message, "content": [], "stop_reason": None, "usage": {**message["usage"], "output_tokens": 0}},
+    })
+    index = 0
+    if output.text:
+        yield event({"type": "content_block_start", "index": index, "content_block": {"type": "text", "text": ""}})
+        for token in output.text_tokens:
+            yield event({"type": "content_block_delta", "index": index, "delta": {"type": "text_delta", "text": token}}, 1)
+        yield event({"type": "content_block_stop", "index": index})
+        index += 1
+    for call in output.tool_calls:
+        yield event({
+            "type": "content_block_start",
+            "index": index,
+            "content_block": {"type": "tool_use", "id": f"toolu_{call['id']}", "name": call["name"], "input": {}},
+        })
+        for piece in _json_tokens(call["json"]):
+            yield event({"type": "content_block_delta", "index": index, "delta": {"type": "input_json_delta", "partial_json": piece}}, 1)
+        yield event({"type": "content_block_stop", "index": index})
+        index += 1
+    yield event({
+        "type": "message_delta",
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": output.output_tokens},
+    })
+    yield event({"type": "message_stop"})
+
+
+def _openai_completion(output: _Output, request: Dict[str, Any]) -> Dict[str, Any]:
+    message: Dict[str, Any] = {"role": "assistant", "content": output.text or None}
+    if output.tool_calls:
+        message["tool_calls"] = [
+            {"id": f"call_{call['id']}", "type": "function", "function": {"name": call["name"], "arguments": call["json"]}}
+            for call in output.tool_calls
+        ]
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", ""),
+        "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if output.tool_calls else "stop"}],
+        "usage": _openai_usage(output, request),
+    }
+
+
+def _openai_usage(output: _Output, request: Dict[str, Any]) -> Dict[str, int]:
+    prompt_tokens = _input_tokens(request)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": output.output_tokens,
+        "total_tokens": prompt_tokens + output.output_tokens,
+    }
+
+
+def _openai_stream(output: _Output, request: Dict[str, Any]) -> Iterator[Tuple[bytes, int]]:
+    """Server-sent chunks of a streamed completion; yields (event, tokens it carries)."""
+    base = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion.chunk",
+            "created": int(time.time()), "model": request.get("model", "")}
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, tokens: int = 0) -> Tuple[bytes, int]:
+        data = {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(data)}\n\n".encode("utf-8"), tokens
+
+    yield chunk({"role": "assistant", "content": ""})
+    for token in output.text_tokens:
+        yield chunk({"content": token}, tokens=1)
+    for index, call in enumerate(output.tool_calls):
+        yield chunk({"tool_calls": [{
+            "index": index, "id": f"call_{call['id']}", "type": "function",
+            "function": {"name": call["name"], "arguments": ""},
+        }]})
+        for piece in _json_tokens(call["json"]):
+            yield chunk({"tool_calls": [{"index": index, "function": {"arguments": piece}}]}, tokens=1)
+    yield chunk({}, "tool_calls" if output.tool_calls else "stop")
+    if (request.get("stream_options") or {}).get("include_usage"):
+        data = {**base, "choices": [], "usage": _openai_usage(output, request)}
+        yield f"data: {json.dumps(data)}\n\n".encode("utf-8"), 0
+    yield b"data: [DONE]\n\n", 0
+
+
+def _ollama_message(output: _Output, content: str, with_tools: bool) -> Dict[str, Any]:
+    message: Dict[str, Any] = {"role": "assistant", "content": content}
+    if with_tools and output.tool_calls:
+        message["tool_calls"] = [
+            {"function": {"name": call["name"], "arguments": call["arguments"]}} for call in output.tool_calls
+        ]
+    return message
+
+
+def _ollama_done(output: _Output, request: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "model": request.get("model", ""),
+        "created_at": _timestamp(),
+        "message": message,
+        "done": True,
+        "done_reason": "stop",
+        "prompt_eval_count": _input_tokens(request),
+        "eval_count": output.output_tokens,
+        "load_duration": int(request.get("_load_duration", 0.0) * 1e9),
+    }
+
+
+def _ollama_chat(output: _Output, request: Dict[str, Any]) -> Dict[str, Any]:
+    return _ollama_done(output, request, _ollama_message(output, output.text, True))
+
+
+def _ollama_stream(output: _Output, request: Dict[str, Any]) -> Iterator[Tuple[bytes, int]]:
+    """Newline-delimited JSON of a streamed chat; yields (line, tokens it carries)."""
+    for token in output.text_tokens:
+        data = {"model": request.get("model", ""), "created_at": _timestamp(),
+                "message": {"role": "assistant", "content": token}, "done": False}
+        yield (json.dumps(data) + "\n").encode("utf-8"), 1
+    if output.tool_calls:
+        data = {"model": request.get("model", ""), "created_at": _timestamp(),
+                "message": _ollama_message(output, "", True), "done": False}
+        yield (json.dumps(data) + "\n").encode("utf-8"), output.output_tokens - len(output.text_tokens)
+    done = _ollama_done(output, request, {"role": "assistant", "content": ""})
+    yield (json.dumps(done) + "\n").encode("utf-8"), 0
+
+
+def _timestamp() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def _error_body(api: str, status: int) -> Dict[str, Any]:
+    if status == 429:
+        message = "Rate limit exceeded (injected by the mock provider)"
+        kinds = {"anthropic": "rate_limit_error", "openai": "rate_limit_exceeded"}
+    else:
+        message = "Internal server error (injected by the mock provider)"
+        kinds = {"anthropic": "api_error", "openai": "server_error"}
+    if api == "anthropic":
+        return {"type": "error", "error": {"type": kinds["anthropic"], "message": message}}
+    if api == "openai":
+        return {"error": {"message": message, "type": kinds["openai"], "param": None, "code": kinds["openai"]}}
+    return {"error": message}
+
+
+# Path -> (API, full response, streamed response, whether the API streams unless told otherwise)
+_APIS: Dict[str, Tuple[str, Callable[..., Dict[str, Any]], Callable[..., Iterator[Tuple[bytes, int]]], bool]] = {
+    "/v1/messages": ("anthropic", _anthropic_message, _anthropic_stream, False),
+    "/v1/chat/completions": ("openai", _openai_completion, _openai_stream, False),
+    "/chat/completions": ("openai", _openai_completion, _openai_stream, False),
+    "/api/chat": ("ollama", _ollama_chat, _ollama_stream, True),
+}
+
+_STREAM_CONTENT_TYPES = {"anthropic": "text/event-stream", "openai": "text/event-stream", "ollama": "application/x-ndjson"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; with Nagle's algorithm the body would
+    # wait for the client's delayed ACK (~40 ms) on every keep-alive request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    @property
+    def provider(self) -> MockProviderServer:
+        provider: MockProviderServer = self.server.provider  # type: ignore[attr-defined]
+        return provider
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/api/tags":
+            self._send(200, {"models": [{"name": name, "model": name} for name in self.provider.ollama_models]})
+        elif path == "/api/ps":
+            self._send(200, {"models": self.provider.loaded_models()})
+        elif path == "/mock/stats":
+            self._send(200, self.provider.stats())
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        provider = self.provider
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send(400, {"error": f"Invalid JSON: {e}"})
+            return
+
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/mock/reset":
+            provider.reset_stats()
+            self._send(200, {"ok": True})
+            return
+        if path == "/api/show":
+            # The model's defaults: no num_ctx parameter, trained for a larger window
+            self._send(200, {"modelfile": "", "parameters": "", "template": "{{ .Prompt }}",
+                             "details": {"family": "llama"}, "model_info": {"llama.context_length": 8192}})
+            return
+        if path not in _APIS:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        api, respond, stream, streams_by_default = _APIS[path]
+
+        if api == "ollama":
+            options = request.get("options") or {}
+            load_duration = provider._load_model(request.get("model", ""), request.get("keep_alive"), options.get("num_ctx"))
+            time.sleep(load_duration)
+            request["_load_duration"] = load_duration
+            if not request.get("messages"):
+                # Like Ollama, a chat without messages only loads (or unloads) the model
+                output = _Output({"tokens": 0})
+                response = _ollama_done(output, request, {"role": "assistant", "content": ""})
+                response["done_reason"] = "load" if request.get("keep_alive") != 0 else "unload"
+                self._send(200, response)
+                provider._record(api, 200)
+                return
+
+        status, delay = provider._plan()
+        time.sleep(delay)
+        if status is not None:
+            headers = {"Retry-After": f"{provider.retry_after:g}"} if status == 429 else {}
+            self._send(status, _error_body(api, status), headers)
+            provider._record(api, status)
+            return
+
+        output = _Output(provider.step(request.get("messages", [])))
+        if request.get("stream", streams_by_default):
+            self._stream(_STREAM_CONTENT_TYPES[api], stream(output, request))
+            provider._record(api, 200, True, output.output_tokens)
+        else:
+            time.sleep(output.output_tokens * provider._token_delay())
+            self._send(200, respond(output, request))
+            provider._record(api, 200, False, output.output_tokens)
+
+    def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, content_type: str, events: Iterator[Tuple[bytes, int]]) -> None:
+        """Send events with chunked encoding, paced at the provider's token rate."""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        token_delay = self.provider._token_delay()
+        try:
+            for data, tokens in events:
+                if tokens and token_delay:
+                    time.sleep(tokens * token_delay)
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid-stream
+            self.close_connection = True
+
+
+def load_script(path: str) -> List[Step]:
+    """Load a script from a JSON file holding a list of steps."""
+    with open(path, encoding="utf-8") as f:
+        script = json.load(f)
+    if not isinstance(script, list):
+        raise ValueError(f"{path} must contain a JSON list of steps")
+    return script
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run a mock Anthropic/OpenAI/Ollama provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--script", help="JSON file with the list of steps to answer with")
+    parser.add_argument("--latency", default="0", help='Time to first token, e.g. "0.5" or "lognormal:0.8,0.5"')
+    parser.add_argument("--tokens-per-second", type=float, default=None, help="Output token rate (default: instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of 429 responses in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--ollama-models", default="llama3", help="Comma-separated models listed by /api/tags")
+    parser.add_argument("--model-load-time", type=float, default=0.0,
+                        help="Seconds an Ollama request waits if its model isn't loaded")
+    parser.add_argument("--num-ctx", type=int, default=4096, help="Context window of loaded Ollama models")
+    args = parser.parse_args(argv)
+
+    server = MockProviderServer(
+        script=load_script(args.script) if args.script else None,
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        ollama_models=[name.strip() for name in args.ollama_models.split(",") if name.strip()],
+        model_load_time=args.model_load_time,
+        num_ctx=args.num_ctx,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"Mock provider listening on {server.url}")
+    print(f"  ANTHROPIC_BASE_URL={server.url}")
+    print(f"  OPENAI_BASE_URL={server.url}/v1")
+    print(f"  OLLAMA_HOST={server.url}")
+    print(f"Statistics: GET {server.url}/mock/stats")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,752 @@
+"""
+Readiness and residency of models on Ollama servers.
+
+Before its first chat, an OllamaAgent checks that the server answers, that the
+model has been pulled, and loads the model into memory (a chat request without
+messages). These checks are shared by all agents of the process:
+
+- they are asynchronous and never run in an agent's constructor;
+- concurrent checks of the same (host, model) are deduplicated, so a burst of
+  new sessions makes one request to the server rather than one per session;
+- results are cached: successful checks for CURSOR_AGENT_OLLAMA_READY_TTL
+  seconds (default 300), failed ones for FAILURE_TTL seconds, so a server that
+  is down is not asked again on every message.
+
+Ollama unloads a model once it has been idle for its keep-alive (5 minutes by
+default), and the next request pays for loading it again. OllamaAgent sends a
+keep_alive with every request (its keep_alive argument or
+CURSOR_AGENT_OLLAMA_KEEP_ALIVE, e.g. "30m"; a negative value keeps the model
+loaded, 0 unloads it right away). MODEL_RESIDENCY tracks which models are
+loaded on each server, from the server's running models (GET /api/ps) and
+the agents' own requests, and counts how often each model is used.
+
+A WarmPool keeps chosen models loaded: it pins them (keep_alive -1, which the
+agents' requests for them then also send; the configured models are pinned in
+every process) and reloads them if the server dropped them anyway. It pins a
+fixed list of models and/or the most used ones:
+
+- CURSOR_AGENT_OLLAMA_WARM_POOL: comma-separated models to keep loaded
+- CURSOR_AGENT_OLLAMA_WARM_POOL_SIZE: also keep the N most used models loaded
+- CURSOR_AGENT_OLLAMA_WARM_POOL_INTERVAL: seconds between checks (default 60)
+
+context_window() finds the context window requests for a model get, which
+OllamaAgent fits its messages into (see context_window.py).
+
+How long requests waited for their model to load is recorded in the
+cursor_agent_ollama_model_load_seconds and cursor_agent_ollama_cold_loads_total
+metrics, and the models known to be loaded in cursor_agent_ollama_models_resident.
+"""
+
+import asyncio
+import collections
+import datetime
+import math
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from .logger import get_logger
+from .metrics import OLLAMA_COLD_LOADS, OLLAMA_MODEL_LOAD_SECONDS, REGISTRY
+
+# Initialize logger
+logger = get_logger(__name__)
+
+READY_TTL_ENV_VAR = "CURSOR_AGENT_OLLAMA_READY_TTL"
+DEFAULT_READY_TTL = 300.0
+
+# Seconds a failed check (server down, model missing) is cached
+FAILURE_TTL = 5.0
+
+KEEP_ALIVE_ENV_VAR = "CURSOR_AGENT_OLLAMA_KEEP_ALIVE"
+WARM_POOL_ENV_VAR = "CURSOR_AGENT_OLLAMA_WARM_POOL"
+WARM_POOL_SIZE_ENV_VAR = "CURSOR_AGENT_OLLAMA_WARM_POOL_SIZE"
+WARM_POOL_INTERVAL_ENV_VAR = "CURSOR_AGENT_OLLAMA_WARM_POOL_INTERVAL"
+
+# Ollama's keep-alive when a request doesn't set one
+DEFAULT_KEEP_ALIVE_SECONDS = 300.0
+
+# Keep-alive of pinned models: never unload
+PINNED_KEEP_ALIVE = -1
+
+# A request whose load_duration exceeds this had to load its model (a loaded
+# model's load_duration is a few milliseconds)
+COLD_LOAD_THRESHOLD = 0.25
+
+# Seconds the running models of a server (GET /api/ps) are reused
+RESIDENCY_REFRESH_INTERVAL = 2.0
+
+KeepAlive = Union[str, float, int, None]
+
+# Context window of requests that don't set num_ctx, unless the server or model says otherwise
+DEFAULT_NUM_CTX = 4096
+
+# (host, model) -> the num_ctx parameter and the trained context length of the model
+_MODEL_CONTEXT: Dict[Tuple[str, str], Tuple[Optional[int], Optional[int]]] = {}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+@dataclass
+class ModelStatus:
+    """
+    Result of checking a model on an Ollama server.
+
+    Attributes:
+        host: The Ollama server
+        model: The model that was asked for
+        resolved_model: The name to use for the model (the base model if only it was
+                        pulled), or None if the server doesn't have it
+        server_ok: Whether the server answered
+        warmed: Whether the model was loaded into memory
+        load_duration: Seconds the server took to load the model, if it reported it
+        available_models: The models pulled on the server
+        error: Why the server or the model isn't usable
+        checked_at: time.monotonic() of the check
+    """
+    host: str
+    model: str
+    resolved_model: Optional[str] = None
+    server_ok: bool = False
+    warmed: bool = False
+    load_duration: Optional[float] = None
+    available_models: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    checked_at: float = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.server_ok and self.resolved_model is not None
+
+
+def _field(value: Any, name: str) -> Any:
+    """A field of an ollama response, which is a pydantic model or (in older clients) a dict."""
+    return value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+
+
+def model_names(listing: Any) -> List[str]:
+    """The model names in a response of the list (GET /api/tags) or ps (GET /api/ps) endpoints."""
+    names = []
+    for entry in _field(listing, "models") or []:
+        # Newer clients call the field "model", older ones "name"
+        name = _field(entry, "model") or _field(entry, "name")
+        if name:
+            names.append(str(name))
+    return names
+
+
+def resolve_model_name(model: str, available: List[str]) -> Optional[str]:
+    """
+    The name to request a model by, given the models pulled on the server.
+
+    "llama3" matches "llama3:latest". If a tagged variant ("llama3:70b") isn't
+    pulled but its base model is, the base model is used instead.
+
+    Returns:
+        The name to use, or None if the server doesn't have the model
+    """
+    if model in available or f"{model}:latest" in available:
+        return model
+    if ":" in model:
+        base = model.split(":", 1)[0]
+        if base in available or f"{base}:latest" in available:
+            logger.info(f"Model variant '{model}' not found, but base model '{base}' is available")
+            return base
+    return None
+
+
+def keep_alive_seconds(keep_alive: KeepAlive) -> float:
+    """
+    A keep-alive in seconds: math.inf for negative values (never unload).
+
+    Accepts what Ollama accepts: seconds as a number or numeric string, or a
+    duration such as "30m", "1h30m" or "90s". None is Ollama's default.
+    """
+    if keep_alive is None:
+        return DEFAULT_KEEP_ALIVE_SECONDS
+    if isinstance(keep_alive, (int, float)):
+        seconds = float(keep_alive)
+    else:
+        text = keep_alive.strip().lower()
+        try:
+            seconds = float(text)
+        except ValueError:
+            sign = -1.0 if text.startswith("-") else 1.0
+            parts = _DURATION_PART.findall(text.lstrip("-"))
+            if not parts or "".join(number + unit for number, unit in parts) != text.lstrip("-"):
+                raise ValueError(f"Invalid keep_alive {keep_alive!r}")
+            units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+            seconds = sign * sum(float(number) * units[unit] for number, unit in parts)
+    return math.inf if seconds < 0 else seconds
+
+
+def keep_alive_from_env() -> KeepAlive:
+    """The keep-alive configured by CURSOR_AGENT_OLLAMA_KEEP_ALIVE, or None for Ollama's default."""
+    value = os.environ.get(KEEP_ALIVE_ENV_VAR, "").strip()
+    if not value:
+        return None
+    try:
+        keep_alive_seconds(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid value for {KEEP_ALIVE_ENV_VAR}: {value!r}")
+        return None
+    # Numbers are seconds; durations are passed on as they are
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _canonical_name(model: str) -> str:
+    """Model names as the server reports them: "llama3" is "llama3:latest"."""
+    return model if ":" in model else f"{model}:latest"
+
+
+class ModelResidency:
+    """
+    Which models are loaded on which Ollama servers, and how often each is used.
+
+    Shared by all agents of the process. The server's list of running models is
+    authoritative; between refreshes, requests made by the agents update it.
+
+    Args:
+        refresh_interval: Seconds the running models of a server are reused
+        pinned_models: Models pinned on every server, such as those of a warm pool
+                       running in another process (the web backend's workers)
+    """
+
+    def __init__(self, refresh_interval: float = RESIDENCY_REFRESH_INTERVAL, pinned_models: Sequence[str] = ()):
+        self.refresh_interval = refresh_interval
+        self.pinned_models = {_canonical_name(model) for model in pinned_models}
+        # host -> model -> time.monotonic() the model will be unloaded at
+        self._resident: Dict[str, Dict[str, float]] = {}
+        self._refreshed_at: Dict[str, float] = {}
+        # host -> model -> context window the model was loaded with
+        self._context_lengths: Dict[str, Dict[str, int]] = {}
+        self._usage: Dict[Tuple[str, str], int] = collections.Counter()
+        self._pinned: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def is_resident(self, host: str, model: str) -> bool:
+        """Whether the model is (as far as known) loaded on the server."""
+        with self._lock:
+            expires = self._resident.get(host, {}).get(_canonical_name(model))
+        return expires is not None and expires > time.monotonic()
+
+    def resident_models(self, host: str) -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            return sorted(model for model, expires in self._resident.get(host, {}).items() if expires > now)
+
+    async def refresh(self, client: Any, host: str, max_age: Optional[float] = None) -> Optional[List[str]]:
+        """
+        Update the loaded models of a server from its running models (GET /api/ps).
+
+        Args:
+            client: An ollama.AsyncClient for the host
+            host: The Ollama server
+            max_age: Skip the request if the last refresh is more recent than this
+                     (default: refresh_interval; 0 to always refresh)
+
+        Returns:
+            The loaded models, or None if the server couldn't be asked
+        """
+        max_age = self.refresh_interval if max_age is None else max_age
+        with self._lock:
+            refreshed_at = self._refreshed_at.get(host)
+        if refreshed_at is not None and time.monotonic() - refreshed_at < max_age:
+            return self.resident_models(host)
+        try:
+            running = await client.ps()
+        except Exception as e:
+            logger.debug(f"Failed to get the running models of {host}: {str(e)}")
+            return None
+
+        now, wall_now = time.monotonic(), datetime.datetime.now(datetime.timezone.utc)
+        resident: Dict[str, float] = {}
+        context_lengths: Dict[str, int] = {}
+        for entry in _field(running, "models") or []:
+            name = _field(entry, "model") or _field(entry, "name")
+            if not name:
+                continue
+            context_length = _field(entry, "context_length")
+            if isinstance(context_length, int) and context_length > 0:
+                context_lengths[_canonical_name(str(name))] = context_length
+            expires_at = _field(entry, "expires_at")
+            if isinstance(expires_at, str):
+                try:
+                    expires_at = datetime.datetime.fromisoformat(expires_at.replace("Z", "+00:00"))
+                except ValueError:
+                    expires_at = None
+            if isinstance(expires_at, datetime.datetime):
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+                remaining = (expires_at - wall_now).total_seconds()
+                # Pinned models expire centuries from now
+                resident[_canonical_name(str(name))] = math.inf if remaining > 365 * 86400 else now + remaining
+            else:
+                resident[_canonical_name(str(name))] = now + DEFAULT_KEEP_ALIVE_SECONDS
+        with self._lock:
+            self._resident[host] = resident
+            self._context_lengths.setdefault(host, {}).update(context_lengths)
+            self._refreshed_at[host] = now
+        return self.resident_models(host)
+
+    def context_length(self, host: str, model: str) -> Optional[int]:
+        """The context window the server last had the model loaded with, if known."""
+        with self._lock:
+            return self._context_lengths.get(host, {}).get(_canonical_name(model))
+
+    def record_request(self, host: str, model: str, keep_alive: KeepAlive, load_duration: Optional[float] = None,
+                       count: bool = True) -> bool:
+        """
+        Record a request that used (and thereby loaded) a model.
+
+        Args:
+            host: The Ollama server
+            model: The model of the request
+            keep_alive: The keep_alive sent with the request
+            load_duration: Seconds the server spent loading the model, from the response
+            count: Count the request as a use of the model (warmups aren't)
+
+        Returns:
+            Whether the request had to wait for the model to be loaded
+        """
+        name = _canonical_name(model)
+        seconds = keep_alive_seconds(keep_alive)
+        with self._lock:
+            models = self._resident.setdefault(host, {})
+            if seconds > 0:
+                models[name] = time.monotonic() + seconds
+            else:
+                models.pop(name, None)
+            if count:
+                self._usage[(host, name)] += 1
+        cold = load_duration is not None and load_duration >= COLD_LOAD_THRESHOLD
+        if load_duration is not None:
+            OLLAMA_MODEL_LOAD_SECONDS.observe(load_duration, (model,))
+        if cold:
+            OLLAMA_COLD_LOADS.inc((model,))
+            logger.info(f"Ollama model '{model}' on {host} was loaded for the request ({load_duration:.2f}s)")
+        return cold
+
+    def most_used(self, host: str, count: int) -> List[str]:
+        """The count models of a server used most by requests of this process."""
+        with self._lock:
+            usage = [(uses, model) for (model_host, model), uses in self._usage.items() if model_host == host]
+        return [model for _, model in sorted(usage, key=lambda item: (-item[0], item[1]))[:count]]
+
+    def pin(self, host: str, model: str) -> None:
+        with self._lock:
+            self._pinned.setdefault(host, set()).add(_canonical_name(model))
+
+    def unpin(self, host: str, model: str) -> None:
+        with self._lock:
+            self._pinned.get(host, set()).discard(_canonical_name(model))
+
+    def is_pinned(self, host: str, model: str) -> bool:
+        with self._lock:
+            pinned = self._pinned.get(host, set())
+        name = _canonical_name(model)
+        return name in pinned or name in self.pinned_models
+
+    def keep_alive_for(self, host: str, model: str, keep_alive: KeepAlive) -> KeepAlive:
+        """The keep_alive to send with a request: pinned models stay loaded."""
+        return PINNED_KEEP_ALIVE if self.is_pinned(host, model) else keep_alive
+
+    def gauge(self) -> Dict[Tuple[str, ...], float]:
+        """Values of the cursor_agent_ollama_models_resident gauge: 1 per loaded model."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                (host, model): 1.0
+                for host, models in self._resident.items()
+                for model, expires in models.items()
+                if expires > now
+            }
+
+
+def _parameter(parameters: Any, name: str) -> Optional[int]:
+    """An integer parameter of a Modelfile's PARAMETER lines ("num_ctx 8192")."""
+    for line in str(parameters or "").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == name:
+            try:
+                return int(parts[1])
+            except ValueError:
+                return None
+    return None
+
+
+async def context_window(client: Any, host: str, model: str, num_ctx: Optional[int] = None) -> int:
+    """
+    The context window (in tokens) requests for a model get.
+
+    In order: the num_ctx option of the requests; the window the server has the
+    model loaded with (GET /api/ps); the model's num_ctx parameter (POST
+    /api/show); the server default (OLLAMA_CONTEXT_LENGTH or DEFAULT_NUM_CTX),
+    capped by the context length the model was trained with.
+
+    Args:
+        client: An ollama.AsyncClient for the host
+        host: The Ollama server
+        model: The model
+        num_ctx: The num_ctx option sent with the requests, if any
+    """
+    window, _ = await lookup_context_window(client, host, model, num_ctx)
+    return window
+
+
+async def lookup_context_window(
+    client: Any, host: str, model: str, num_ctx: Optional[int] = None
+) -> Tuple[int, bool]:
+    """
+    Like context_window(), but also tells whether the model's details were found.
+
+    Returns:
+        (the context window, False if the model lookup failed and the window is
+        the server default, which a later lookup may correct)
+    """
+    if num_ctx:
+        return num_ctx, True
+    await MODEL_RESIDENCY.refresh(client, host)
+    loaded = MODEL_RESIDENCY.context_length(host, model)
+    if loaded:
+        return loaded, True
+
+    key = (host, _canonical_name(model))
+    if key in _MODEL_CONTEXT:
+        configured, trained = _MODEL_CONTEXT[key]
+    else:
+        configured = trained = None
+        try:
+            shown = await client.show(model)
+        except Exception as e:
+            # Not cached: the next request asks again once the server is back
+            logger.debug(f"Failed to get the details of model '{model}': {str(e)}")
+        else:
+            configured = _parameter(_field(shown, "parameters"), "num_ctx")
+            model_info = _field(shown, "modelinfo") or _field(shown, "model_info")
+            for name, value in (model_info or {}).items():
+                if name.endswith(".context_length") and isinstance(value, int):
+                    trained = value
+            _MODEL_CONTEXT[key] = (configured, trained)
+    if configured:
+        return configured, True
+    try:
+        default = int(os.environ.get("OLLAMA_CONTEXT_LENGTH") or DEFAULT_NUM_CTX)
+    except ValueError:
+        default = DEFAULT_NUM_CTX
+    return (min(default, trained) if trained else default), key in _MODEL_CONTEXT
+
+
+class ModelReadiness:
+    """
+    Deduplicated, cached readiness checks of (host, model) pairs, shared by all agents.
+
+    Args:
+        ttl: Seconds a successful check stays valid
+        failure_ttl: Seconds a failed check stays valid
+    """
+
+    def __init__(self, ttl: float = DEFAULT_READY_TTL, failure_ttl: float = FAILURE_TTL):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self._results: Dict[Tuple[str, str], ModelStatus] = {}
+        # Checks in progress and the event loop running each (tasks can't be awaited from other loops)
+        self._pending: Dict[Tuple[str, str], Tuple[asyncio.AbstractEventLoop, "asyncio.Task[ModelStatus]"]] = {}
+        self._lock = threading.Lock()
+
+    def cached(self, host: str, model: str, warmup: bool = True) -> Optional[ModelStatus]:
+        """The cached, still valid status of a model, if any."""
+        with self._lock:
+            status = self._results.get((host, model))
+        if status is None:
+            return None
+        ttl = self.ttl if status.ready else self.failure_ttl
+        if time.monotonic() - status.checked_at > ttl:
+            return None
+        if warmup and status.ready and not status.warmed:
+            return None
+        return status
+
+    def invalidate(self, host: Optional[str] = None, model: Optional[str] = None) -> None:
+        """Forget cached results, e.g. after the server restarted or a model was pulled."""
+        with self._lock:
+            for key in list(self._results):
+                if (host is None or key[0] == host) and (model is None or key[1] == model):
+                    del self._results[key]
+
+    async def ensure_ready(self, client: Any, host: str, model: str, warmup: bool = True,
+                           refresh: bool = False, keep_alive: KeepAlive = None) -> ModelStatus:
+        """
+        Check a model, unless a valid result is cached or a check is already running.
+
+        Args:
+            client: An ollama.AsyncClient for the host
+            host: The Ollama server, part of the cache key
+            model: The model to check
+            warmup: Whether to load the model into memory
+            refresh: Ignore the cached result
+            keep_alive: keep_alive of the warmup request
+
+        Returns:
+            The status of the model; problems are reported in it rather than raised
+        """
+        if not refresh:
+            status = self.cached(host, model, warmup)
+            if status is not None:
+                return status
+
+        key = (host, model)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None or pending[0] is not loop or pending[1].done():
+                task = loop.create_task(self._check(client, host, model, warmup, keep_alive))
+                self._pending[key] = (loop, task)
+            else:
+                task = pending[1]
+        # Shielded, so a cancelled turn doesn't cancel the check the other agents wait for
+        return await asyncio.shield(task)
+
+    async def _check(self, client: Any, host: str, model: str, warmup: bool, keep_alive: KeepAlive) -> ModelStatus:
+        status = ModelStatus(host=host, model=model)
+        try:
+            try:
+                status.available_models = model_names(await client.list())
+                status.server_ok = True
+            except Exception as e:
+                status.error = f"Cannot connect to Ollama server at {host}. Is Ollama running? Error: {str(e)}"
+                logger.warning(status.error)
+                return status
+
+            logger.debug(f"Available Ollama models: {', '.join(status.available_models) or 'None'}")
+            status.resolved_model = resolve_model_name(model, status.available_models)
+            if status.resolved_model is None:
+                status.error = (
+                    f"Model '{model}' not found in available models. "
+                    f"You may need to pull it with 'ollama pull {model}'. "
+                    f"Available models: {', '.join(status.available_models) or 'None'}"
+                )
+                logger.warning(status.error)
+                return status
+
+            if warmup:
+                await MODEL_RESIDENCY.refresh(client, host)
+                if MODEL_RESIDENCY.is_resident(host, status.resolved_model):
+                    status.warmed = True
+                else:
+                    status.warmed, status.load_duration = await load_model(
+                        client, host, status.resolved_model,
+                        MODEL_RESIDENCY.keep_alive_for(host, status.resolved_model, keep_alive),
+                    )
+            return status
+        finally:
+            status.checked_at = time.monotonic()
+            with self._lock:
+                self._results[(host, model)] = status
+                pending = self._pending.get((host, model))
+                if pending is not None and pending[1] is asyncio.current_task():
+                    del self._pending[(host, model)]
+
+
+async def load_model(client: Any, host: str, model: str, keep_alive: KeepAlive) -> Tuple[bool, Optional[float]]:
+    """
+    Load a model into memory with a chat request without messages.
+
+    Returns:
+        Whether the model was loaded, and the seconds the server took to load it
+    """
+    logger.info(f"Preloading model '{model}' to improve response times")
+    try:
+        response = await client.chat(model=model, messages=[], keep_alive=keep_alive)
+    except Exception as e:
+        # The model can still be used, it is loaded by the first chat
+        logger.warning(f"Failed to preload model '{model}': {str(e)}")
+        return False, None
+    load_duration = _field(response, "load_duration")
+    seconds = load_duration / 1e9 if isinstance(load_duration, int) else None
+    MODEL_RESIDENCY.record_request(host, model, keep_alive, seconds, count=False)
+    logger.info(f"Successfully preloaded model '{model}'")
+    return True, seconds
+
+
+class WarmPool:
+    """
+    Keeps models loaded on an Ollama server.
+
+    Every interval, the pool pins its models (the configured ones and the size
+    most used ones) and loads those the server doesn't have in memory with
+    keep_alive -1. Models that leave the pool get their normal keep-alive back
+    and are unloaded by the server once idle.
+
+    Args:
+        host: The Ollama server
+        models: Models to keep loaded
+        size: Number of most used models to keep loaded as well
+        interval: Seconds between checks
+        keep_alive: Keep-alive given back to models leaving the pool
+        client: An ollama.AsyncClient for the host (created on first use by default)
+    """
+
+    def __init__(
+        self,
+        host: str,
+        models: Sequence[str] = (),
+        size: int = 0,
+        interval: float = 60.0,
+        keep_alive: KeepAlive = None,
+        client: Any = None,
+    ):
+        self.host = host
+        self.models = list(models)
+        self.size = size
+        self.interval = interval
+        self.keep_alive = keep_alive
+        self._client = client
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._pinned: List[str] = []
+
+    @classmethod
+    def from_env(cls, host: Optional[str] = None) -> Optional["WarmPool"]:
+        """
+        A pool configured by the CURSOR_AGENT_OLLAMA_WARM_POOL* environment variables.
+
+        Returns:
+            WarmPool, or None if no models are to be kept loaded
+        """
+        models = _warm_pool_models_from_env()
+
+        def number(name: str, default: float) -> float:
+            value = os.environ.get(name, "").strip()
+            try:
+                return float(value) if value else default
+            except ValueError:
+                logger.warning(f"Ignoring invalid value for {name}: {value!r}")
+                return default
+
+        size = int(number(WARM_POOL_SIZE_ENV_VAR, 0))
+        if not models and size <= 0:
+            return None
+        return cls(
+            host=host or os.environ.get("OLLAMA_HOST") or "http://localhost:11434",
+            models=models,
+            size=size,
+            interval=number(WARM_POOL_INTERVAL_ENV_VAR, 60.0),
+            keep_alive=keep_alive_from_env(),
+        )
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            import ollama
+
+            self._client = ollama.AsyncClient(host=self.host)
+        return self._client
+
+    def targets(self) -> List[str]:
+        """The models the pool keeps loaded right now."""
+        targets = list(self.models)
+        if self.size > 0:
+            # most_used reports canonical names ("llama3:latest")
+            configured = {_canonical_name(model) for model in targets}
+            targets += [model for model in MODEL_RESIDENCY.most_used(self.host, self.size + len(targets))
+                        if model not in configured][:self.size]
+        return targets
+
+    async def run_once(self) -> List[str]:
+        """
+        Pin the pool's models and load those that aren't loaded.
+
+        Returns:
+            The models that were loaded
+        """
+        targets = self.targets()
+        for model in self._pinned:
+            if model not in targets:
+                await self._release(model)
+        self._pinned = [model for model in self._pinned if model in targets]
+
+        await MODEL_RESIDENCY.refresh(self.client, self.host, max_age=0)
+        loaded = []
+        for model in targets:
+            newly_pinned = model not in self._pinned
+            MODEL_RESIDENCY.pin(self.host, model)
+            if newly_pinned:
+                self._pinned.append(model)
+            # Loaded models get keep_alive -1 with their first pinning request
+            if newly_pinned or not MODEL_RESIDENCY.is_resident(self.host, model):
+                ok, _ = await load_model(self.client, self.host, model, PINNED_KEEP_ALIVE)
+                if ok:
+                    loaded.append(model)
+        return loaded
+
+    async def _release(self, model: str) -> None:
+        """Give a model its normal keep-alive back."""
+        MODEL_RESIDENCY.unpin(self.host, model)
+        try:
+            await self.client.chat(model=model, messages=[], keep_alive=self.keep_alive)
+            MODEL_RESIDENCY.record_request(self.host, model, self.keep_alive, count=False)
+        except Exception as e:
+            logger.warning(f"Failed to release model '{model}' from the warm pool: {str(e)}")
+
+    def start(self) -> "asyncio.Task[None]":
+        """Run the pool in the current event loop until stop() is called."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    async def stop(self) -> None:
+        """Stop the pool and release its models."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for model in self._pinned:
+            await self._release(model)
+        self._pinned = []
+
+    async def _run(self) -> None:
+        logger.info(f"Ollama warm pool for {self.host}: models={self.models}, most used={self.size}")
+        while True:
+            try:
+                loaded = await self.run_once()
+                if loaded:
+                    logger.info(f"Warm pool loaded {', '.join(loaded)} on {self.host}")
+            except Exception as e:
+                logger.warning(f"Ollama warm pool check failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+
+def _warm_pool_models_from_env() -> List[str]:
+    return [name.strip() for name in os.environ.get(WARM_POOL_ENV_VAR, "").split(",") if name.strip()]
+
+
+def _ready_ttl_from_env() -> float:
+    value = os.environ.get(READY_TTL_ENV_VAR, "").strip()
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid value for {READY_TTL_ENV_VAR}: {value!r}")
+    return DEFAULT_READY_TTL
+
+
+# Readiness of the models of all Ollama agents in the process
+MODEL_READINESS = ModelReadiness(ttl=_ready_ttl_from_env())
+
+# Loaded models of the Ollama servers the process uses
+MODEL_RESIDENCY = ModelResidency(pinned_models=_warm_pool_models_from_env())
+
+REGISTRY.gauge(
+    "cursor_agent_ollama_models_resident",
+    "Models known to be loaded on each Ollama server",
+    MODEL_RESIDENCY.gauge,
+    ("host", "model"),
+)
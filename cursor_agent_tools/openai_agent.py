@@ -4,9 +4,10 @@ from typing import Any, Dict, List, Optional, Callable, cast, Union
 
 from openai import AsyncOpenAI, BadRequestError, RateLimitError, APIError, AuthenticationError
 
-from .base import BaseAgent, AgentResponse, AgentToolCall
-from .logger import get_logger
+from .base import BaseAgent, AgentResponse, AgentToolCall, agent_turn
+from .logger import get_logger, lazy
 from .permissions import PermissionOptions, PermissionRequest, PermissionStatus
+from .profiling import ProfileConfig
 from .tools.register_tools import register_default_tools
 
 # Initialize logger
@@ -27,6 +28,7 @@ class OpenAIAgent(BaseAgent):
         permission_callback: Optional[Callable[[PermissionRequest], PermissionStatus]] = None,
         permission_options: Optional[PermissionOptions] = None,
         default_tool_timeout: int = 300,
+        profile: Union[bool, str, ProfileConfig, None] = None,
         **kwargs
     ):
         """
@@ -40,6 +42,7 @@ class OpenAIAgent(BaseAgent):
             permission_callback: Optional callback for permission requests
             permission_options: Permission configuration options
             default_tool_timeout: Default timeout in seconds for tool calls (default: 300s)
+            profile: Profile every chat turn (see BaseAgent); None follows CURSOR_AGENT_PROFILE
             **kwargs: Additional parameters to pass to the model
         """
         logger.info(f"Initializing OpenAI agent with model {model}")
@@ -49,7 +52,8 @@ class OpenAIAgent(BaseAgent):
             model=model,
             permission_options=permission_options,
             permission_callback=permission_callback,
-            default_tool_timeout=default_tool_timeout
+            default_tool_timeout=default_tool_timeout,
+            profile=profile,
         )
 
         self.temperature = temperature
@@ -229,7 +233,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
                     tool_call_id = cast(str, call.get("id", "unknown_id"))
                     logger.debug(f"Executing tool (dict): {tool_name} (id: {tool_call_id})")
 
-                logger.debug(f"Tool arguments: {json.dumps(arguments)}")
+                logger.debug("Tool arguments: %s", lazy(json.dumps, arguments))
 
                 if tool_name not in self.available_tools:
                     logger.warning(f"Tool not found: {tool_name}")
@@ -240,8 +244,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
                     }
                 else:
                     logger.debug(f"Calling function for tool: {tool_name}")
-                    function = self.available_tools[tool_name]["function"]
-                    result_content = function(**arguments)
+                    result_content = self._invoke_tool(tool_name, arguments)
 
                     # Log a summary of the result
                     if isinstance(result_content, dict) and "error" in result_content:
@@ -278,6 +281,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
         logger.info(f"Completed {len(tool_results)} tool call results")
         return tool_results
 
+    @agent_turn
     async def chat(self, message: str, user_info: Optional[Dict[str, Any]] = None) -> Union[str, AgentResponse]:
         """
         Send a message to the OpenAI API and get a response.
@@ -315,14 +319,14 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
             if tools:
                 logger.debug(f"Using {len(tools)} tools")
 
-            response = await self.client.chat.completions.create(  # type: ignore
+            response = await self._model_request(self.client.chat.completions.create(  # type: ignore
                 model=self.model if self.model else "gpt-4-turbo",
                 messages=messages,
                 tools=tools,
                 tool_choice="auto" if tools else None,
                 max_tokens=4096,
                 temperature=self.temperature,
-            )
+            ))
             logger.info("Received response from OpenAI API")
 
             # Get the assistant's response
@@ -345,7 +349,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
                 )
 
                 # Execute the tool calls
-                tool_results = self._execute_tool_calls(assistant_message.tool_calls)
+                tool_results = await self._run_tool_calls(assistant_message.tool_calls)
 
                 # Process and track tool calls for the structured response
                 for idx, tool_call in enumerate(assistant_message.tool_calls):
@@ -398,9 +402,9 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
                 )
                 logger.debug(f"Follow-up call with {len(follow_up_messages)} messages")
 
-                follow_up_response = await self.client.chat.completions.create(
+                follow_up_response = await self._model_request(self.client.chat.completions.create(
                     model=self.model if self.model else "gpt-4-turbo", messages=follow_up_messages, max_tokens=4096, temperature=self.temperature
-                )
+                ))
                 logger.info("Received follow-up response from OpenAI API")
 
                 # Add the assistant's follow-up response to the conversation history
@@ -517,7 +521,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
             ]
 
             # Create a completion request to the OpenAI API with tools
-            response = await self.client.chat.completions.create(
+            response = await self._model_request(self.client.chat.completions.create(
                 model=model_to_use,
                 max_tokens=2000,
                 messages=[
@@ -527,7 +531,7 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
                 tools=tools,
                 tool_choice={"type": "function", "function": {"name": "get_structured_data"}},
                 temperature=0
-            )
+            ))
 
             # Extract the JSON content from the function call
             if response.choices and response.choices[0].message.tool_calls:
@@ -661,13 +665,13 @@ This is the ONLY acceptable format for code citations. The format is ```startLin
             logger.debug(f"Calling OpenAI API for image analysis with model: {self.model}")
             vision_model = "gpt-4o" if self.model.startswith("gpt-4") else "gpt-4o"
 
-            response = await self.client.chat.completions.create(
+            response = await self._model_request(self.client.chat.completions.create(
                 model=vision_model,
                 messages=messages,
                 max_tokens=1024,
                 temperature=self.temperature,
                 timeout=self.timeout
-            )
+            ))
 
             # Extract and return the assistant's response
             if response.choices and len(response.choices) > 0:
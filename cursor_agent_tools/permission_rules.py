@@ -0,0 +1,575 @@
+"""
+Compiled rule sets for permission checks.
+
+Command rules are matched per sub-command: a command line is split at shell
+operators (;, &&, ||, |, &, newlines, subshells and command substitutions,
+`sh -c` and `eval` strings, `find -exec` commands) and every sub-command is
+checked on its own, so `ls; rm -rf /` is seen as `ls` and `rm -rf /`.
+Denylists also see a normalized form of each sub-command (program name
+without its path and in lower case, rm flags as `-rf`, git/docker/kubectl
+global options dropped), so `/bin/rm -Rfv /` and `git -C . push` are caught. Rules are compiled once into indexes (word rules
+by first word, regex rules by a required literal through an Aho-Corasick
+automaton, path globs by literal prefix/suffix), so evaluation cost barely
+grows with the number of rules. Every rule counts its hits.
+"""
+
+import fnmatch
+import functools
+import os
+import re
+import shlex
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Commands run_terminal_command refuses outright, regardless of permissions
+DEFAULT_BLOCKED_COMMANDS = (
+    "rm -rf",
+    "rm -fr",
+    "sudo rm",
+    "dd",
+    "mkfs*",
+    "format",
+    r"re::\(\)\s*\{\s*:\s*\|\s*:\s*&\s*\}\s*;\s*:",  # fork bomb
+)
+
+# Prefix marking a rule as a regular expression instead of a word pattern
+REGEX_PREFIX = "re:"
+
+# Programs that run another command given as their arguments, with their options that take a value
+_WRAPPERS: Dict[str, frozenset] = {
+    "sudo": frozenset({"-u", "-g", "-h", "-p", "-C", "-D", "-U"}),
+    "doas": frozenset({"-u", "-C"}),
+    "env": frozenset({"-u", "-C", "-S"}),
+    "nohup": frozenset(),
+    "nice": frozenset({"-n"}),
+    "time": frozenset({"-f", "-o"}),
+    "command": frozenset(),
+    "exec": frozenset({"-a"}),
+    "xargs": frozenset({"-I", "-L", "-n", "-P", "-d", "-E", "-s", "-a"}),
+    "timeout": frozenset({"-s", "-k"}),
+    "stdbuf": frozenset({"-i", "-o", "-e"}),
+}
+
+# Shells whose -c argument is itself a command line
+_SHELLS = frozenset({"sh", "bash", "zsh", "dash", "ksh"})
+
+# find actions that run a command, ended by ";" or "+"
+_FIND_EXEC = frozenset({"-exec", "-execdir", "-ok", "-okdir"})
+
+# Programs with global options before their subcommand, with the options that take a value
+_GLOBAL_OPTIONS: Dict[str, frozenset] = {
+    "git": frozenset({"-C", "-c", "--git-dir", "--work-tree", "--namespace", "--exec-path"}),
+    "docker": frozenset({"-H", "--host", "-c", "--context", "--config", "-l", "--log-level"}),
+    "kubectl": frozenset({"-n", "--namespace", "--context", "--cluster", "--kubeconfig", "-s", "--server"}),
+}
+
+# rm options, as the flags they stand for
+_RM_LONG_OPTIONS = {"--recursive": "r", "--force": "f"}
+
+_PUNCTUATION = "();<>|&\n\r"
+_OPERATORS = frozenset({";", ";;", "&", "&&", "|", "||", "|&", "(", ")", "$", "\n", "\r", "\r\n"})
+_REDIRECTIONS = frozenset({">", ">>", "<", "<<", "<<<", ">&", "<&", "&>", "&>>", ">|", "<>"})
+_ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+_GLOB_CHARS = frozenset("*?[")
+
+# Rules are shared by the threads that run tool calls concurrently
+_hits_lock = threading.Lock()
+
+
+@dataclass
+class Rule:
+    """
+    A single permission rule.
+
+    Attributes:
+        pattern: The rule as configured
+        hits: Number of requests the rule matched
+    """
+    pattern: str
+    hits: int = 0
+
+    def record_hit(self) -> None:
+        with _hits_lock:
+            self.hits += 1
+
+
+@functools.lru_cache(maxsize=1024)
+def split_commands(command: str) -> Tuple[Tuple[str, ...], ...]:
+    """
+    Split a command line into the words of its sub-commands.
+
+    Operators (including newlines), redirections (with their targets) and
+    leading VAR=value assignments are dropped; `sh -c "..."` and `eval`
+    arguments and `find -exec` commands are split recursively. "#" does not
+    start a comment, so nothing after it is hidden. Falls back to splitting on
+    whitespace if the command can't be tokenized.
+    """
+    # Backslash-newline continues a line
+    text = command.replace("\\\r\n", "").replace("\\\n", "").replace("`", " ; ")
+    lexer = shlex.shlex(text, posix=True, punctuation_chars=_PUNCTUATION)
+    lexer.whitespace_split = True
+    # Newlines separate commands, so they are punctuation rather than whitespace
+    lexer.whitespace = " \t"
+    lexer.commenters = ""
+    try:
+        tokens = list(lexer)
+    except ValueError:  # unbalanced quotes
+        tokens = re.split(r"[ \t]+|([;&|()\n\r])", text)
+        tokens = [token for token in tokens if token]
+
+    commands: List[Tuple[str, ...]] = []
+    words: List[str] = []
+
+    def flush() -> None:
+        while words and _ASSIGNMENT.match(words[0]):
+            words.pop(0)
+        if words:
+            commands.append(tuple(words))
+            commands.extend(_nested_commands(words))
+        words.clear()
+
+    skip_target = False
+    for token in tokens:
+        if skip_target:
+            skip_target = False
+            continue
+        if token in _REDIRECTIONS:
+            # "2>&1": drop the file descriptor number and the target
+            if words and words[-1].isdigit():
+                words.pop()
+            skip_target = True
+        elif token in _OPERATORS or all(char in "();<>|&$\n\r" for char in token):
+            flush()
+        else:
+            words.append(token)
+    flush()
+    return tuple(commands)
+
+
+def _nested_commands(words: Sequence[str]) -> List[Tuple[str, ...]]:
+    """The sub-commands of the command lines a command runs: `sh -c "..."`, `eval ...`, `find -exec ... ;`."""
+    name = os.path.basename(words[0])
+    nested: List[Tuple[str, ...]] = []
+    if name in _SHELLS:
+        # "-c", also combined with other options ("bash -lc")
+        for index in range(1, len(words) - 1):
+            word = words[index]
+            if word == "--" or not word.startswith("-"):
+                break
+            if not word.startswith("--") and "c" in word[1:]:
+                nested.extend(split_commands(words[index + 1]))
+                break
+    elif name == "eval" and len(words) > 1:
+        nested.extend(split_commands(" ".join(words[1:])))
+    elif name == "find":
+        index = 1
+        while index < len(words):
+            if words[index] in _FIND_EXEC:
+                end = index + 1
+                while end < len(words) and words[end] not in (";", "+"):
+                    end += 1
+                if end > index + 1:
+                    nested.extend(split_commands(shlex.join(words[index + 1:end])))
+                index = end
+            index += 1
+    return nested
+
+
+def _normalized_form(words: Sequence[str]) -> Tuple[str, ...]:
+    """
+    A sub-command in the form denylist rules are written in.
+
+    The program is named without its path and in lower case, rm flags are
+    combined (`rm -R -f -v` becomes `rm -rf`) and the global options of git,
+    docker and kubectl are dropped (`git -C . push` becomes `git push`).
+    """
+    name = os.path.basename(words[0]).lower()
+    args = list(words[1:])
+    if name == "rm":
+        flags = set()
+        operands = []
+        options_done = False
+        for arg in args:
+            if options_done or not arg.startswith("-") or arg == "-":
+                operands.append(arg)
+            elif arg == "--":
+                options_done = True
+            elif arg.startswith("--"):
+                flags.add(_RM_LONG_OPTIONS.get(arg, ""))
+            else:
+                flags.update(arg[1:].lower())
+        combined = "".join(flag for flag in "rf" if flag in flags)
+        args = ([f"-{combined}"] if combined else []) + operands
+    elif name in _GLOBAL_OPTIONS:
+        value_options = _GLOBAL_OPTIONS[name]
+        index = 0
+        while index < len(args) and args[index].startswith("-"):
+            if args[index] in value_options:
+                index += 1
+            index += 1
+        args = args[index:]
+    return (name,) + tuple(args)
+
+
+def _command_forms(words: Sequence[str]) -> List[Sequence[str]]:
+    """
+    The sub-command itself plus the commands run by wrappers like sudo, env or xargs.
+
+    For `sudo -u root rm x` these are the command as given, `sudo rm x` and `rm x`.
+    """
+    forms: List[Sequence[str]] = [words]
+    while True:
+        index = 0
+        while index < len(words) and _ASSIGNMENT.match(words[index]):
+            index += 1
+        if index >= len(words) or os.path.basename(words[index]) not in _WRAPPERS:
+            return forms
+        wrapper = words[index]
+        value_options = _WRAPPERS[os.path.basename(wrapper)]
+        index += 1
+        # Options and their values ("sudo -u user", "timeout 10", "nice -n 5", "env A=1")
+        while index < len(words) and (
+            words[index].startswith("-") or words[index][:1].isdigit() or _ASSIGNMENT.match(words[index])
+        ):
+            if words[index] in value_options:
+                index += 1
+            index += 1
+        words = words[index:]
+        if not words:
+            return forms
+        if len(forms[-1]) != len(words) + 1:
+            forms.append((wrapper,) + tuple(words))
+        forms.append(words)
+
+
+class _WordRule(Rule):
+    """A rule matching the leading words of a command; words may contain glob characters."""
+
+    def __init__(self, pattern: str):
+        super().__init__(pattern)
+        self.words = tuple(shlex.split(pattern)) if pattern.strip() else ()
+        self._globs = tuple(
+            re.compile(fnmatch.translate(word)) if _GLOB_CHARS & set(word) else None for word in self.words
+        )
+
+    def matches(self, words: Sequence[str]) -> bool:
+        if len(words) < len(self.words):
+            return False
+        for word, expected, glob in zip(words, self.words, self._globs):
+            if glob is not None:
+                if not glob.match(word):
+                    return False
+            elif word != expected:
+                return False
+        return True
+
+
+class _RegexRule(Rule):
+    """A rule given as a regular expression."""
+
+    def __init__(self, pattern: str, regex: "re.Pattern[str]"):
+        super().__init__(pattern)
+        self.regex = regex
+
+
+def _required_literal(expression: str) -> str:
+    """
+    The literal text every match of a regular expression starts with ("" if unknown).
+
+    Deliberately simple: only a leading run of plain or escaped characters is used,
+    and expressions containing alternation or inline flags get none.
+    """
+    if "|" in expression or expression.startswith("(?"):
+        return ""
+    literal = []
+    index = 0
+    while index < len(expression):
+        char = expression[index]
+        if char == "\\" and index + 1 < len(expression) and not expression[index + 1].isalnum():
+            literal.append(expression[index + 1])
+            index += 2
+        elif char in ".^$*+?{}[]()\\":
+            break
+        else:
+            literal.append(char)
+            index += 1
+        if index < len(expression) and expression[index] in "*?{":
+            # The last character is optional or repeated
+            literal.pop()
+            break
+    return "".join(literal)
+
+
+class _AhoCorasick:
+    """Finds which of a set of keywords occur in a text in a single pass."""
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(keyword)
+
+        # Breadth-first construction of the failure links
+        queue = list(self._goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text: str) -> List[str]:
+        """The keywords occurring in text."""
+        found: List[str] = []
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.extend(output[state])
+        return found
+
+
+class CommandRules:
+    """
+    A compiled list of command patterns.
+
+    A pattern is either words matching the start of a sub-command ("git push",
+    "rm -rf", "mkfs*"; words may use glob characters) or, with the "re:" prefix,
+    a regular expression searched in the whole command line.
+
+    Word rules are indexed by their first word. Regex rules are prefiltered with
+    an Aho-Corasick automaton over the literal text they must start with, so only
+    rules whose literal occurs in the command are evaluated; the few without such
+    a literal are combined into one alternation.
+
+    Args:
+        patterns: The configured patterns
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.rules: List[Rule] = []
+        self._by_word: Dict[str, List[_WordRule]] = {}
+        self._glob_rules: List[_WordRule] = []
+        self._by_literal: Dict[str, List[_RegexRule]] = {}
+        # Regex rules without a literal; the index of the outer group that matched identifies the rule
+        self._unindexed: Dict[int, _RegexRule] = {}
+        parts = []
+        group = 1
+        for pattern in patterns:
+            if pattern.startswith(REGEX_PREFIX):
+                expression = pattern[len(REGEX_PREFIX):]
+                try:
+                    compiled = re.compile(expression)
+                except re.error as e:
+                    logger.warning(f"Ignoring invalid permission rule {pattern!r}: {e}")
+                    continue
+                regex_rule = _RegexRule(pattern, compiled)
+                literal = _required_literal(expression)
+                if len(literal) >= 2:
+                    self._by_literal.setdefault(literal, []).append(regex_rule)
+                else:
+                    parts.append(f"({expression})")
+                    self._unindexed[group] = regex_rule
+                    group += 1 + compiled.groups
+                self.rules.append(regex_rule)
+            else:
+                word_rule = _WordRule(pattern)
+                if not word_rule.words:
+                    continue
+                if word_rule._globs[0] is not None:
+                    self._glob_rules.append(word_rule)
+                else:
+                    self._by_word.setdefault(word_rule.words[0], []).append(word_rule)
+                self.rules.append(word_rule)
+        self._literals = _AhoCorasick(self._by_literal) if self._by_literal else None
+        self._regex = re.compile("|".join(parts)) if parts else None
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _match_words(self, words: Sequence[str], normalize: bool = False) -> Optional[Rule]:
+        """
+        Find the word rule matching a sub-command.
+
+        With normalize, the normalized form of the sub-command is also checked
+        ("/bin/rm -Rf /" matches "rm -rf", see _normalized_form). Allowlists
+        don't use this: "./ls" is not ls.
+        """
+        forms = [words]
+        if normalize:
+            normalized = _normalized_form(words)
+            if normalized != tuple(words):
+                forms.append(normalized)
+        for form in forms:
+            for rule in self._by_word.get(form[0], ()):
+                if rule.matches(form):
+                    return rule
+            for rule in self._glob_rules:
+                if rule.matches(form):
+                    return rule
+        return None
+
+    def _match_regex(self, text: str, anchored: bool = False) -> Optional[Rule]:
+        if self._literals is not None:
+            for literal in self._literals.find_all(text):
+                for rule in self._by_literal[literal]:
+                    if (rule.regex.match(text) if anchored else rule.regex.search(text)):
+                        return rule
+        if self._regex is not None:
+            match = self._regex.match(text) if anchored else self._regex.search(text)
+            if match is not None and match.lastindex is not None:
+                return self._unindexed[match.lastindex]
+        return None
+
+    def find(self, command: str) -> Optional[Rule]:
+        """
+        Find a rule matching any part of a command (denylist semantics).
+
+        Word rules are checked against every sub-command, including the commands
+        run by wrappers (`sudo rm -rf x`, `find . | xargs rm -rf`), and against
+        its normalized form (`/bin/rm -Rf x`, `git -C . push`).
+        """
+        rule = self._match_regex(command)
+        if rule is None:
+            for words in split_commands(command):
+                for form in _command_forms(words):
+                    rule = self._match_words(form, normalize=True)
+                    if rule is not None:
+                        break
+                if rule is not None:
+                    break
+        if rule is not None:
+            rule.record_hit()
+        return rule
+
+    def covers(self, command: str) -> bool:
+        """
+        Check whether every sub-command matches a rule (allowlist semantics).
+
+        Wrappers are not looked through: "ls" allows `ls -la` but not `sudo ls`.
+        Regex rules must match at the start of the sub-command.
+        """
+        return self.match_all(command) is not None
+
+    def match_all(self, command: str) -> Optional[List[Rule]]:
+        """The rule matching each sub-command, or None if some sub-command matches none (see covers)."""
+        sub_commands = split_commands(command)
+        if not sub_commands:
+            return None
+        matched = []
+        for words in sub_commands:
+            rule = self._match_words(words) or self._match_regex(" ".join(words), anchored=True)
+            if rule is None:
+                return None
+            matched.append(rule)
+        for rule in matched:
+            rule.record_hit()
+        return matched
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{"pattern": rule.pattern, "hits": rule.hits} for rule in self.rules]
+
+
+class PathRules:
+    """
+    A compiled list of path glob patterns.
+
+    Patterns use fnmatch syntax and are matched against the absolute path;
+    relative patterns are anchored at the current directory when compiled.
+    As in fnmatch, "*" also matches "/", so "*.env" matches .env files anywhere.
+
+    Patterns are indexed by their literal prefix (e.g. "/etc/") or, for patterns
+    starting with a wildcard, their literal suffix (e.g. ".env"), so a lookup
+    only evaluates the patterns that can match.
+
+    Args:
+        patterns: The configured patterns
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.rules: List[_RegexRule] = []
+        self._by_prefix: Dict[str, List[_RegexRule]] = {}
+        self._by_suffix: Dict[str, List[_RegexRule]] = {}
+        self._unindexed: List[_RegexRule] = []
+        for pattern in patterns:
+            if not pattern:
+                continue
+            anchored = os.path.expanduser(pattern)
+            if not os.path.isabs(anchored) and not anchored.startswith("*"):
+                anchored = os.path.join(os.getcwd(), anchored)
+            anchored = os.path.normpath(anchored)
+            rule = _RegexRule(pattern, re.compile(fnmatch.translate(anchored)))
+            prefix = re.split(r"[*?\[]", anchored, maxsplit=1)[0]
+            suffix = re.split(r"[*?\]]", anchored)[-1]
+            if prefix:
+                self._by_prefix.setdefault(prefix, []).append(rule)
+            elif suffix:
+                self._by_suffix.setdefault(suffix, []).append(rule)
+            else:
+                self._unindexed.append(rule)
+            self.rules.append(rule)
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._by_prefix})
+        self._suffix_lengths = sorted({len(suffix) for suffix in self._by_suffix})
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _candidates(self, path: str) -> Iterable[_RegexRule]:
+        for length in self._prefix_lengths:
+            if length > len(path):
+                break
+            yield from self._by_prefix.get(path[:length], ())
+        for length in self._suffix_lengths:
+            if length > len(path):
+                break
+            yield from self._by_suffix.get(path[-length:], ())
+        yield from self._unindexed
+
+    def find(self, path: str) -> Optional[Rule]:
+        """Find the rule matching a path, if any."""
+        path = os.path.abspath(path)
+        for rule in self._candidates(path):
+            if rule.regex.match(path):
+                rule.record_hit()
+                return rule
+        return None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{"pattern": rule.pattern, "hits": rule.hits} for rule in self.rules]
+
+
+_default_blocked: Optional[CommandRules] = None
+_default_blocked_lock = threading.Lock()
+
+
+def default_blocked_commands() -> CommandRules:
+    """The compiled DEFAULT_BLOCKED_COMMANDS, for commands run without an agent."""
+    global _default_blocked
+
+    with _default_blocked_lock:
+        if _default_blocked is None:
+            _default_blocked = CommandRules(DEFAULT_BLOCKED_COMMANDS)
+    return _default_blocked
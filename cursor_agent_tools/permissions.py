@@ -6,11 +6,19 @@ including permission requests, options, and status management.
 """
 
 import enum
+import itertools
 import json
-from dataclasses import dataclass, field
-from typing import Callable, Dict, List, Optional, Any
-
-from .logger import get_logger
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from .logger import get_logger, lazy
+from .metrics import PERMISSION_WAIT_SECONDS
+from .permission_rules import DEFAULT_BLOCKED_COMMANDS, CommandRules, PathRules, split_commands
+from .tracing import start_span
 
 # Initialize logger
 logger = get_logger(__name__)
@@ -25,6 +33,52 @@ class PermissionStatus(enum.Enum):
     NEEDS_CONFIRMATION = "needs_confirmation"
 
 
+# Scopes a remembered grant can have
+GRANT_SCOPES = ("session", "path", "command")
+
+# Maximum number of entries kept in a PermissionManager's audit log
+AUDIT_LOG_SIZE = 1000
+
+
+@dataclass
+class PermissionGrant:
+    """
+    A remembered approval, applied to later requests instead of asking again.
+
+    Attributes:
+        scope: "session" (every request for the operation), "path" (file operations
+               on paths under value) or "command" (commands starting with value)
+        operation: The operation the grant applies to
+        value: The path prefix or command prefix, depending on the scope
+        expires_at: Time (time.time()) after which the grant no longer applies, or None
+        grant_id: Identifier assigned when the grant is added
+        created_at: Time the grant was created
+        uses: Number of requests the grant approved
+    """
+    scope: str
+    operation: str
+    value: Optional[str] = None
+    expires_at: Optional[float] = None
+    grant_id: str = ""
+    created_at: float = field(default_factory=time.time)
+    uses: int = 0
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return self.expires_at is not None and (now if now is not None else time.time()) >= self.expires_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PermissionGrant":
+        return cls(
+            scope=data["scope"],
+            operation=data["operation"],
+            value=data.get("value"),
+            expires_at=data.get("expires_at"),
+        )
+
+
 @dataclass
 class PermissionRequest:
     """
@@ -33,9 +87,12 @@ class PermissionRequest:
     Attributes:
         operation: The type of operation requesting permission
         details: Details of the operation
+        grant: Set by a permission callback that grants the request to have the
+               approval remembered for similar requests (see grant_for_request)
     """
     operation: str
     details: Dict[str, Any]
+    grant: Optional[PermissionGrant] = None
 
 
 @dataclass
@@ -50,12 +107,25 @@ class PermissionOptions:
         command_denylist: List of commands that are always denied
         delete_file_protection: Whether to require confirmation for file deletions
                                even in yolo mode
+        path_allowlist: Path globs file operations are limited to in yolo mode
+                        (others require confirmation)
+        path_denylist: Path globs file operations are always denied on
+        blocked_commands: Commands run_terminal_command refuses to run at all
+        grant_ttl: Seconds remembered grants stay valid (None: as long as the agent)
+
+    Command patterns are matched word by word against each sub-command
+    ("git push" matches `git push origin main` and `make && git push`); a
+    pattern starting with "re:" is a regular expression. See permission_rules.
     """
     yolo_mode: bool = False
     yolo_prompt: Optional[str] = None
     command_allowlist: List[str] = field(default_factory=list)
     command_denylist: List[str] = field(default_factory=list)
     delete_file_protection: bool = True
+    path_allowlist: List[str] = field(default_factory=list)
+    path_denylist: List[str] = field(default_factory=list)
+    blocked_commands: List[str] = field(default_factory=lambda: list(DEFAULT_BLOCKED_COMMANDS))
+    grant_ttl: Optional[float] = None
 
     def __post_init__(self) -> None:
         if self.yolo_mode:
@@ -81,11 +151,124 @@ class PermissionOptions:
             command_allowlist=data.get("command_allowlist", []),
             command_denylist=data.get("command_denylist", []),
             delete_file_protection=data.get("delete_file_protection", True),
+            path_allowlist=data.get("path_allowlist", []),
+            path_denylist=data.get("path_denylist", []),
+            blocked_commands=data.get("blocked_commands", list(DEFAULT_BLOCKED_COMMANDS)),
+            grant_ttl=data.get("grant_ttl"),
         )
 
 
 PermissionCallback = Callable[[PermissionRequest], PermissionStatus]
 
+# Answers several requests at once; returns one status per request, in order
+PermissionBatchCallback = Callable[[List[PermissionRequest]], List[PermissionStatus]]
+
+# Detail keys holding the paths a file operation touches
+PATH_DETAIL_KEYS = ("target_file", "file_path", "image_paths")
+
+
+def _request_paths(request: PermissionRequest) -> List[str]:
+    paths: List[str] = []
+    for key in PATH_DETAIL_KEYS:
+        value = request.details.get(key)
+        if isinstance(value, str):
+            paths.append(value)
+        elif isinstance(value, (list, tuple)):
+            paths.extend(path for path in value if isinstance(path, str))
+    return paths
+
+
+def default_command_prefix(command: str) -> str:
+    """
+    The prefix a command grant created from a command covers.
+
+    The program and, if it looks like a subcommand, its first argument:
+    `git commit -m x` gives "git commit", `pytest tests/` gives "pytest".
+    """
+    sub_commands = split_commands(command)
+    if not sub_commands:
+        return command.strip()
+    words = sub_commands[0]
+    if len(words) > 1 and words[1].replace("-", "").isalnum() and not words[1].startswith("-"):
+        return f"{words[0]} {words[1]}"
+    return words[0]
+
+
+def _parse_selection(text: str, count: int) -> Optional[Set[int]]:
+    """Parse a selection like "1,3-4" into a set of numbers from 1 to count (None if invalid)."""
+    selected: Set[int] = set()
+    for part in text.replace(" ", ",").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start, end = int(first), int(last or first)
+        if not 1 <= start <= end <= count:
+            return None
+        selected.update(range(start, end + 1))
+    return selected or None
+
+
+def grant_for_request(
+    request: PermissionRequest,
+    scope: str,
+    value: Optional[str] = None,
+    ttl: Optional[float] = None,
+) -> PermissionGrant:
+    """
+    Create a grant remembering the approval of a request.
+
+    Args:
+        request: The approved request
+        scope: "session", "path" or "command"
+        value: Path or command prefix; defaults to the directory of the request's
+               path or the request command's program (and subcommand)
+        ttl: Seconds the grant stays valid (None: PermissionOptions.grant_ttl)
+
+    Returns:
+        The grant, to be set as request.grant or passed to PermissionManager.add_grant
+
+    Raises:
+        ValueError: If the scope is unknown or does not apply to the request
+    """
+    if scope not in GRANT_SCOPES:
+        raise ValueError(f"Unknown grant scope: {scope}")
+    if scope == "path" and value is None:
+        paths = _request_paths(request)
+        if not paths:
+            raise ValueError(f"A path grant needs a path; {request.operation} has none")
+        value = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    elif scope == "command":
+        if request.operation != "run_terminal_command":
+            raise ValueError("A command grant only applies to run_terminal_command")
+        if value is None:
+            value = default_command_prefix(request.details.get("command", ""))
+    expires_at = time.time() + ttl if ttl is not None else None
+    return PermissionGrant(scope=scope, operation=request.operation, value=value, expires_at=expires_at)
+
+
+class _CompiledRules:
+    """The rule lists of a PermissionOptions, compiled."""
+
+    def __init__(self, options: PermissionOptions):
+        self.key = _rules_key(options)
+        self.denied_commands = CommandRules(options.command_denylist)
+        self.allowed_commands = CommandRules(options.command_allowlist)
+        self.blocked_commands = CommandRules(options.blocked_commands)
+        self.denied_paths = PathRules(options.path_denylist)
+        self.allowed_paths = PathRules(options.path_allowlist)
+
+
+def _rules_key(options: PermissionOptions) -> tuple:
+    # Identity and length of each list: cheap enough for every request and catches
+    # reassigned lists and appended/removed entries; refresh_rules() covers the rest
+    lists = (
+        options.command_denylist, options.command_allowlist, options.blocked_commands,
+        options.path_denylist, options.path_allowlist,
+    )
+    return tuple((id(entries), len(entries)) for entries in lists)
+
 
 class PermissionManager:
     """
@@ -98,7 +281,8 @@ class PermissionManager:
     def __init__(
         self,
         options: Optional[PermissionOptions] = None,
-        callback: Optional[PermissionCallback] = None
+        callback: Optional[PermissionCallback] = None,
+        batch_callback: Optional[PermissionBatchCallback] = None
     ):
         """
         Initialize the permission manager.
@@ -106,10 +290,27 @@ class PermissionManager:
         Args:
             options: Configuration options for permissions
             callback: Optional callback function for handling permission requests
+            batch_callback: Optional callback answering several requests in one
+                            interaction (see request_permissions)
         """
         logger.debug("Initializing PermissionManager")
         self.options = options or PermissionOptions()
         self.callback = callback
+        self.batch_callback = batch_callback
+        self._rules: Optional[_CompiledRules] = None
+
+        # Remembered grants: session grants by operation, path grants by operation and
+        # directory, command grants compiled into CommandRules (rebuilt when they change)
+        self._grants_lock = threading.RLock()
+        self._grant_ids = itertools.count(1)
+        self._session_grants: Dict[str, PermissionGrant] = {}
+        self._path_grants: Dict[str, Dict[str, PermissionGrant]] = {}
+        self._command_grants: Dict[str, PermissionGrant] = {}
+        self._command_grant_rules: Optional[CommandRules] = None
+        self._audit_log: Deque[Dict[str, Any]] = deque(maxlen=AUDIT_LOG_SIZE)
+
+        # Answers from the last batch, consumed by the matching request_permission calls
+        self._batch_decisions: Dict[tuple, List[bool]] = {}
 
         # Display warning when YOLO mode is enabled
         if self.options.yolo_mode:
@@ -133,7 +334,7 @@ class PermissionManager:
             True if permission is granted, False otherwise
         """
         logger.info(f"Permission requested for: {operation}")
-        logger.debug(f"Permission details: {json.dumps(details)}")
+        logger.debug("Permission details: %s", lazy(json.dumps, details))
 
         request = PermissionRequest(operation=operation, details=details)
         status = self._evaluate_permission(request)
@@ -141,21 +342,42 @@ class PermissionManager:
         # Handle automatic grant in yolo mode
         if status == PermissionStatus.GRANTED:
             logger.info(f"Permission automatically granted for {operation}")
+            self._audit("decision", request, granted=True, source="rule")
             return True
 
         # Handle automatic denial
         if status == PermissionStatus.DENIED:
             logger.warning(f"Permission automatically denied for {operation}")
             print(f"\n❌ Permission denied for {operation}: {json.dumps(details, indent=2)}")
+            self._audit("decision", request, granted=False, source="rule")
             return False
 
+        # A remembered grant answers the request without asking again
+        grant = self.find_grant(request)
+        if grant is not None:
+            logger.info(f"Permission granted for {operation} by remembered grant {grant.grant_id}")
+            self._audit("decision", request, granted=True, source="grant", grant=grant)
+            return True
+
+        # So does the user's answer to a batch this request was part of
+        batch_decision = self._take_batch_decision(request)
+        if batch_decision is not None:
+            logger.info(f"Permission {'granted' if batch_decision else 'denied'} for {operation} by batch answer")
+            return batch_decision
+
         # If we need confirmation and have a callback, use it
         if status == PermissionStatus.NEEDS_CONFIRMATION and self.callback:
             # Forward the request to the callback for handling
             logger.debug("Forwarding permission request to callback")
-            callback_result = self.callback(request)
-            granted = callback_result == PermissionStatus.GRANTED
+            with start_span("permission.wait", {"permission.operation": operation, "permission.source": "callback"}) as span, \
+                    PERMISSION_WAIT_SECONDS.time(("callback",)):
+                callback_result = self.callback(request)
+                granted = callback_result == PermissionStatus.GRANTED
+                span.set_attribute("permission.granted", granted)
             logger.info(f"Callback returned permission status: {'granted' if granted else 'denied'}")
+            self._audit("decision", request, granted=granted, source="callback")
+            if granted and request.grant is not None:
+                self.add_grant(request.grant)
             return granted
 
         # Default to using the built-in permission prompt if no callback provided
@@ -163,18 +385,376 @@ class PermissionManager:
         print(f"\n🔒 Permission Request: {operation}")
         print(f"Details: {json.dumps(details, indent=2)}")
 
+        choices = self._prompt_choices(request)
+        prompt = "Allow this operation? (y/n" + "".join(f", {key}={label}" for key, (label, _) in choices.items()) + "): "
         while True:
-            response = input("Allow this operation? (y/n): ").strip().lower()
-            if response in ("y", "yes"):
+            with start_span("permission.wait", {"permission.operation": operation, "permission.source": "user"}), \
+                    PERMISSION_WAIT_SECONDS.time(("user",)):
+                response = input(prompt).strip().lower()
+            if response in ("y", "yes") or response in choices:
                 logger.info(f"User granted permission for {operation}")
+                self._audit("decision", request, granted=True, source="user")
+                if response in choices:
+                    self.add_grant(choices[response][1])
                 return True
             elif response in ("n", "no"):
                 logger.info(f"User denied permission for {operation}")
+                self._audit("decision", request, granted=False, source="user")
                 return False
             else:
                 logger.debug("Invalid response, prompting again")
                 print("Please enter 'y' or 'n'")
 
+    def request_permissions(self, requests: List[PermissionRequest]) -> List[Optional[bool]]:
+        """
+        Ask for the permissions of several operations in a single interaction.
+
+        Requests decided by the rules or a remembered grant are answered directly;
+        the others are presented together, to the batch callback if there is one,
+        otherwise with the built-in prompt (unless a single-request callback is set,
+        which is then left to answer each request when it is made). The answers are
+        kept until clear_batch(), so the request_permission calls the tools make for
+        these operations don't ask again.
+
+        Args:
+            requests: The permission requests, e.g. one per tool call of a model turn
+
+        Returns:
+            Per request: True if granted, False if denied, None if not decided yet
+        """
+        decisions: List[Optional[bool]] = [None] * len(requests)
+        pending: List[int] = []
+        for index, request in enumerate(requests):
+            status = self._evaluate_permission(request)
+            if status != PermissionStatus.NEEDS_CONFIRMATION:
+                decisions[index] = status == PermissionStatus.GRANTED
+            elif self._lookup_grant_unused(request):
+                decisions[index] = True
+            else:
+                pending.append(index)
+
+        if len(pending) < 2:
+            # Nothing to batch; request_permission handles a single request with the usual prompt
+            return decisions
+
+        batch = [requests[index] for index in pending]
+        if self.batch_callback is not None:
+            logger.info(f"Forwarding batch of {len(batch)} permission requests to batch callback")
+            source = "batch_callback"
+            with start_span("permission.wait", {"permission.batch_size": len(batch), "permission.source": source}), \
+                    PERMISSION_WAIT_SECONDS.time((source,)):
+                statuses = self.batch_callback(batch)
+            answers = [status == PermissionStatus.GRANTED for status in statuses]
+        elif self.callback is None:
+            source = "user"
+            with start_span("permission.wait", {"permission.batch_size": len(batch), "permission.source": source}), \
+                    PERMISSION_WAIT_SECONDS.time((source,)):
+                answers = self._prompt_batch(batch)
+        else:
+            return decisions
+        if len(answers) != len(batch):
+            logger.warning(f"Batch answer has {len(answers)} entries for {len(batch)} requests, ignoring it")
+            return decisions
+
+        with self._grants_lock:
+            for index, request, granted in zip(pending, batch, answers):
+                decisions[index] = granted
+                self._batch_decisions.setdefault(self._batch_key(request), []).append(granted)
+                self._audit("decision", request, granted=granted, source=source)
+                if granted and request.grant is not None:
+                    self.add_grant(request.grant)
+        logger.info(f"Batch of {len(batch)} permission requests answered: {sum(answers)} granted")
+        return decisions
+
+    def clear_batch(self) -> None:
+        """Forget batch answers that no request_permission call has used."""
+        with self._grants_lock:
+            self._batch_decisions.clear()
+
+    @staticmethod
+    def _batch_key(request: PermissionRequest) -> tuple:
+        command = request.details.get("command")
+        return (request.operation, command if command is not None else tuple(_request_paths(request)))
+
+    def _take_batch_decision(self, request: PermissionRequest) -> Optional[bool]:
+        with self._grants_lock:
+            if not self._batch_decisions:
+                return None
+            answers = self._batch_decisions.get(self._batch_key(request))
+            if not answers:
+                return None
+            return answers.pop(0)
+
+    def _lookup_grant_unused(self, request: PermissionRequest) -> bool:
+        """Whether a grant covers a request, without counting it as a use."""
+        with self._grants_lock:
+            now = time.time()
+            grant = self._lookup_grant(request, now)
+            return grant is not None and not grant.expired(now)
+
+    def _prompt_batch(self, batch: List[PermissionRequest]) -> List[bool]:
+        """Built-in prompt for a batch: the user approves all, none or a subset."""
+        print(f"\n🔒 Permission Request: {len(batch)} operations")
+        for number, request in enumerate(batch, 1):
+            command = request.details.get("command")
+            target = command if command is not None else ", ".join(_request_paths(request))
+            print(f"  {number}. {request.operation}: {target}")
+
+        while True:
+            response = input("Allow which operations? (a=all, n=none, or numbers, e.g. 1,3-4): ").strip().lower()
+            if response in ("a", "all", "y", "yes"):
+                return [True] * len(batch)
+            if response in ("n", "none", "no"):
+                return [False] * len(batch)
+            selected = _parse_selection(response, len(batch))
+            if selected is not None:
+                return [number in selected for number in range(1, len(batch) + 1)]
+            print("Please enter 'a', 'n' or operation numbers")
+
+    def _prompt_choices(self, request: PermissionRequest) -> Dict[str, Any]:
+        """The grants the built-in prompt offers, by answer key."""
+        ttl = self.options.grant_ttl
+        choices = {"a": ("always this session", grant_for_request(request, "session", ttl=ttl))}
+        if request.operation == "run_terminal_command":
+            grant = grant_for_request(request, "command", ttl=ttl)
+            choices["c"] = (f"always for commands starting with '{grant.value}'", grant)
+        elif _request_paths(request):
+            grant = grant_for_request(request, "path", ttl=ttl)
+            choices["p"] = (f"always under {grant.value}", grant)
+        return choices
+
+    def add_grant(self, grant: PermissionGrant) -> PermissionGrant:
+        """
+        Remember an approval for later requests.
+
+        Grants never override the deny lists, which are evaluated first.
+        A grant without an expiry gets PermissionOptions.grant_ttl.
+
+        Args:
+            grant: The grant, e.g. from grant_for_request
+
+        Returns:
+            The grant, with its grant_id set
+
+        Raises:
+            ValueError: If the grant's scope is unknown or it lacks a value
+        """
+        if grant.scope not in GRANT_SCOPES:
+            raise ValueError(f"Unknown grant scope: {grant.scope}")
+        value = grant.value or ""
+        if grant.scope != "session" and not value:
+            raise ValueError(f"A {grant.scope} grant needs a value")
+        if grant.expires_at is None and self.options.grant_ttl is not None:
+            grant.expires_at = grant.created_at + self.options.grant_ttl
+        with self._grants_lock:
+            grant.grant_id = f"grant-{next(self._grant_ids)}"
+            if grant.scope == "session":
+                replaced = self._session_grants.get(grant.operation)
+                self._session_grants[grant.operation] = grant
+            elif grant.scope == "path":
+                prefix = os.path.normpath(os.path.abspath(os.path.expanduser(value)))
+                replaced = self._path_grants.setdefault(grant.operation, {}).get(prefix)
+                self._path_grants[grant.operation][prefix] = grant
+            else:
+                replaced = self._command_grants.get(value)
+                self._command_grants[value] = grant
+                self._command_grant_rules = None
+            if replaced is not None:
+                self._audit("grant_replaced", grant=replaced)
+            self._audit("grant_added", grant=grant)
+        logger.info(f"Added {grant.scope} grant {grant.grant_id} for {grant.operation}"
+                    + (f": {grant.value}" if grant.value else ""))
+        return grant
+
+    def revoke_grant(self, grant_id: str) -> bool:
+        """
+        Forget a grant.
+
+        Returns:
+            True if the grant existed
+        """
+        with self._grants_lock:
+            for grant in self._all_grants():
+                if grant.grant_id == grant_id:
+                    self._remove_grant(grant)
+                    self._audit("grant_revoked", grant=grant)
+                    return True
+        return False
+
+    def clear_grants(self) -> None:
+        """Forget all grants."""
+        with self._grants_lock:
+            for grant in self._all_grants():
+                self._audit("grant_revoked", grant=grant)
+            self._session_grants.clear()
+            self._path_grants.clear()
+            self._command_grants.clear()
+            self._command_grant_rules = None
+
+    def list_grants(self) -> List[Dict[str, Any]]:
+        """The active grants, as dicts."""
+        with self._grants_lock:
+            self._prune_expired()
+            return [grant.to_dict() for grant in self._all_grants()]
+
+    def audit_log(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        The most recent permission decisions and grant changes, oldest first.
+
+        Each entry has "time" and "event" ("decision", "grant_added", "grant_replaced",
+        "grant_revoked" or "grant_expired"); decisions also have "operation", "target",
+        "granted", "source" ("rule", "grant", "callback", "batch_callback" or "user") and, when a grant
+        decided, "grant_id".
+        """
+        with self._grants_lock:
+            entries = list(self._audit_log)
+        return entries[-limit:] if limit else entries
+
+    def find_grant(self, request: PermissionRequest) -> Optional[PermissionGrant]:
+        """
+        Find a remembered grant covering a request.
+
+        A path grant covers a request if all its paths are under the grant's
+        directory; a command grant if every sub-command starts with a granted prefix.
+        """
+        with self._grants_lock:
+            if not (self._session_grants or self._path_grants or self._command_grants):
+                return None
+            now = time.time()
+            grant = self._lookup_grant(request, now)
+            if grant is not None and grant.expired(now):
+                # Drop expired grants; another grant may still cover the request
+                self._prune_expired()
+                grant = self._lookup_grant(request, now)
+            if grant is not None:
+                grant.uses += 1
+            return grant
+
+    def _lookup_grant(self, request: PermissionRequest, now: float) -> Optional[PermissionGrant]:
+        return (
+            self._session_grants.get(request.operation)
+            or self._match_path_grant(request, now)
+            or self._match_command_grant(request, now)
+        )
+
+    def _match_path_grant(self, request: PermissionRequest, now: float) -> Optional[PermissionGrant]:
+        grants = self._path_grants.get(request.operation)
+        paths = _request_paths(request)
+        if not grants or not paths:
+            return None
+        found = None
+        for path in paths:
+            # Look up the path and each of its parents instead of scanning the grants
+            directory = os.path.normpath(os.path.abspath(path))
+            while True:
+                grant = grants.get(directory)
+                if grant is not None and not grant.expired(now):
+                    break
+                parent = os.path.dirname(directory)
+                if parent == directory:
+                    return None
+                directory = parent
+            found = found or grant
+        return found
+
+    def _match_command_grant(self, request: PermissionRequest, now: float) -> Optional[PermissionGrant]:
+        if request.operation != "run_terminal_command" or not self._command_grants:
+            return None
+        if self._command_grant_rules is None:
+            self._command_grant_rules = CommandRules(self._command_grants)
+        matched = self._command_grant_rules.match_all(request.details.get("command", ""))
+        if not matched:
+            return None
+        grants = [self._command_grants[rule.pattern] for rule in matched]
+        return next((grant for grant in grants if grant.expired(now)), grants[0])
+
+    def _all_grants(self) -> List[PermissionGrant]:
+        grants = list(self._session_grants.values())
+        for by_prefix in self._path_grants.values():
+            grants.extend(by_prefix.values())
+        grants.extend(self._command_grants.values())
+        return grants
+
+    def _remove_grant(self, grant: PermissionGrant) -> None:
+        if grant.scope == "session":
+            self._session_grants.pop(grant.operation, None)
+        elif grant.scope == "path":
+            by_prefix = self._path_grants.get(grant.operation, {})
+            for prefix, existing in list(by_prefix.items()):
+                if existing is grant:
+                    del by_prefix[prefix]
+        elif grant.value is not None:
+            self._command_grants.pop(grant.value, None)
+            self._command_grant_rules = None
+
+    def _prune_expired(self) -> None:
+        now = time.time()
+        for grant in self._all_grants():
+            if grant.expired(now):
+                self._remove_grant(grant)
+                self._audit("grant_expired", grant=grant)
+                logger.info(f"Grant {grant.grant_id} expired")
+
+    def _audit(
+        self,
+        event: str,
+        request: Optional[PermissionRequest] = None,
+        granted: Optional[bool] = None,
+        source: Optional[str] = None,
+        grant: Optional[PermissionGrant] = None,
+    ) -> None:
+        entry: Dict[str, Any] = {"time": time.time(), "event": event}
+        if request is not None:
+            command = request.details.get("command")
+            entry.update(
+                operation=request.operation,
+                target=command if command is not None else (_request_paths(request) or None),
+                granted=granted,
+                source=source,
+            )
+        if grant is not None:
+            entry["grant_id"] = grant.grant_id
+            if event != "decision":
+                entry.update(scope=grant.scope, operation=grant.operation, value=grant.value)
+        with self._grants_lock:
+            self._audit_log.append(entry)
+
+    @property
+    def rules(self) -> _CompiledRules:
+        """The compiled rules, recompiled when the option lists have been changed."""
+        rules = self._rules
+        if rules is None or rules.key != _rules_key(self.options):
+            rules = self._rules = _CompiledRules(self.options)
+            logger.debug(f"Compiled permission rules: {len(rules.denied_commands)} denied, "
+                         f"{len(rules.allowed_commands)} allowed, {len(rules.blocked_commands)} blocked commands; "
+                         f"{len(rules.denied_paths)} denied, {len(rules.allowed_paths)} allowed paths")
+        return rules
+
+    def refresh_rules(self) -> None:
+        """Recompile the rules after entries of the option lists were replaced in place."""
+        self._rules = None
+
+    def blocked_command(self, command: str) -> Optional[str]:
+        """
+        Check a command against the blocked commands.
+
+        Returns:
+            The matching blocked pattern, or None if the command may run
+        """
+        rule = self.rules.blocked_commands.find(command)
+        return rule.pattern if rule else None
+
+    def rule_stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Hit counts of all rules, by rule list."""
+        rules = self.rules
+        return {
+            "command_denylist": rules.denied_commands.stats(),
+            "command_allowlist": rules.allowed_commands.stats(),
+            "blocked_commands": rules.blocked_commands.stats(),
+            "path_denylist": rules.denied_paths.stats(),
+            "path_allowlist": rules.allowed_paths.stats(),
+        }
+
     def _evaluate_permission(self, request: PermissionRequest) -> PermissionStatus:
         """
         Evaluate permission request based on configuration.
@@ -186,17 +766,23 @@ class PermissionManager:
             The permission status
         """
         logger.debug(f"Evaluating permission for: {request.operation}")
+        rules = self.rules
+        command = request.details.get("command", "") if request.operation == "run_terminal_command" else None
+        paths = _request_paths(request)
 
-        # First, check for command deny list - it takes precedence over everything
-        if request.operation == "run_terminal_command":
-            command = request.details.get("command", "")
+        # First, check the deny lists - they take precedence over everything
+        if command is not None:
             logger.debug(f"Evaluating terminal command: {command}")
+            rule = rules.denied_commands.find(command)
+            if rule is not None:
+                logger.warning(f"Command '{command}' matched denylist entry '{rule.pattern}' - automatically denied")
+                return PermissionStatus.DENIED
 
-            # Check denylist first - deny if any denied command is found
-            if self.options.command_denylist:
-                if any(denied in command for denied in self.options.command_denylist):
-                    logger.warning(f"Command '{command}' matched denylist entry - automatically denied")
-                    return PermissionStatus.DENIED
+        for path in paths:
+            rule = rules.denied_paths.find(path)
+            if rule is not None:
+                logger.warning(f"Path '{path}' matched path denylist entry '{rule.pattern}' - automatically denied")
+                return PermissionStatus.DENIED
 
         # Special protection for delete_file, even in yolo mode
         if (request.operation == "delete_file"
@@ -208,18 +794,9 @@ class PermissionManager:
         # YOLO mode evaluation for other operations
         if self.options.yolo_mode:
             logger.debug("Evaluating in YOLO mode context")
-            # Command allowlist check for terminal commands
-            if request.operation == "run_terminal_command":
-                command = request.details.get("command", "")
-
-                # If allowlist is set, only allow commands that match the allowlist
-                if self.options.command_allowlist and not any(allowed in command for allowed in self.options.command_allowlist):
-                    # Special test case handling for 'rm -rf /' command
-                    if "rm -rf /" in command:
-                        logger.warning(f"Potentially destructive command '{command}' requires confirmation even in YOLO mode")
-                        # This ensures our test passes by guaranteeing this specific command needs confirmation
-                        return PermissionStatus.NEEDS_CONFIRMATION
-                    # If the command is not in the allowlist, it needs confirmation
+            # Command allowlist check for terminal commands: every sub-command must be allowed
+            if command is not None:
+                if len(rules.allowed_commands) and not rules.allowed_commands.covers(command):
                     logger.info(f"Command '{command}' not in allowlist - requires confirmation")
                     return PermissionStatus.NEEDS_CONFIRMATION
 
@@ -227,6 +804,13 @@ class PermissionManager:
                 logger.info(f"Command '{command}' authorized in YOLO mode")
                 return PermissionStatus.GRANTED
 
+            # Path allowlist check for file operations
+            if len(rules.allowed_paths):
+                for path in paths:
+                    if rules.allowed_paths.find(path) is None:
+                        logger.info(f"Path '{path}' not in path allowlist - requires confirmation")
+                        return PermissionStatus.NEEDS_CONFIRMATION
+
             # Other operations in yolo mode are automatically granted
             logger.info(f"Operation '{request.operation}' automatically granted in YOLO mode")
             return PermissionStatus.GRANTED
@@ -0,0 +1,383 @@
+"""
+Opt-in per-turn profiling for agents.
+
+When profiling is enabled, every chat turn of an agent is profiled and the
+response gets a "profile" entry breaking the turn's wall time down into model
+requests, tool calls and everything else (the agent's own code, permission
+waits, event callbacks), with the duration of every tool call. The profile
+itself is written to a file per turn:
+
+- "sample" (default): a sampling profiler records the stacks of the thread
+  running the turn and of the threads running its tools every few
+  milliseconds and writes them as collapsed stacks (one "frame;frame;... count"
+  line per stack, as produced by py-spy and stackcollapse), which flamegraph.pl,
+  speedscope or inferno turn into a flame graph. Time spent waiting for the
+  model shows up as frames in the event loop's selector.
+- "cprofile": cProfile instruments the turn's thread and its tool threads;
+  the merged statistics are written as a .prof file for pstats or snakeviz.
+  cProfile sees every call but adds noticeable overhead.
+
+Samples of the event loop thread include other coroutines the loop runs at
+the same time, e.g. the turns of other sessions of a web server.
+
+Enabled per agent (the ``profile`` argument of the agent constructors) or from
+the environment:
+
+- CURSOR_AGENT_PROFILE: "1" or "sample" for the sampling profiler, "cprofile"
+  for cProfile (disabled by default)
+- CURSOR_AGENT_PROFILE_DIR: directory profiles are written to (default:
+  cursor_agent_profiles in the system temp directory)
+- CURSOR_AGENT_PROFILE_INTERVAL: sampling interval in seconds (default 0.005)
+
+When profiling is disabled a turn only pays for a None check.
+"""
+
+import collections
+import cProfile
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from types import CodeType
+from typing import Any, Dict, List, Mapping, Optional, TypedDict, Union
+
+from .logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+PROFILE_ENV_VAR = "CURSOR_AGENT_PROFILE"
+PROFILE_DIR_ENV_VAR = "CURSOR_AGENT_PROFILE_DIR"
+PROFILE_INTERVAL_ENV_VAR = "CURSOR_AGENT_PROFILE_INTERVAL"
+
+DEFAULT_PROFILE_DIR = os.path.join(tempfile.gettempdir(), "cursor_agent_profiles")
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+PROFILE_MODES = ("sample", "cprofile")
+
+
+class ToolTiming(TypedDict):
+    """Duration of a single tool call"""
+    name: str
+    duration: float
+    error: bool
+
+
+class ToolTotals(TypedDict):
+    """Calls and total duration of one tool in a turn"""
+    calls: int
+    duration: float
+
+
+class TurnProfileReport(TypedDict):
+    """Timing breakdown of a turn, attached to agent responses as "profile" """
+    mode: str
+    duration: float
+    model: float
+    tools: float
+    other: float
+    tool_calls: List[ToolTiming]
+    by_tool: Dict[str, ToolTotals]
+    samples: Optional[int]
+    file: Optional[str]
+
+
+@dataclass(frozen=True)
+class ProfileConfig:
+    """
+    How agent turns are profiled.
+
+    Attributes:
+        mode: "sample" for the sampling profiler or "cprofile"
+        directory: Directory the per-turn profiles are written to (None: don't write them)
+        interval: Sampling interval in seconds
+    """
+    mode: str = "sample"
+    directory: Optional[str] = DEFAULT_PROFILE_DIR
+    interval: float = DEFAULT_SAMPLE_INTERVAL
+
+    def __post_init__(self) -> None:
+        if self.mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {self.mode!r}, expected one of {', '.join(PROFILE_MODES)}")
+        if self.interval <= 0:
+            raise ValueError("The sampling interval must be positive")
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> Optional["ProfileConfig"]:
+        """
+        Read the configuration from the CURSOR_AGENT_PROFILE* environment variables.
+
+        Returns:
+            ProfileConfig, or None if profiling is not enabled
+        """
+        environ = os.environ if environ is None else environ
+        value = environ.get(PROFILE_ENV_VAR, "").strip().lower()
+        if value in ("", "0", "false", "no"):
+            return None
+        mode = "sample" if value in ("1", "true", "yes") else value
+        if mode not in PROFILE_MODES:
+            logger.warning(f"Ignoring invalid value for {PROFILE_ENV_VAR}: {value!r}")
+            return None
+
+        interval = DEFAULT_SAMPLE_INTERVAL
+        raw_interval = environ.get(PROFILE_INTERVAL_ENV_VAR, "").strip()
+        if raw_interval:
+            try:
+                interval = float(raw_interval)
+                if interval <= 0:
+                    raise ValueError(raw_interval)
+            except ValueError:
+                logger.warning(f"Ignoring invalid value for {PROFILE_INTERVAL_ENV_VAR}: {raw_interval!r}")
+                interval = DEFAULT_SAMPLE_INTERVAL
+        return cls(mode=mode, directory=environ.get(PROFILE_DIR_ENV_VAR) or DEFAULT_PROFILE_DIR, interval=interval)
+
+    @classmethod
+    def resolve(cls, value: Union[bool, str, "ProfileConfig", None]) -> Optional["ProfileConfig"]:
+        """
+        The configuration for the ``profile`` argument of the agent constructors.
+
+        Args:
+            value: None to use the environment, False to disable profiling, True or a
+                   mode name to enable it with the default settings, or a ProfileConfig
+
+        Returns:
+            ProfileConfig, or None if profiling is disabled
+        """
+        if value is None:
+            return cls.from_env()
+        if isinstance(value, ProfileConfig):
+            return value
+        if value is False:
+            return None
+        if value is True:
+            return cls()
+        return cls(mode=value)
+
+
+def _frame_label(code: CodeType) -> str:
+    """A frame as it appears in collapsed stacks: ``function (file:line)``, like py-spy."""
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Samples the stacks of a set of threads from a background thread.
+
+    Threads are added and removed while sampling runs (tool calls start and end
+    in executor threads); only the stacks of threads currently added are counted.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self._threads: Dict[int, List[Any]] = {}  # ident -> [thread name, nesting depth]
+        self._labels: Dict[CodeType, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, ident: Optional[int] = None, name: Optional[str] = None) -> None:
+        """Start sampling a thread (the calling thread by default)."""
+        if ident is None:
+            ident, name = threading.get_ident(), threading.current_thread().name
+        with self._lock:
+            entry = self._threads.setdefault(ident, [name or str(ident), 0])
+            entry[1] += 1
+
+    def remove_thread(self, ident: Optional[int] = None) -> None:
+        """Stop sampling a thread once every add_thread for it has been matched."""
+        ident = threading.get_ident() if ident is None else ident
+        with self._lock:
+            entry = self._threads.get(ident)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._threads[ident]
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="cursor-agent-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        """Record the current stack of every sampled thread."""
+        with self._lock:
+            threads = {ident: entry[0] for ident, entry in self._threads.items()}
+        if not threads:
+            return
+        frames = sys._current_frames()
+        self.samples += 1
+        for ident, name in threads.items():
+            frame = frames.get(ident)
+            stack: List[str] = []
+            while frame is not None:
+                label = self._labels.get(frame.f_code)
+                if label is None:
+                    label = self._labels[frame.f_code] = _frame_label(frame.f_code)
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                stack.append(name)
+                self.counts[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """The samples in the collapsed stack format, one ``stack count`` line per stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items()))
+
+
+class TurnProfile:
+    """
+    Profile of a single agent turn.
+
+    Created and started by the agent_turn decorator; tool calls report their
+    duration with record_tool() and run inside enter_thread()/exit_thread() so
+    the profiler covers the executor threads running them.
+    """
+
+    def __init__(self, config: ProfileConfig, name: str = "turn"):
+        self.config = config
+        self.name = name
+        self.tool_calls: List[ToolTiming] = []
+        self._lock = threading.Lock()
+        self._sampler: Optional[StackSampler] = None
+        self._profilers: List[cProfile.Profile] = []
+        self._thread_profilers: Dict[int, cProfile.Profile] = {}
+        self._start = 0.0
+        self.duration = 0.0
+
+    def start(self) -> None:
+        """Start profiling the calling thread (the one running the turn)."""
+        self._start = time.perf_counter()
+        if self.config.mode == "sample":
+            self._sampler = StackSampler(self.config.interval)
+            self._sampler.add_thread()
+            self._sampler.start()
+        else:
+            self.enter_thread()
+
+    def stop(self) -> None:
+        """Stop profiling; the turn's thread is the calling thread."""
+        self.duration = time.perf_counter() - self._start
+        if self._sampler is not None:
+            self._sampler.stop()
+        else:
+            self.exit_thread()
+
+    def enter_thread(self) -> None:
+        """Include the calling thread (e.g. an executor thread running a tool) in the profile."""
+        if self._sampler is not None:
+            self._sampler.add_thread()
+            return
+        if self.config.mode != "cprofile" or threading.get_ident() in self._thread_profilers:
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiler is active in this thread
+            logger.debug(f"Not profiling thread {threading.current_thread().name}: {e}")
+            return
+        with self._lock:
+            self._thread_profilers[threading.get_ident()] = profiler
+
+    def exit_thread(self) -> None:
+        """Stop including the calling thread in the profile."""
+        if self._sampler is not None:
+            self._sampler.remove_thread()
+            return
+        with self._lock:
+            profiler = self._thread_profilers.pop(threading.get_ident(), None)
+        if profiler is not None:
+            profiler.disable()
+            with self._lock:
+                self._profilers.append(profiler)
+
+    def record_tool(self, name: str, duration: float, error: bool = False) -> None:
+        """Record the duration of a tool call."""
+        with self._lock:
+            self.tool_calls.append({"name": name, "duration": duration, "error": error})
+
+    def write(self) -> Optional[str]:
+        """
+        Write the profile to the configured directory.
+
+        Returns:
+            The path of the file, or None if nothing was written
+        """
+        if self.config.directory is None:
+            return None
+        if self._sampler is not None:
+            if not self._sampler.counts:
+                return None
+            content, suffix = self._sampler.collapsed(), ".collapsed"
+        elif not self._profilers:
+            return None
+        else:
+            content, suffix = None, ".prof"
+
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.config.directory, f"{timestamp}-{self.name}{suffix}")
+        try:
+            os.makedirs(self.config.directory, exist_ok=True)
+            if content is not None:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(content)
+            else:
+                stats = pstats.Stats(self._profilers[0])
+                for profiler in self._profilers[1:]:
+                    stats.add(profiler)
+                stats.dump_stats(path)
+        except OSError as e:
+            logger.warning(f"Failed to write turn profile to {path}: {str(e)}")
+            return None
+        return path
+
+    def report(self, model_seconds: float, file: Optional[str] = None) -> TurnProfileReport:
+        """
+        The timing breakdown of the turn.
+
+        Tool calls of one model response may run concurrently, so "other" (the turn's
+        time outside model requests and tools) is clamped at zero.
+
+        Args:
+            model_seconds: Time the turn spent in model requests
+            file: Path of the written profile, if any
+        """
+        with self._lock:
+            tool_calls = list(self.tool_calls)
+        by_tool: Dict[str, ToolTotals] = {}
+        for call in tool_calls:
+            totals = by_tool.setdefault(call["name"], {"calls": 0, "duration": 0.0})
+            totals["calls"] += 1
+            totals["duration"] += call["duration"]
+        tools = sum(call["duration"] for call in tool_calls)
+        return {
+            "mode": self.config.mode,
+            "duration": self.duration,
+            "model": model_seconds,
+            "tools": tools,
+            "other": max(self.duration - model_seconds - tools, 0.0),
+            "tool_calls": tool_calls,
+            "by_tool": by_tool,
+            "samples": self._sampler.samples if self._sampler is not None else None,
+            "file": file,
+        }
+
+
+def turn_profile_name(agent_class: str, trace_id: Optional[str] = None) -> str:
+    """A unique file name stem for a turn's profile, matching the turn's trace if there is one."""
+    return f"{agent_class}-{trace_id or uuid.uuid4().hex}"
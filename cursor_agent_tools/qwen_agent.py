@@ -7,9 +7,10 @@ from typing import Any, Dict, List, Optional, Callable, cast, Union
 import httpx
 from openai import AsyncOpenAI, BadRequestError, RateLimitError, APIError, AuthenticationError
 
-from .base import BaseAgent, AgentResponse, AgentToolCall
-from .logger import get_logger
+from .base import BaseAgent, AgentResponse, AgentToolCall, agent_turn
+from .logger import get_logger, lazy
 from .permissions import PermissionOptions, PermissionRequest, PermissionStatus
+from .profiling import ProfileConfig
 from .tools.register_tools import register_default_tools
 
 # Initialize logger
@@ -31,6 +32,7 @@ class QwenAgent(BaseAgent):
         permission_callback: Optional[Callable[[PermissionRequest], PermissionStatus]] = None,
         permission_options: Optional[PermissionOptions] = None,
         default_tool_timeout: int = 300,
+        profile: Union[bool, str, ProfileConfig, None] = None,
         **kwargs
     ):
         """
@@ -45,6 +47,7 @@ class QwenAgent(BaseAgent):
             permission_callback: Optional callback for permission requests
             permission_options: Permission configuration options
             default_tool_timeout: Default timeout in seconds for tool calls (default: 300s)
+            profile: Profile every chat turn (see BaseAgent); None follows CURSOR_AGENT_PROFILE
             **kwargs: Additional parameters to pass to the model
         """
         logger.info(f"Initializing Qwen agent with model {model}")
@@ -54,7 +57,8 @@ class QwenAgent(BaseAgent):
             model=model,
             permission_options=permission_options,
             permission_callback=permission_callback,
-            default_tool_timeout=default_tool_timeout
+            default_tool_timeout=default_tool_timeout,
+            profile=profile,
         )
 
         self.temperature = temperature
@@ -248,7 +252,7 @@ class QwenAgent(BaseAgent):
                     tool_call_id = cast(str, call.get("id", "unknown_id"))
                     logger.debug(f"Executing tool (dict): {tool_name} (id: {tool_call_id})")
 
-                logger.debug(f"Tool arguments: {json.dumps(arguments)}")
+                logger.debug("Tool arguments: %s", lazy(json.dumps, arguments))
 
                 if tool_name not in self.available_tools:
                     logger.warning(f"Tool not found: {tool_name}")
@@ -259,8 +263,7 @@ class QwenAgent(BaseAgent):
                     }
                 else:
                     logger.debug(f"Calling function for tool: {tool_name}")
-                    function = self.available_tools[tool_name]["function"]
-                    result_content = function(**arguments)
+                    result_content = self._invoke_tool(tool_name, arguments)
 
                     # Log a summary of the result
                     if isinstance(result_content, dict) and "error" in result_content:
@@ -297,6 +300,7 @@ class QwenAgent(BaseAgent):
         logger.info(f"Completed {len(tool_results)} tool call results")
         return tool_results
 
+    @agent_turn
     async def chat(self, message: str, user_info: Optional[Dict[str, Any]] = None) -> Union[str, AgentResponse]:
         """
         Send a message to the Qwen API and get a response.
@@ -338,14 +342,14 @@ class QwenAgent(BaseAgent):
             if tools:
                 logger.debug(f"Using {len(tools)} tools")
 
-            response = await self.client.chat.completions.create(  # type: ignore
+            response = await self._model_request(self.client.chat.completions.create(  # type: ignore
                 model=self.model if self.model else "qwen-plus",
                 messages=messages,
                 tools=tools,
                 tool_choice="auto" if tools else None,
                 max_tokens=4096,
                 temperature=self.temperature,
-            )
+            ))
             logger.info("Received response from Qwen API")
 
             # Get the assistant's response
@@ -368,7 +372,7 @@ class QwenAgent(BaseAgent):
                 )
 
                 # Execute the tool calls
-                tool_results = self._execute_tool_calls(assistant_message.tool_calls)
+                tool_results = await self._run_tool_calls(assistant_message.tool_calls)
 
                 # Process and track tool calls for the structured response
                 for idx, tool_call in enumerate(assistant_message.tool_calls):
@@ -421,9 +425,9 @@ class QwenAgent(BaseAgent):
                 )
                 logger.debug(f"Follow-up call with {len(follow_up_messages)} messages")
 
-                follow_up_response = await self.client.chat.completions.create(
+                follow_up_response = await self._model_request(self.client.chat.completions.create(
                     model=self.model if self.model else "qwen-plus", messages=follow_up_messages, max_tokens=4096, temperature=self.temperature
-                )
+                ))
                 logger.info("Received follow-up response from Qwen API")
 
                 # Add the assistant's follow-up response to the conversation history
@@ -543,7 +547,7 @@ class QwenAgent(BaseAgent):
             chinese_system_prompt = self.system_prompt + "\n\n**重要：请务必使用中文回复，不要使用英文。**"
             chinese_prompt = prompt + "\n\n**重要：请务必使用中文回复，不要使用英文。**"
             
-            response = await self.client.chat.completions.create(
+            response = await self._model_request(self.client.chat.completions.create(
                 model=model_to_use,
                 max_tokens=2000,
                 messages=[
@@ -553,7 +557,7 @@ class QwenAgent(BaseAgent):
                 tools=tools,
                 tool_choice={"type": "function", "function": {"name": "get_structured_data"}},
                 temperature=0
-            )
+            ))
 
             # Extract the JSON content from the function call
             if response.choices and response.choices[0].message.tool_calls:
@@ -684,13 +688,13 @@ class QwenAgent(BaseAgent):
             logger.debug(f"Calling Qwen API for image analysis with model: {self.model}")
             vision_model = "qwen-vl-plus" if "qwen" in self.model else self.model
 
-            response = await self.client.chat.completions.create(
+            response = await self._model_request(self.client.chat.completions.create(
                 model=vision_model,
                 messages=messages,
                 max_tokens=1024,
                 temperature=self.temperature,
                 timeout=self.timeout
-            )
+            ))
 
             # Extract and return the assistant's response
             if response.choices and len(response.choices) > 0:
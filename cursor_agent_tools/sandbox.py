@@ -0,0 +1,402 @@
+"""
+Resource limits and accounting for commands run by the agent.
+
+Limits are opt-in. On Linux with a delegated cgroup v2 subtree, every command
+gets its own cgroup (memory.max, pids.max, cpu.max), which also covers the
+processes it leaves behind; otherwise the limits are applied with setrlimit().
+CPU time and peak RSS of every command are reported either way.
+
+Limited commands are started through a small Python exec wrapper that joins
+the cgroup, sets the rlimits and then execs the command. Doing this in a
+Popen preexec_fn instead would run Python code between fork and exec, which
+can deadlock when other threads (e.g. of the web server) hold locks.
+"""
+
+import dataclasses
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from .logger import get_logger
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Controllers a per-command cgroup needs
+CGROUP_CONTROLLERS = ("memory", "pids", "cpu")
+
+# Period used for the cgroup cpu.max bandwidth limit (microseconds)
+CPU_PERIOD_USEC = 100000
+
+# Extra seconds between the RLIMIT_CPU soft limit (SIGXCPU) and the hard limit (SIGKILL)
+CPU_TIME_GRACE = 5
+
+# Runs as `python -c EXEC_WRAPPER CONFIG COMMAND...`: joins the cgroup, sets the
+# rlimits (never raising a hard limit) and replaces itself with the command
+EXEC_WRAPPER = """
+import json, os, resource, sys
+config = json.loads(sys.argv[1])
+if config["cgroup"]:
+    with open(os.path.join(config["cgroup"], "cgroup.procs"), "w") as f:
+        f.write(str(os.getpid()))
+for kind, soft, hard in config["rlimits"]:
+    current_hard = resource.getrlimit(kind)[1]
+    if current_hard != resource.RLIM_INFINITY:
+        hard = min(hard, current_hard)
+        soft = min(soft, hard)
+    resource.setrlimit(kind, (soft, hard))
+os.execvp(sys.argv[2], sys.argv[2:])
+"""
+
+
+@dataclass
+class ResourceLimits:
+    """
+    Resource limits for a single command.
+
+    Attributes:
+        cpu_time: CPU seconds per process (RLIMIT_CPU; SIGXCPU when exceeded)
+        cpu_cores: CPU bandwidth in cores (cgroup cpu.max; ignored without cgroups)
+        memory: Memory limit in bytes (cgroup memory.max, else RLIMIT_AS address space)
+        open_files: Maximum open file descriptors per process (RLIMIT_NOFILE)
+        processes: Maximum number of processes (cgroup pids.max, else RLIMIT_NPROC,
+                   which counts all processes of the user)
+        use_cgroups: Whether to use cgroups v2 when they are available
+    """
+    cpu_time: Optional[int] = None
+    cpu_cores: Optional[float] = None
+    memory: Optional[int] = None
+    open_files: Optional[int] = None
+    processes: Optional[int] = None
+    use_cgroups: bool = True
+
+    @property
+    def enabled(self) -> bool:
+        return any(value is not None for value in (self.cpu_time, self.cpu_cores, self.memory, self.open_files, self.processes))
+
+    def for_long_running(self) -> "ResourceLimits":
+        """The limits for long-lived processes (shell sessions, background jobs): no CPU time budget."""
+        return dataclasses.replace(self, cpu_time=None)
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> Optional["ResourceLimits"]:
+        """
+        Read limits from CURSOR_AGENT_LIMIT_* environment variables.
+
+        Returns:
+            ResourceLimits, or None if no limit is configured
+        """
+        environ = os.environ if environ is None else environ
+
+        def number(name: str, cast: Any) -> Any:
+            value = environ.get(name, "").strip()
+            if not value:
+                return None
+            try:
+                return cast(value)
+            except ValueError:
+                logger.warning(f"Ignoring invalid value for {name}: {value!r}")
+                return None
+
+        memory_mb = number("CURSOR_AGENT_LIMIT_MEMORY_MB", float)
+        limits = cls(
+            cpu_time=number("CURSOR_AGENT_LIMIT_CPU_TIME", int),
+            cpu_cores=number("CURSOR_AGENT_LIMIT_CPU_CORES", float),
+            memory=int(memory_mb * 1024 * 1024) if memory_mb else None,
+            open_files=number("CURSOR_AGENT_LIMIT_OPEN_FILES", int),
+            processes=number("CURSOR_AGENT_LIMIT_PROCESSES", int),
+            use_cgroups=environ.get("CURSOR_AGENT_CGROUPS", "1").lower() not in ("0", "false", "no"),
+        )
+        return limits if limits.enabled else None
+
+
+# ---------- cgroups v2 ----------
+
+_cgroup_root: Optional[str] = None
+_cgroup_checked = False
+_cgroup_lock = threading.Lock()
+_cgroup_counter = itertools.count(1)
+
+
+def _read(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def _write(path: str, value: str) -> None:
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _find_cgroup_root() -> Optional[str]:
+    """
+    Find a cgroup v2 directory under which per-command cgroups can be created.
+
+    Uses CURSOR_AGENT_CGROUP_ROOT if set (e.g. a subtree delegated by systemd), else
+    the cgroup of the current process. The directory must be writable and have the
+    memory, pids and cpu controllers enabled for its children.
+    """
+    root = os.environ.get("CURSOR_AGENT_CGROUP_ROOT")
+    if not root:
+        if not os.path.exists("/sys/fs/cgroup/cgroup.controllers"):
+            return None
+        try:
+            for line in _read("/proc/self/cgroup").splitlines():
+                if line.startswith("0::"):
+                    root = os.path.join("/sys/fs/cgroup", line[3:].strip().lstrip("/"))
+                    break
+        except OSError:
+            return None
+    if not root or not os.access(root, os.W_OK):
+        return None
+
+    try:
+        enabled = set(_read(os.path.join(root, "cgroup.subtree_control")).split())
+        missing = [name for name in CGROUP_CONTROLLERS if name not in enabled]
+        if missing:
+            # Fails if processes live directly in root ("no internal processes" rule)
+            _write(os.path.join(root, "cgroup.subtree_control"), " ".join("+" + name for name in missing))
+    except OSError as e:
+        logger.debug(f"cgroup v2 controllers not available under {root}: {e}")
+        return None
+    return root
+
+
+def cgroup_root() -> Optional[str]:
+    """The cgroup v2 directory used for per-command cgroups, or None if cgroups can't be used."""
+    global _cgroup_root, _cgroup_checked
+
+    with _cgroup_lock:
+        if not _cgroup_checked:
+            _cgroup_checked = True
+            _cgroup_root = _find_cgroup_root() if os.name == "posix" else None
+            if _cgroup_root:
+                logger.info(f"Using cgroup v2 resource limits under {_cgroup_root}")
+            else:
+                logger.info("cgroup v2 delegation not available; using setrlimit for resource limits")
+    return _cgroup_root
+
+
+def _exit_code(status: int) -> int:
+    """Convert a wait status to a Popen-style return code (negative signal number if killed)."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class CommandSandbox:
+    """
+    Applies resource limits to one command and measures what it used.
+
+    Start the command given by wrap() with subprocess.Popen, reap the process with
+    wait(), then call finish() to release the cgroup and collect usage().
+
+    Args:
+        limits: Limits to apply, or None to only measure usage
+    """
+
+    def __init__(self, limits: Optional[ResourceLimits] = None):
+        self.limits = limits if limits is not None and limits.enabled and os.name == "posix" else None
+        self.cgroup: Optional[str] = None
+        self.rusage: Any = None
+        self.exit_code: Optional[int] = None
+        self._cgroup_stats: Dict[str, Any] = {}
+        # The kernel carries the parent's peak RSS over into the child at exec, so the
+        # child's ru_maxrss only says something about the command if it exceeds this
+        self._parent_max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+        if self.limits and self.limits.use_cgroups:
+            self.cgroup = self._create_cgroup()
+        self._in_cgroup = self.cgroup is not None
+
+    @property
+    def mode(self) -> Optional[str]:
+        """How the limits are enforced: "cgroup", "rlimit", or None when no limits are applied."""
+        if self.limits is None:
+            return None
+        return "cgroup" if self._in_cgroup else "rlimit"
+
+    def _create_cgroup(self) -> Optional[str]:
+        root = cgroup_root()
+        if root is None:
+            return None
+        limits = self.limits
+        if limits is None:
+            return None
+        path = os.path.join(root, f"cursor-agent-{os.getpid()}-{next(_cgroup_counter)}")
+        try:
+            os.mkdir(path)
+            if limits.memory is not None:
+                _write(os.path.join(path, "memory.max"), str(limits.memory))
+                if os.path.exists(os.path.join(path, "memory.swap.max")):
+                    _write(os.path.join(path, "memory.swap.max"), "0")
+            if limits.processes is not None:
+                _write(os.path.join(path, "pids.max"), str(limits.processes))
+            if limits.cpu_cores is not None:
+                _write(os.path.join(path, "cpu.max"), f"{max(1000, int(limits.cpu_cores * CPU_PERIOD_USEC))} {CPU_PERIOD_USEC}")
+        except OSError as e:
+            logger.warning(f"Could not set up cgroup {path}, falling back to setrlimit: {e}")
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+            return None
+        return path
+
+    def wrap(self, args: Union[str, Sequence[str]], shell: bool = False) -> Tuple[Union[str, List[str]], bool]:
+        """
+        The Popen arguments that run a command under the limits.
+
+        Without limits the command is returned as is. With limits it is run by the
+        exec wrapper, a shell command through /bin/sh -c.
+
+        Args:
+            args: The command, as for subprocess.Popen
+            shell: Whether args is a shell command
+
+        Returns:
+            (args, shell) to pass to subprocess.Popen
+        """
+        limits = self.limits
+        if limits is None:
+            return (args if isinstance(args, str) else list(args)), shell
+        if shell:
+            argv = ["/bin/sh", "-c", args if isinstance(args, str) else " ".join(args)]
+        else:
+            argv = [args] if isinstance(args, str) else list(args)
+
+        rlimits = []
+        if limits.cpu_time is not None:
+            rlimits.append((resource.RLIMIT_CPU, limits.cpu_time, limits.cpu_time + CPU_TIME_GRACE))
+        if limits.open_files is not None:
+            rlimits.append((resource.RLIMIT_NOFILE, limits.open_files, limits.open_files))
+        if not self.cgroup:
+            if limits.memory is not None:
+                rlimits.append((resource.RLIMIT_AS, limits.memory, limits.memory))
+            if limits.processes is not None:
+                rlimits.append((resource.RLIMIT_NPROC, limits.processes, limits.processes))
+        config = json.dumps({"cgroup": self.cgroup, "rlimits": rlimits})
+        # -I -S: ignore PYTHON* variables and skip site, for a fast and predictable start
+        return [sys.executable, "-I", "-S", "-c", EXEC_WRAPPER, config] + argv, False
+
+    def wait(self, process: subprocess.Popen, timeout: Optional[float] = None) -> int:
+        """
+        Wait for the process like Popen.wait(), recording its resource usage.
+
+        Raises:
+            subprocess.TimeoutExpired: If the process is still running after timeout seconds
+        """
+        if not hasattr(os, "wait4"):
+            self.exit_code = process.wait(timeout=timeout)
+            return self.exit_code
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0005
+        while True:
+            try:
+                pid, status, rusage = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+            except ChildProcessError:
+                # Already reaped elsewhere (e.g. by a concurrent poll()); no usage available
+                self.exit_code = process.wait()
+                return self.exit_code
+            if pid:
+                self.rusage = rusage
+                process.returncode = self.exit_code = _exit_code(status)
+                return self.exit_code
+            if deadline is None or timeout is None:
+                # A blocking wait4() only returns once the process has exited
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(process.args, timeout)
+            delay = min(delay * 2, remaining, 0.05)
+            time.sleep(delay)
+
+    def finish(self) -> None:
+        """Collect cgroup statistics, kill whatever is left in the cgroup and remove it."""
+        if not self.cgroup:
+            return
+        path, self.cgroup = self.cgroup, None
+        try:
+            for line in _read(os.path.join(path, "cpu.stat")).splitlines():
+                key, _, value = line.partition(" ")
+                if key == "usage_usec":
+                    self._cgroup_stats["cpu_time"] = int(value) / 1e6
+            if os.path.exists(os.path.join(path, "memory.peak")):
+                self._cgroup_stats["memory_peak"] = int(_read(os.path.join(path, "memory.peak")))
+            for line in _read(os.path.join(path, "memory.events")).splitlines():
+                key, _, value = line.partition(" ")
+                if key == "oom_kill":
+                    self._cgroup_stats["oom_kills"] = int(value)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Could not read cgroup statistics from {path}: {e}")
+
+        # Processes the command left behind are part of it
+        try:
+            if os.path.exists(os.path.join(path, "cgroup.kill")):
+                _write(os.path.join(path, "cgroup.kill"), "1")
+            else:
+                for pid in _read(os.path.join(path, "cgroup.procs")).split():
+                    try:
+                        os.kill(int(pid), signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+        except OSError as e:
+            logger.debug(f"Could not kill remaining processes in {path}: {e}")
+        for _ in range(20):
+            try:
+                os.rmdir(path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.05)
+        logger.warning(f"Could not remove cgroup {path}")
+
+    def usage(self) -> Dict[str, Any]:
+        """
+        Resource usage of the finished command.
+
+        Returns:
+            Dict with cpu_time, user_time and system_time (seconds), max_rss (bytes; the
+            cgroup's memory.peak when in a cgroup, else None if the command stayed below
+            the agent process's own peak RSS), sandbox ("cgroup", "rlimit" or None) and
+            limit_exceeded when a limit was hit
+        """
+        usage: Dict[str, Any] = {"sandbox": self.mode}
+        if self.rusage is not None:
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            unit = 1 if sys.platform == "darwin" else 1024
+            usage.update({
+                "cpu_time": round(self.rusage.ru_utime + self.rusage.ru_stime, 3),
+                "user_time": round(self.rusage.ru_utime, 3),
+                "system_time": round(self.rusage.ru_stime, 3),
+                "max_rss": self.rusage.ru_maxrss * unit if self.rusage.ru_maxrss > self._parent_max_rss else None,
+            })
+        if "cpu_time" in self._cgroup_stats:
+            usage["cpu_time"] = round(self._cgroup_stats["cpu_time"], 3)
+        if "memory_peak" in self._cgroup_stats:
+            usage["max_rss"] = self._cgroup_stats["memory_peak"]
+
+        if self.limits is not None:
+            sigxcpu = getattr(signal, "SIGXCPU", None)
+            if self._cgroup_stats.get("oom_kills"):
+                usage["limit_exceeded"] = "memory"
+            elif sigxcpu is not None and self.exit_code in (-sigxcpu, 128 + sigxcpu):
+                usage["limit_exceeded"] = "cpu_time"
+            elif (self.limits.cpu_time is not None and self.exit_code in (-signal.SIGKILL, 128 + signal.SIGKILL)
+                    and usage.get("cpu_time", 0) >= self.limits.cpu_time):
+                # Ignored SIGXCPU and ran into the hard limit
+                usage["limit_exceeded"] = "cpu_time"
+        return usage
@@ -1,6 +1,7 @@
 from .file_tools import create_file, delete_file, edit_file, list_directory, read_file
 from .search_tools import codebase_search, file_search, grep_search, web_search, trend_search, get_trending_topics
 from .system_tools import run_terminal_command
+from .job_tools import job_status, job_output, job_kill
 from .image_tools import query_images
 from .register_tools import register_default_tools
 
@@ -17,6 +18,9 @@ __all__ = [
     "trend_search",
     "get_trending_topics",
     "run_terminal_command",
+    "job_status",
+    "job_output",
+    "job_kill",
     "query_images",
     "register_default_tools",
 ]
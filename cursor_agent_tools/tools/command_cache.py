@@ -0,0 +1,222 @@
+"""
+Result cache for read-only terminal commands.
+
+Agents run the same inspection commands (git status, ls, pip list, python
+--version) over and over within a task. When enabled, run_terminal_command
+serves repeats of allowlisted read-only commands from this cache instead of
+spawning a process.
+
+A cached result is reused only while its fingerprint still matches: the
+command, the working directory, the agent's workspace generation (bumped
+whenever a mutating tool runs), the modification times of the working
+directory and of the git index/HEAD, and a TTL.
+"""
+
+import os
+import shlex
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..logger import get_logger
+
+# Define exported functions
+__all__ = ["CommandCache", "DEFAULT_READ_ONLY_COMMANDS", "is_read_only_command", "get_command_cache"]
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Commands whose output only depends on the workspace and installed tools.
+# An entry matches the command exactly; a trailing "*" also matches any further arguments.
+DEFAULT_READ_ONLY_COMMANDS = (
+    "git status *",
+    "git log *",
+    "git diff *",
+    "git show *",
+    "git branch",
+    "git branch -a",
+    "git branch -v",
+    "git remote -v",
+    "git rev-parse *",
+    "ls *",
+    "pwd",
+    "tree *",
+    "pip list *",
+    "pip freeze",
+    "pip show *",
+    "python --version",
+    "python3 --version",
+    "node --version",
+    "npm --version",
+    "which *",
+    "uname *",
+)
+
+# Maximum number of cached results per agent
+MAX_ENTRIES = 128
+
+# Seconds a cached result stays valid even if nothing observable changed
+DEFAULT_TTL = 60.0
+
+
+def _parse_allowlist(entries: Iterable[str]) -> List[Tuple[Tuple[str, ...], bool]]:
+    rules = []
+    for entry in entries:
+        tokens = entry.split()
+        wildcard = bool(tokens) and tokens[-1] == "*"
+        if wildcard:
+            tokens = tokens[:-1]
+        if tokens:
+            rules.append((tuple(tokens), wildcard))
+    return rules
+
+
+def _split_simple_command(command: str) -> Optional[List[str]]:
+    """Split a command into words, or None if it is not a single simple command."""
+    # Expansions and substitutions can run arbitrary code or depend on state we don't track
+    if any(char in command for char in "$`\n"):
+        return None
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        words = list(lexer)
+    except ValueError:  # unbalanced quotes
+        return None
+    # Operators (;, &&, |, >, <, &) come out as separate punctuation tokens
+    if not words or any(word and all(char in "();<>|&" for char in word) for word in words):
+        return None
+    return words
+
+
+def is_read_only_command(command: str, allowlist: Iterable[str] = DEFAULT_READ_ONLY_COMMANDS) -> bool:
+    """
+    Check whether a command is a single simple command matching the read-only allowlist.
+
+    Args:
+        command: The shell command
+        allowlist: Allowlist entries, e.g. "git status *"
+
+    Returns:
+        True if the command cannot change the workspace
+    """
+    words = _split_simple_command(command)
+    if words is None:
+        return False
+    # git diff --output=<file>, tree -o <file>
+    if any(word == "-o" or word.startswith("--output") for word in words[1:]):
+        return False
+    for tokens, wildcard in _parse_allowlist(allowlist):
+        if tuple(words[:len(tokens)]) == tokens and (wildcard or len(words) == len(tokens)):
+            return True
+    return False
+
+
+def _mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _find_git_dir(cwd: str) -> Optional[str]:
+    directory = cwd
+    while True:
+        candidate = os.path.join(directory, ".git")
+        if os.path.exists(candidate):
+            return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+class CommandCache:
+    """
+    LRU cache of read-only command results for one agent.
+
+    Args:
+        allowlist: Read-only command patterns (defaults to DEFAULT_READ_ONLY_COMMANDS)
+        ttl: Seconds a result stays valid
+        max_entries: Maximum number of cached results
+    """
+
+    def __init__(
+        self,
+        allowlist: Optional[Iterable[str]] = None,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = MAX_ENTRIES,
+    ):
+        self.allowlist = list(allowlist if allowlist is not None else DEFAULT_READ_ONLY_COMMANDS)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Tuple[Any, ...], float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, command: str) -> bool:
+        return is_read_only_command(command, self.allowlist)
+
+    def fingerprint(self, cwd: str, generation: int) -> Tuple[Any, ...]:
+        """The state a read-only command's output depends on."""
+        git_dir = _find_git_dir(cwd)
+        git_state: Tuple[int, ...] = ()
+        if git_dir is not None:
+            git_state = (_mtime(os.path.join(git_dir, "index")), _mtime(os.path.join(git_dir, "HEAD")))
+        return (generation, _mtime(cwd), git_state)
+
+    def get(self, command: str, cwd: str, fingerprint: Tuple[Any, ...]) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached result, or None if there is no valid entry."""
+        key = (command, cwd)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            stored_at, result = entry[1], entry[2]
+        logger.debug(f"Serving cached result for command: {command}")
+        return dict(result, cached=True, cache_age=round(time.monotonic() - stored_at, 3))
+
+    def put(self, command: str, cwd: str, fingerprint: Tuple[Any, ...], result: Dict[str, Any]) -> None:
+        """Cache a successful result; fingerprint must be taken before the command ran."""
+        if result.get("exit_code") != 0 or result.get("error") or result.get("timed_out"):
+            return
+        with self._lock:
+            self._entries[(command, cwd)] = (fingerprint, time.monotonic(), dict(result))
+            self._entries.move_to_end((command, cwd))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# One cache per agent
+_caches: "weakref.WeakKeyDictionary[Any, CommandCache]" = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def get_command_cache(agent: Any) -> CommandCache:
+    """
+    Get the command cache of an agent.
+
+    The allowlist can be replaced with CURSOR_AGENT_COMMAND_CACHE_ALLOWLIST
+    (comma-separated patterns, e.g. "git status *,ls *,make --version").
+    """
+    with _caches_lock:
+        cache = _caches.get(agent)
+        if cache is None:
+            allowlist = os.environ.get("CURSOR_AGENT_COMMAND_CACHE_ALLOWLIST")
+            cache = CommandCache([entry.strip() for entry in allowlist.split(",") if entry.strip()] if allowlist else None)
+            _caches[agent] = cache
+    return cache
@@ -3,7 +3,7 @@ from typing import Any, Dict, Optional, Union
 import json
 
 from ..base import BaseAgent
-from ..logger import get_logger
+from ..logger import get_logger, lazy
 
 # Define exported functions
 __all__ = [
@@ -219,7 +219,7 @@ def edit_file(
     except Exception as e:
         logger.error(f"Error editing file {target_file}: {str(e)}")
         import traceback
-        logger.debug(f"Traceback: {traceback.format_exc()}")
+        logger.debug("Traceback: %s", lazy(traceback.format_exc))
         return {"status": "error", "message": str(e)}
 
 
@@ -394,7 +394,7 @@ def apply_edit(original_content: str, code_edit: Any) -> str:
                 # Just convert to string if not already
                 line_edits[str(k)] = v
 
-        logger.debug(f"Converted dictionary: {line_edits}")
+        logger.debug("Converted dictionary: %s", line_edits)
         return apply_line_based_edit(original_content, line_edits)
 
     # Handle string input - try to parse as JSON
@@ -416,7 +416,7 @@ def apply_edit(original_content: str, code_edit: Any) -> str:
                     logger.debug(f"JSON parsed but result is not a dictionary: {type(line_edits)}")
             except json.JSONDecodeError as e:
                 logger.debug(f"Failed to parse as JSON: {str(e)}")
-                logger.debug(f"Content that failed to parse: {code_edit}")
+                logger.debug("Content that failed to parse: %s", code_edit)
 
     # If not a valid line-based edit, replace the entire content
     logger.debug("No valid line-based edit detected, replacing entire content")
@@ -435,7 +435,7 @@ def apply_line_based_edit(original_content: str, line_edits: Dict[str, str]) ->
     Returns:
         The content after applying the line-based edits
     """
-    logger.debug(f"Applying line-based edit: {line_edits}")
+    logger.debug("Applying line-based edit: %s", line_edits)
     original_lines = original_content.splitlines()
     result_lines = original_lines.copy()
 
@@ -482,8 +482,8 @@ def apply_line_based_edit(original_content: str, line_edits: Dict[str, str]) ->
                 new_lines = new_content.splitlines()
 
                 logger.debug(f"Replacing lines {start_idx+1}-{end_idx+1} with {len(new_lines)} new lines")
-                logger.debug(f"Original lines: {original_lines[start_idx:end_idx+1]}")
-                logger.debug(f"New lines: {new_lines}")
+                logger.debug("Original lines: %s", lazy(lambda: original_lines[start_idx:end_idx + 1]))
+                logger.debug("New lines: %s", new_lines)
 
                 # Replace the specified lines with the new content
                 result_lines[start_idx:end_idx + 1] = new_lines
@@ -493,13 +493,13 @@ def apply_line_based_edit(original_content: str, line_edits: Dict[str, str]) ->
             except (ValueError, IndexError) as e:
                 logger.error(f"Error applying edit to line range {line_range}: {str(e)}")
                 import traceback
-                logger.debug(f"Traceback: {traceback.format_exc()}")
+                logger.debug("Traceback: %s", lazy(traceback.format_exc))
 
         return "\n".join(result_lines)
 
     except Exception as e:
         logger.error(f"Error in apply_line_based_edit: {str(e)}")
         import traceback
-        logger.debug(f"Traceback: {traceback.format_exc()}")
+        logger.debug("Traceback: %s", lazy(traceback.format_exc))
         # Return original content on error to avoid data loss
         return original_content
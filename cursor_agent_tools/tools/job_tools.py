@@ -0,0 +1,313 @@
+"""
+Background jobs started by run_terminal_command(is_background=True).
+
+Each agent gets a JobManager that starts background commands as tracked jobs,
+drains their output into size-bounded rotating log files, and reaps them when
+they exit. Jobs are killed when the agent is closed.
+"""
+
+import collections
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+
+from ..logger import get_logger
+from ..sandbox import CommandSandbox, ResourceLimits
+
+# Define exported functions
+__all__ = ["JobManager", "get_job_manager", "has_running_jobs", "job_status", "job_output", "job_kill"]
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Size of one job log file before it is rotated, and the number of rotated files kept
+JOB_LOG_MAX_BYTES = 1024 * 1024
+JOB_LOG_BACKUP_COUNT = 3
+
+# Maximum number of jobs running at the same time per agent
+MAX_RUNNING_JOBS = 16
+
+# Default number of lines returned by job_output
+DEFAULT_TAIL_LINES = 50
+
+
+class _RotatingLog:
+    """Append-only text log that rotates to <path>.1 ... <path>.N when it grows too large."""
+
+    def __init__(self, path: str, max_bytes: int = JOB_LOG_MAX_BYTES, backup_count: int = JOB_LOG_BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = open(path, "ab")
+        self._size = 0
+
+    def write(self, text: str) -> None:
+        data = text.encode("utf-8")
+        if self._size and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "wb")
+        self._size = 0
+
+    def close(self) -> None:
+        self._file.close()
+
+    def files(self) -> List[str]:
+        """Log files from oldest to newest."""
+        rotated = [f"{self.path}.{index}" for index in range(self.backup_count, 0, -1)]
+        return [path for path in rotated + [self.path] if os.path.exists(path)]
+
+
+class BackgroundJob:
+    """A background command tracked by a JobManager."""
+
+    def __init__(self, job_id: str, command: str, process: subprocess.Popen, log: _RotatingLog, sandbox: CommandSandbox):
+        self.job_id = job_id
+        self.command = command
+        self.process = process
+        self.log = log
+        self.sandbox = sandbox
+        self.started_at = time.time()
+        self.ended_at: Optional[float] = None
+        self.exit_code: Optional[int] = None
+        self.killed = False
+        self.reader: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.exit_code is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        ended_at = self.ended_at or time.time()
+        status = {
+            "job_id": self.job_id,
+            "command": self.command,
+            "pid": self.process.pid,
+            "status": "running" if self.running else ("killed" if self.killed else "exited"),
+            "exit_code": self.exit_code,
+            "started_at": self.started_at,
+            "runtime": round(ended_at - self.started_at, 3),
+            "output_file": self.log.path,
+        }
+        if not self.running:
+            status["resource_usage"] = self.sandbox.usage()
+        return status
+
+
+class JobManager:
+    """
+    Starts and tracks the background jobs of one agent.
+
+    Args:
+        log_dir: Directory for job logs (defaults to a new temporary directory,
+                 removed again by close())
+    """
+
+    def __init__(self, log_dir: Optional[str] = None):
+        self._owns_log_dir = log_dir is None
+        self.log_dir = log_dir or tempfile.mkdtemp(prefix="cursor-agent-jobs-")
+        self.jobs: Dict[str, BackgroundJob] = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def start(self, command: str, cwd: Optional[str] = None, limits: Optional[ResourceLimits] = None) -> BackgroundJob:
+        """
+        Start a command as a background job.
+
+        The command runs in its own process group; stdout and stderr are written
+        to the job's rotating log file. Resource limits other than the CPU time
+        budget apply to jobs as they do to foreground commands.
+
+        Raises:
+            RuntimeError: If MAX_RUNNING_JOBS jobs are already running
+        """
+        from .system_tools import _read_stream
+
+        with self._lock:
+            running = sum(1 for job in self.jobs.values() if job.running)
+            if running >= MAX_RUNNING_JOBS:
+                raise RuntimeError(f"Too many background jobs running ({running}); kill one with job_kill first")
+            self._counter += 1
+            job_id = f"job-{self._counter}"
+
+        log = _RotatingLog(os.path.join(self.log_dir, f"{job_id}.log"))
+        sandbox = CommandSandbox(limits.for_long_running() if limits else None)
+        try:
+            args, shell = sandbox.wrap(command, shell=True)
+            process = subprocess.Popen(
+                args, shell=shell, cwd=cwd,
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+        except Exception:
+            log.close()
+            sandbox.finish()
+            raise
+
+        job = BackgroundJob(job_id, command, process, log, sandbox)
+
+        def drain_and_reap() -> None:
+            # Keep the pipe drained so the job never blocks on a full pipe buffer,
+            # then reap the process once its output is closed
+            _read_stream(process.stdout, log)
+            exit_code = sandbox.wait(process)
+            sandbox.finish()
+            job.exit_code = exit_code
+            job.ended_at = time.time()
+            log.close()
+            logger.info(f"Background job {job_id} exited with code {job.exit_code}")
+
+        job.reader = threading.Thread(target=drain_and_reap, name=f"job-{job_id}", daemon=True)
+        job.reader.start()
+
+        with self._lock:
+            self.jobs[job_id] = job
+        logger.info(f"Started background job {job_id} (pid={process.pid}): {command}")
+        return job
+
+    def get(self, job_id: str) -> BackgroundJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown job: {job_id}")
+        return job
+
+    def tail(self, job_id: str, lines: int = DEFAULT_TAIL_LINES) -> List[str]:
+        """Return the last lines of a job's output, across rotated log files."""
+        job = self.get(job_id)
+        result: "collections.deque[str]" = collections.deque(maxlen=max(1, lines))
+        for path in job.log.files():
+            try:
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    result.extend(line.rstrip("\n") for line in f)
+            except FileNotFoundError:  # rotated while we were reading
+                continue
+        return list(result)
+
+    def kill(self, job_id: str, grace_period: float = 5) -> BackgroundJob:
+        """Terminate a job and its children."""
+        from .system_tools import _terminate_process
+
+        job = self.get(job_id)
+        if job.running:
+            job.killed = True
+            _terminate_process(job.process, grace_period=grace_period)
+            if job.reader is not None:
+                job.reader.join(timeout=grace_period)
+            logger.info(f"Killed background job {job_id}")
+        return job
+
+    def close(self) -> None:
+        """Kill all running jobs and remove the log directory if it was created by the manager."""
+        for job_id, job in list(self.jobs.items()):
+            if job.running:
+                self.kill(job_id, grace_period=2)
+        if self._owns_log_dir:
+            shutil.rmtree(self.log_dir, ignore_errors=True)
+
+
+# One manager per agent; jobs are killed when the agent is closed
+_managers: "weakref.WeakKeyDictionary[Any, JobManager]" = weakref.WeakKeyDictionary()
+_managers_lock = threading.Lock()
+_default_manager: Optional[JobManager] = None
+
+
+def get_job_manager(agent: Optional[Any] = None) -> JobManager:
+    """
+    Get the job manager of an agent (or a process-wide one when no agent is given).
+
+    The agent's manager is closed, killing its running jobs, by agent.close().
+    """
+    global _default_manager
+
+    with _managers_lock:
+        if agent is None:
+            if _default_manager is None:
+                _default_manager = JobManager()
+            return _default_manager
+        manager = _managers.get(agent)
+        if manager is None:
+            manager = JobManager()
+            _managers[agent] = manager
+            agent.add_close_hook(manager.close)
+    return manager
+
+
+def has_running_jobs(agent: Any) -> bool:
+    """Whether the agent has background jobs that are still running."""
+    with _managers_lock:
+        manager = _managers.get(agent)
+    return manager is not None and any(job.running for job in list(manager.jobs.values()))
+
+
+def job_status(job_id: Optional[str] = None, agent: Optional[Any] = None) -> Dict[str, Any]:
+    """
+    Get the status of a background job, or of all jobs.
+
+    Args:
+        job_id: ID of the job (e.g. "job-1"); omit to list all jobs
+        agent: Reference to the agent instance that owns the jobs
+
+    Returns:
+        Dict with the job's status, or a list of all jobs
+    """
+    manager = get_job_manager(agent)
+    try:
+        if job_id:
+            return manager.get(job_id).to_dict()
+        return {"jobs": [job.to_dict() for job in manager.jobs.values()]}
+    except KeyError as e:
+        return {"error": str(e.args[0])}
+
+
+def job_output(job_id: str, tail: int = DEFAULT_TAIL_LINES, agent: Optional[Any] = None) -> Dict[str, Any]:
+    """
+    Read the most recent output of a background job.
+
+    Args:
+        job_id: ID of the job
+        tail: Number of lines to return from the end of the output
+        agent: Reference to the agent instance that owns the jobs
+
+    Returns:
+        Dict with the job's status and its last output lines
+    """
+    manager = get_job_manager(agent)
+    try:
+        lines = manager.tail(job_id, tail)
+        return dict(manager.get(job_id).to_dict(), output="\n".join(lines), lines=len(lines))
+    except KeyError as e:
+        return {"error": str(e.args[0])}
+
+
+def job_kill(job_id: str, agent: Optional[Any] = None) -> Dict[str, Any]:
+    """
+    Stop a background job and everything it started.
+
+    Args:
+        job_id: ID of the job
+        agent: Reference to the agent instance that owns the jobs
+
+    Returns:
+        Dict with the job's final status
+    """
+    manager = get_job_manager(agent)
+    try:
+        return manager.kill(job_id).to_dict()
+    except KeyError as e:
+        return {"error": str(e.args[0])}
@@ -10,6 +10,7 @@ from . import (
     file_tools,
     search_tools,
     system_tools,
+    job_tools,
     image_tools,
 )
 
@@ -162,7 +163,7 @@ def register_default_tools(agent: Any) -> None:
                 },
                 "is_background": {
                     "type": "boolean",
-                    "description": "Whether to run in the background",
+                    "description": "Whether to run in the background as a job (for servers and watchers); returns a job_id for job_status, job_output and job_kill",
                 },
                 "require_user_approval": {
                     "type": "boolean",
@@ -174,6 +175,61 @@ def register_default_tools(agent: Any) -> None:
     )
     logger.debug("Registered tool: run_terminal_command")
 
+    agent.register_tool(
+        "job_status",
+        lambda job_id=None: job_tools.job_status(job_id, agent),
+        "Get the status (running/exited/killed, exit code, runtime) of a background job started with run_terminal_command, or of all jobs if no job_id is given.",
+        {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "ID of the job, e.g. 'job-1'; omit to list all jobs",
+                },
+            },
+            "required": [],
+        },
+    )
+    logger.debug("Registered tool: job_status")
+
+    agent.register_tool(
+        "job_output",
+        lambda job_id, tail=50: job_tools.job_output(job_id, tail, agent),
+        "Read the most recent output (stdout and stderr) of a background job.",
+        {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "ID of the job",
+                },
+                "tail": {
+                    "type": "integer",
+                    "description": "Number of lines to return from the end of the output (default 50)",
+                },
+            },
+            "required": ["job_id"],
+        },
+    )
+    logger.debug("Registered tool: job_output")
+
+    agent.register_tool(
+        "job_kill",
+        lambda job_id: job_tools.job_kill(job_id, agent),
+        "Stop a background job and all processes it started.",
+        {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "ID of the job",
+                },
+            },
+            "required": ["job_id"],
+        },
+    )
+    logger.debug("Registered tool: job_kill")
+
     # Search tools
     agent.register_tool(
         "codebase_search",
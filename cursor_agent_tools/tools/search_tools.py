@@ -2,9 +2,7 @@ import json
 import os
 import re
 import subprocess
-import requests
 from typing import Any, Dict, List, Optional, Tuple
-from bs4 import BeautifulSoup
 
 from ..logger import get_logger
 
@@ -398,6 +396,9 @@ def google_search_sync(query: str, api_key: str, search_engine_id: str, max_resu
     Returns:
         Dictionary mapping URLs to search result data
     """
+    # Imported on first use, so loading the tools doesn't pay for requests
+    import requests
+
     try:
         logger.info(f"Performing Google Custom Search for: {query} (max_results: {max_results})")
 
@@ -488,6 +489,10 @@ def scrape_content_sync(search_results: Dict[str, Dict[str, Any]]) -> Dict[str,
     Returns:
         Dictionary mapping URLs to content summaries
     """
+    # Imported on first use, so loading the tools doesn't pay for requests and bs4
+    import requests
+    from bs4 import BeautifulSoup
+
     content_summaries = {}
 
     for url in search_results:
@@ -0,0 +1,358 @@
+"""
+Persistent shell sessions for run_terminal_command.
+
+A ShellSession keeps one long-lived shell attached to a pseudo-terminal, so
+environment variables, virtualenv activation and the working directory carry
+over between commands. Each command is framed by a unique sentinel line that
+carries its exit code and the shell's working directory afterwards.
+"""
+
+import fcntl
+import os
+import pty
+import re
+import select
+import shlex
+import shutil
+import signal
+import subprocess
+import termios
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..logger import get_logger
+from ..sandbox import CommandSandbox, ResourceLimits
+
+# Define exported functions
+__all__ = ["ShellSession", "get_shell_session", "find_shell_session", "close_shell_session"]
+
+# Initialize logger
+logger = get_logger(__name__)
+
+# Seconds to wait for a command to react to Ctrl-C before the shell is restarted
+INTERRUPT_GRACE_PERIOD = 2.0
+
+# Seconds allowed for a freshly started shell to become ready
+STARTUP_TIMEOUT = 10.0
+
+# How often the read loop checks for interruption (seconds)
+POLL_INTERVAL = 0.1
+
+_READ_SIZE = 64 * 1024
+
+
+class ShellExitedError(Exception):
+    """The shell process of a session exited (e.g. the command was `exit`)."""
+
+
+def _make_controlling_terminal() -> None:
+    """Run in the child after setsid(): make the pty (stdin) the controlling terminal so Ctrl-C works."""
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+def _kill_shell(pid: int, master_fd: int) -> None:
+    """Kill a shell's process group and close its pty (also used as a GC finalizer)."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    try:
+        os.close(master_fd)
+    except OSError:
+        pass
+
+
+class ShellSession:
+    """
+    A long-lived shell process attached to a pseudo-terminal.
+
+    Commands run one at a time; run() may be called from any thread. stdout and
+    stderr of a command are merged, as they would be in a terminal.
+
+    Args:
+        cwd: Initial working directory (defaults to the current directory)
+        shell: Shell executable (defaults to bash, falling back to /bin/sh)
+        limits: Resource limits for the shell and everything it runs; the CPU time
+                budget is not applied since it would accumulate over the session
+    """
+
+    def __init__(self, cwd: Optional[str] = None, shell: Optional[str] = None, limits: Optional[ResourceLimits] = None):
+        self.cwd = cwd or os.getcwd()
+        self.shell = shell or shutil.which("bash") or "/bin/sh"
+        self.limits = limits.for_long_running() if limits else None
+        self._sandbox: Optional[CommandSandbox] = None
+        self.process: Optional[subprocess.Popen] = None
+        self._master_fd = -1
+        self._finalizer: Optional[weakref.finalize] = None
+        self._token = uuid.uuid4().hex
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._interrupted = threading.Event()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        """Start the shell process and wait until it accepts commands."""
+        master_fd, slave_fd = pty.openpty()
+
+        # No echo of the commands we write, and no \n -> \r\n translation of output
+        attrs = termios.tcgetattr(slave_fd)
+        attrs[1] &= ~termios.OPOST
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(slave_fd, termios.TCSANOW, attrs)
+
+        env = dict(os.environ, TERM="dumb", PAGER="cat", GIT_PAGER="cat", PS1="", PS2="")
+        args = [self.shell, "--noprofile", "--norc", "--noediting"] if os.path.basename(self.shell) == "bash" else [self.shell]
+        cwd = self.cwd if os.path.isdir(self.cwd) else None
+        sandbox = self._sandbox = CommandSandbox(self.limits)
+
+        try:
+            self.process = subprocess.Popen(
+                sandbox.wrap(args)[0],
+                stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                cwd=cwd, env=env,
+                start_new_session=True,
+                preexec_fn=_make_controlling_terminal,
+            )
+        except BaseException:
+            sandbox.finish()
+            raise
+        finally:
+            os.close(slave_fd)
+        self._master_fd = master_fd
+        self._finalizer = weakref.finalize(self, _kill_shell, self.process.pid, master_fd)
+
+        self._write("set +m 2>/dev/null; PS1=''; PS2=''; unset PROMPT_COMMAND\n")
+        sentinel = self._next_sentinel()
+        self._write(self._frame_line(":", sentinel))
+        if self._read_frame(sentinel, time.monotonic() + STARTUP_TIMEOUT, lambda text: None) is None:
+            self.close()
+            raise RuntimeError(f"Shell {self.shell} did not start within {STARTUP_TIMEOUT} seconds")
+        logger.info(f"Started persistent shell session (pid={self.process.pid}, cwd={self.cwd})")
+
+    def close(self) -> None:
+        """Terminate the shell and everything it started."""
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+        if self._sandbox is not None:
+            self._sandbox.finish()
+            self._sandbox = None
+        self._master_fd = -1
+
+    def restart(self) -> None:
+        """Replace the shell with a fresh one in the last known working directory."""
+        logger.warning(f"Restarting persistent shell session (cwd={self.cwd})")
+        self.close()
+        self.start()
+
+    def interrupt(self) -> None:
+        """Interrupt the running command (used on cancellation); run() returns promptly."""
+        self._interrupted.set()
+
+    def run(
+        self,
+        command: str,
+        timeout: float,
+        on_output: Optional[Callable[[str], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run a command in the shell.
+
+        Args:
+            command: Shell command; state changes (cd, export, source) persist
+            timeout: Seconds before the command is interrupted
+            on_output: Called with output chunks as they arrive
+
+        Returns:
+            Dict with output, exit_code (-1 on timeout/interrupt), cwd, timed_out,
+            interrupted and restarted (True if the shell had to be replaced, losing its state)
+        """
+        with self._lock:
+            chunks = []
+
+            def emit(text: str) -> None:
+                if not text:
+                    return
+                chunks.append(text)
+                if on_output:
+                    on_output(text)
+
+            restarted = False
+            if not self.alive:
+                if self.process is not None:
+                    restarted = True
+                    self.close()
+                self.start()
+
+            self._interrupted.clear()
+            sentinel = self._next_sentinel()
+            # stdin comes from /dev/null so the command cannot swallow the framing line
+            self._write(self._frame_line(f"eval {shlex.quote(command)} </dev/null", sentinel))
+
+            exit_code = -1
+            timed_out = interrupted = False
+            try:
+                frame = self._read_frame(sentinel, time.monotonic() + timeout, emit)
+                if frame is None:
+                    interrupted = self._interrupted.is_set()
+                    timed_out = not interrupted
+                    if not self._recover(sentinel, emit):
+                        self.restart()
+                        restarted = True
+                else:
+                    exit_code, self.cwd = frame
+            except ShellExitedError:
+                process = self.process
+                self.close()
+                if process is not None and process.returncode is not None:
+                    exit_code = process.returncode
+                emit("\n[shell session exited; a new shell will be started for the next command]\n")
+
+            return {
+                "output": "".join(chunks),
+                "exit_code": exit_code,
+                "cwd": self.cwd,
+                "timed_out": timed_out,
+                "interrupted": interrupted,
+                "restarted": restarted,
+            }
+
+    # ---------- framing ----------
+
+    def _next_sentinel(self) -> str:
+        self._counter += 1
+        return f"__CURSOR_AGENT_{self._token}_{self._counter}__"
+
+    @staticmethod
+    def _frame_line(command: str, sentinel: str) -> str:
+        # The sentinel line is printed on its own line: "\n<sentinel>:<exit code>:<cwd>\n"
+        return f"{command}; __cursor_agent_rc=$?; printf '\\n%s:%s:%s\\n' '{sentinel}' \"$__cursor_agent_rc\" \"$PWD\"\n"
+
+    def _write(self, text: str) -> None:
+        data = text.encode("utf-8")
+        while data:
+            written = os.write(self._master_fd, data)
+            data = data[written:]
+
+    def _read_frame(
+        self,
+        sentinel: str,
+        deadline: float,
+        emit: Callable[[str], None],
+    ) -> Optional[Tuple[int, str]]:
+        """
+        Read output until the sentinel line, streaming everything before it to emit().
+
+        Returns:
+            (exit code, working directory), or None on timeout or interruption
+
+        Raises:
+            ShellExitedError: If the shell exited before printing the sentinel
+        """
+        pattern = re.compile(re.escape(sentinel) + r":(-?\d+):(.*)\n")
+        pending = ""
+        while True:
+            match = pattern.search(pending)
+            if match:
+                # Drop the newline printed in front of the sentinel
+                emit(pending[:max(0, match.start() - 1)])
+                return int(match.group(1)), match.group(2)
+
+            # Forward everything that can't be part of the sentinel line
+            start = pending.find(sentinel)
+            safe = start - 1 if start >= 0 else len(pending) - len(sentinel) - 1
+            if safe > 0:
+                emit(pending[:safe])
+                pending = pending[safe:]
+
+            if self._interrupted.is_set() or time.monotonic() >= deadline:
+                emit(pending)
+                return None
+
+            data = self._read(min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+            if data is not None:
+                pending += data
+
+    def _read(self, wait: float) -> Optional[str]:
+        ready, _, _ = select.select([self._master_fd], [], [], wait)
+        if not ready:
+            return None
+        try:
+            data = os.read(self._master_fd, _READ_SIZE)
+        except OSError:  # EIO: the shell closed the pty
+            data = b""
+        if not data:
+            raise ShellExitedError()
+        return data.decode("utf-8", errors="replace")
+
+    def _recover(self, sentinel: str, emit: Callable[[str], None]) -> bool:
+        """
+        Interrupt a command that timed out or was cancelled, keeping the shell if possible.
+
+        Sends Ctrl-C, then a fresh sync frame. Returns False if the shell did not come back
+        within INTERRUPT_GRACE_PERIOD, in which case the caller restarts it.
+        """
+        self._interrupted.clear()
+        try:
+            self._write("\x03")
+            sync = self._next_sentinel()
+            self._write(self._frame_line(":", sync))
+            # The interrupted command may or may not have printed its own sentinel line
+            stale = re.compile(r"\n?" + re.escape(sentinel) + r":-?\d+:.*\n")
+            output: List[str] = []
+            frame = self._read_frame(sync, time.monotonic() + INTERRUPT_GRACE_PERIOD, output.append)
+            text = stale.sub("", "".join(output))
+            if text.strip():  # the shell itself prints a bare newline on Ctrl-C
+                emit(text)
+        except (ShellExitedError, OSError):
+            return False
+        if frame is None:
+            return False
+        self.cwd = frame[1]
+        return True
+
+
+# One session per agent; dropped (and the shell killed) when the agent is garbage collected
+_sessions: "weakref.WeakKeyDictionary[Any, ShellSession]" = weakref.WeakKeyDictionary()
+_sessions_lock = threading.Lock()
+
+
+def get_shell_session(agent: Any) -> ShellSession:
+    """
+    Get the persistent shell session of an agent, starting it on first use.
+
+    The session is closed by agent.close().
+    """
+    with _sessions_lock:
+        session = _sessions.get(agent)
+        if session is None:
+            session = ShellSession(limits=agent.resource_limits)
+            _sessions[agent] = session
+            agent.add_close_hook(lambda: close_shell_session(agent))
+    return session
+
+
+def find_shell_session(agent: Any) -> Optional[ShellSession]:
+    """Get the persistent shell session of an agent without starting one."""
+    with _sessions_lock:
+        return _sessions.get(agent)
+
+
+def close_shell_session(agent: Any) -> None:
+    """Terminate the persistent shell session of an agent, if any."""
+    with _sessions_lock:
+        session = _sessions.pop(agent, None)
+    if session is not None:
+        session.close()
+        logger.info("Closed persistent shell session")
@@ -1,9 +1,15 @@
+import codecs
+import os
+import signal
 import subprocess
+import threading
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Protocol
 
 from ..base import BaseAgent
 from ..logger import get_logger
+from ..permission_rules import default_blocked_commands
+from ..sandbox import CommandSandbox
 
 # Define exported functions
 __all__ = ["run_terminal_command"]
@@ -11,6 +17,242 @@ __all__ = ["run_terminal_command"]
 # Initialize logger
 logger = get_logger(__name__)
 
+# Output retained per stream: the first OUTPUT_HEAD_CHARS and the last OUTPUT_TAIL_CHARS
+# characters are kept, everything in between is dropped so chatty commands stay bounded
+OUTPUT_HEAD_CHARS = 16 * 1024
+OUTPUT_TAIL_CHARS = 48 * 1024
+
+# Maximum number of bytes read from a pipe at once (and so the largest streamed chunk)
+OUTPUT_CHUNK_BYTES = 64 * 1024
+
+
+class _TextSink(Protocol):
+    """Where _read_stream puts decoded output (an _OutputBuffer or a job log)."""
+
+    def write(self, text: str) -> None:
+        ...
+
+
+class _OutputBuffer:
+    """
+    Bounded buffer for command output that keeps the head and the tail.
+
+    The head is filled first; once it is full, later output goes into a ring of
+    chunks holding at most tail_chars characters, and older tail chunks are dropped.
+    """
+
+    def __init__(self, head_chars: int = OUTPUT_HEAD_CHARS, tail_chars: int = OUTPUT_TAIL_CHARS):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self._head: List[str] = []
+        self._head_size = 0
+        self._tail: List[str] = []
+        self._tail_size = 0
+        self.dropped = 0
+
+    def write(self, text: str) -> None:
+        if self._head_size < self.head_chars:
+            room = self.head_chars - self._head_size
+            self._head.append(text[:room])
+            self._head_size += len(text[:room])
+            text = text[room:]
+        if not text:
+            return
+
+        self._tail.append(text)
+        self._tail_size += len(text)
+        while self._tail_size > self.tail_chars:
+            excess = self._tail_size - self.tail_chars
+            if len(self._tail[0]) <= excess:
+                self.dropped += len(self._tail[0])
+                self._tail_size -= len(self._tail.pop(0))
+            else:
+                self._tail[0] = self._tail[0][excess:]
+                self._tail_size -= excess
+                self.dropped += excess
+
+    def getvalue(self) -> str:
+        head = "".join(self._head)
+        tail = "".join(self._tail)
+        if not self.dropped:
+            return head + tail
+        return f"{head}\n... [{self.dropped} characters of output truncated] ...\n{tail}"
+
+
+def _read_stream(
+    pipe: Any,
+    buffer: _TextSink,
+    on_chunk: Optional[Callable[[str], None]] = None,
+) -> None:
+    """
+    Read a process pipe until EOF, decoding incrementally and forwarding each chunk.
+
+    Args:
+        pipe: Binary pipe of the process (stdout or stderr)
+        buffer: Sink retaining the output
+        on_chunk: Called with every decoded chunk as it arrives
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    fd = pipe.fileno()
+    try:
+        while True:
+            data = os.read(fd, OUTPUT_CHUNK_BYTES)
+            text = decoder.decode(data, final=not data)
+            if text:
+                buffer.write(text)
+                if on_chunk:
+                    on_chunk(text)
+            if not data:
+                break
+    except OSError as e:
+        logger.debug(f"Stopped reading command output: {str(e)}")
+    finally:
+        pipe.close()
+
+
+def _terminate_process(process: subprocess.Popen, grace_period: float = 5) -> None:
+    """
+    Terminate a command started by run_terminal_command, including its children.
+
+    Sends SIGTERM to the command's process group (the shell plus everything it
+    spawned), then SIGKILL if it is still alive after the grace period.
+
+    Args:
+        process: The process to terminate
+        grace_period: Seconds to wait after SIGTERM before killing
+    """
+    if process.poll() is not None:
+        return
+
+    def send(sig: int) -> None:
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, sig)
+            elif sig == signal.SIGTERM:
+                process.terminate()
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    send(signal.SIGTERM)
+    try:
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        logger.warning(f"Forcefully killing process {process.pid}")
+        send(signal.SIGKILL if os.name == "posix" else signal.SIGTERM)
+
+
+def _run_in_shell_session(command: str, timeout: float, agent: BaseAgent) -> Dict[str, Any]:
+    """
+    Run a command in the agent's persistent shell session.
+
+    Output is streamed as "tool_output" events and bounded like one-shot commands.
+    stderr is merged into stdout, as in a terminal.
+
+    Args:
+        command: The command to run (already approved)
+        timeout: Seconds before the command is interrupted
+        agent: The agent owning the shell session
+
+    Returns:
+        Dict in the same format as run_terminal_command, plus the shell's cwd
+    """
+    from .shell_session import get_shell_session
+
+    session = get_shell_session(agent)
+    buffer = _OutputBuffer()
+
+    def on_output(text: str) -> None:
+        buffer.write(text)
+        agent._emit_event("tool_output", {
+            "name": "run_terminal_command",
+            "command": command,
+            "stream": "stdout",
+            "data": text,
+        })
+
+    agent.add_cancel_hook(session.interrupt)
+    start_time = time.time()
+    try:
+        outcome = session.run(command, timeout, on_output)
+    finally:
+        agent.remove_cancel_hook(session.interrupt)
+    execution_time = time.time() - start_time
+
+    exit_code = outcome["exit_code"]
+    result: Dict[str, Any] = {
+        "command": command,
+        "exit_code": exit_code,
+        "stdout": buffer.getvalue(),
+        "stderr": "",
+        "execution_time": execution_time,
+        "timed_out": outcome["timed_out"],
+        "cwd": outcome["cwd"],
+        "shell_session": True,
+    }
+    if buffer.dropped:
+        result["truncated_chars"] = {"stdout": buffer.dropped}
+    if outcome["restarted"]:
+        result["shell_restarted"] = True
+
+    if outcome["interrupted"]:
+        result["error"] = "Command was cancelled"
+        result["cancelled"] = True
+        logger.warning(f"Command cancelled: {command}")
+    elif outcome["timed_out"]:
+        result["error"] = f"Command timed out after {timeout} seconds"
+        logger.warning(f"Command timed out: {command}")
+    elif exit_code != 0:
+        result["error"] = f"Command failed with exit code {exit_code}"
+        logger.warning(f"Command failed with exit code {exit_code}")
+    else:
+        logger.info(f"Command executed successfully in {execution_time:.2f}s with exit code {exit_code}")
+    if outcome["restarted"]:
+        logger.warning("Persistent shell was restarted; environment changes from earlier commands were lost")
+
+    return result
+
+
+def _command_cwd(agent: BaseAgent) -> str:
+    """The directory the agent's next command runs in."""
+    if agent.persistent_shell and os.name == "posix":
+        from .shell_session import find_shell_session
+
+        session = find_shell_session(agent)
+        if session is not None:
+            return session.cwd
+    return os.getcwd()
+
+
+def _start_background_job(command: str, agent: Optional[BaseAgent]) -> Dict[str, Any]:
+    """
+    Start a command as a managed background job of the agent.
+
+    The job's output goes to a rotating log file that can be read with job_output;
+    job_status and job_kill inspect and stop it. Jobs are killed when the agent is closed.
+    """
+    from .job_tools import get_job_manager
+
+    # The job manager does the backgrounding; a trailing & would detach the command from it
+    stripped = command.rstrip()
+    if stripped.endswith("&") and not stripped.endswith("&&"):
+        command = stripped[:-1].rstrip()
+
+    # Start in the persistent shell's working directory, if the agent has one
+    cwd = _command_cwd(agent) if agent else None
+    job = get_job_manager(agent).start(command, cwd=cwd, limits=agent.resource_limits if agent else None)
+    return {
+        "command": command,
+        "exit_code": 0,
+        "stdout": f"Command running in background as {job.job_id} (PID {job.process.pid}); "
+                  f"use job_output, job_status or job_kill with job_id '{job.job_id}'",
+        "stderr": "",
+        "job_id": job.job_id,
+        "pid": job.process.pid,
+        "output_file": job.log.path,
+    }
+
 
 def run_terminal_command(
     command: str,
@@ -41,15 +283,18 @@ def run_terminal_command(
         timeout = agent.default_tool_timeout if agent else 300
         logger.debug(f"Command options - background: {is_background}, require_approval: {require_user_approval}, timeout: {timeout}s")
 
-        # For safety, we'll add a check to prevent destructive commands
-        dangerous_commands = ["rm -rf", "sudo rm", "dd", "mkfs", "format", ":(){:|:&};:"]
-
-        for dangerous in dangerous_commands:
-            if dangerous in command:
-                logger.warning(f"Dangerous command detected: {dangerous} in '{command}'")
-                return {
-                    "error": f"Command '{command}' contains potentially dangerous operation '{dangerous}'. Execution aborted."
-                }
+        # For safety, refuse destructive commands (PermissionOptions.blocked_commands,
+        # matched per sub-command)
+        if agent:
+            dangerous = agent.permission_manager.blocked_command(command)
+        else:
+            rule = default_blocked_commands().find(command)
+            dangerous = rule.pattern if rule else None
+        if dangerous is not None:
+            logger.warning(f"Dangerous command detected: {dangerous} in '{command}'")
+            return {
+                "error": f"Command '{command}' contains potentially dangerous operation '{dangerous}'. Execution aborted."
+            }
 
         # Request permission if agent is provided
         if agent:
@@ -59,20 +304,42 @@ def run_terminal_command(
                 "is_background": is_background,
             }
 
-            # For testing - special handling for sudo command to ensure test passes
-            if "sudo" in command and agent.permission_manager.options.command_denylist and "sudo" in agent.permission_manager.options.command_denylist:
-                logger.warning(f"Command '{command}' contains 'sudo' which is in the denylist")
-                raise PermissionError(f"Permission denied to execute command: {command}")
-
             if not agent.request_permission("run_terminal_command", operation_details):
                 # Raise an exception when permission is denied
                 logger.warning(f"Permission denied to execute command: {command}")
                 raise PermissionError(f"Permission denied to execute command: {command}")
 
-        # If the command is to be run in the background, add & at the end
-        if is_background and not command.strip().endswith("&"):
-            command = f"{command} &"
-            logger.debug(f"Added background operator to command: {command}")
+            # The turn may have been cancelled while we were waiting for permission
+            if agent.is_cancelled:
+                return {"error": "Command not started: the request was cancelled"}
+
+        # Repeats of read-only commands (git status, ls, ...) are served from the agent's
+        # command cache while nothing they depend on has changed; any other command
+        # invalidates cached results, since it may have changed the workspace
+        read_only = False
+        cache_entry = None
+        original_command = command
+        if agent:
+            from .command_cache import get_command_cache, is_read_only_command
+            from .job_tools import has_running_jobs
+
+            cache = get_command_cache(agent) if agent.cache_read_only_commands else None
+            read_only = not is_background and (cache.is_cacheable(command) if cache else is_read_only_command(command))
+            # Running background jobs may change the workspace at any time
+            if cache is not None and read_only and not has_running_jobs(agent):
+                cwd = _command_cwd(agent)
+                fingerprint = cache.fingerprint(cwd, agent.workspace_generation)
+                cached = cache.get(command, cwd, fingerprint)
+                if cached is not None:
+                    return cached
+                cache_entry = (cache, cwd, fingerprint)
+
+        def finish(result: Dict[str, Any]) -> Dict[str, Any]:
+            if agent and not read_only:
+                agent.mark_workspace_changed()
+            if cache_entry is not None:
+                cache_entry[0].put(original_command, cache_entry[1], cache_entry[2], result)
+            return result
 
         # If this is a command that would require a pager, we'll append | cat
         pager_commands = ["less", "more", "git diff", "git show", "head", "tail"]
@@ -82,54 +349,100 @@ def run_terminal_command(
                     command = f"{command} | cat"
                     logger.debug(f"Added '| cat' to pager command: {command}")
 
-        # Add timeout command for non-background commands if available on system
-        if not is_background:
-            # Use timeout command on Unix-like systems
-            if subprocess.run("which timeout", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode == 0:
-                command = f"timeout {timeout} {command}"
-                logger.debug(f"Added timeout wrapper: {command}")
+        if is_background:
+            return finish(_start_background_job(command, agent))
+
+        if agent and agent.persistent_shell and os.name == "posix":
+            return finish(_run_in_shell_session(command, timeout, agent))
+
+        # No `timeout` wrapper: timeout(1) moves the command into its own process group,
+        # which would escape the group kill used on timeout and cancellation below.
+        # The timeout is enforced by wait() instead.
 
         logger.debug(f"Executing final command: {command}")
 
-        # Start the process
+        # Start the process in its own process group so it can be terminated together
+        # with its children on timeout or cancellation
+        # With resource limits configured, the command runs in its own cgroup or under
+        # setrlimit(); its CPU time and peak RSS are measured either way
+        sandbox = CommandSandbox(agent.resource_limits if agent else None)
         start_time = time.time()
-        process = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True
-        )
+        try:
+            args, shell = sandbox.wrap(command, shell=True)
+            process = subprocess.Popen(
+                args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell,
+                start_new_session=True,
+            )
+        except BaseException:
+            sandbox.finish()
+            raise
 
-        # For background processes, don't wait
-        if is_background:
-            stdout = f"Command running in background with PID {process.pid}"
-            stderr = ""
-            exit_code = 0
-        else:
-            # Wait for process to complete with timeout
-            try:
-                stdout, stderr = process.communicate(timeout=timeout)
-                exit_code = process.returncode
-            except subprocess.TimeoutExpired:
-                # Kill the process if it exceeds timeout
-                logger.warning(f"Command timed out after {timeout} seconds: {command}")
-
-                # Try gentle termination first
-                process.terminate()
-                try:
-                    # Give it a short grace period to terminate
-                    process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    # If still running after grace period, force kill
-                    logger.warning(f"Forcefully killing command: {command}")
-                    process.kill()
-
-                # Get any output that was produced before timeout
-                stdout, stderr = process.communicate()
-                exit_code = -1  # Special code for timeout
-                stderr += f"\nCommand timed out after {timeout} seconds"
+        cancelled = False
+        # Output is read as it arrives: each chunk is streamed to the agent's event
+        # callback ("tool_output" events) and retained in a bounded head + tail buffer
+        buffers = {"stdout": _OutputBuffer(), "stderr": _OutputBuffer()}
+
+        def make_forwarder(stream: str) -> Optional[Callable[[str], None]]:
+            if not agent:
+                return None
+            return lambda text: agent._emit_event("tool_output", {
+                "name": "run_terminal_command",
+                "command": command,
+                "stream": stream,
+                "data": text,
+            })
+
+        readers = [
+            threading.Thread(
+                target=_read_stream,
+                args=(pipe, buffers[stream], make_forwarder(stream)),
+                name=f"command-{stream}-{process.pid}",
+                daemon=True,
+            )
+            for stream, pipe in (("stdout", process.stdout), ("stderr", process.stderr))
+        ]
+        for reader in readers:
+            reader.start()
+
+        # Terminate the command if the agent's turn is cancelled while it runs
+        def cancel_hook() -> None:
+            logger.info(f"Cancelling running command: {command}")
+            _terminate_process(process, grace_period=2)
+
+        if agent:
+            agent.add_cancel_hook(cancel_hook)
+
+        # Wait for process to complete with timeout
+        timed_out = False
+        try:
+            exit_code = sandbox.wait(process, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # Kill the process if it exceeds timeout
+            logger.warning(f"Command timed out after {timeout} seconds: {command}")
+            _terminate_process(process)
+            timed_out = True
+            exit_code = -1  # Special code for timeout
+        finally:
+            if agent:
+                agent.remove_cancel_hook(cancel_hook)
+                cancelled = agent.is_cancelled
+
+        # Collect the output produced so far; a detached grandchild may still hold
+        # the pipes open, so don't wait for EOF forever (in a cgroup, finish() kills it)
+        sandbox.finish()
+        for reader in readers:
+            reader.join(timeout=5)
+
+        stdout = buffers["stdout"].getvalue()
+        stderr = buffers["stderr"].getvalue()
+        if timed_out:
+            stderr += f"\nCommand timed out after {timeout} seconds"
+        truncated = {stream: buffer.dropped for stream, buffer in buffers.items() if buffer.dropped}
 
         execution_time = time.time() - start_time
 
         # Prepare the output
-        result = {
+        result: Dict[str, Any] = {
             "command": command,
             "exit_code": exit_code,
             "stdout": stdout,
@@ -137,8 +450,18 @@ def run_terminal_command(
             "execution_time": execution_time,
             "timed_out": exit_code == -1
         }
+        if truncated:
+            result["truncated_chars"] = truncated
+        result["resource_usage"] = sandbox.usage()
+        if "limit_exceeded" in result["resource_usage"]:
+            stderr += f"\nCommand exceeded its {result['resource_usage']['limit_exceeded']} limit"
+            result["stderr"] = stderr
 
-        if exit_code != 0 and exit_code != -1:
+        if cancelled:
+            result["error"] = "Command was cancelled"
+            result["cancelled"] = True
+            logger.warning(f"Command cancelled: {command}")
+        elif exit_code != 0 and exit_code != -1:
             result["error"] = f"Command failed with exit code {exit_code}"
             logger.warning(f"Command failed with exit code {exit_code}")
             if stderr:
@@ -149,7 +472,7 @@ def run_terminal_command(
         else:
             logger.info(f"Command executed successfully in {execution_time:.2f}s with exit code {exit_code}")
 
-        return result
+        return finish(result)
 
     except Exception as e:
         logger.error(f"Error executing terminal command: {str(e)}")
@@ -0,0 +1,476 @@
+"""
+Tracing module for cursor-agent.
+
+Records spans for agent turns, model requests, tool calls, permission waits and
+web pushes. Spans follow the OpenTelemetry data model (trace and span IDs,
+parent links, attributes, events and a status) without depending on the
+OpenTelemetry SDK, and finished spans are exported in the OTLP/JSON format, so
+the file can be loaded by any OTLP-capable backend or collector.
+
+The current span is kept in a context variable, so spans started inside it,
+also in other asyncio tasks, become its children. Code handing work to a thread
+pool should run it in a copy of the context (contextvars.copy_context().run).
+
+Configured from the environment or with configure_tracing():
+
+- CURSOR_AGENT_TRACING: "0" disables tracing (enabled by default)
+- CURSOR_AGENT_TRACE_FILE: file finished spans are appended to, one OTLP/JSON
+  ExportTraceServiceRequest per line (default: cursor_agent_traces.jsonl in
+  the system temp directory)
+
+Usage:
+
+    with start_span("tool.call", {"tool.name": name}) as span:
+        result = run_tool()
+        span.set_attribute("tool.result_size", len(result))
+"""
+
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from .logger import get_logger
+
+# Initialize logger
+logger = get_logger(__name__)
+
+TRACING_ENV_VAR = "CURSOR_AGENT_TRACING"
+TRACE_FILE_ENV_VAR = "CURSOR_AGENT_TRACE_FILE"
+
+DEFAULT_TRACE_FILE = os.path.join(tempfile.gettempdir(), "cursor_agent_traces.jsonl")
+
+# Name of the instrumentation scope and of the service in exported resources
+SCOPE_NAME = "cursor_agent_tools"
+SERVICE_NAME = "cursor-agent"
+
+# OTLP span kinds and status codes
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3, "producer": 4, "consumer": 5}
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_TRACEPARENT_PATTERN = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def _random_id(length: int) -> str:
+    """A random non-zero hex ID of the given number of bytes."""
+    while True:
+        value = os.urandom(length).hex()
+        if value.strip("0"):
+            return value
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Parse a W3C traceparent header.
+
+    Args:
+        header: Header value, e.g. "00-<32 hex trace id>-<16 hex span id>-01"
+
+    Returns:
+        (trace_id, parent_span_id), or None if the header is missing or invalid
+    """
+    if not header:
+        return None
+    match = _TRACEPARENT_PATTERN.match(header.strip().lower())
+    if match is None:
+        return None
+    trace_id, span_id = match.groups()
+    if not trace_id.strip("0") or not span_id.strip("0"):
+        return None
+    return trace_id, span_id
+
+
+class Span:
+    """
+    A timed operation within a trace.
+
+    Spans are created with start_span(), which also ends and exports them.
+    """
+
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_span_id", "kind", "attributes", "events",
+        "status_code", "status_message", "start_time_ns", "end_time_ns", "_tracer",
+    )
+
+    recording = True
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str],
+        kind: str = "internal",
+        attributes: Optional[Dict[str, Any]] = None,
+        tracer: Optional["Tracer"] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes: Dict[str, Any] = {}
+        self.events: List[Tuple[int, str, Dict[str, Any]]] = []
+        self.status_code = STATUS_UNSET
+        self.status_message = ""
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+        self._tracer = tracer
+        if attributes:
+            self.set_attributes(attributes)
+
+    @property
+    def traceparent(self) -> str:
+        """The W3C traceparent header identifying this span."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Set an attribute; None values are ignored."""
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        """Set several attributes; None values are ignored."""
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> None:
+        """Record a point-in-time event on the span."""
+        self.events.append((time.time_ns(), name, attributes or {}))
+
+    def set_status(self, ok: bool, message: str = "") -> None:
+        """Mark the span as successful or failed."""
+        self.status_code = STATUS_OK if ok else STATUS_ERROR
+        self.status_message = message
+
+    def record_exception(self, exception: BaseException) -> None:
+        """Record an exception as an event and mark the span as failed."""
+        self.add_event("exception", {
+            "exception.type": type(exception).__name__,
+            "exception.message": str(exception),
+        })
+        self.set_status(False, str(exception) or type(exception).__name__)
+
+    def end(self) -> None:
+        """End the span and hand it to the exporter; later calls do nothing."""
+        if self.end_time_ns is not None:
+            return
+        self.end_time_ns = time.time_ns()
+        if self._tracer is not None:
+            self._tracer.export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in the OTLP/JSON encoding."""
+        data: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns or self.start_time_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status_code},
+        }
+        if self.parent_span_id:
+            data["parentSpanId"] = self.parent_span_id
+        if self.status_message:
+            data["status"]["message"] = self.status_message
+        if self.events:
+            data["events"] = [
+                {"timeUnixNano": str(timestamp), "name": name, "attributes": _otlp_attributes(attributes)}
+                for timestamp, name, attributes in self.events
+            ]
+        return data
+
+
+class _NonRecordingSpan(Span):
+    """The span handed out while tracing is disabled; it records nothing."""
+
+    __slots__ = ()
+
+    recording = False
+
+    def __init__(self) -> None:
+        super().__init__("", "", None)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> None:
+        pass
+
+    def set_status(self, ok: bool, message: str = "") -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+_NON_RECORDING_SPAN = _NonRecordingSpan()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """Encode an attribute value as an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # 64-bit integers are strings in OTLP/JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+class OtlpJsonFileExporter:
+    """
+    Exports finished spans to a file in the OTLP/JSON format.
+
+    Spans are queued and written in batches by a background thread, so ending a
+    span never waits for file I/O. Each batch is one line holding an
+    ExportTraceServiceRequest. If the queue is full, spans are dropped (and
+    counted) rather than blocking the caller.
+
+    Args:
+        path: File the spans are appended to
+        max_batch_size: Maximum number of spans written in one line
+        flush_interval: Seconds queued spans may wait before they are written
+        max_queue_size: Maximum number of spans waiting to be written
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_batch_size: int = 256,
+        flush_interval: float = 2.0,
+        max_queue_size: int = 10000,
+    ):
+        self.path = path
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: "queue.Queue[Union[Span, threading.Event, None]]" = queue.Queue(max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._resource = {"attributes": _otlp_attributes({
+            "service.name": SERVICE_NAME,
+            "process.pid": os.getpid(),
+        })}
+
+    def export(self, span: Span) -> None:
+        """Queue a finished span for writing."""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """
+        Write all queued spans.
+
+        Returns:
+            True if they were written within the timeout
+        """
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def shutdown(self, timeout: Optional[float] = 5.0) -> None:
+        """Write all queued spans and stop the background thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cursor-agent-trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        batch: List[Span] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = False  # type: ignore[assignment]
+            if isinstance(item, Span):
+                batch.append(item)
+                if len(batch) < self.max_batch_size:
+                    continue
+            # A full batch, a flush, the interval elapsing or shutdown: write what we have
+            if batch:
+                self._write(batch)
+                batch = []
+            deadline = time.monotonic() + self.flush_interval
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                return
+
+    def _write(self, spans: List[Span]) -> None:
+        request = {"resourceSpans": [{
+            "resource": self._resource,
+            "scopeSpans": [{"scope": {"name": SCOPE_NAME}, "spans": [span.to_otlp() for span in spans]}],
+        }]}
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(request, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"Failed to write {len(spans)} spans to {self.path}: {e}")
+
+
+class Tracer:
+    """
+    Creates spans and hands finished ones to an exporter.
+
+    Args:
+        exporter: Exporter for finished spans; None disables tracing
+    """
+
+    def __init__(self, exporter: Optional[OtlpJsonFileExporter] = None):
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def export(self, span: Span) -> None:
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    def create_span(
+        self,
+        name: str,
+        attributes: Optional[Dict[str, Any]] = None,
+        parent: Union[Span, str, None] = None,
+        kind: str = "internal",
+    ) -> Span:
+        """Create a span under parent (a span or a traceparent header) or else the current span."""
+        if not self.enabled:
+            return _NON_RECORDING_SPAN
+        if parent is None:
+            parent = _current_span.get()
+        if isinstance(parent, Span) and parent.recording:
+            return Span(name, parent.trace_id, parent.span_id, kind, attributes, self)
+        context = parse_traceparent(parent) if isinstance(parent, str) else None
+        if context is not None:
+            return Span(name, context[0], context[1], kind, attributes, self)
+        return Span(name, _random_id(16), None, kind, attributes, self)
+
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("cursor_agent_current_span", default=None)
+_tracer: Optional[Tracer] = None
+
+
+def configure_tracing(enabled: Optional[bool] = None, path: Optional[str] = None) -> Tracer:
+    """
+    (Re)configure tracing, replacing the current exporter.
+
+    Args:
+        enabled: Whether to record spans (default: CURSOR_AGENT_TRACING, enabled unless "0")
+        path: File spans are exported to (default: CURSOR_AGENT_TRACE_FILE or DEFAULT_TRACE_FILE)
+
+    Returns:
+        The new tracer
+    """
+    global _tracer
+    if enabled is None:
+        enabled = os.getenv(TRACING_ENV_VAR, "1").strip().lower() not in ("0", "false", "no", "off")
+    exporter = None
+    if enabled:
+        exporter = OtlpJsonFileExporter(path or os.getenv(TRACE_FILE_ENV_VAR) or DEFAULT_TRACE_FILE)
+
+    previous, _tracer = _tracer, Tracer(exporter)
+    if previous is not None and previous.exporter is not None:
+        previous.exporter.shutdown()
+    return _tracer
+
+
+def get_tracer() -> Tracer:
+    """Get the tracer, configuring it from the environment on first use."""
+    if _tracer is None:
+        return configure_tracing()
+    return _tracer
+
+
+def shutdown_tracing() -> None:
+    """Write all spans that have not been exported yet."""
+    if _tracer is not None and _tracer.exporter is not None:
+        _tracer.exporter.shutdown()
+
+
+atexit.register(shutdown_tracing)
+
+
+def current_span() -> Optional[Span]:
+    """The span the calling code runs in, if any."""
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    """The ID of the trace the calling code runs in, if any."""
+    span = _current_span.get()
+    return span.trace_id if span is not None and span.recording else None
+
+
+@contextlib.contextmanager
+def start_span(
+    name: str,
+    attributes: Optional[Dict[str, Any]] = None,
+    parent: Union[Span, str, None] = None,
+    kind: str = "internal",
+) -> Iterator[Span]:
+    """
+    Run a block in a new span, which becomes the current span.
+
+    An exception leaving the block is recorded on the span before it is re-raised.
+
+    Args:
+        name: Span name, e.g. "tool.call"
+        attributes: Initial attributes
+        parent: Parent span or W3C traceparent header (default: the current span)
+        kind: "internal", "server", "client", "producer" or "consumer"
+
+    Yields:
+        The span, for adding attributes
+    """
+    span = get_tracer().create_span(name, attributes, parent, kind)
+    if not span.recording:
+        yield span
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_exception(e)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Ended in another context than it started in (e.g. an abandoned generator)
+            pass
+        span.end()
@@ -0,0 +1,285 @@
+"""
+Token, latency and cost accounting for agents.
+
+Every model request an agent makes is recorded by its UsageTracker, which keeps
+the totals of the current turn and of the whole session, and checks them
+against an optional UsageBudget so runaway sessions can be stopped.
+
+Token counts are normalized across providers:
+
+- input_tokens: input tokens that were neither read from nor written to a cache
+- cache_read_tokens: input tokens read from the provider's prompt cache
+- cache_creation_tokens: input tokens written to the prompt cache (Anthropic)
+- output_tokens: generated tokens
+
+Costs are estimated from MODEL_PRICES (USD per million tokens). Requests to
+models without a known price have a cost of None; totals leave them out and
+count them in unpriced_calls. Prices can be added or overridden with
+set_model_price().
+"""
+
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Mapping, Optional, TypedDict
+
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_creation_tokens")
+
+
+class AgentUsage(TypedDict):
+    """Totals of a turn or a session"""
+    api_calls: int
+    input_tokens: int
+    output_tokens: int
+    cache_read_tokens: int
+    cache_creation_tokens: int
+    latency: float
+    cost: float
+    unpriced_calls: int
+
+
+class ApiCallUsage(TypedDict):
+    """Usage of a single model request"""
+    provider: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+    cache_read_tokens: int
+    cache_creation_tokens: int
+    latency: float
+    cost: Optional[float]
+
+
+class UsageReport(TypedDict):
+    """Usage attached to an agent response: the turn, its requests and the session so far"""
+    turn: AgentUsage
+    calls: List[ApiCallUsage]
+    session: AgentUsage
+    budget: Optional[Dict[str, Optional[float]]]
+    budget_exceeded: Optional[str]
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """
+    Price of a model in USD per million tokens.
+
+    Cache prices default to the input price when the provider has no separate one.
+    """
+    input: float
+    output: float
+    cache_read: Optional[float] = None
+    cache_creation: Optional[float] = None
+
+    def cost(self, counts: Dict[str, int]) -> float:
+        cache_read = self.input if self.cache_read is None else self.cache_read
+        cache_creation = self.input if self.cache_creation is None else self.cache_creation
+        return (
+            counts.get("input_tokens", 0) * self.input
+            + counts.get("output_tokens", 0) * self.output
+            + counts.get("cache_read_tokens", 0) * cache_read
+            + counts.get("cache_creation_tokens", 0) * cache_creation
+        ) / 1_000_000
+
+
+# Published list prices by model name prefix; the longest matching prefix wins
+MODEL_PRICES: Dict[str, ModelPrice] = {
+    "claude-3-haiku": ModelPrice(0.25, 1.25, 0.03, 0.30),
+    "claude-3-5-haiku": ModelPrice(0.80, 4.0, 0.08, 1.0),
+    "claude-3-5-sonnet": ModelPrice(3.0, 15.0, 0.30, 3.75),
+    "claude-3-7-sonnet": ModelPrice(3.0, 15.0, 0.30, 3.75),
+    "claude-sonnet-4": ModelPrice(3.0, 15.0, 0.30, 3.75),
+    "claude-3-opus": ModelPrice(15.0, 75.0, 1.50, 18.75),
+    "claude-opus-4": ModelPrice(15.0, 75.0, 1.50, 18.75),
+    "gpt-4o": ModelPrice(2.50, 10.0, 1.25),
+    "gpt-4o-mini": ModelPrice(0.15, 0.60, 0.075),
+    "gpt-4.1": ModelPrice(2.0, 8.0, 0.50),
+    "gpt-4.1-mini": ModelPrice(0.40, 1.60, 0.10),
+    "gpt-4.1-nano": ModelPrice(0.10, 0.40, 0.025),
+    "o3-mini": ModelPrice(1.10, 4.40, 0.55),
+    "qwen-turbo": ModelPrice(0.05, 0.20),
+    "qwen-plus": ModelPrice(0.40, 1.20),
+    "qwen-max": ModelPrice(1.60, 6.40),
+}
+
+# Providers whose models cost nothing per token (locally hosted)
+FREE_PROVIDERS = frozenset({"ollama"})
+
+_prices_lock = threading.Lock()
+
+
+def set_model_price(prefix: str, price: ModelPrice) -> None:
+    """
+    Add or override the price of the models whose name starts with prefix.
+
+    Args:
+        prefix: Model name prefix, e.g. "gpt-4o" or a fine-tuned model's full name
+        price: The price in USD per million tokens
+    """
+    with _prices_lock:
+        MODEL_PRICES[prefix.lower()] = price
+
+
+def model_price(provider: str, model: str) -> Optional[ModelPrice]:
+    """The price of a model, or None if it is unknown."""
+    if provider in FREE_PROVIDERS:
+        return ModelPrice(0.0, 0.0)
+    name = (model or "").lower()
+    with _prices_lock:
+        matches = [prefix for prefix in MODEL_PRICES if name.startswith(prefix)]
+        return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def empty_usage() -> AgentUsage:
+    """Zero totals."""
+    return {
+        "api_calls": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cache_read_tokens": 0,
+        "cache_creation_tokens": 0,
+        "latency": 0.0,
+        "cost": 0.0,
+        "unpriced_calls": 0,
+    }
+
+
+def total_tokens(usage: Mapping[str, Any]) -> int:
+    """All input, cache and output tokens of a usage record."""
+    return sum(usage.get(field, 0) for field in TOKEN_FIELDS)
+
+
+class BudgetExceededError(Exception):
+    """Raised when an agent's session has used up its usage budget."""
+
+
+@dataclass
+class UsageBudget:
+    """
+    Limits on what a session may use; None means no limit.
+
+    Args:
+        max_tokens: Total input, cache and output tokens
+        max_cost: Estimated cost in USD (requests to models without a known price are not counted)
+        max_seconds: Total time spent waiting for model requests
+    """
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    max_seconds: Optional[float] = None
+
+    def exceeded(self, usage: AgentUsage) -> Optional[str]:
+        """Why the usage is over budget, or None if it is within it."""
+        if self.max_tokens is not None and total_tokens(usage) >= self.max_tokens:
+            return f"token budget of {self.max_tokens} exhausted ({total_tokens(usage)} used)"
+        if self.max_cost is not None and usage["cost"] >= self.max_cost:
+            return f"cost budget of ${self.max_cost:.4f} exhausted (${usage['cost']:.4f} used)"
+        if self.max_seconds is not None and usage["latency"] >= self.max_seconds:
+            return f"time budget of {self.max_seconds:.1f}s exhausted ({usage['latency']:.1f}s used)"
+        return None
+
+    def remaining(self, usage: AgentUsage) -> Dict[str, Optional[float]]:
+        """What is left of each limit (None for no limit)."""
+        return {
+            "tokens": None if self.max_tokens is None else max(self.max_tokens - total_tokens(usage), 0),
+            "cost": None if self.max_cost is None else max(self.max_cost - usage["cost"], 0.0),
+            "seconds": None if self.max_seconds is None else max(self.max_seconds - usage["latency"], 0.0),
+        }
+
+    def to_dict(self) -> Dict[str, Optional[float]]:
+        return asdict(self)
+
+
+class UsageTracker:
+    """
+    Accumulates the usage of an agent's model requests per turn and per session.
+
+    Args:
+        budget: Optional limits for the session
+    """
+
+    def __init__(self, budget: Optional[UsageBudget] = None):
+        self.budget = budget
+        self._lock = threading.Lock()
+        self.session: AgentUsage = empty_usage()
+        self.turn: AgentUsage = empty_usage()
+        self.turn_calls: List[ApiCallUsage] = []
+
+    def begin_turn(self) -> None:
+        """Start counting a new turn."""
+        with self._lock:
+            self.turn = empty_usage()
+            self.turn_calls = []
+
+    def record(self, provider: str, model: str, counts: Dict[str, int], latency: float) -> ApiCallUsage:
+        """
+        Record a model request.
+
+        Args:
+            provider: Provider name, e.g. "claude"
+            model: Model name
+            counts: Token counts by TOKEN_FIELDS name; missing ones count as 0
+            latency: Seconds the request took
+
+        Returns:
+            The request's usage record
+        """
+        price = model_price(provider, model)
+        call: ApiCallUsage = {
+            "provider": provider,
+            "model": model,
+            "input_tokens": counts.get("input_tokens", 0),
+            "output_tokens": counts.get("output_tokens", 0),
+            "cache_read_tokens": counts.get("cache_read_tokens", 0),
+            "cache_creation_tokens": counts.get("cache_creation_tokens", 0),
+            "latency": latency,
+            "cost": price.cost(counts) if price is not None else None,
+        }
+        with self._lock:
+            self.turn_calls.append(call)
+            for usage in (self.turn, self.session):
+                _add_call(usage, call)
+        return call
+
+    def exceeded(self) -> Optional[str]:
+        """Why the session is over budget, or None."""
+        if self.budget is None:
+            return None
+        with self._lock:
+            return self.budget.exceeded(self.session)
+
+    def check_budget(self) -> None:
+        """
+        Raises:
+            BudgetExceededError: If the session has used up its budget
+        """
+        reason = self.exceeded()
+        if reason is not None:
+            raise BudgetExceededError(f"Usage budget exceeded: {reason}")
+
+    def report(self) -> UsageReport:
+        """The usage of the current turn and of the session."""
+        with self._lock:
+            return {
+                "turn": dict(self.turn),  # type: ignore[typeddict-item]
+                "calls": list(self.turn_calls),
+                "session": dict(self.session),  # type: ignore[typeddict-item]
+                "budget": self.budget.to_dict() if self.budget is not None else None,
+                "budget_exceeded": self.budget.exceeded(self.session) if self.budget is not None else None,
+            }
+
+    def reset(self) -> None:
+        """Forget all recorded usage."""
+        with self._lock:
+            self.session = empty_usage()
+            self.turn = empty_usage()
+            self.turn_calls = []
+
+
+def _add_call(usage: AgentUsage, call: ApiCallUsage) -> None:
+    usage["api_calls"] += 1
+    for field in TOKEN_FIELDS:
+        usage[field] += call[field]  # type: ignore[literal-required]
+    usage["latency"] += call["latency"]
+    if call["cost"] is None:
+        usage["unpriced_calls"] += 1
+    else:
+        usage["cost"] += call["cost"]
@@ -69,6 +69,7 @@ setup(
         "dev": [
             "pytest>=7.0.0",
             "pytest-cov>=4.0.0",
+            "pytest-benchmark>=4.0.0",
             "black>=23.0.0",
             "isort>=5.12.0",
             "flake8>=6.0.0",
@@ -0,0 +1,125 @@
+"""
+Tests for the admission control of the web backend.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+# The web backend is not a package; its modules import each other by name
+web_backend_dir = str(Path(__file__).parent.parent / "web_backend")
+if web_backend_dir not in sys.path:
+    sys.path.insert(0, web_backend_dir)
+
+from admission import AdmissionController, AdmissionRejected, tenant_key  # noqa: E402
+from cursor_agent_tools.metrics import REGISTRY  # noqa: E402
+
+
+def test_session_and_tenant_limits() -> None:
+    async def main() -> Any:
+        controller = AdmissionController(global_limit=0, session_limit=1, tenant_limit=2)
+        first = await controller.acquire("s1", "t1")
+        with pytest.raises(AdmissionRejected) as session_rejection:
+            await controller.acquire("s1", "t1")
+        second = await controller.acquire("s2", "t1")
+        with pytest.raises(AdmissionRejected) as tenant_rejection:
+            await controller.acquire("s3", "t1")
+        # Other tenants are not affected
+        other = await controller.acquire("s3", "t2")
+        first.release()
+        first.release()
+        again = await controller.acquire("s1", "t1")
+        for ticket in (second, other, again):
+            ticket.release()
+        return session_rejection.value, tenant_rejection.value, controller.stats()
+
+    session_rejection, tenant_rejection, stats = asyncio.run(main())
+
+    assert (session_rejection.reason, tenant_rejection.reason) == ("session_limit", "tenant_limit")
+    assert session_rejection.retry_after >= 1
+    assert stats["rejected"] == {"session_limit": 1, "tenant_limit": 1}
+    assert (stats["admitted"], stats["active_sessions"], stats["active_tenants"]) == (4, 0, 0)
+
+
+def test_global_limit_hands_slots_to_waiters_in_order() -> None:
+    async def main() -> Any:
+        controller = AdmissionController(global_limit=1, queue_size=3, session_limit=0, tenant_limit=0)
+        order: List[str] = []
+        holder = await controller.acquire("s0", "t")
+
+        async def wait(name: str) -> None:
+            async with controller.admit(name, "t"):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        waiters = [asyncio.ensure_future(wait(f"s{i}")) for i in range(1, 4)]
+        await asyncio.sleep(0.05)
+        queued = controller.stats()["queued"]
+        holder.release()
+        await asyncio.gather(*waiters)
+        return order, queued, controller.stats()
+
+    order, queued, stats = asyncio.run(main())
+
+    assert queued == 3
+    assert order == ["s1", "s2", "s3"]
+    assert (stats["in_flight"], stats["queued"], stats["admitted"]) == (0, 0, 4)
+    assert stats["queue_wait"]["count"] == 4 and stats["queue_wait"]["max_ms"] >= 40
+
+
+def test_full_queue_and_queue_timeout_are_rejected_with_retry_after() -> None:
+    async def main() -> Any:
+        controller = AdmissionController(global_limit=1, queue_size=1, queue_timeout=0.1,
+                                         session_limit=0, tenant_limit=0)
+        holder = await controller.acquire("s0", "t")
+        queued = asyncio.ensure_future(controller.acquire("s1", "t"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as full:
+            await controller.acquire("s2", "t")
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await queued
+        holder.release()
+        return full.value, timed_out.value, controller.stats()
+
+    full, timed_out, stats = asyncio.run(main())
+
+    assert (full.reason, timed_out.reason) == ("queue_full", "queue_timeout")
+    assert 1 <= full.retry_after <= 60 and 1 <= timed_out.retry_after <= 60
+    assert stats["rejected"] == {"queue_full": 1, "queue_timeout": 1}
+    # The timed-out request gave back its session and tenant counts
+    assert (stats["in_flight"], stats["queued"], stats["active_sessions"]) == (0, 0, 0)
+    # Rejections and queue waits are exported to /metrics too
+    rendered = REGISTRY.render()
+    assert 'cursor_agent_admission_rejected_total{reason="queue_timeout"}' in rendered
+    assert 'cursor_agent_admission_queue_wait_seconds_bucket{le="0.01"}' in rendered
+
+
+def test_cancelled_waiter_does_not_leak_the_slot() -> None:
+    async def main() -> Any:
+        controller = AdmissionController(global_limit=1, session_limit=0, tenant_limit=0)
+        holder = await controller.acquire("s0", "t")
+        waiter = asyncio.ensure_future(controller.acquire("s1", "t"))
+        await asyncio.sleep(0.01)
+        # The slot is handed over and the waiter is cancelled before it runs
+        holder.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        ticket = await asyncio.wait_for(controller.acquire("s2", "t"), 1)
+        ticket.release()
+        return controller.stats()
+
+    stats = asyncio.run(main())
+
+    assert (stats["in_flight"], stats["queued"], stats["active_sessions"]) == (0, 0, 0)
+
+
+def test_tenant_key() -> None:
+    by_key = tenant_key({"x-api-key": "secret"}, "10.0.0.1")
+    assert by_key.startswith("key:") and "secret" not in by_key
+    assert tenant_key({"authorization": "Bearer secret"}, "10.0.0.2") == by_key
+    assert tenant_key({}, "10.0.0.1") == "ip:10.0.0.1"
+    assert tenant_key({}, None) == "ip:unknown"
@@ -0,0 +1,176 @@
+"""
+Tests for the agent worker pool of the web backend.
+
+The workers are real processes; they create FakeAgent instances instead of
+model-backed agents.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+
+# The web backend is not a package; its modules import each other by name
+web_backend_dir = str(Path(__file__).parent.parent / "web_backend")
+if web_backend_dir not in sys.path:
+    sys.path.insert(0, web_backend_dir)
+
+import agent_workers  # noqa: E402
+from agent_workers import AgentWorkerPool, WorkerCallError  # noqa: E402
+from cursor_agent_tools.permissions import PermissionRequest, PermissionStatus  # noqa: E402
+
+
+class FakeAgent:
+    """Stands in for an agent in the worker processes; the message picks the behavior."""
+
+    def __init__(self, **kwargs: Any):
+        self.kwargs = kwargs
+        self.event_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None
+
+    def register_default_tools(self) -> None:
+        pass
+
+    def set_event_callback(self, callback: Callable[[str, Dict[str, Any]], None]) -> None:
+        self.event_callback = callback
+
+    def set_usage_budget(self, budget: Any) -> None:
+        pass
+
+    def cancel(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+    async def chat(self, message: str, user_info: Optional[Dict[str, Any]] = None) -> Any:
+        if message == "crash":
+            # Give the queue's feeder thread time to send "started" before the process dies
+            time.sleep(0.2)
+            os._exit(1)
+        if message == "hang":
+            await asyncio.sleep(60)
+        if self.event_callback is not None:
+            self.event_callback("thinking", {"message": message})
+        return {"message": f"echo: {message}", "pid": os.getpid(), "name": self.kwargs.get("name")}
+
+
+def make_fake_agent(**kwargs: Any) -> FakeAgent:
+    kwargs.pop("permission_callback", None)
+    return FakeAgent(**kwargs)
+
+
+def deny(request: PermissionRequest) -> PermissionStatus:
+    return PermissionStatus.DENIED
+
+
+async def wait_for(condition: Callable[[], bool], timeout: float = 30.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached in time"
+        await asyncio.sleep(0.05)
+
+
+def run_with_pool(test: Callable[[AgentWorkerPool], Any], num_workers: int = 1) -> Any:
+    async def main() -> Any:
+        pool = AgentWorkerPool(num_workers, max_concurrency=2, agent_factory=make_fake_agent)
+        pool.start()
+        try:
+            return await test(pool)
+        finally:
+            pool.stop()
+
+    return asyncio.run(main())
+
+
+def test_call_round_trip() -> None:
+    events: List[Any] = []
+
+    async def test(pool: AgentWorkerPool) -> Any:
+        agents = [
+            pool.create_session(f"s{i}", {"name": f"agent {i}"}, None, deny,
+                                lambda event_type, data: events.append((event_type, data)))
+            for i in range(2)
+        ]
+        results = await asyncio.gather(*(agent.chat(f"hi {i}") for i, agent in enumerate(agents)))
+        await wait_for(lambda: len(events) == 2)
+        with pytest.raises(WorkerCallError):
+            await pool.call("missing", "chat", {"message": "hi"})
+        return results, pool.stats()
+
+    results, stats = run_with_pool(test, num_workers=2)
+
+    assert [(result["message"], result["name"]) for result in results] == [("echo: hi 0", "agent 0"),
+                                                                           ("echo: hi 1", "agent 1")]
+    # New sessions go to the worker with the fewest sessions
+    assert results[0]["pid"] != results[1]["pid"] and os.getpid() not in (results[0]["pid"], results[1]["pid"])
+    assert sorted(data["message"] for _, data in events) == ["hi 0", "hi 1"]
+    assert [worker["completed"] for worker in stats["workers"]] == [1, 1]
+    assert stats["queued"] == stats["running"] == 0
+
+
+def test_cancel_stops_the_call_in_the_worker() -> None:
+    async def test(pool: AgentWorkerPool) -> Any:
+        agent = pool.create_session("s", {}, None, deny, lambda event_type, data: None)
+        call = asyncio.ensure_future(agent.chat("hang"))
+        await wait_for(lambda: pool.stats()["running"] == 1)
+        assert agent.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        # The session still works after the cancellation
+        result = await agent.chat("again")
+        return result, pool.stats()
+
+    result, stats = run_with_pool(test)
+
+    assert result["message"] == "echo: again"
+    assert (stats["workers"][0]["cancelled"], stats["workers"][0]["completed"]) == (1, 1)
+    assert stats["running"] == 0
+
+
+def test_crashed_worker_is_restarted_with_its_sessions() -> None:
+    async def test(pool: AgentWorkerPool) -> Any:
+        agent = pool.create_session("s", {"name": "survivor"}, None, deny, lambda event_type, data: None)
+        first = await agent.chat("before")
+        with pytest.raises(WorkerCallError, match="异常退出"):
+            await agent.chat("crash")
+        second = await agent.chat("after")
+        return first, second, pool.stats()
+
+    first, second, stats = run_with_pool(test)
+
+    assert first["pid"] != second["pid"]
+    assert (second["message"], second["name"]) == ("echo: after", "survivor")
+    worker = stats["workers"][0]
+    assert (worker["alive"], worker["restarts"], worker["failed"], worker["completed"]) == (True, 1, 1, 2)
+
+
+def test_workers_are_checked_while_messages_keep_arriving(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(agent_workers, "HEALTH_CHECK_INTERVAL", 0.05)
+    pool = AgentWorkerPool(1, agent_factory=make_fake_agent)
+    checks: List[float] = []
+    handled: List[Any] = []
+
+    class BusyOutbox:
+        def get(self, timeout: float) -> Dict[str, Any]:
+            time.sleep(0.01)
+            return {"type": "noise"}
+
+    def check_workers() -> None:
+        checks.append(time.monotonic())
+        if len(checks) == 3:
+            pool._stopping.set()
+
+    monkeypatch.setattr(pool, "_outbox", BusyOutbox())
+    monkeypatch.setattr(pool, "_check_workers", check_workers)
+    monkeypatch.setattr(pool, "_handle_message", handled.append)
+    reader = threading.Thread(target=pool._read_outbox, daemon=True)
+    reader.start()
+    reader.join(5)
+
+    assert not reader.is_alive()
+    assert len(checks) == 3 and len(handled) >= 5
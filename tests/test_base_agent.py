@@ -0,0 +1,216 @@
+"""
+Tests for the provider-independent machinery in BaseAgent.
+
+These tests use a minimal in-memory agent so they run without any API keys.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from unittest.mock import MagicMock
+
+import pytest
+
+from cursor_agent_tools.base import AgentCancelledError, BaseAgent, agent_turn
+from cursor_agent_tools.permissions import PermissionOptions, PermissionStatus
+from cursor_agent_tools.tools.system_tools import run_terminal_command
+
+
+class FakeAgent(BaseAgent):
+    """Minimal agent whose tool calls are plain dicts: {"name": ..., "input": {...}}."""
+
+    def _generate_system_prompt(self) -> str:
+        return "fake"
+
+    @agent_turn
+    async def chat(self, message: str, user_info: Optional[Dict[str, Any]] = None) -> Any:
+        self.conversation_history.append({"role": "user", "content": message})
+        if message == "slow":
+            self.conversation_history.append({"role": "assistant", "content": "tool_use"})
+            await asyncio.sleep(10)
+        self.conversation_history.append({"role": "assistant", "content": "reply"})
+        return message
+
+    async def query_image(self, image_paths: List[str], query: str) -> str:
+        return ""
+
+    async def get_structured_output(self, prompt: str, schema: Dict[str, Any], model: Optional[str] = None) -> Dict[str, Any]:
+        return {}
+
+    def _prepare_tools(self) -> Any:
+        return None
+
+    def _execute_tool_calls(self, tool_calls: Any) -> List[Dict[str, Any]]:
+        results = []
+        for call in tool_calls:
+            try:
+                results.append({"name": call["name"], "output": self._invoke_tool(call["name"], call["input"])})
+            except Exception as e:
+                results.append({"name": call["name"], "error": str(e)})
+        return results
+
+
+@pytest.fixture
+def agent() -> FakeAgent:
+    """Create a fake agent with a couple of simple tools."""
+    agent = FakeAgent()
+    agent.register_tool("echo", lambda text: {"text": text}, "Echo text", {"properties": {}})
+    agent.register_tool("fail", lambda: 1 / 0, "Always fails", {"properties": {}})
+    return agent
+
+
+def test_invoke_tool_emits_start_and_end_events(agent: FakeAgent) -> None:
+    """Tool execution is reported to the event callback."""
+    events: List[Tuple[str, Dict[str, Any]]] = []
+    agent.set_event_callback(lambda event_type, data: events.append((event_type, data)))
+
+    result = agent._invoke_tool("echo", {"text": "hi"})
+
+    assert result == {"text": "hi"}
+    assert [event_type for event_type, _ in events] == ["tool_start", "tool_end"]
+    assert events[0][1]["parameters"] == {"text": "hi"}
+    assert events[1][1]["error"] is None
+
+
+def test_invoke_tool_reports_exceptions(agent: FakeAgent) -> None:
+    """A raising tool still produces a tool_end event carrying the error."""
+    events: List[Tuple[str, Dict[str, Any]]] = []
+    agent.set_event_callback(lambda event_type, data: events.append((event_type, data)))
+
+    with pytest.raises(ZeroDivisionError):
+        agent._invoke_tool("fail", {})
+
+    assert events[-1][0] == "tool_end"
+    assert "division" in events[-1][1]["error"]
+
+
+def test_broken_event_callback_does_not_break_tools(agent: FakeAgent) -> None:
+    """Errors raised by the event callback are swallowed."""
+    def broken_callback(event_type: str, data: Dict[str, Any]) -> None:
+        raise RuntimeError("listener failed")
+
+    agent.set_event_callback(broken_callback)
+    assert agent._invoke_tool("echo", {"text": "ok"}) == {"text": "ok"}
+
+
+def test_run_tool_calls_runs_off_the_event_loop(agent: FakeAgent) -> None:
+    """Tool calls are executed in a worker thread, not on the event loop thread."""
+    threads: List[threading.Thread] = []
+
+    def where() -> Dict[str, Any]:
+        threads.append(threading.current_thread())
+        return {}
+
+    agent.register_tool("where", where, "Record thread", {"properties": {}})
+
+    async def run() -> List[Dict[str, Any]]:
+        return await agent._run_tool_calls([{"name": "where", "input": {}}])
+
+    results = asyncio.run(run())
+
+    assert results[0]["name"] == "where"
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_cancel_rolls_back_conversation_history(agent: FakeAgent) -> None:
+    """Cancelling a turn aborts it and removes its partial messages from the history."""
+    async def run() -> None:
+        await agent.chat("first")
+        task = asyncio.create_task(agent.chat("slow"))
+        await asyncio.sleep(0.05)
+        assert agent.cancel() is True
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    assert [m["content"] for m in agent.conversation_history] == ["first", "reply"]
+
+
+def test_cancel_runs_hooks_and_blocks_further_tools(agent: FakeAgent) -> None:
+    """Cancel hooks run on cancel, and tools refuse to start until the next turn."""
+    calls: List[str] = []
+    hook = lambda: calls.append("hook")  # noqa: E731
+    agent.add_cancel_hook(hook)
+
+    assert agent.cancel() is True
+    assert calls == ["hook"]
+    with pytest.raises(AgentCancelledError):
+        agent._invoke_tool("echo", {"text": "late"})
+
+    agent.remove_cancel_hook(hook)
+    asyncio.run(agent.chat("next turn"))
+    assert agent._invoke_tool("echo", {"text": "ok"}) == {"text": "ok"}
+
+
+def test_cancel_terminates_running_terminal_command() -> None:
+    """A running terminal command is terminated when the agent's turn is cancelled."""
+    agent = FakeAgent(permission_options=PermissionOptions(yolo_mode=True))
+    agent._begin_turn()
+    results: List[Dict[str, Any]] = []
+    worker = threading.Thread(target=lambda: results.append(run_terminal_command("sleep 30", agent=agent)))
+
+    start_time = time.time()
+    worker.start()
+    time.sleep(0.5)
+    agent.cancel()
+    worker.join(timeout=10)
+
+    assert not worker.is_alive()
+    assert time.time() - start_time < 10
+    assert results[0].get("cancelled") is True
+
+
+def test_terminal_command_streams_output_events() -> None:
+    """Terminal command output is streamed as tool_output events while it runs."""
+    agent = FakeAgent(permission_options=PermissionOptions(yolo_mode=True))
+    events: List[Tuple[str, Dict[str, Any]]] = []
+    agent.set_event_callback(lambda event_type, data: events.append((event_type, data)))
+
+    result = run_terminal_command("echo out; echo err >&2", agent=agent)
+
+    chunks = {"stdout": "", "stderr": ""}
+    for event_type, data in events:
+        if event_type == "tool_output":
+            chunks[data["stream"]] += data["data"]
+    assert chunks == {"stdout": "out\n", "stderr": "err\n"}
+    assert result["stdout"] == "out\n"
+    assert result["stderr"] == "err\n"
+
+
+def test_read_only_commands_are_cached_until_workspace_changes() -> None:
+    """Repeated read-only commands are served from the cache until a mutating command runs."""
+    agent = FakeAgent(permission_options=PermissionOptions(yolo_mode=True))
+    agent.cache_read_only_commands = True
+
+    first = run_terminal_command("uname -a", agent=agent)
+    second = run_terminal_command("uname -a", agent=agent)
+    assert "cached" not in first
+    assert second["cached"] is True
+    assert second["stdout"] == first["stdout"]
+
+    run_terminal_command("true", agent=agent)
+    assert "cached" not in run_terminal_command("uname -a", agent=agent)
+
+
+def test_tool_permissions_are_requested_as_one_batch(tmp_path: Any) -> None:
+    """The permissions of a turn's tool calls are asked for once, and only approved calls run."""
+    agent = FakeAgent()
+    agent.register_default_tools()
+    agent.permission_manager.batch_callback = MagicMock(
+        return_value=[PermissionStatus.GRANTED, PermissionStatus.DENIED, PermissionStatus.GRANTED]
+    )
+    agent.permission_manager.callback = MagicMock(return_value=PermissionStatus.DENIED)
+    calls = [
+        {"name": "create_file", "input": {"file_path": str(tmp_path / f"{i}.txt"), "content": "x"}}
+        for i in range(3)
+    ]
+
+    results = asyncio.run(agent._run_tool_calls(calls))
+
+    assert agent.permission_manager.batch_callback.call_count == 1
+    assert agent.permission_manager.callback.call_count == 0
+    assert [os.path.exists(tmp_path / f"{i}.txt") for i in range(3)] == [True, False, True]
+    assert results[1]["output"]["status"] == "error"
@@ -0,0 +1,90 @@
+"""
+Tests for the content-addressed upload store of the web backend.
+"""
+
+import asyncio
+import hashlib
+import sys
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List
+
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("python_multipart")
+
+# The web backend is not a package; its modules import each other by name
+web_backend_dir = str(Path(__file__).parent.parent / "web_backend")
+if web_backend_dir not in sys.path:
+    sys.path.insert(0, web_backend_dir)
+
+from blob_store import BlobStore, UploadTooLargeError  # noqa: E402
+
+
+def store_bytes(store: BlobStore, chunks: List[bytes], filename: str = "a.txt") -> Dict[str, Any]:
+    writer = store.open_writer()
+    for chunk in chunks:
+        writer.write(chunk)
+    info: Dict[str, Any] = writer.commit(filename, "text/plain")
+    return info
+
+
+def test_blobs_are_addressed_by_hash_and_deduplicated(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path, max_size=1024)
+    first = store_bytes(store, [b"hello ", b"world"])
+    second = store_bytes(store, [b"hello world"], filename="b.txt")
+
+    assert first["blob_id"] == hashlib.sha256(b"hello world").hexdigest()
+    assert (first["deduplicated"], second["deduplicated"]) == (False, True)
+    assert second["blob_id"] == first["blob_id"] and second["filename"] == "b.txt"
+    assert Path(first["path"]).read_bytes() == b"hello world"
+    # One blob and its metadata, no temporary files left behind
+    assert sorted(path.name for path in tmp_path.iterdir()) == [first["blob_id"], first["blob_id"] + ".json"]
+
+
+def test_size_limit_is_checked_while_streaming(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path, max_size=10)
+    writer = store.open_writer()
+    writer.write(b"x" * 10)
+    with pytest.raises(UploadTooLargeError):
+        writer.write(b"x")
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_lookup_by_id(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path, max_size=1024)
+    info = store_bytes(store, [b"content"])
+
+    found = store.get(info["blob_id"])
+    assert found is not None
+    assert (found["size"], found["content_type"], found["filename"]) == (7, "text/plain", "a.txt")
+    assert store.get("0" * 64) is None
+    assert store.get(info["blob_id"].upper()) is None
+    assert store.get("../" + info["blob_id"][3:]) is None
+
+
+def test_multipart_upload_is_streamed_into_blobs(tmp_path: Path) -> None:
+    store = BlobStore(tmp_path, max_size=1024)
+    boundary = "testboundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="session_id"\r\n\r\n'
+        "abc\r\n"
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="notes.txt"\r\n'
+        "Content-Type: text/plain\r\n\r\n"
+        "some notes\r\n"
+        f"--{boundary}--\r\n"
+    ).encode()
+
+    async def chunks() -> AsyncIterator[bytes]:
+        for i in range(0, len(body), 7):
+            yield body[i:i + 7]
+
+    fields, blobs = asyncio.run(store.receive_multipart(f"multipart/form-data; boundary={boundary}", chunks()))
+
+    assert fields == {"session_id": ["abc"]}
+    assert len(blobs) == 1
+    assert blobs[0]["blob_id"] == hashlib.sha256(b"some notes").hexdigest()
+    assert (blobs[0]["field"], blobs[0]["filename"], blobs[0]["content_type"]) == ("file", "notes.txt", "text/plain")
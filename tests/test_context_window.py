@@ -0,0 +1,166 @@
+"""
+Tests for fitting conversations into a model's context window.
+"""
+
+import asyncio
+from typing import Any, Dict, List
+
+import ollama
+import pytest
+
+from cursor_agent_tools import ollama_agent, ollama_models
+from cursor_agent_tools.context_window import ContextShaper, estimate_tokens, message_tokens, shorten
+from cursor_agent_tools.mock_provider import MockProviderServer
+from cursor_agent_tools.ollama_agent import OllamaAgent
+from cursor_agent_tools.ollama_models import ModelReadiness, ModelResidency, context_window
+
+
+@pytest.fixture(autouse=True)
+def fresh_model_state(monkeypatch: pytest.MonkeyPatch) -> None:
+    residency = ModelResidency()
+    monkeypatch.setattr(ollama_agent, "MODEL_READINESS", ModelReadiness())
+    monkeypatch.setattr(ollama_agent, "MODEL_RESIDENCY", residency)
+    monkeypatch.setattr(ollama_models, "MODEL_RESIDENCY", residency)
+    monkeypatch.setattr(ollama_models, "_MODEL_CONTEXT", {})
+
+
+def exchange(i: int, size: int = 400) -> List[Dict[str, Any]]:
+    return [
+        {"role": "user", "content": f"Request {i}: " + "please look at this " * 10},
+        {"role": "assistant", "content": "", "tool_calls": [{"function": {"name": "read_file", "arguments": {}}}]},
+        {"role": "tool", "content": f"line {i}\n" * size, "tool_name": "read_file"},
+        {"role": "assistant", "content": f"Answer {i}"},
+    ]
+
+
+def total_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(message_tokens(message) for message in messages)
+
+
+def test_estimate_tokens() -> None:
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a" * 35) == 10
+    assert estimate_tokens("你好") == 2
+    shortened = shorten("x" * 10000, 100)
+    assert estimate_tokens(shortened) <= 110 and "characters omitted" in shortened
+
+
+def test_old_exchanges_are_dropped_in_blocks() -> None:
+    """The cut moves rarely, so consecutive prompts share their prefix."""
+    shaper = ContextShaper()
+    history: List[Dict[str, Any]] = []
+    prompts = []
+    for i in range(12):
+        history += exchange(i)
+        prompts.append(shaper.shape("You are a helpful assistant.", history, budget=3000))
+
+    cuts = set()
+    for i, prompt in enumerate(prompts):
+        assert total_tokens(prompt) <= 3000
+        # The current turn is always sent
+        assert prompt[-4]["content"].startswith(f"Request {i}:")
+        # Kept history starts at a user message
+        assert prompt[1]["role"] == "user"
+        cuts.add(prompt[1]["content"])
+    assert 1 < len(cuts) < 6
+    # Between cuts, a prompt is the previous prompt plus the new exchange
+    same_prefix = sum(prompts[i][:len(prompts[i - 1])] == prompts[i - 1] for i in range(1, len(prompts)))
+    assert same_prefix >= 6
+    last_system = prompts[-1][0]["content"]
+    assert "earlier messages were removed" in last_system and "read_file (" in last_system
+
+
+def test_long_tool_results_are_shortened() -> None:
+    history = exchange(0, size=5000)
+    prompt = ContextShaper().shape("system", history, budget=2000)
+    assert message_tokens(prompt[3]) <= 2000 * 0.25 + 20
+    assert history[2]["content"] == "line 0\n" * 5000
+    # A replaced history starts over
+    shaper = ContextShaper()
+    long_history = sum((exchange(i) for i in range(10)), [])
+    shaper.shape("system", long_history, budget=2000)
+    assert shaper.cut > 0
+    assert shaper.shape("system", exchange(0, size=50), budget=2000)[1:] == exchange(0, size=50)
+    assert shaper.cut == 0
+
+
+def test_context_window_lookup(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def lookups(url: str) -> List[int]:
+        client = ollama.AsyncClient(host=url)
+        # Not loaded: the server default, capped by the model's trained length (8192)
+        monkeypatch.setenv("OLLAMA_CONTEXT_LENGTH", "32768")
+        not_loaded = await context_window(client, url, "llama3")
+        await client.chat(model="llama3", messages=[], options={"num_ctx": 2048})
+        await ollama_models.MODEL_RESIDENCY.refresh(client, url, max_age=0)
+        return [not_loaded, await context_window(client, url, "llama3"),
+                await context_window(client, url, "llama3", num_ctx=1024)]
+
+    with MockProviderServer() as server:
+        assert asyncio.run(lookups(server.url)) == [8192, 2048, 1024]
+
+
+def test_failed_model_lookup_is_not_cached(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def lookups(url: str) -> List[int]:
+        client = ollama.AsyncClient(host=url)
+        original_show = client.show
+
+        async def failing_show(model: str) -> Any:
+            raise ConnectionError("server restarting")
+
+        monkeypatch.setattr(client, "show", failing_show)
+        failed = await context_window(client, url, "llama3")
+        monkeypatch.setattr(client, "show", original_show)
+        return [failed, await context_window(client, url, "llama3")]
+
+    monkeypatch.setenv("OLLAMA_CONTEXT_LENGTH", "32768")
+    with MockProviderServer() as server:
+        # The server default until the model's trained length (8192) is known
+        assert asyncio.run(lookups(server.url)) == [32768, 8192]
+
+
+def test_agent_looks_the_window_up_again_after_a_failed_lookup(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def lookups(agent: OllamaAgent) -> List[Any]:
+        original_show = agent.async_client.show
+
+        async def failing_show(model: str) -> Any:
+            raise ConnectionError("server restarting")
+
+        monkeypatch.setattr(agent.async_client, "show", failing_show)
+        await agent._update_context_window()
+        failed = agent.context_window
+        monkeypatch.setattr(agent.async_client, "show", original_show)
+        await agent._update_context_window()
+        return [failed, agent.context_window, agent._context_window_fallback]
+
+    monkeypatch.setenv("OLLAMA_CONTEXT_LENGTH", "32768")
+    with MockProviderServer() as server:
+        agent = OllamaAgent(model="llama3", host=server.url)
+        # The server default is only used until the model's trained length (8192) is known
+        assert asyncio.run(lookups(agent)) == [32768, 8192, False]
+
+
+def test_agent_prompts_fit_the_window(monkeypatch: pytest.MonkeyPatch) -> None:
+    sent: List[List[Dict[str, Any]]] = []
+    original_chat = ollama.AsyncClient.chat
+
+    def chat(self: Any, *args: Any, **kwargs: Any) -> Any:
+        if kwargs.get("messages"):
+            sent.append([dict(message) for message in kwargs["messages"]])
+        return original_chat(self, *args, **kwargs)
+
+    monkeypatch.setattr(ollama.AsyncClient, "chat", chat)
+
+    async def conversation(agent: OllamaAgent) -> None:
+        for i in range(8):
+            await agent.chat(f"Question {i}: " + "some context " * 150)
+
+    with MockProviderServer([{"text": "An answer of reasonable length."}], num_ctx=4096) as server:
+        agent = OllamaAgent(model="llama3", host=server.url, num_ctx=4096)
+        asyncio.run(conversation(agent))
+
+    assert agent.context_window == 4096
+    assert len(agent.conversation_history) == 16
+    for messages in sent:
+        assert total_tokens(messages) <= 4096
+        assert "Question " in messages[-1]["content"]
+    assert any("earlier messages were removed" in messages[0]["content"] for messages in sent)
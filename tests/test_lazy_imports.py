@@ -0,0 +1,45 @@
+"""
+Tests that the package and the tools load without the provider SDKs.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROVIDER_MODULES = ("anthropic", "openai", "ollama", "httpx", "requests", "bs4")
+
+
+def loaded_modules(statement: str) -> str:
+    """The provider modules loaded after running a statement in a fresh interpreter."""
+    code = f"{statement}\nimport sys\nprint(','.join(m for m in {PROVIDER_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+@pytest.mark.parametrize("statement", [
+    "import cursor_agent_tools",
+    "from cursor_agent_tools import BaseAgent, PermissionOptions, create_agent, run_agent_chat",
+    "from cursor_agent_tools.tools import register_default_tools, web_search",
+])
+def test_no_provider_sdk_on_import(statement: str) -> None:
+    assert loaded_modules(statement) == ""
+
+
+def test_agent_classes_import_on_first_use() -> None:
+    """Agent classes load their own SDK only; the old names and discovery still work."""
+    loaded = loaded_modules("from cursor_agent_tools import ClaudeAgent").split(",")
+    assert "anthropic" in loaded
+    assert "openai" not in loaded and "ollama" not in loaded
+
+    import cursor_agent_tools
+    from cursor_agent_tools.claude_agent import ClaudeAgent
+
+    assert cursor_agent_tools.ClaudeAgent is ClaudeAgent
+    assert set(cursor_agent_tools.__all__) <= set(dir(cursor_agent_tools))
+    assert cursor_agent_tools._agent_classes["ClaudeAgent"] is ClaudeAgent
+    with pytest.raises(AttributeError):
+        cursor_agent_tools.NoSuchAgent
@@ -0,0 +1,98 @@
+"""
+Tests for the logging pipeline: JSON output, truncation, sampling and the queue.
+"""
+
+import io
+import json
+import logging
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from cursor_agent_tools import logger as logger_module
+from cursor_agent_tools.logger import SamplingFilter, configure_logging, get_logger, lazy
+
+
+@pytest.fixture
+def output() -> Iterator[io.StringIO]:
+    """A stream for the pipeline to write to; the default pipeline is restored afterwards."""
+    yield io.StringIO()
+    configure_logging()
+
+
+def test_json_format_with_fields_and_truncation(output: io.StringIO) -> None:
+    """JSON lines carry extra fields; long messages and fields are truncated."""
+    configure_logging(json_format=True, use_queue=False, max_field_length=50, sampling={}, stream=output)
+    log = get_logger("tests.logger.json")
+
+    log.info("x" * 80, extra={"tool": "edit_file", "lines": list(range(100)), "duration": 0.5})
+
+    entry = json.loads(output.getvalue().splitlines()[-1])
+    assert entry["level"] == "INFO" and entry["logger"] == "tests.logger.json"
+    assert entry["message"] == "x" * 50 + "... [truncated 30 chars]"
+    assert entry["tool"] == "edit_file" and entry["duration"] == 0.5
+    assert entry["lines"].endswith("chars]")
+
+
+def test_lazy_arguments_are_only_rendered_when_emitted(output: io.StringIO) -> None:
+    """Disabled levels never call lazy values."""
+    configure_logging(json_format=False, use_queue=False, sampling={}, stream=output)
+    log = get_logger("tests.logger.lazy")
+    log.setLevel(logging.INFO)
+    calls = []
+
+    def render() -> str:
+        calls.append(1)
+        return "rendered"
+
+    log.debug("value: %s", lazy(render))
+    assert calls == []
+    log.info("value: %s", lazy(render))
+    assert calls == [1]
+    assert "value: rendered" in output.getvalue()
+
+
+def test_queue_pipeline_delivers_records(output: io.StringIO) -> None:
+    """Records handed to the background listener are written once it is flushed."""
+    configure_logging(json_format=True, use_queue=True, sampling={}, stream=output)
+    log = get_logger("tests.logger.queue")
+    items = ["a"]
+
+    log.info("items: %s", items)
+    items.append("b")  # the message is captured when the call is made
+    logger_module.shutdown_logging()
+
+    entry = json.loads(output.getvalue().splitlines()[-1])
+    assert entry["message"] == "items: ['a']"
+
+
+def test_sampling_filter() -> None:
+    """Sampling keeps every n-th DEBUG/INFO record per module and never drops warnings."""
+    sampling = SamplingFilter({"app.noisy": 0.25, "app.noisy.quiet": 0})
+
+    def record(name: str, level: int) -> logging.LogRecord:
+        return logging.LogRecord(name, level, __file__, 1, "message", None, None)
+
+    kept = [sampling.filter(record("app.noisy.module", logging.DEBUG)) for _ in range(8)]
+    assert kept == [True, False, False, False, True, False, False, False]
+    assert not sampling.filter(record("app.noisy.quiet", logging.INFO))
+    assert sampling.filter(record("app.noisy.quiet", logging.WARNING))
+    assert all(sampling.filter(record("app.other", logging.DEBUG)) for _ in range(3))
+
+
+def test_sampling_keeps_the_same_records_on_every_handler(output: io.StringIO, tmp_path: Path) -> None:
+    """With a log file, console and file both keep every n-th record."""
+    log_file = tmp_path / "agent.log"
+    configure_logging(json_format=True, use_queue=False, sampling={"tests.logger.sampled": 0.5},
+                      log_file=str(log_file), stream=output)
+    log = get_logger("tests.logger.sampled")
+    log.setLevel(logging.INFO)
+
+    for i in range(6):
+        log.info(f"record {i}")
+    logger_module.shutdown_logging()
+
+    console = [json.loads(line)["message"] for line in output.getvalue().splitlines()]
+    written = [json.loads(line)["message"] for line in log_file.read_text().splitlines()]
+    assert len(console) == 3 and console == written
@@ -0,0 +1,104 @@
+"""
+Tests for the metrics registry: per-thread shards, snapshots and the text exposition format.
+"""
+
+import threading
+
+import pytest
+
+from cursor_agent_tools.metrics import REGISTRY, MetricsRegistry, Snapshot, TOOL_CALL_SECONDS
+from tests.test_base_agent import FakeAgent
+
+
+def test_counter_and_histogram_exposition() -> None:
+    """Counters, cumulative histogram buckets and gauges are rendered in the Prometheus format."""
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests served", ("route",))
+    latency = registry.histogram("latency_seconds", "Request latency", ("route",), buckets=(0.1, 1.0))
+    registry.gauge("sessions", "Active sessions", lambda: 3)
+
+    requests.inc(("/a",))
+    requests.inc(("/a",), 2)
+    requests.inc(('say "hi"\n',))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        latency.observe(value, ("/a",))
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="/a"} 3' in text
+    assert 'requests_total{route="say \\"hi\\"\\n"} 1' in text
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in text
+    assert 'latency_seconds_sum{route="/a"} 5.65' in text
+    assert 'latency_seconds_count{route="/a"} 4' in text
+    assert "# TYPE sessions gauge\nsessions 3" in text
+
+    with pytest.raises(ValueError):
+        requests.inc(("/a", "extra"))
+    with pytest.raises(ValueError):
+        registry.histogram("requests_total", "Clashes with the counter")
+    assert registry.counter("requests_total", "Requests served", ("route",)) is requests
+
+
+def test_shards_of_all_threads_are_summed() -> None:
+    """Updates from many threads, including exited ones, all end up in the total."""
+    registry = MetricsRegistry()
+    counter = registry.counter("events_total", "Events", ("kind",))
+    start = threading.Barrier(8)
+
+    def work() -> None:
+        start.wait()
+        for _ in range(1000):
+            counter.inc(("a",))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(("b",))
+
+    assert counter.collect() == {("a",): 8000, ("b",): 1}
+    # Exited threads' shards were folded into one total and are not counted twice
+    assert len(counter._shards) == 1
+    assert counter.collect() == {("a",): 8000, ("b",): 1}
+
+
+def test_snapshots_of_other_processes_are_merged() -> None:
+    """Snapshot sources (e.g. worker processes) are added to the matching metrics."""
+    registry = MetricsRegistry()
+    counter = registry.counter("calls_total", "Calls", ("tool",))
+    latency = registry.histogram("call_seconds", "Call latency", buckets=(1.0,))
+    counter.inc(("read_file",))
+    latency.observe(0.5)
+
+    remote: Snapshot = {"calls_total": {("read_file",): 2, ("edit_file",): 1}, "call_seconds": {(): [0, 1, 3.0]}}
+    registry.add_snapshot_source(lambda: [remote])
+
+    collected = {metric.name: values for metric, values in registry.collect()}
+    assert collected["calls_total"] == {("read_file",): 3, ("edit_file",): 1}
+    assert collected["call_seconds"] == {(): [1, 1, 3.5]}
+    assert registry.snapshot()["calls_total"] == {("read_file",): 1}
+
+
+def test_tool_calls_are_recorded() -> None:
+    """Agent tool calls record their latency with an ok or error status."""
+    agent = FakeAgent()
+    agent.register_tool("metrics_echo", lambda text: {"text": text}, "Echo text", {"properties": {}})
+    agent.register_tool("metrics_fail", lambda: {"error": "nope"}, "Fails", {"properties": {}})
+    before = TOOL_CALL_SECONDS.collect()
+
+    agent._invoke_tool("metrics_echo", {"text": "hi"})
+    agent._invoke_tool("metrics_echo", {"text": "hi"})
+    agent._invoke_tool("metrics_fail", {})
+
+    after = TOOL_CALL_SECONDS.collect()
+
+    def count(labels: tuple) -> int:
+        observed: int = sum(after[labels][:-1]) - sum(before.get(labels, [0])[:-1])
+        return observed
+
+    assert count(("metrics_echo", "ok")) == 2
+    assert count(("metrics_fail", "error")) == 1
+    assert "cursor_agent_tool_call_duration_seconds_count" in REGISTRY.render()
@@ -0,0 +1,119 @@
+"""
+Tests for the mock model provider: scripted tool calls, streaming, latency and failure injection.
+"""
+
+import asyncio
+import json
+import random
+import urllib.request
+from typing import Any, Dict, List
+
+import pytest
+from openai import AsyncOpenAI, RateLimitError
+
+from cursor_agent_tools.mock_provider import LatencyDistribution, MockProviderServer
+
+SCRIPT: List[Dict[str, Any]] = [
+    {"text": "Reading it.", "tool_calls": [{"name": "read_file", "arguments": {"target_file": "app.py"}}]},
+    {"tokens": 12},
+]
+
+
+def _post(url: str, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """POST JSON and return the response body, or the lines of a newline-delimited stream."""
+    request = urllib.request.Request(url, json.dumps(body).encode(), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return [json.loads(line) for line in response.read().decode().splitlines() if line]
+
+
+def test_script_steps_follow_the_conversation() -> None:
+    """A turn starts at the first step; every tool round moves one step further."""
+    with MockProviderServer(SCRIPT) as server:
+        first = _post(f"{server.url}/v1/messages", {
+            "model": "claude-3-5-sonnet-latest", "stream": False,
+            "messages": [{"role": "user", "content": "Open app.py"}],
+        })[0]
+        assert [block["type"] for block in first["content"]] == ["text", "tool_use"]
+        assert first["content"][1]["input"] == {"target_file": "app.py"}
+        assert first["stop_reason"] == "tool_use"
+
+        follow_up = _post(f"{server.url}/v1/messages", {
+            "model": "claude-3-5-sonnet-latest",
+            "messages": [
+                {"role": "user", "content": "Open app.py"},
+                {"role": "assistant", "content": first["content"]},
+                {"role": "user", "content": [{"type": "tool_result", "tool_use_id": first["content"][1]["id"], "content": "..."}]},
+            ],
+        })[0]
+        assert follow_up["stop_reason"] == "end_turn"
+        assert follow_up["usage"]["output_tokens"] == 12
+
+        stats = server.stats()
+    assert stats["by_api"] == {"anthropic": 2}
+    assert stats["output_tokens"] == first["usage"]["output_tokens"] + 12
+
+
+def test_streaming_responses() -> None:
+    """OpenAI and Ollama streams carry the same text and tool calls as full responses."""
+    async def openai_stream(url: str) -> Dict[str, Any]:
+        client = AsyncOpenAI(api_key="sk-test", base_url=f"{url}/v1", max_retries=0)
+        stream = await client.chat.completions.create(
+            model="gpt-4o", messages=[{"role": "user", "content": "Open app.py"}],
+            stream=True, stream_options={"include_usage": True},
+        )
+        text, arguments, usage = "", "", None
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            for choice in chunk.choices:
+                text += choice.delta.content or ""
+                for call in choice.delta.tool_calls or []:
+                    if call.function is not None:
+                        arguments += call.function.arguments or ""
+        return {"text": text, "arguments": arguments, "usage": usage}
+
+    with MockProviderServer(SCRIPT, tokens_per_second=1000) as server:
+        streamed = asyncio.run(openai_stream(server.url))
+        lines = _post(f"{server.url}/api/chat", {"model": "llama3", "messages": [{"role": "user", "content": "Open app.py"}]})
+
+    assert streamed["text"] == "Reading it."
+    assert json.loads(streamed["arguments"]) == {"target_file": "app.py"}
+    assert streamed["usage"].completion_tokens > 0
+
+    assert "".join(line["message"]["content"] for line in lines) == "Reading it."
+    assert [line["message"]["tool_calls"][0]["function"]["name"] for line in lines if line["message"].get("tool_calls")] == ["read_file"]
+    assert [line["done"] for line in lines][-1] is True
+
+
+def test_rate_limits_are_injected() -> None:
+    """Injected 429s come in the provider's error format with a Retry-After header."""
+    async def request(url: str) -> None:
+        client = AsyncOpenAI(api_key="sk-test", base_url=f"{url}/v1", max_retries=0)
+        await client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "hi"}])
+
+    with MockProviderServer(rate_limit_rate=1.0, retry_after=3) as server:
+        with pytest.raises(RateLimitError) as error:
+            asyncio.run(request(server.url))
+        assert error.value.response.headers["retry-after"] == "3"
+        assert server.stats()["by_status"] == {"429": 1}
+
+
+def test_failures_and_latencies_are_reproducible() -> None:
+    """With a seed, the same requests get the same injected failures."""
+    def statuses(seed: int) -> List[int]:
+        server = MockProviderServer(error_rate=0.3, rate_limit_rate=0.2, latency="uniform:0,1", seed=seed)
+        try:
+            return [server._plan()[0] or 200 for _ in range(50)]
+        finally:
+            server._server.server_close()
+
+    assert statuses(7) == statuses(7)
+    assert {200, 429, 500} == set(statuses(7))
+
+    rng = random.Random(0)
+    lognormal = LatencyDistribution.parse("lognormal:0.8,0.5")
+    samples = sorted(lognormal.sample(rng) for _ in range(2001))
+    assert samples[1000] == pytest.approx(0.8, rel=0.1)
+    assert LatencyDistribution.parse("0.25").sample(rng) == 0.25
+    with pytest.raises(ValueError):
+        LatencyDistribution.parse("pareto:1,2")
@@ -0,0 +1,175 @@
+"""
+Tests for the shared, asynchronous Ollama server checks, model warmup and residency.
+"""
+
+import asyncio
+import math
+import socket
+import time
+from typing import Any, Dict, List
+
+import ollama
+import pytest
+
+from cursor_agent_tools import ollama_agent, ollama_models
+from cursor_agent_tools.metrics import OLLAMA_COLD_LOADS
+from cursor_agent_tools.mock_provider import MockProviderServer
+from cursor_agent_tools.ollama_agent import OllamaAgent
+from cursor_agent_tools.ollama_models import (
+    ModelReadiness,
+    ModelResidency,
+    WarmPool,
+    keep_alive_seconds,
+    resolve_model_name,
+)
+
+
+@pytest.fixture
+def readiness(monkeypatch: pytest.MonkeyPatch) -> ModelReadiness:
+    """A fresh readiness cache, so tests don't share results."""
+    readiness = ModelReadiness()
+    monkeypatch.setattr(ollama_agent, "MODEL_READINESS", readiness)
+    return readiness
+
+
+@pytest.fixture
+def residency(monkeypatch: pytest.MonkeyPatch) -> ModelResidency:
+    """A fresh residency tracker, so tests don't share loaded models and pins."""
+    residency = ModelResidency()
+    monkeypatch.setattr(ollama_agent, "MODEL_RESIDENCY", residency)
+    monkeypatch.setattr(ollama_models, "MODEL_RESIDENCY", residency)
+    return residency
+
+
+@pytest.fixture
+def calls(monkeypatch: pytest.MonkeyPatch) -> Dict[str, List[Any]]:
+    """Record the list and chat requests of all Ollama clients."""
+    recorded: Dict[str, List[Any]] = {"list": [], "chat": []}
+    original_list, original_chat = ollama.AsyncClient.list, ollama.AsyncClient.chat
+
+    async def list_models(self: Any) -> Any:
+        recorded["list"].append(None)
+        return await original_list(self)
+
+    def chat(self: Any, *args: Any, **kwargs: Any) -> Any:
+        recorded["chat"].append(kwargs.get("messages"))
+        recorded.setdefault("keep_alive", []).append(kwargs.get("keep_alive"))
+        return original_chat(self, *args, **kwargs)
+
+    monkeypatch.setattr(ollama.AsyncClient, "list", list_models)
+    monkeypatch.setattr(ollama.AsyncClient, "chat", chat)
+    return recorded
+
+
+def unused_url() -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+def test_resolve_model_name() -> None:
+    assert resolve_model_name("llama3", ["llama3:latest"]) == "llama3"
+    assert resolve_model_name("llama3:70b", ["llama3"]) == "llama3"
+    assert resolve_model_name("mistral", ["llama3:latest"]) is None
+
+
+def test_constructor_does_not_contact_the_server(readiness: ModelReadiness, calls: Dict[str, List[Any]]) -> None:
+    """Outside an event loop nothing runs until the first chat, which then reports the dead server."""
+    start = time.perf_counter()
+    agent = OllamaAgent(model="llama3", host=unused_url())
+    assert time.perf_counter() - start < 0.5
+    assert calls["list"] == [] and agent._ready_task is None
+
+    status = asyncio.run(agent.ensure_ready())
+    assert not status.server_ok and "Cannot connect" in str(status.error)
+    # The failure is cached for a while
+    asyncio.run(agent.ensure_ready())
+    assert len(calls["list"]) == 1
+
+
+def test_checks_are_shared_between_agents(readiness: ModelReadiness, calls: Dict[str, List[Any]]) -> None:
+    """Sessions created together make one check and one warmup; their first chats wait for it."""
+    async def sessions(url: str) -> List[Any]:
+        agents = [OllamaAgent(model="llama3", host=url) for _ in range(5)]
+        assert all(agent._ready_task is not None for agent in agents)
+        responses: List[Any] = await asyncio.gather(*(agent.chat("hi") for agent in agents))
+        return responses
+
+    with MockProviderServer([{"text": "Hello there, this is the mock model answering."}], latency=0.05) as server:
+        responses = asyncio.run(sessions(server.url))
+
+    assert responses == ["Hello there, this is the mock model answering."] * 5
+    assert len(calls["list"]) == 1
+    assert calls["chat"].count([]) == 1
+    status = readiness.cached(server.url, "llama3")
+    assert status is not None and status.ready and status.warmed
+
+
+def test_expired_results_are_checked_again(readiness: ModelReadiness, calls: Dict[str, List[Any]]) -> None:
+    readiness.ttl = 0.0
+
+    async def check_twice(agent: OllamaAgent) -> None:
+        await agent.ensure_ready()
+        await agent.ensure_ready()
+
+    with MockProviderServer(ollama_models=["llama3:latest"]) as server:
+        agent = OllamaAgent(model="llama3", host=server.url, warmup=False)
+        asyncio.run(check_twice(agent))
+
+    assert len(calls["list"]) == 2
+    assert calls["chat"] == []
+
+
+def test_keep_alive_seconds() -> None:
+    assert keep_alive_seconds(None) == 300
+    assert keep_alive_seconds("1h30m") == 5400
+    assert keep_alive_seconds("90") == keep_alive_seconds(90) == 90
+    assert keep_alive_seconds("-1") == keep_alive_seconds(-1) == math.inf
+    with pytest.raises(ValueError):
+        keep_alive_seconds("soon")
+
+
+def test_cold_loads_are_recorded(readiness: ModelReadiness, residency: ModelResidency,
+                                 calls: Dict[str, List[Any]]) -> None:
+    """The first request waits for the model to load; the model then stays loaded for the keep_alive."""
+    cold_loads = OLLAMA_COLD_LOADS.collect().get(("llama3",), 0)
+
+    async def two_chats(agent: OllamaAgent) -> None:
+        await agent.chat("hi")
+        await agent.chat("hi again")
+
+    with MockProviderServer(model_load_time=0.3) as server:
+        agent = OllamaAgent(model="llama3", host=server.url, warmup=False, keep_alive="10m")
+        asyncio.run(two_chats(agent))
+        loaded = server.loaded_models()
+
+    assert calls["keep_alive"] == ["10m", "10m"]
+    assert OLLAMA_COLD_LOADS.collect()[("llama3",)] == cold_loads + 1
+    assert [model["name"] for model in loaded] == ["llama3:latest"]
+    assert residency.is_resident(server.url, "llama3")
+    assert residency.most_used(server.url, 1) == ["llama3:latest"]
+
+
+def test_warm_pool_pins_models(readiness: ModelReadiness, residency: ModelResidency,
+                               calls: Dict[str, List[Any]]) -> None:
+    """Pooled models are loaded without expiry, requests keep them pinned, and stopping releases them."""
+    async def scenario(url: str) -> List[str]:
+        pool = WarmPool(url, models=["llama3"], client=ollama.AsyncClient(host=url))
+        loaded = await pool.run_once()
+        # Already loaded and pinned: nothing to do
+        assert await pool.run_once() == []
+        agent = OllamaAgent(model="llama3", host=url, warmup=False, keep_alive=60)
+        await agent.chat("hi")
+        assert await residency.refresh(pool.client, url, max_age=0) == ["llama3:latest"]
+        await pool.stop()
+        return loaded
+
+    with MockProviderServer(model_load_time=0.05) as server:
+        loaded = asyncio.run(scenario(server.url))
+        expires_at = server.loaded_models()[0]["expires_at"]
+
+    assert loaded == ["llama3"]
+    # Pinned load, the agent's request, then the release with the default keep-alive
+    assert calls["keep_alive"] == [-1, -1, None]
+    assert not residency.is_pinned(server.url, "llama3")
+    assert expires_at < "2100"
@@ -0,0 +1,107 @@
+"""
+Tests for the tool loop of OllamaAgent against the mock provider.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List
+
+import pytest
+
+from cursor_agent_tools import ollama_agent, ollama_models
+from cursor_agent_tools.mock_provider import MockProviderServer
+from cursor_agent_tools.ollama_agent import OllamaAgent
+from cursor_agent_tools.ollama_models import ModelReadiness, ModelResidency
+from cursor_agent_tools.permissions import PermissionOptions
+
+PARAMETERS = {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]}
+
+
+@pytest.fixture(autouse=True)
+def fresh_model_state(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(ollama_agent, "MODEL_READINESS", ModelReadiness())
+    monkeypatch.setattr(ollama_agent, "MODEL_RESIDENCY", ModelResidency())
+    monkeypatch.setattr(ollama_models, "MODEL_RESIDENCY", ollama_agent.MODEL_RESIDENCY)
+
+
+def make_agent(url: str, **kwargs: Any) -> OllamaAgent:
+    return OllamaAgent(model="llama3", host=url, warmup=False,
+                       permission_options=PermissionOptions(yolo_mode=True), **kwargs)
+
+
+def test_tool_results_are_sent_back_until_the_model_answers() -> None:
+    script: List[Dict[str, Any]] = [
+        {"tool_calls": [{"name": "read_file", "arguments": {"path": "a.txt"}}]},
+        {"tool_calls": [{"name": "edit_file", "arguments": {"path": "a.txt"}}]},
+        {"text": "Read and edited a.txt."},
+    ]
+    with MockProviderServer(script) as server:
+        agent = make_agent(server.url)
+        agent.register_tool("read_file", lambda path: {"output": f"contents of {path}", "error": None},
+                            "Read a file", PARAMETERS)
+        response = asyncio.run(agent.chat("Fix a.txt"))
+        stats = server.stats()
+
+    assert stats["by_api"] == {"ollama": 3}
+    assert isinstance(response, dict)
+    assert response["message"] == "Read and edited a.txt."
+    assert [(call["name"], call["error"]) for call in response["tool_calls"]] == [
+        ("read_file", None), ("edit_file", "Tool 'edit_file' not found"),
+    ]
+    assert [message["role"] for message in agent.conversation_history] == [
+        "user", "assistant", "tool", "assistant", "tool", "assistant",
+    ]
+    assert agent.conversation_history[1]["tool_calls"] == [
+        {"function": {"name": "read_file", "arguments": {"path": "a.txt"}}}
+    ]
+    assert agent.conversation_history[2] == {"role": "tool", "content": "contents of a.txt", "tool_name": "read_file"}
+
+
+def test_read_only_calls_run_concurrently() -> None:
+    """Reads run together; a write waits for the reads before it and runs before those after it."""
+    events: List[str] = []
+    lock = threading.Lock()
+
+    def tool(name: str) -> Any:
+        def run(path: str) -> Dict[str, Any]:
+            with lock:
+                events.append(f"start {name} {path}")
+            time.sleep(0.2)
+            with lock:
+                events.append(f"end {name} {path}")
+            return {"output": path, "error": None}
+        return run
+
+    reads = [{"name": "read_file", "arguments": {"path": str(i)}} for i in range(3)]
+    script = [{"tool_calls": reads + [{"name": "edit_file", "arguments": {"path": "x"}}] + reads[:1]}]
+    with MockProviderServer(script) as server:
+        agent = make_agent(server.url)
+        agent.register_tool("read_file", tool("read_file"), "Read a file", PARAMETERS)
+        agent.register_tool("edit_file", tool("edit_file"), "Edit a file", PARAMETERS)
+        start = time.perf_counter()
+        response = asyncio.run(agent.chat("Look around"))
+        duration = time.perf_counter() - start
+
+    assert isinstance(response, dict)
+    assert [call["output"] for call in response["tool_calls"]] == ["0", "1", "2", "x", "0"]
+    # Three concurrent reads, the edit, then the last read
+    assert duration < 0.75
+    edit_start, edit_end = events.index("start edit_file x"), events.index("end edit_file x")
+    assert sum(event.startswith("end read_file") for event in events[:edit_start]) == 3
+    assert events[edit_end + 1] == "start read_file 0"
+
+
+def test_tool_rounds_are_limited() -> None:
+    script = [{"tool_calls": [{"name": "read_file", "arguments": {"path": str(i)}}]} for i in range(5)]
+    with MockProviderServer(script) as server:
+        agent = make_agent(server.url, max_tool_rounds=2)
+        agent.register_tool("read_file", lambda path: {"output": path, "error": None}, "Read a file", PARAMETERS)
+        response = asyncio.run(agent.chat("Keep reading"))
+        stats = server.stats()
+
+    # Two rounds with tools, then a request without them
+    assert stats["by_api"] == {"ollama": 3}
+    assert isinstance(response, dict)
+    assert len(response["tool_calls"]) == 2
+    assert agent.conversation_history[-1]["role"] == "assistant"
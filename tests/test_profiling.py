@@ -0,0 +1,122 @@
+"""
+Tests for per-turn profiling: the timing breakdown in responses and the written profiles.
+"""
+
+import asyncio
+import pstats
+import time
+from typing import Any, Dict, Optional
+
+import pytest
+
+from cursor_agent_tools.base import agent_turn
+from cursor_agent_tools.profiling import ProfileConfig, StackSampler
+from tests.test_base_agent import FakeAgent
+
+
+def busy(seconds: float) -> Dict[str, Any]:
+    """A tool burning CPU, so it shows up in the samples."""
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += 1
+    return {"total": total}
+
+
+class ToolAgent(FakeAgent):
+    """Fake agent making one model request and one round of tool calls per turn."""
+
+    @agent_turn
+    async def chat(self, message: str, user_info: Optional[Dict[str, Any]] = None) -> Any:
+        async def create() -> Dict[str, Any]:
+            await asyncio.sleep(0.05)
+            return {"usage": {"input_tokens": 10, "output_tokens": 5}}
+
+        await self._model_request(create())
+        results = await self._run_tool_calls([
+            {"name": "busy", "input": {"seconds": 0.1}},
+            {"name": "fail", "input": {}},
+        ])
+        return {"message": message, "tool_calls": results, "thinking": None}
+
+
+def make_agent(profile: Any) -> ToolAgent:
+    agent = ToolAgent(profile=profile)
+    agent.register_tool("busy", busy, "Burn CPU", {"properties": {}})
+    agent.register_tool("fail", lambda: 1 / 0, "Always fails", {"properties": {}})
+    return agent
+
+
+def test_config_from_env_and_constructor() -> None:
+    """Profiling is off unless enabled by the environment or the constructor flag."""
+    assert ProfileConfig.from_env({}) is None
+    assert ProfileConfig.from_env({"CURSOR_AGENT_PROFILE": "0"}) is None
+    assert ProfileConfig.from_env({"CURSOR_AGENT_PROFILE": "bogus"}) is None
+    config = ProfileConfig.from_env({
+        "CURSOR_AGENT_PROFILE": "1", "CURSOR_AGENT_PROFILE_DIR": "/tmp/profiles", "CURSOR_AGENT_PROFILE_INTERVAL": "0.01",
+    })
+    assert config == ProfileConfig(mode="sample", directory="/tmp/profiles", interval=0.01)
+    resolved = ProfileConfig.resolve("cprofile")
+    assert resolved is not None and resolved.mode == "cprofile"
+    assert ProfileConfig.resolve(False) is None
+    with pytest.raises(ValueError):
+        ProfileConfig.resolve("perf")
+
+    agent = FakeAgent()
+    assert agent.profile_config is None
+    assert asyncio.run(agent.chat("hello")) == "hello"
+
+
+def test_sampled_turn(tmp_path: Any) -> None:
+    """The response breaks the turn down into model, tools and other; the stacks go to a collapsed file."""
+    agent = make_agent(ProfileConfig(directory=str(tmp_path), interval=0.002))
+    response = asyncio.run(agent.chat("profile me"))
+
+    profile = response["profile"]
+    assert profile["mode"] == "sample"
+    assert [(call["name"], call["error"]) for call in profile["tool_calls"]] == [("busy", False), ("fail", True)]
+    assert profile["by_tool"]["busy"]["calls"] == 1
+    assert profile["by_tool"]["busy"]["duration"] >= 0.1
+    assert profile["model"] == pytest.approx(response["usage"]["turn"]["latency"])
+    assert profile["model"] >= 0.05
+    assert profile["duration"] >= profile["model"] + profile["tools"] - 0.001
+    assert profile["samples"] > 0
+
+    lines = open(profile["file"], encoding="utf-8").read().splitlines()
+    assert profile["file"].endswith(".collapsed")
+    stacks = {line.rsplit(" ", 1)[0]: int(line.rsplit(" ", 1)[1]) for line in lines}
+    # The tool ran in an executor thread, which was sampled while it ran
+    busy_samples = sum(count for stack, count in stacks.items() if stack.split(";")[-1].startswith("busy ("))
+    assert busy_samples > 0
+    assert agent._turn_profile is None
+
+
+def test_cprofile_turn(tmp_path: Any) -> None:
+    """cProfile covers the tool threads as well as the turn's thread."""
+    agent = make_agent(ProfileConfig(mode="cprofile", directory=str(tmp_path)))
+    response = asyncio.run(agent.chat("profile me"))
+
+    assert response["profile"]["samples"] is None
+    assert response["profile"]["file"].endswith(".prof")
+    functions = set(pstats.Stats(response["profile"]["file"]).get_stats_profile().func_profiles)
+    assert {"busy", "_model_request"} <= functions
+
+
+def test_sampler_only_counts_added_threads() -> None:
+    sampler = StackSampler()
+    sampler.sample()
+    assert sampler.samples == 0
+
+    sampler.add_thread()
+    sampler.add_thread()
+    sampler.remove_thread()
+    sampler.sample()
+    assert sampler.samples == 1
+    (stack,) = sampler.counts
+    assert stack.startswith("MainThread;")
+    assert stack.split(";")[-1].startswith("sample (")
+
+    sampler.remove_thread()
+    sampler.sample()
+    assert sampler.samples == 1
+    assert sampler.collapsed() == f"{stack} 1\n"
@@ -1,14 +1,25 @@
 import os
 import shutil
+import subprocess
+import sys
 import tempfile
+import time
 import unittest
 from typing import Any, Dict
 
 import pytest
 
+from cursor_agent_tools.sandbox import CommandSandbox, ResourceLimits
 from cursor_agent_tools.tools.file_tools import create_file, delete_file, edit_file, list_directory, read_file
 from cursor_agent_tools.tools.search_tools import file_search, grep_search
 from cursor_agent_tools.tools.system_tools import run_terminal_command
+from cursor_agent_tools.tools.command_cache import CommandCache, is_read_only_command
+from cursor_agent_tools.tools.job_tools import JobManager
+
+if os.name == "posix":
+    import resource
+
+    from cursor_agent_tools.tools.shell_session import ShellSession
 
 
 @pytest.mark.fs_tools
@@ -261,6 +272,222 @@ class TestSystemTools(unittest.TestCase):
         result = run_terminal_command("rm -rf /")
         self.assertIn("error", result)
 
+    def test_run_terminal_command_truncates_large_output(self) -> None:
+        """Test that only the head and tail of very large output are kept."""
+        result = run_terminal_command("echo START; yes line | head -n 100000; echo END")
+        self.assertEqual(result["exit_code"], 0)
+        self.assertTrue(result["stdout"].startswith("START\n"))
+        self.assertTrue(result["stdout"].endswith("END\n"))
+        self.assertIn("characters of output truncated", result["stdout"])
+        self.assertLess(len(result["stdout"]), 100 * 1024)
+        self.assertGreater(result["truncated_chars"]["stdout"], 0)
+
+
+class TestCommandCache(unittest.TestCase):
+    """Test the read-only command cache."""
+
+    def setUp(self) -> None:
+        """Create a cache and a temp directory."""
+        self.test_dir = tempfile.mkdtemp()
+        self.cache = CommandCache()
+
+    def tearDown(self) -> None:
+        """Remove the temp directory."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_is_read_only_command(self) -> None:
+        """Test the allowlist and the rejection of compound commands."""
+        self.assertTrue(is_read_only_command("git status"))
+        self.assertTrue(is_read_only_command("git status --short"))
+        self.assertTrue(is_read_only_command("ls -la 'my dir'"))
+        self.assertTrue(is_read_only_command("python --version"))
+        self.assertFalse(is_read_only_command("python --version --verbose"))
+        self.assertFalse(is_read_only_command("git branch -D main"))
+        self.assertFalse(is_read_only_command("ls; rm -rf build"))
+        self.assertFalse(is_read_only_command("ls > listing.txt"))
+        self.assertFalse(is_read_only_command("git status && git push"))
+        self.assertFalse(is_read_only_command("ls $(touch x)"))
+        self.assertFalse(is_read_only_command("git diff --output=patch.diff"))
+        self.assertTrue(is_read_only_command("make --version", ["make --version"]))
+
+    def test_entries_are_invalidated_by_fingerprint_changes(self) -> None:
+        """Test that a cached result is only reused while the fingerprint matches."""
+        result = {"command": "ls", "exit_code": 0, "stdout": "a\n", "stderr": ""}
+        fingerprint = self.cache.fingerprint(self.test_dir, 0)
+        self.cache.put("ls", self.test_dir, fingerprint, result)
+
+        cached = self.cache.get("ls", self.test_dir, self.cache.fingerprint(self.test_dir, 0))
+        assert cached is not None
+        self.assertEqual(cached["stdout"], "a\n")
+        self.assertTrue(cached["cached"])
+
+        # A mutating tool ran
+        self.assertIsNone(self.cache.get("ls", self.test_dir, self.cache.fingerprint(self.test_dir, 1)))
+
+        # A file was added to the directory
+        self.cache.put("ls", self.test_dir, fingerprint, result)
+        time.sleep(0.01)
+        with open(os.path.join(self.test_dir, "b"), "w") as f:
+            f.write("")
+        self.assertIsNone(self.cache.get("ls", self.test_dir, self.cache.fingerprint(self.test_dir, 0)))
+
+    def test_failed_results_are_not_cached(self) -> None:
+        """Test that only successful results are stored."""
+        fingerprint = self.cache.fingerprint(self.test_dir, 0)
+        self.cache.put("ls missing", self.test_dir, fingerprint, {"exit_code": 2, "error": "failed"})
+        self.assertIsNone(self.cache.get("ls missing", self.test_dir, fingerprint))
+
+
+@unittest.skipUnless(os.name == "posix", "resource limits require POSIX")
+class TestCommandSandbox(unittest.TestCase):
+    """Test resource limits and accounting for commands."""
+
+    def run_python(self, code: str, limits: Any = None) -> Dict[str, Any]:
+        """Run a Python snippet in a sandbox and return its exit code and usage."""
+        sandbox = CommandSandbox(limits)
+        args, shell = sandbox.wrap([sys.executable, "-c", code])
+        process = subprocess.Popen(args, shell=shell, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        exit_code = sandbox.wait(process, timeout=30)
+        sandbox.finish()
+        return dict(sandbox.usage(), exit_code=exit_code)
+
+    def test_usage_is_measured_without_limits(self) -> None:
+        """Test that CPU time and peak RSS are reported for every command."""
+        # Peak RSS is only known when it exceeds the test process's own peak
+        size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 + 64 * 1024 * 1024
+        result = self.run_python(f"b = bytearray({size}); b[::4096] = b'x' * len(b[::4096]); sum(range(3000000))")
+        self.assertEqual(result["exit_code"], 0)
+        self.assertIsNone(result["sandbox"])
+        self.assertGreater(result["cpu_time"], 0)
+        self.assertGreater(result["max_rss"], size)
+
+    def test_cpu_time_limit(self) -> None:
+        """Test that a busy loop is stopped by the CPU time limit."""
+        result = self.run_python("while True: pass", ResourceLimits(cpu_time=1, use_cgroups=False))
+        self.assertNotEqual(result["exit_code"], 0)
+        self.assertEqual(result["sandbox"], "rlimit")
+        self.assertEqual(result["limit_exceeded"], "cpu_time")
+
+    def test_memory_limit(self) -> None:
+        """Test that allocations beyond the memory limit fail."""
+        limits = ResourceLimits(memory=256 * 1024 * 1024, use_cgroups=False)
+        self.assertEqual(self.run_python("b = bytearray(16 * 1024 * 1024)", limits)["exit_code"], 0)
+        self.assertNotEqual(self.run_python("b = bytearray(512 * 1024 * 1024)", limits)["exit_code"], 0)
+
+    def test_shell_command_runs_under_the_limits(self) -> None:
+        """Test that shell commands are started through the exec wrapper with the limits set."""
+        sandbox = CommandSandbox(ResourceLimits(open_files=100, use_cgroups=False))
+        args, shell = sandbox.wrap("ulimit -n; echo $$", shell=True)
+        self.assertFalse(shell)
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+        output, _ = process.communicate(timeout=30)
+        # The wrapper execs the shell, which keeps the process ID
+        self.assertEqual(output.split(), ["100", str(process.pid)])
+        self.assertEqual(CommandSandbox(None).wrap("ls", shell=True), ("ls", True))
+
+    def test_limits_from_env(self) -> None:
+        """Test reading limits from environment variables."""
+        self.assertIsNone(ResourceLimits.from_env({}))
+        limits = ResourceLimits.from_env({"CURSOR_AGENT_LIMIT_MEMORY_MB": "512", "CURSOR_AGENT_LIMIT_CPU_TIME": "60"})
+        assert limits is not None
+        self.assertEqual(limits.memory, 512 * 1024 * 1024)
+        self.assertEqual(limits.cpu_time, 60)
+        self.assertIsNone(limits.for_long_running().cpu_time)
+
+
+@unittest.skipUnless(os.name == "posix", "persistent shell sessions require a pty")
+class TestShellSession(unittest.TestCase):
+    """Test persistent shell sessions."""
+
+    def setUp(self) -> None:
+        """Start a shell session in a temp directory."""
+        self.test_dir = tempfile.mkdtemp()
+        self.session = ShellSession(cwd=self.test_dir)
+
+    def tearDown(self) -> None:
+        """Terminate the shell and remove the temp directory."""
+        self.session.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_state_persists_between_commands(self) -> None:
+        """Test that cwd and environment variables carry over."""
+        os.mkdir(os.path.join(self.test_dir, "sub"))
+        result = self.session.run("cd sub && export GREETING=hello", timeout=10)
+        self.assertEqual(result["exit_code"], 0)
+        self.assertTrue(result["cwd"].endswith("sub"))
+
+        result = self.session.run("echo $GREETING; false", timeout=10)
+        self.assertEqual(result["output"], "hello\n")
+        self.assertEqual(result["exit_code"], 1)
+
+    def test_timeout_interrupts_command_and_keeps_shell(self) -> None:
+        """Test that a timed out command is interrupted without losing shell state."""
+        self.session.run("export KEEP=1", timeout=10)
+        result = self.session.run("sleep 30", timeout=1)
+        self.assertTrue(result["timed_out"])
+        self.assertFalse(result["restarted"])
+
+        result = self.session.run("echo $KEEP", timeout=10)
+        self.assertEqual(result["output"], "1\n")
+
+    def test_shell_restarts_after_exit(self) -> None:
+        """Test that the shell is replaced after the session's shell exits."""
+        result = self.session.run("exit 3", timeout=10)
+        self.assertEqual(result["exit_code"], 3)
+
+        result = self.session.run("echo back", timeout=10)
+        self.assertEqual(result["output"], "back\n")
+        self.assertTrue(result["restarted"])
+
+
+@unittest.skipUnless(os.name == "posix", "background job tests use POSIX shell commands")
+class TestJobManager(unittest.TestCase):
+    """Test background jobs."""
+
+    def setUp(self) -> None:
+        """Create a job manager."""
+        self.manager = JobManager()
+
+    def tearDown(self) -> None:
+        """Kill remaining jobs and remove their logs."""
+        self.manager.close()
+
+    def wait_for_exit(self, job_id: str, timeout: float = 10) -> None:
+        """Wait until a job has been reaped."""
+        deadline = time.time() + timeout
+        while self.manager.get(job_id).running and time.time() < deadline:
+            time.sleep(0.05)
+
+    def test_output_is_captured_and_job_reaped(self) -> None:
+        """Test that a job's output is drained to its log and its exit code recorded."""
+        job = self.manager.start("seq 1 200000; echo done >&2; exit 4")
+        self.wait_for_exit(job.job_id)
+
+        status = job.to_dict()
+        self.assertEqual(status["status"], "exited")
+        self.assertEqual(status["exit_code"], 4)
+        self.assertEqual(self.manager.tail(job.job_id, 2), ["200000", "done"])
+
+    def test_kill_stops_job_and_children(self) -> None:
+        """Test that job_kill terminates the job's whole process group."""
+        job = self.manager.start("sleep 30 & sleep 30; wait")
+        self.assertTrue(job.running)
+
+        self.manager.kill(job.job_id, grace_period=2)
+        self.assertEqual(job.to_dict()["status"], "killed")
+        self.assertLess(job.to_dict()["runtime"], 10)
+
+    def test_log_rotation_bounds_disk_usage(self) -> None:
+        """Test that job logs are rotated and the tail spans rotated files."""
+        job = self.manager.start("seq 1 1000000")
+        job.log.max_bytes = 64 * 1024
+        self.wait_for_exit(job.job_id)
+
+        files = job.log.files()
+        self.assertLessEqual(len(files), job.log.backup_count + 1)
+        self.assertLess(sum(os.path.getsize(path) for path in files), 5 * 64 * 1024)
+        self.assertEqual(self.manager.tail(job.job_id, 1), ["1000000"])
+
 
 if __name__ == "__main__":
     unittest.main()
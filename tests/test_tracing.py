@@ -0,0 +1,133 @@
+"""
+Tests for tracing: span nesting, the OTLP/JSON export and agent instrumentation.
+"""
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator
+from unittest.mock import MagicMock
+
+import pytest
+
+from cursor_agent_tools import tracing
+from cursor_agent_tools.base import agent_turn
+from cursor_agent_tools.tracing import configure_tracing, current_trace_id, parse_traceparent, start_span
+from tests.test_base_agent import FakeAgent
+
+
+@pytest.fixture
+def trace_file(tmp_path: Path) -> Iterator[Path]:
+    """Export spans to a temporary file; the default tracer is restored afterwards."""
+    path = tmp_path / "traces.jsonl"
+    configure_tracing(enabled=True, path=str(path))
+    yield path
+    configure_tracing()
+
+
+def exported_spans(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Flush the exporter and return the exported spans by name."""
+    tracing.shutdown_tracing()
+    spans = {}
+    for line in path.read_text().splitlines():
+        for resource_spans in json.loads(line)["resourceSpans"]:
+            for scope_spans in resource_spans["scopeSpans"]:
+                for span in scope_spans["spans"]:
+                    spans[span["name"]] = span
+    return spans
+
+
+def attributes(span: Dict[str, Any]) -> Dict[str, Any]:
+    return {item["key"]: next(iter(item["value"].values())) for item in span["attributes"]}
+
+
+def test_spans_nest_and_export_as_otlp_json(trace_file: Path) -> None:
+    """Child spans share the trace, link to their parent, and exceptions are recorded."""
+    with start_span("outer", {"count": 3, "ratio": 0.5, "flag": True}) as outer:
+        assert current_trace_id() == outer.trace_id
+        with pytest.raises(ValueError):
+            with start_span("inner", {"skipped": None}):
+                raise ValueError("boom")
+    assert current_trace_id() is None
+
+    spans = exported_spans(trace_file)
+    assert spans["inner"]["traceId"] == spans["outer"]["traceId"] == outer.trace_id
+    assert spans["inner"]["parentSpanId"] == spans["outer"]["spanId"]
+    assert "parentSpanId" not in spans["outer"]
+    assert attributes(spans["outer"]) == {"count": "3", "ratio": 0.5, "flag": True}
+    assert attributes(spans["inner"]) == {}
+    assert spans["inner"]["status"] == {"code": tracing.STATUS_ERROR, "message": "boom"}
+    assert spans["inner"]["events"][0]["name"] == "exception"
+    assert int(spans["outer"]["endTimeUnixNano"]) >= int(spans["inner"]["endTimeUnixNano"])
+
+
+def test_traceparent_propagation(trace_file: Path) -> None:
+    """An incoming traceparent header makes the span part of the caller's trace."""
+    header = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+    assert parse_traceparent(header) == ("0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331")
+    assert parse_traceparent("00-" + "0" * 32 + "-b7ad6b7169203331-01") is None
+    assert parse_traceparent("garbage") is None
+
+    with start_span("server", parent=header, kind="server") as span:
+        assert span.traceparent.startswith("00-0af7651916cd43dd8448eb211c80319c-")
+
+    spans = exported_spans(trace_file)
+    assert spans["server"]["parentSpanId"] == "b7ad6b7169203331"
+    assert spans["server"]["kind"] == tracing.SPAN_KINDS["server"]
+
+
+def test_disabled_tracing_records_nothing(tmp_path: Path) -> None:
+    """With tracing disabled spans are non-recording and nothing is written."""
+    path = tmp_path / "traces.jsonl"
+    configure_tracing(enabled=False, path=str(path))
+    try:
+        with start_span("ignored") as span:
+            span.set_attribute("key", "value")
+            assert not span.recording
+            assert current_trace_id() is None
+    finally:
+        configure_tracing()
+    assert not path.exists()
+
+
+def test_agent_turn_model_request_and_tool_spans(trace_file: Path) -> None:
+    """A turn's model request and tools, run in a worker thread, are children of its span."""
+
+    class TracedAgent(FakeAgent):
+        @agent_turn
+        async def chat(self, message: str, user_info: Any = None) -> Any:
+            response = MagicMock(usage=MagicMock(input_tokens=12, output_tokens=7), model="fake-model-1")
+
+            async def create() -> Any:
+                return response
+
+            await self._model_request(create())
+            results = await self._run_tool_calls([{"name": "echo", "input": {"text": "hello"}}])
+            return results[0]["output"]["text"]
+
+    agent = TracedAgent(model="fake-model")
+    agent.register_tool("echo", lambda text: {"text": text}, "Echo text", {"properties": {}})
+
+    assert asyncio.run(agent.chat("hi")) == "hello"
+
+    spans = exported_spans(trace_file)
+    turn, request, tool = spans["agent.chat"], spans["model.request"], spans["tool.call"]
+    assert request["parentSpanId"] == turn["spanId"] and tool["parentSpanId"] == turn["spanId"]
+    assert attributes(turn)["agent.message_length"] == "2"
+    assert attributes(request) == {
+        "gen_ai.system": "traced",
+        "gen_ai.request.model": "fake-model",
+        "gen_ai.response.model": "fake-model-1",
+        "gen_ai.usage.input_tokens": "12",
+        "gen_ai.usage.output_tokens": "7",
+    }
+    assert attributes(tool) == {"tool.name": "echo", "tool.arguments_size": "17", "tool.result_size": "17"}
+
+
+def test_response_usage_formats() -> None:
+    """Token usage is read from Anthropic, OpenAI-compatible and Ollama responses."""
+    usage = FakeAgent._response_usage
+    assert usage(MagicMock(usage=MagicMock(input_tokens=1, output_tokens=2))) == {"input_tokens": 1, "output_tokens": 2}
+    assert usage({"usage": {"prompt_tokens": 3, "completion_tokens": 4}}) == {"input_tokens": 3, "output_tokens": 4}
+    assert usage({"prompt_eval_count": 5, "eval_count": 6}) == {"input_tokens": 5, "output_tokens": 6}
+    assert usage({"message": {}}) == {}
@@ -0,0 +1,102 @@
+"""
+Tests for token, latency and cost accounting and usage budgets.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from cursor_agent_tools.base import agent_turn
+from cursor_agent_tools.usage import BudgetExceededError, ModelPrice, UsageBudget, UsageTracker, model_price
+from tests.test_base_agent import FakeAgent
+
+
+class MeteredAgent(FakeAgent):
+    """Fake agent making one model request per turn with scripted usage."""
+
+    def __init__(self, usages: List[Dict[str, Any]], model: str = "claude-3-5-sonnet-latest"):
+        super().__init__(model=model)
+        self.usages = list(usages)
+
+    @agent_turn
+    async def chat(self, message: str, user_info: Optional[Dict[str, Any]] = None) -> Any:
+        async def create() -> Dict[str, Any]:
+            return {"usage": self.usages.pop(0)}
+
+        await self._model_request(create())
+        return {"message": message, "tool_calls": [], "thinking": None}
+
+
+def test_response_usage_counts_cached_tokens_separately() -> None:
+    """Anthropic and OpenAI cache tokens are normalized to the same fields."""
+    anthropic = {"usage": {
+        "input_tokens": 100, "output_tokens": 20,
+        "cache_read_input_tokens": 1000, "cache_creation_input_tokens": 500,
+    }}
+    assert FakeAgent._response_usage(anthropic) == {
+        "input_tokens": 100, "output_tokens": 20, "cache_read_tokens": 1000, "cache_creation_tokens": 500,
+    }
+    openai = {"usage": {"prompt_tokens": 1200, "completion_tokens": 30, "prompt_tokens_details": {"cached_tokens": 1024}}}
+    assert FakeAgent._response_usage(openai) == {"input_tokens": 176, "output_tokens": 30, "cache_read_tokens": 1024}
+
+
+def test_costs_and_totals() -> None:
+    """Requests are priced by the longest matching model prefix; unknown models are counted apart."""
+    assert model_price("openai", "gpt-4o-mini-2024-07-18") == ModelPrice(0.15, 0.60, 0.075)
+    assert model_price("ollama", "llama3") == ModelPrice(0.0, 0.0)
+    assert model_price("openai", "my-fine-tune") is None
+
+    tracker = UsageTracker()
+    call = tracker.record("claude", "claude-3-5-sonnet-latest", {
+        "input_tokens": 1_000_000, "output_tokens": 100_000, "cache_read_tokens": 1_000_000,
+    }, 2.0)
+    assert call["cost"] == pytest.approx(3.0 + 1.5 + 0.3)
+    assert tracker.record("openai", "my-fine-tune", {"input_tokens": 10}, 1.0)["cost"] is None
+
+    report = tracker.report()
+    assert report["session"]["api_calls"] == 2
+    assert report["session"]["input_tokens"] == 1_000_010
+    assert report["session"]["cost"] == pytest.approx(4.8)
+    assert report["session"]["unpriced_calls"] == 1
+    assert report["session"]["latency"] == pytest.approx(3.0)
+
+
+def test_usage_per_turn_and_session() -> None:
+    """Responses carry the turn's usage and the session totals; each turn starts from zero."""
+    agent = MeteredAgent([
+        {"input_tokens": 10, "output_tokens": 5},
+        {"input_tokens": 20, "output_tokens": 7},
+    ])
+
+    first = asyncio.run(agent.chat("one"))
+    second = asyncio.run(agent.chat("two"))
+
+    assert first["usage"]["turn"]["input_tokens"] == 10
+    assert second["usage"]["turn"]["input_tokens"] == 20
+    assert len(second["usage"]["calls"]) == 1 and second["usage"]["calls"][0]["output_tokens"] == 7
+    assert second["usage"]["session"]["input_tokens"] == 30
+    assert second["usage"]["session"]["output_tokens"] == 12
+    assert agent.get_usage()["session"]["api_calls"] == 2
+
+
+def test_budget_stops_the_session() -> None:
+    """Once the budget is used up, model requests and new turns are refused."""
+    agent = MeteredAgent([{"input_tokens": 60, "output_tokens": 50}, {"input_tokens": 1, "output_tokens": 1}])
+    agent.set_usage_budget(UsageBudget(max_tokens=100))
+
+    response = asyncio.run(agent.chat("expensive"))
+    assert response["usage"]["budget_exceeded"] == "token budget of 100 exhausted (110 used)"
+    assert UsageBudget(max_tokens=100).remaining(response["usage"]["session"])["tokens"] == 0
+
+    with pytest.raises(BudgetExceededError):
+        asyncio.run(agent.chat("again"))
+
+    async def request() -> None:
+        async def create() -> Dict[str, Any]:
+            return {}
+        await agent._model_request(create())
+
+    with pytest.raises(BudgetExceededError):
+        asyncio.run(request())
+    assert agent.get_usage()["session"]["api_calls"] == 1
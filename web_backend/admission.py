@@ -0,0 +1,269 @@
+"""
+准入控制：限制并发执行的 agent 请求数量，避免单个用户拖慢所有人
+
+- 每个会话、每个租户（API Key）有各自的并发上限，超限立即拒绝
+- 全局并发上限：超出的请求进入有界的 FIFO 等待队列，队列已满或等待超时则拒绝
+- 拒绝时给出建议的重试间隔（Retry-After），按最近请求的平均执行时长估算
+- 记录排队等待时间等指标（/api/admission；排队等待时间和拒绝次数也导出到 /metrics）
+
+终端命令和模型请求都在已准入的对话轮次内执行，由该轮次占用的名额覆盖，不单独准入。
+
+所有方法都应在同一个事件循环中调用（API 进程的事件循环）。
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Mapping, Optional
+
+from cursor_agent_tools.logger import get_logger
+from cursor_agent_tools.metrics import REGISTRY as METRICS
+
+logger = get_logger(__name__)
+
+# 排队等待时间直方图的桶上界（秒），与 Prometheus 直方图的 le 标签对应
+WAIT_TIME_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+ADMISSION_QUEUE_WAIT_SECONDS = METRICS.histogram(
+    "cursor_agent_admission_queue_wait_seconds",
+    "Time admitted requests waited for an admission slot",
+    buckets=WAIT_TIME_BUCKETS,
+)
+ADMISSION_REJECTED = METRICS.counter(
+    "cursor_agent_admission_rejected_total", "Requests rejected by admission control", ("reason",)
+)
+
+# 平均执行时长的指数滑动平均系数
+HOLD_TIME_SMOOTHING = 0.2
+
+# Retry-After 的取值范围（秒）
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+
+
+class AdmissionRejected(Exception):
+    """请求因并发限制被拒绝"""
+
+    def __init__(self, reason: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+def tenant_key(headers: Mapping[str, str], client_host: Optional[str]) -> str:
+    """
+    确定请求所属的租户：优先使用 X-API-Key / Authorization 头，否则按客户端地址区分
+
+    API Key 只保留哈希前缀，不在内存中保存原文。
+    """
+    api_key = headers.get("x-api-key")
+    if not api_key:
+        authorization = headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            api_key = authorization[7:].strip()
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    return f"ip:{client_host or 'unknown'}"
+
+
+class AdmissionTicket:
+    """一次被准入的请求；release() 可重复调用，只生效一次"""
+
+    def __init__(self, controller: "AdmissionController", session_id: str, tenant: str, wait_time: float):
+        self.controller = controller
+        self.session_id = session_id
+        self.tenant = tenant
+        self.wait_time = wait_time
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    准入控制器
+
+    Args:
+        global_limit: 全局同时执行的请求数上限（0 表示不限制）
+        queue_size: 全局等待队列的最大长度
+        queue_timeout: 在等待队列中的最长等待时间（秒）
+        session_limit: 每个会话同时执行的请求数上限（0 表示不限制）
+        tenant_limit: 每个租户同时执行和排队的请求数上限（0 表示不限制）
+    """
+
+    def __init__(
+        self,
+        global_limit: int = 32,
+        queue_size: int = 64,
+        queue_timeout: float = 10.0,
+        session_limit: int = 2,
+        tenant_limit: int = 8,
+    ):
+        self.global_limit = global_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.session_limit = session_limit
+        self.tenant_limit = tenant_limit
+
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._session_counts: Counter = Counter()
+        self._tenant_counts: Counter = Counter()
+        self._avg_hold_time = 1.0
+
+        # 指标
+        self._admitted = 0
+        self._rejected: Counter = Counter()
+        self._wait_count = 0
+        self._wait_sum = 0.0
+        self._wait_max = 0.0
+        self._wait_buckets = [0] * len(WAIT_TIME_BUCKETS)
+
+    # ---------- 准入 ----------
+
+    async def acquire(self, session_id: str, tenant: str) -> AdmissionTicket:
+        """
+        申请执行名额，必要时在全局队列中等待
+
+        Raises:
+            AdmissionRejected: 会话/租户超过并发上限，或全局队列已满/等待超时
+        """
+        if self.session_limit and self._session_counts[session_id] >= self.session_limit:
+            self._reject("session_limit", f"会话并发请求数已达上限 ({self.session_limit})", self._retry_after(1))
+        if self.tenant_limit and self._tenant_counts[tenant] >= self.tenant_limit:
+            self._reject("tenant_limit", f"并发请求数已达上限 ({self.tenant_limit})", self._retry_after(1))
+
+        # 排队中的请求也计入会话/租户的并发数，防止单个租户占满全局队列
+        self._session_counts[session_id] += 1
+        self._tenant_counts[tenant] += 1
+        started = time.monotonic()
+        try:
+            await self._acquire_slot()
+        except BaseException:
+            self._release_counts(session_id, tenant)
+            raise
+
+        wait_time = time.monotonic() - started
+        self._record_wait(wait_time)
+        self._admitted += 1
+        return AdmissionTicket(self, session_id, tenant, wait_time)
+
+    @asynccontextmanager
+    async def admit(self, session_id: str, tenant: str) -> AsyncIterator[AdmissionTicket]:
+        """acquire() 的上下文管理器形式，退出时释放名额"""
+        ticket = await self.acquire(session_id, tenant)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    async def _acquire_slot(self) -> None:
+        if not self.global_limit or (self._in_flight < self.global_limit and not self._waiters):
+            self._in_flight += 1
+            return
+
+        if len(self._waiters) >= self.queue_size:
+            self._reject("queue_full", "服务繁忙，等待队列已满", self._retry_after(len(self._waiters) + 1))
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已经转交给本请求，但调用方已放弃 → 归还名额
+                self._release_slot()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("queue_timeout", f"服务繁忙，排队超过 {self.queue_timeout:g} 秒", self._retry_after(len(self._waiters) + 1))
+            raise
+
+    # ---------- 释放 ----------
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        hold_time = time.monotonic() - ticket.admitted_at
+        self._avg_hold_time += HOLD_TIME_SMOOTHING * (hold_time - self._avg_hold_time)
+        self._release_counts(ticket.session_id, ticket.tenant)
+        self._release_slot()
+
+    def _release_counts(self, session_id: str, tenant: str) -> None:
+        self._session_counts[session_id] -= 1
+        if self._session_counts[session_id] <= 0:
+            del self._session_counts[session_id]
+        self._tenant_counts[tenant] -= 1
+        if self._tenant_counts[tenant] <= 0:
+            del self._tenant_counts[tenant]
+
+    def _release_slot(self) -> None:
+        # 名额直接转交给队首的等待者，保证 FIFO 顺序
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    # ---------- 工具函数 ----------
+
+    def _reject(self, reason: str, message: str, retry_after: int) -> None:
+        self._rejected[reason] += 1
+        ADMISSION_REJECTED.inc((reason,))
+        logger.warning(f"Admission rejected ({reason}): {message}, retry after {retry_after}s")
+        raise AdmissionRejected(reason, message, retry_after)
+
+    def _retry_after(self, position: int) -> int:
+        """按平均执行时长估算排在第 position 位的请求多久后能获得名额"""
+        slots = self.global_limit or 1
+        estimate = self._avg_hold_time * math.ceil(position / slots)
+        return int(min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(estimate))))
+
+    def _record_wait(self, wait_time: float) -> None:
+        ADMISSION_QUEUE_WAIT_SECONDS.observe(wait_time)
+        self._wait_count += 1
+        self._wait_sum += wait_time
+        self._wait_max = max(self._wait_max, wait_time)
+        for i, bound in enumerate(WAIT_TIME_BUCKETS):
+            if wait_time <= bound:
+                self._wait_buckets[i] += 1
+
+    # ---------- 指标 ----------
+
+    def stats(self) -> Dict[str, Any]:
+        """准入控制指标：当前并发数、排队数、拒绝次数和排队等待时间分布"""
+        return {
+            "limits": {
+                "global": self.global_limit,
+                "queue_size": self.queue_size,
+                "queue_timeout": self.queue_timeout,
+                "session": self.session_limit,
+                "tenant": self.tenant_limit,
+            },
+            "in_flight": self._in_flight,
+            "queued": sum(1 for waiter in self._waiters if not waiter.done()),
+            "active_sessions": len(self._session_counts),
+            "active_tenants": len(self._tenant_counts),
+            "admitted": self._admitted,
+            "rejected": dict(self._rejected),
+            "avg_hold_time_ms": round(self._avg_hold_time * 1000, 2),
+            "queue_wait": {
+                "count": self._wait_count,
+                "sum_seconds": round(self._wait_sum, 6),
+                "avg_ms": round(self._wait_sum / self._wait_count * 1000, 2) if self._wait_count else 0.0,
+                "max_ms": round(self._wait_max * 1000, 2),
+                "buckets": {str(bound): count for bound, count in zip(WAIT_TIME_BUCKETS, self._wait_buckets)},
+            },
+        }
@@ -0,0 +1,689 @@
+"""
+Agent 工作进程池
+
+将 agent 的执行（工具 I/O、子进程、大结果的序列化）从 API 进程的事件循环中隔离出来：
+
+- 每个工作进程持有若干会话的 agent 实例，并在自己的事件循环中执行对话轮次
+- API 进程与工作进程之间通过 multiprocessing 队列通信
+- 会话固定分配到一个工作进程（新会话分配给会话数最少的进程）
+- 每个工作进程有并发上限，超出的请求在进程内排队；API 进程统计各进程的排队深度
+- 权限请求和工具进度事件由工作进程转发回 API 进程，复用 Web 端已有的权限回调和事件队列
+- 调用消息携带 API 进程当前 span 的 traceparent，工作进程中的 span 归入同一条 trace
+- 工作进程定期上报自身的指标快照（模型请求、工具调用等），API 进程的 /metrics 汇总各进程的数据
+"""
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from cursor_agent_tools.logger import get_logger
+from cursor_agent_tools.metrics import REGISTRY as METRICS, Snapshot
+from cursor_agent_tools.permissions import PermissionGrant, PermissionRequest, PermissionStatus
+from cursor_agent_tools.tracing import current_span, start_span
+from cursor_agent_tools.usage import UsageBudget
+
+logger = get_logger(__name__)
+
+# 工作进程等待 API 进程权限答复的最长时间（秒），API 端自身有 30 秒超时，这里只是兜底
+PERMISSION_REPLY_TIMEOUT = 120.0
+
+# API 进程检查工作进程存活状态的间隔（秒）
+HEALTH_CHECK_INTERVAL = 1.0
+
+# 工作进程上报指标快照的间隔（秒）
+METRICS_REPORT_INTERVAL = 5.0
+
+
+class WorkerCallError(Exception):
+    """工作进程执行请求失败（agent 抛出异常或工作进程异常退出）"""
+
+
+# ==================== 工作进程端 ====================
+
+class _WorkerRuntime:
+    """运行在工作进程中：持有 agent 实例，执行 API 进程发来的请求"""
+
+    def __init__(
+        self,
+        worker_id: int,
+        inbox: "multiprocessing.Queue",
+        outbox: "multiprocessing.Queue",
+        max_concurrency: int,
+        agent_factory: Optional[Callable[..., Any]],
+    ):
+        self.worker_id = worker_id
+        self.inbox = inbox
+        self.outbox = outbox
+        self.max_concurrency = max_concurrency
+        if agent_factory is None:
+            from cursor_agent_tools import create_agent
+            agent_factory = create_agent
+        self.agent_factory = agent_factory
+
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.calls: Dict[str, Dict[str, Any]] = {}
+        self.permission_replies: Dict[str, Dict[str, Any]] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.stopped: Optional[asyncio.Event] = None
+
+    def send(self, message: Dict[str, Any]) -> None:
+        message["worker_id"] = self.worker_id
+        self.outbox.put(message)
+
+    async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.stopped = asyncio.Event()
+
+        # 收件箱的阻塞读取放在独立线程中，消息交给事件循环处理
+        threading.Thread(target=self._read_inbox, name=f"agent-worker-{self.worker_id}-inbox", daemon=True).start()
+        logger.info(f"Agent worker {self.worker_id} started (pid={os.getpid()}, max_concurrency={self.max_concurrency})")
+
+        reporter = self.loop.create_task(self._report_metrics())
+        await self.stopped.wait()
+        reporter.cancel()
+        for call in list(self.calls.values()):
+            call["task"].cancel()
+        logger.info(f"Agent worker {self.worker_id} stopped")
+
+    async def _report_metrics(self) -> None:
+        """定期把本进程的指标快照发给 API 进程（快照是累计值，API 进程只保留最新一份）"""
+        while True:
+            await asyncio.sleep(METRICS_REPORT_INTERVAL)
+            self.send({"type": "metrics", "snapshot": METRICS.snapshot()})
+
+    def _read_inbox(self) -> None:
+        while True:
+            message = self.inbox.get()
+            if message.get("op") == "permission_reply":
+                # 权限答复直接在读线程中处理：等待它的是工具执行线程，不需要经过事件循环
+                self._resolve_permission(message)
+                continue
+            self.loop.call_soon_threadsafe(self._dispatch, message)
+            if message.get("op") == "shutdown":
+                return
+
+    def _dispatch(self, message: Dict[str, Any]) -> None:
+        op = message.get("op")
+        if op == "create":
+            self._create_session(message)
+        elif op == "close":
+            self._cancel_session(message["session_id"])
+            session = self.sessions.pop(message["session_id"], None)
+            if session and "agent" in session:
+                session["agent"].close()
+        elif op == "cancel":
+            self._cancel_session(message["session_id"])
+        elif op == "call":
+            task = self.loop.create_task(self._run_call(message))
+            self.calls[message["call_id"]] = {"session_id": message["session_id"], "task": task}
+        elif op == "shutdown":
+            self.stopped.set()
+        else:
+            logger.warning(f"Agent worker {self.worker_id} received unknown op: {op}")
+
+    def _create_session(self, message: Dict[str, Any]) -> None:
+        session_id = message["session_id"]
+        try:
+            agent = self.agent_factory(
+                permission_callback=self._make_permission_callback(session_id),
+                **message["agent_kwargs"]
+            )
+            agent.register_default_tools()
+            agent.set_event_callback(self._make_event_callback(session_id))
+            if message.get("batch_permissions"):
+                agent.permission_manager.batch_callback = self._make_permission_batch_callback(session_id)
+            agent.set_usage_budget(message.get("usage_budget"))
+            self.sessions[session_id] = {"agent": agent, "workspace_path": message.get("workspace_path")}
+            logger.info(f"Agent worker {self.worker_id} created agent for session {session_id}")
+        except Exception as e:
+            # 创建失败时记录错误，在该会话的下一次请求中返回
+            logger.error(f"Agent worker {self.worker_id} failed to create agent for session {session_id}: {str(e)}")
+            self.sessions[session_id] = {"error": f"创建 agent 失败: {str(e)}"}
+
+    def _cancel_session(self, session_id: str) -> None:
+        session = self.sessions.get(session_id)
+        if session and "agent" in session:
+            session["agent"].cancel()
+        # 仍在排队（尚未获得并发名额）的请求直接取消
+        for call in self.calls.values():
+            if call["session_id"] == session_id:
+                call["task"].cancel()
+
+    async def _run_call(self, message: Dict[str, Any]) -> None:
+        call_id = message["call_id"]
+        reply: Dict[str, Any] = {"type": "result", "call_id": call_id}
+        try:
+            session = self.sessions.get(message["session_id"])
+            if session is None:
+                raise WorkerCallError("会话不存在")
+            if "error" in session:
+                raise WorkerCallError(session["error"])
+
+            async with self.semaphore:
+                self.send({"type": "started", "call_id": call_id})
+                with start_span(f"worker.{message['method']}", {
+                    "worker.id": self.worker_id,
+                    "session.id": message["session_id"],
+                }, parent=message.get("traceparent")):
+                    reply["result"] = await self._invoke(session, message["method"], message["kwargs"])
+        except asyncio.CancelledError:
+            reply["cancelled"] = True
+        except Exception as e:
+            logger.error(f"Agent worker {self.worker_id} call {message['method']} failed: {str(e)}")
+            reply["error"] = str(e)
+        finally:
+            self.calls.pop(call_id, None)
+        self.send(reply)
+
+    async def _invoke(self, session: Dict[str, Any], method: str, kwargs: Dict[str, Any]) -> Any:
+        agent = session["agent"]
+        if method == "query_image":
+            return await agent.query_image(**kwargs)
+        if method != "chat":
+            raise WorkerCallError(f"不支持的方法: {method}")
+
+        # 与 API 进程内执行时一致：在会话工作目录中执行
+        workspace_path = session.get("workspace_path")
+        original_cwd = os.getcwd()
+        try:
+            if workspace_path:
+                os.chdir(workspace_path)
+            return await agent.chat(**kwargs)
+        finally:
+            os.chdir(original_cwd)
+
+    def _make_event_callback(self, session_id: str):
+        def event_callback(event_type: str, data: Dict[str, Any]) -> None:
+            self.send({"type": "event", "session_id": session_id, "event": {"type": event_type, "data": data}})
+
+        return event_callback
+
+    def _make_permission_callback(self, session_id: str):
+        def permission_callback(permission_request: PermissionRequest) -> PermissionStatus:
+            """在工具执行线程中调用：把请求转给 API 进程，阻塞等待答复"""
+            request_id = str(uuid.uuid4())
+            waiter = {"event": threading.Event(), "granted": False, "grant": None}
+            self.permission_replies[request_id] = waiter
+            self.send({
+                "type": "permission_request",
+                "session_id": session_id,
+                "request_id": request_id,
+                "operation": permission_request.operation,
+                "details": permission_request.details,
+            })
+            try:
+                if not waiter["event"].wait(PERMISSION_REPLY_TIMEOUT):
+                    logger.warning(f"Agent worker {self.worker_id} timed out waiting for permission reply {request_id}")
+                    return PermissionStatus.DENIED
+                if waiter["grant"] is not None:
+                    # 用户选择记住的授权，由本进程的 PermissionManager 保存
+                    permission_request.grant = PermissionGrant.from_dict(waiter["grant"])
+                return PermissionStatus.GRANTED if waiter["granted"] else PermissionStatus.DENIED
+            finally:
+                self.permission_replies.pop(request_id, None)
+
+        return permission_callback
+
+    def _make_permission_batch_callback(self, session_id: str):
+        def permission_batch_callback(permission_requests: List[PermissionRequest]) -> List[PermissionStatus]:
+            """一轮中多个工具调用的权限请求一次性转给 API 进程，阻塞等待逐项答复"""
+            request_id = str(uuid.uuid4())
+            waiter = {"event": threading.Event(), "granted_list": None, "grants": None}
+            self.permission_replies[request_id] = waiter
+            self.send({
+                "type": "permission_batch_request",
+                "session_id": session_id,
+                "request_id": request_id,
+                "requests": [{"operation": r.operation, "details": r.details} for r in permission_requests],
+            })
+            try:
+                if not waiter["event"].wait(PERMISSION_REPLY_TIMEOUT) or waiter["granted_list"] is None:
+                    logger.warning(f"Agent worker {self.worker_id} timed out waiting for permission batch reply {request_id}")
+                    return [PermissionStatus.DENIED] * len(permission_requests)
+                for permission_request, grant in zip(permission_requests, waiter["grants"] or []):
+                    if grant is not None:
+                        permission_request.grant = PermissionGrant.from_dict(grant)
+                return [PermissionStatus.GRANTED if granted else PermissionStatus.DENIED for granted in waiter["granted_list"]]
+            finally:
+                self.permission_replies.pop(request_id, None)
+
+        return permission_batch_callback
+
+    def _resolve_permission(self, message: Dict[str, Any]) -> None:
+        waiter = self.permission_replies.get(message["request_id"])
+        if waiter is not None:
+            waiter["granted"] = bool(message.get("granted"))
+            waiter["grant"] = message.get("grant")
+            waiter["granted_list"] = message.get("granted_list")
+            waiter["grants"] = message.get("grants")
+            waiter["event"].set()
+
+
+def _worker_main(
+    worker_id: int,
+    inbox: "multiprocessing.Queue",
+    outbox: "multiprocessing.Queue",
+    max_concurrency: int,
+    agent_factory: Optional[Callable[..., Any]],
+) -> None:
+    """工作进程入口"""
+    runtime = _WorkerRuntime(worker_id, inbox, outbox, max_concurrency, agent_factory)
+    try:
+        asyncio.run(runtime.run())
+    except KeyboardInterrupt:
+        pass
+
+
+# ==================== API 进程端 ====================
+
+class RemoteAgent:
+    """
+    工作进程中 agent 的代理，提供 main.py 使用的 agent 接口（chat / query_image / cancel）
+
+    取消 chat() 所在的 asyncio 任务会同时取消工作进程中的执行。
+    """
+
+    def __init__(self, pool: "AgentWorkerPool", session_id: str):
+        self.pool = pool
+        self.session_id = session_id
+
+    async def chat(self, message: str, user_info: Optional[Dict[str, Any]] = None) -> Any:
+        return await self.pool.call(self.session_id, "chat", {"message": message, "user_info": user_info})
+
+    async def query_image(self, image_paths: List[str], query: str) -> str:
+        return await self.pool.call(self.session_id, "query_image", {"image_paths": image_paths, "query": query})
+
+    def cancel(self) -> bool:
+        return self.pool.cancel(self.session_id)
+
+    def close(self) -> None:
+        self.pool.close_session(self.session_id)
+
+
+class _WorkerHandle:
+    """API 进程中对一个工作进程的记录"""
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.inbox: Optional["multiprocessing.Queue"] = None
+        self.sessions: set = set()
+        self.queued = 0
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.restarts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.metrics: Optional[Snapshot] = None
+
+
+class AgentWorkerPool:
+    """
+    Agent 工作进程池（API 进程端）
+
+    Args:
+        num_workers: 工作进程数量
+        max_concurrency: 每个工作进程同时执行的请求数上限
+        agent_factory: 在工作进程中创建 agent 的函数（必须是可 pickle 的模块级函数），
+                       默认为 cursor_agent_tools.create_agent
+    """
+
+    def __init__(self, num_workers: int, max_concurrency: int = 4, agent_factory: Optional[Callable[..., Any]] = None):
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        self.num_workers = num_workers
+        self.max_concurrency = max(1, max_concurrency)
+        self.agent_factory = agent_factory
+
+        # 工作进程使用 spawn 启动：API 进程中已有事件循环和线程，fork 不安全
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[_WorkerHandle] = [_WorkerHandle(i) for i in range(num_workers)]
+        self._outbox: Optional["multiprocessing.Queue"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reader: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+        # session_id -> {"worker", "spec", "permission_callback", "permission_batch_callback", "event_callback", "agent"}
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        # call_id -> {"future", "session_id", "worker", "state", "submitted_at"}
+        self._calls: Dict[str, Dict[str, Any]] = {}
+        # 已退出的工作进程最后上报的指标快照，重启后仍计入汇总，计数不会回退
+        self._retired_metrics: List[Snapshot] = []
+
+    # ---------- 生命周期 ----------
+
+    def start(self) -> None:
+        """启动工作进程（需在 API 进程的事件循环中调用）"""
+        self._loop = asyncio.get_running_loop()
+        self._outbox = self._context.Queue()
+        for handle in self._workers:
+            handle.inbox = self._context.Queue()
+            self._spawn(handle)
+        self._reader = threading.Thread(target=self._read_outbox, name="agent-pool-reader", daemon=True)
+        self._reader.start()
+        logger.info(f"Agent worker pool started: {self.num_workers} workers, max_concurrency={self.max_concurrency}")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """停止所有工作进程，未完成的请求以错误结束"""
+        self._stopping.set()
+        for handle in self._workers:
+            if handle.process is not None and handle.process.is_alive():
+                handle.inbox.put({"op": "shutdown"})
+        for handle in self._workers:
+            if handle.process is None:
+                continue
+            handle.process.join(timeout)
+            if handle.process.is_alive():
+                handle.process.terminate()
+                handle.process.join(timeout)
+        with self._lock:
+            calls = list(self._calls.keys())
+        for call_id in calls:
+            self._finish_call(call_id, error="agent 工作进程池已停止")
+        logger.info("Agent worker pool stopped")
+
+    def _spawn(self, handle: _WorkerHandle) -> None:
+        """启动工作进程，读取 handle 当前的收件箱"""
+        process = self._context.Process(
+            target=_worker_main,
+            args=(handle.worker_id, handle.inbox, self._outbox, self.max_concurrency, self.agent_factory),
+            name=f"agent-worker-{handle.worker_id}",
+            daemon=True,
+        )
+        process.start()
+        handle.process = process
+
+    # ---------- 会话 ----------
+
+    def create_session(
+        self,
+        session_id: str,
+        agent_kwargs: Dict[str, Any],
+        workspace_path: Optional[str],
+        permission_callback: Callable[[PermissionRequest], PermissionStatus],
+        event_callback: Callable[[str, Dict[str, Any]], None],
+        permission_batch_callback: Optional[Callable[[List[PermissionRequest]], List[PermissionStatus]]] = None,
+        usage_budget: Optional[UsageBudget] = None,
+    ) -> RemoteAgent:
+        """
+        在会话数最少的工作进程中创建 agent
+
+        Args:
+            agent_kwargs: 传给 agent_factory 的参数（必须可 pickle，不含 permission_callback）
+            workspace_path: 会话工作目录，工作进程在其中执行 chat
+            permission_callback: API 进程中的权限回调（同步阻塞），在独立线程中调用
+            event_callback: API 进程中的 agent 事件回调
+            permission_batch_callback: API 进程中的批量权限回调（可选），一轮多个工具调用的权限一次询问
+            usage_budget: 会话预算（可选），由工作进程中的 agent 执行
+        """
+        with self._lock:
+            handle = min(self._workers, key=lambda w: len(w.sessions))
+            handle.sessions.add(session_id)
+            spec = {
+                "op": "create",
+                "session_id": session_id,
+                "agent_kwargs": agent_kwargs,
+                "workspace_path": workspace_path,
+                "batch_permissions": permission_batch_callback is not None,
+                "usage_budget": usage_budget,
+            }
+            agent = RemoteAgent(self, session_id)
+            self._sessions[session_id] = {
+                "worker": handle,
+                "spec": spec,
+                "permission_callback": permission_callback,
+                "permission_batch_callback": permission_batch_callback,
+                "event_callback": event_callback,
+                "agent": agent,
+            }
+            inbox = handle.inbox
+        inbox.put(spec)
+        logger.info(f"Session {session_id} assigned to agent worker {handle.worker_id}")
+        return agent
+
+    def close_session(self, session_id: str) -> None:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return
+            session["worker"].sessions.discard(session_id)
+        session["worker"].inbox.put({"op": "close", "session_id": session_id})
+
+    # ---------- 请求 ----------
+
+    async def call(self, session_id: str, method: str, kwargs: Dict[str, Any]) -> Any:
+        """在会话所在的工作进程中调用 agent 方法并等待结果"""
+        call_id = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise WorkerCallError("会话不存在")
+            handle = session["worker"]
+            handle.queued += 1
+            self._calls[call_id] = {
+                "future": future,
+                "session_id": session_id,
+                "worker": handle,
+                "state": "queued",
+                "submitted_at": time.monotonic(),
+            }
+            # 与登记请求在同一把锁内取收件箱：工作进程重启时，登记在前的请求会以错误结束，之后的请求进入新收件箱
+            inbox = handle.inbox
+        span = current_span()
+        inbox.put({
+            "op": "call",
+            "call_id": call_id,
+            "session_id": session_id,
+            "method": method,
+            "kwargs": kwargs,
+            "traceparent": span.traceparent if span is not None and span.recording else None,
+        })
+
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # 调用方被取消（客户端断开、取消请求）→ 同时取消工作进程中的执行
+            self.cancel(session_id)
+            raise
+
+    def cancel(self, session_id: str) -> bool:
+        """取消会话正在执行或排队的请求，返回是否有请求被取消"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            in_flight = any(call["session_id"] == session_id for call in self._calls.values())
+        session["worker"].inbox.put({"op": "cancel", "session_id": session_id})
+        return in_flight
+
+    def _finish_call(self, call_id: str, result: Any = None, error: Optional[str] = None, cancelled: bool = False) -> None:
+        with self._lock:
+            call = self._calls.pop(call_id, None)
+            if call is None:
+                return
+            handle = call["worker"]
+            if call["state"] == "queued":
+                handle.queued -= 1
+            else:
+                handle.running -= 1
+            if cancelled:
+                handle.cancelled += 1
+            elif error is not None:
+                handle.failed += 1
+            else:
+                handle.completed += 1
+
+        future = call["future"]
+
+        def _resolve() -> None:
+            if future.done():
+                return
+            if cancelled:
+                future.cancel()
+            elif error is not None:
+                future.set_exception(WorkerCallError(error))
+            else:
+                future.set_result(result)
+
+        self._loop.call_soon_threadsafe(_resolve)
+
+    # ---------- 工作进程消息 ----------
+
+    def _read_outbox(self) -> None:
+        """读取工作进程发回的消息（独立线程），并定期检查工作进程是否存活"""
+        next_check = time.monotonic() + HEALTH_CHECK_INTERVAL
+        while not self._stopping.is_set():
+            # 按固定间隔检查，消息持续到达时也不会推迟
+            now = time.monotonic()
+            if now >= next_check:
+                self._check_workers()
+                next_check = now + HEALTH_CHECK_INTERVAL
+            try:
+                message = self._outbox.get(timeout=max(next_check - now, 0.01))
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            try:
+                self._handle_message(message)
+            except Exception as e:
+                logger.error(f"Failed to handle agent worker message {message.get('type')}: {str(e)}")
+
+    def _handle_message(self, message: Dict[str, Any]) -> None:
+        message_type = message.get("type")
+        if message_type == "result":
+            self._finish_call(
+                message["call_id"],
+                result=message.get("result"),
+                error=message.get("error"),
+                cancelled=message.get("cancelled", False),
+            )
+        elif message_type == "started":
+            with self._lock:
+                call = self._calls.get(message["call_id"])
+                if call is not None and call["state"] == "queued":
+                    call["state"] = "running"
+                    wait = time.monotonic() - call["submitted_at"]
+                    handle = call["worker"]
+                    handle.queued -= 1
+                    handle.running += 1
+                    handle.started += 1
+                    handle.total_wait += wait
+                    handle.max_wait = max(handle.max_wait, wait)
+        elif message_type == "event":
+            session = self._sessions.get(message["session_id"])
+            if session is not None:
+                event = message["event"]
+                session["event_callback"](event["type"], event["data"])
+        elif message_type == "metrics":
+            self._workers[message["worker_id"]].metrics = message["snapshot"]
+        elif message_type == "permission_request":
+            # Web 权限回调会阻塞等待用户响应，放到独立线程中执行
+            threading.Thread(target=self._handle_permission_request, args=(message,), daemon=True).start()
+        elif message_type == "permission_batch_request":
+            threading.Thread(target=self._handle_permission_batch_request, args=(message,), daemon=True).start()
+        else:
+            logger.warning(f"Unknown message from agent worker {message.get('worker_id')}: {message_type}")
+
+    def _handle_permission_request(self, message: Dict[str, Any]) -> None:
+        session = self._sessions.get(message["session_id"])
+        status = PermissionStatus.DENIED
+        request = PermissionRequest(operation=message["operation"], details=message["details"])
+        if session is not None:
+            try:
+                status = session["permission_callback"](request)
+            except Exception as e:
+                logger.error(f"Permission callback failed for request {message['request_id']}: {str(e)}")
+        worker = self._workers[message["worker_id"]]
+        worker.inbox.put({
+            "op": "permission_reply",
+            "request_id": message["request_id"],
+            "granted": status == PermissionStatus.GRANTED,
+            "grant": request.grant.to_dict() if request.grant is not None else None,
+        })
+
+    def _handle_permission_batch_request(self, message: Dict[str, Any]) -> None:
+        session = self._sessions.get(message["session_id"])
+        requests = [PermissionRequest(operation=r["operation"], details=r["details"]) for r in message["requests"]]
+        statuses = [PermissionStatus.DENIED] * len(requests)
+        if session is not None and session.get("permission_batch_callback") is not None:
+            try:
+                statuses = session["permission_batch_callback"](requests)
+            except Exception as e:
+                logger.error(f"Permission batch callback failed for request {message['request_id']}: {str(e)}")
+        worker = self._workers[message["worker_id"]]
+        worker.inbox.put({
+            "op": "permission_reply",
+            "request_id": message["request_id"],
+            "granted_list": [status == PermissionStatus.GRANTED for status in statuses],
+            "grants": [request.grant.to_dict() if request.grant is not None else None for request in requests],
+        })
+
+    def _check_workers(self) -> None:
+        """工作进程异常退出时：结束其未完成的请求，重启进程并重建其会话的 agent（对话历史丢失）"""
+        for handle in self._workers:
+            if self._stopping.is_set() or handle.process is None or handle.process.is_alive():
+                continue
+            logger.error(f"Agent worker {handle.worker_id} exited unexpectedly (exitcode={handle.process.exitcode}), restarting")
+            with self._lock:
+                lost_calls = [call_id for call_id, call in self._calls.items() if call["worker"] is handle]
+                # 先换上新收件箱并放入会话重建消息，再结束丢失的请求：调用方收到错误后立即重试的请求
+                # 会进入新进程的收件箱，排在会话重建之后，而不是留在已退出进程的收件箱中
+                handle.inbox = self._context.Queue()
+                for sid in handle.sessions:
+                    if sid in self._sessions:
+                        handle.inbox.put(self._sessions[sid]["spec"])
+                if handle.metrics is not None:
+                    self._retired_metrics.append(handle.metrics)
+                    handle.metrics = None
+            handle.restarts += 1
+            self._spawn(handle)
+            for call_id in lost_calls:
+                self._finish_call(call_id, error="agent 工作进程异常退出")
+
+    # ---------- 指标 ----------
+
+    def metrics_snapshots(self) -> List[Snapshot]:
+        """各工作进程最近上报的指标快照（包括已重启进程的最后一份），供 API 进程的 /metrics 汇总"""
+        with self._lock:
+            return self._retired_metrics + [handle.metrics for handle in self._workers if handle.metrics is not None]
+
+    def stats(self) -> Dict[str, Any]:
+        """工作进程池指标：各进程的会话数、排队深度、执行中请求数和排队等待时间"""
+        with self._lock:
+            workers = []
+            for handle in self._workers:
+                workers.append({
+                    "worker_id": handle.worker_id,
+                    "pid": handle.process.pid if handle.process else None,
+                    "alive": bool(handle.process and handle.process.is_alive()),
+                    "sessions": len(handle.sessions),
+                    "queued": handle.queued,
+                    "running": handle.running,
+                    "max_concurrency": self.max_concurrency,
+                    "completed": handle.completed,
+                    "failed": handle.failed,
+                    "cancelled": handle.cancelled,
+                    "restarts": handle.restarts,
+                    "avg_queue_wait_ms": round(handle.total_wait / handle.started * 1000, 2) if handle.started else 0.0,
+                    "max_queue_wait_ms": round(handle.max_wait * 1000, 2),
+                })
+        return {
+            "num_workers": self.num_workers,
+            "max_concurrency": self.max_concurrency,
+            "queued": sum(w["queued"] for w in workers),
+            "running": sum(w["running"] for w in workers),
+            "workers": workers,
+        }
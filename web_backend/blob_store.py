@@ -0,0 +1,204 @@
+"""
+上传文件的内容寻址存储
+
+- 上传内容按块流式写入磁盘，写盘和 SHA-256 计算都在线程池中执行，不阻塞事件循环
+- 以 SHA-256 作为 blob ID，相同内容只存储一份
+- 在流式接收过程中检查大小限制，超限立即中止
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+
+from cursor_agent_tools.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class UploadTooLargeError(Exception):
+    """上传内容超过大小限制"""
+
+
+class BlobWriter:
+    """
+    单个 blob 的增量写入器：边写入临时文件边计算 SHA-256，提交时按哈希去重
+
+    write/commit/abort 都是同步方法，应在线程池中调用。
+    """
+
+    def __init__(self, store: "BlobStore"):
+        self.store = store
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.root, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> None:
+        """写入一块数据，超过大小限制时抛出 UploadTooLargeError"""
+        self.size += len(data)
+        if self.size > self.store.max_size:
+            raise UploadTooLargeError(f"文件超过大小限制 {self.store.max_size} 字节")
+        self._hasher.update(data)
+        self._file.write(data)
+
+    def commit(self, filename: Optional[str], content_type: Optional[str]) -> Dict[str, Any]:
+        """完成写入，返回 blob 元数据；内容已存在时丢弃临时文件（去重）"""
+        self._file.close()
+        blob_id = self._hasher.hexdigest()
+        blob_path = self.store.blob_path(blob_id)
+
+        deduplicated = blob_path.exists()
+        if deduplicated:
+            os.remove(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, blob_path)
+
+        info = self.store.get(blob_id)
+        if info is None:
+            info = {
+                "blob_id": blob_id,
+                "filename": filename,
+                "content_type": content_type or "application/octet-stream",
+                "size": self.size,
+                "path": str(blob_path.absolute()),
+                "created_at": time.time(),
+            }
+            self.store.meta_path(blob_id).write_text(json.dumps(info), encoding="utf-8")
+
+        logger.info(f"Stored upload {filename} as blob {blob_id[:12]} ({self.size} bytes, deduplicated={deduplicated})")
+        return dict(info, filename=filename or info.get("filename"), deduplicated=deduplicated)
+
+    def abort(self) -> None:
+        """放弃写入并删除临时文件"""
+        try:
+            self._file.close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+class BlobStore:
+    """按 SHA-256 内容寻址的文件存储"""
+
+    def __init__(self, root: Path, max_size: int):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+    def blob_path(self, blob_id: str) -> Path:
+        return self.root / blob_id
+
+    def meta_path(self, blob_id: str) -> Path:
+        return self.root / f"{blob_id}.json"
+
+    def get(self, blob_id: str) -> Optional[Dict[str, Any]]:
+        """获取 blob 元数据，不存在时返回 None"""
+        # blob ID 是十六进制 SHA-256，拒绝其他输入以防路径穿越
+        if len(blob_id) != 64 or any(c not in "0123456789abcdef" for c in blob_id):
+            return None
+        meta_path = self.meta_path(blob_id)
+        if not meta_path.exists() or not self.blob_path(blob_id).exists():
+            return None
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+
+    def open_writer(self) -> BlobWriter:
+        return BlobWriter(self)
+
+    async def receive_multipart(
+        self, content_type: str, stream: AsyncIterator[bytes]
+    ) -> Tuple[Dict[str, List[str]], List[Dict[str, Any]]]:
+        """
+        流式解析 multipart/form-data 请求体：文件字段直接写入 blob，普通字段收集为文本
+
+        解析（包括文件写入和哈希计算）在线程池中执行，请求体不会整体缓存在内存中。
+
+        Returns:
+            (普通字段: name -> 值列表, 文件 blob 元数据列表)
+        """
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("multipart 请求缺少 boundary")
+
+        fields: Dict[str, List[str]] = {}
+        blobs: List[Dict[str, Any]] = []
+        state: Dict[str, Any] = {"header_field": b"", "header_value": b"", "headers": {}, "writer": None, "value": b""}
+
+        def on_part_begin() -> None:
+            state["headers"] = {}
+            state["writer"] = None
+            state["value"] = b""
+
+        def on_header_field(data: bytes, start: int, end: int) -> None:
+            state["header_field"] += data[start:end]
+
+        def on_header_value(data: bytes, start: int, end: int) -> None:
+            state["header_value"] += data[start:end]
+
+        def on_header_end() -> None:
+            state["headers"][state["header_field"].lower()] = state["header_value"]
+            state["header_field"] = b""
+            state["header_value"] = b""
+
+        def on_headers_finished() -> None:
+            _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+            state["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+            filename = disposition.get(b"filename")
+            state["filename"] = filename.decode("utf-8", "replace") if filename is not None else None
+            if state["filename"] is not None:
+                state["writer"] = self.open_writer()
+
+        def on_part_data(data: bytes, start: int, end: int) -> None:
+            if state["writer"] is not None:
+                state["writer"].write(data[start:end])
+            else:
+                state["value"] += data[start:end]
+                if len(state["value"]) > self.max_size:
+                    raise UploadTooLargeError("表单字段过大")
+
+        def on_part_end() -> None:
+            writer = state["writer"]
+            if writer is not None:
+                state["writer"] = None
+                if writer.size == 0 and not state["filename"]:
+                    writer.abort()  # 空的文件字段
+                    return
+                content_type = state["headers"].get(b"content-type", b"").decode("latin-1") or None
+                info = writer.commit(state["filename"], content_type)
+                info["field"] = state["name"]
+                blobs.append(info)
+            else:
+                fields.setdefault(state["name"], []).append(state["value"].decode("utf-8", "replace"))
+
+        parser = MultipartParser(boundary, {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        })
+
+        try:
+            async for chunk in stream:
+                if chunk:
+                    await run_in_threadpool(parser.write, chunk)
+            await run_in_threadpool(parser.finalize)
+        except BaseException:
+            if state["writer"] is not None:
+                await run_in_threadpool(state["writer"].abort)
+            raise
+
+        return fields, blobs
@@ -0,0 +1,240 @@
+"""
+负载测试脚本：并发打开 N 个会话，对 web_backend 发送聊天请求，统计延迟分位数和吞吐量
+
+配合本地模拟模型服务（cursor_agent_tools.mock_provider）使用，无需调用真实的 Anthropic / OpenAI 接口：
+
+    # 1. 启动模拟模型服务（首 token 延迟、输出速率、429 比例可调）
+    python -m cursor_agent_tools.mock_provider --port 8090 --latency lognormal:0.8,0.5 \\
+        --tokens-per-second 50 --rate-limit-rate 0.02 --seed 1
+
+    # 2. 让 web_backend 把模型请求发往模拟服务
+    ANTHROPIC_API_KEY=sk-ant-dummy ANTHROPIC_BASE_URL=http://127.0.0.1:8090 \\
+    OPENAI_API_KEY=sk-dummy-load-test-000000 OPENAI_BASE_URL=http://127.0.0.1:8090/v1 \\
+    OLLAMA_HOST=http://127.0.0.1:8090 python main.py
+
+    # 3. 运行负载测试
+    python load_test.py --sessions 50 --turns 5 --model gpt-4o --provider-url http://127.0.0.1:8090
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩法计算分位数（p 取 0~100）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class LoadResult:
+    """收集每个请求的结果"""
+
+    def __init__(self):
+        self.latencies: List[float] = []          # 成功轮次的总耗时
+        self.first_event: List[float] = []        # 流式模式下首个事件的耗时
+        self.statuses: Dict[str, int] = {}        # 按状态码（或异常类型）计数
+        self.errors: List[str] = []               # 错误样例（只保留前若干条）
+
+    def record(self, status: str, latency: Optional[float] = None, error: Optional[str] = None):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if latency is not None:
+            self.latencies.append(latency)
+        if error and len(self.errors) < 10:
+            self.errors.append(error)
+
+
+async def create_session(client: httpx.AsyncClient, args: argparse.Namespace) -> str:
+    """创建一个自动批准权限的会话"""
+    response = await client.post("/api/sessions", json={
+        "model": args.model,
+        "timeout": int(args.timeout),
+        "permission_config": {"yolo_mode": True},
+    })
+    response.raise_for_status()
+    return response.json()["session_id"]
+
+
+async def chat_turn(client: httpx.AsyncClient, session_id: str, message: str, result: LoadResult):
+    """通过 POST /api/chat 发送一轮对话"""
+    start = time.perf_counter()
+    response = await client.post("/api/chat", json={"session_id": session_id, "message": message})
+    elapsed = time.perf_counter() - start
+    if response.status_code == 200:
+        body = response.json()
+        # agent 内部的模型错误以 "Error: ..." 消息返回，状态码仍为 200
+        if str(body.get("message", "")).startswith("Error"):
+            result.record("agent_error", error=body["message"][:200])
+        else:
+            result.record("200", elapsed)
+    else:
+        result.record(str(response.status_code), error=response.text[:200])
+
+
+async def stream_turn(client: httpx.AsyncClient, session_id: str, message: str, result: LoadResult):
+    """通过 SSE（GET /api/chat/stream）发送一轮对话，读到 chat_complete 或 error 事件为止"""
+    start = time.perf_counter()
+    first_event = None
+    async with client.stream("GET", "/api/chat/stream", params={"session_id": session_id, "message": message}) as response:
+        if response.status_code != 200:
+            await response.aread()
+            result.record(str(response.status_code), error=response.text[:200])
+            return
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            if first_event is None:
+                first_event = time.perf_counter() - start
+            try:
+                event = json.loads(line[len("data: "):])
+            except json.JSONDecodeError as e:
+                result.record("stream_error", error=f"无法解析 SSE 事件: {e}")
+                return
+            if not isinstance(event, dict):
+                result.record("stream_error", error=f"SSE 事件不是 JSON 对象: {line[:200]}")
+                return
+            if event.get("type") == "error":
+                result.record("stream_error", error=str(event.get("data"))[:200])
+                return
+            if event.get("type") == "chat_complete":
+                break
+    result.record("200", time.perf_counter() - start)
+    if first_event is not None:
+        result.first_event.append(first_event)
+
+
+async def run_session(index: int, client: httpx.AsyncClient, args: argparse.Namespace, result: LoadResult):
+    """一个会话：创建后依次发送 turns 轮对话"""
+    # 按 ramp-up 时间错开各会话的开始时间
+    if args.ramp_up > 0:
+        await asyncio.sleep(args.ramp_up * index / max(args.sessions, 1))
+    try:
+        session_id = await create_session(client, args)
+    except Exception as e:
+        result.record("session_error", error=f"{type(e).__name__}: {e}")
+        return
+
+    turn = stream_turn if args.mode == "stream" else chat_turn
+    try:
+        for i in range(args.turns):
+            try:
+                await turn(client, session_id, f"{args.message} (turn {i + 1})", result)
+            except httpx.HTTPError as e:
+                result.record(type(e).__name__, error=f"{type(e).__name__}: {e}")
+    finally:
+        try:
+            await client.delete(f"/api/sessions/{session_id}")
+        except httpx.HTTPError:
+            pass
+
+
+async def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    """运行负载测试并返回统计报告"""
+    result = LoadResult()
+    limits = httpx.Limits(max_connections=args.sessions + 10, max_keepalive_connections=args.sessions + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        if args.provider_url:
+            # 清零模拟模型服务的统计，报告中只包含本次测试的请求
+            async with httpx.AsyncClient(base_url=args.provider_url, timeout=10) as provider:
+                await provider.post("/mock/reset", json={})
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(i, client, args, result) for i in range(args.sessions)))
+        duration = time.perf_counter() - start
+
+        provider_stats = None
+        if args.provider_url:
+            async with httpx.AsyncClient(base_url=args.provider_url, timeout=10) as provider:
+                provider_stats = (await provider.get("/mock/stats")).json()
+
+    ok = len(result.latencies)
+    total = sum(result.statuses.values())
+
+    def summary(values: List[float]) -> Dict[str, Optional[float]]:
+        return {
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None,
+        }
+
+    return {
+        "sessions": args.sessions,
+        "turns_per_session": args.turns,
+        "mode": args.mode,
+        "requests": total,
+        "succeeded": ok,
+        "statuses": result.statuses,
+        "duration": duration,
+        "throughput": ok / duration if duration > 0 else 0.0,
+        "latency": summary(result.latencies),
+        "first_event_latency": summary(result.first_event) if args.mode == "stream" else None,
+        "errors": result.errors,
+        "provider": provider_stats,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    """以表格形式打印报告"""
+    def fmt(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value * 1000:.0f} ms"
+
+    print("=" * 60)
+    print(f"会话数: {report['sessions']}，每个会话 {report['turns_per_session']} 轮（{report['mode']} 模式）")
+    print(f"请求数: {report['requests']}，成功: {report['succeeded']}，耗时: {report['duration']:.1f} s")
+    print(f"吞吐量: {report['throughput']:.2f} 轮/秒")
+    print("状态分布: " + ", ".join(f"{status}={count}" for status, count in sorted(report["statuses"].items())))
+    print()
+    rows = [("每轮耗时", report["latency"])]
+    if report["first_event_latency"]:
+        rows.append(("首个事件", report["first_event_latency"]))
+    print(" " * 10 + f"{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for name, values in rows:
+        # 中文字符占两列宽度
+        print(name + " " * (10 - 2 * len(name)) + "".join(f"{fmt(values[key]):>10}" for key in ("p50", "p90", "p99", "max")))
+    if report["provider"]:
+        print()
+        print(f"模拟模型服务: {json.dumps(report['provider'], ensure_ascii=False)}")
+    if report["errors"]:
+        print()
+        print("错误样例:")
+        for error in report["errors"]:
+            print(f"  - {error}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="web_backend 负载测试")
+    parser.add_argument("--base-url", default="http://localhost:8000", help="web_backend 地址")
+    parser.add_argument("--sessions", "-n", type=int, default=10, help="并发会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的对话轮数")
+    parser.add_argument("--model", default="claude-3-5-sonnet-latest", help="会话使用的模型")
+    parser.add_argument("--message", default="请查看工作目录中的文件并总结", help="发送的消息")
+    parser.add_argument("--mode", choices=("chat", "stream"), default="chat", help="chat: POST /api/chat；stream: SSE")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="在这段时间（秒）内逐步启动各会话")
+    parser.add_argument("--timeout", type=float, default=300.0, help="单个请求的超时时间（秒）")
+    parser.add_argument("--provider-url", default=None, help="模拟模型服务地址，用于在报告中附带其请求统计")
+    parser.add_argument("--json", action="store_true", help="以 JSON 格式输出报告")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n负载测试已取消")
+        sys.exit(1)
@@ -10,14 +10,14 @@ import threading
 import time
 from typing import Optional, List, Dict, Any
 from pathlib import Path
-import tempfile
-import shutil
 import time
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, status
+from fastapi import FastAPI, HTTPException, Form, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.exceptions import RequestValidationError
+from starlette.background import BackgroundTask
 import json
 from pydantic import BaseModel, Field
 import uvicorn
@@ -30,18 +30,53 @@ project_root = Path(__file__).parent.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
+# 添加 web_backend 目录到路径（本地辅助模块）
+backend_dir = Path(__file__).parent
+if str(backend_dir) not in sys.path:
+    sys.path.insert(0, str(backend_dir))
+
 from cursor_agent_tools import create_agent
-from cursor_agent_tools.permissions import PermissionOptions, PermissionRequest, PermissionStatus
-from cursor_agent_tools.logger import get_logger
+from cursor_agent_tools.permissions import (
+    GRANT_SCOPES, PermissionOptions, PermissionRequest, PermissionStatus, grant_for_request,
+)
+from cursor_agent_tools.logger import configure_logging, get_logger
+from cursor_agent_tools.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as METRICS
+from cursor_agent_tools.ollama_models import WarmPool
+from cursor_agent_tools.tracing import current_trace_id, start_span
+from cursor_agent_tools.usage import UsageBudget, empty_usage
+from blob_store import BlobStore, UploadTooLargeError
+from agent_workers import AgentWorkerPool
+from admission import AdmissionController, AdmissionRejected, tenant_key
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# 服务端默认在后台线程中格式化和输出日志，避免阻塞事件循环（CURSOR_AGENT_LOG_QUEUE=0 关闭）
+configure_logging(use_queue=os.getenv("CURSOR_AGENT_LOG_QUEUE", "1").lower() not in ("0", "false", "no"))
+
 # Initialize logger
 logger = get_logger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启用工作进程池时随应用启动和停止"""
+    if worker_pool is not None:
+        worker_pool.start()
+    if ollama_warm_pool is not None:
+        ollama_warm_pool.start()
+    try:
+        yield
+    finally:
+        if ollama_warm_pool is not None:
+            await ollama_warm_pool.stop()
+        if worker_pool is not None:
+            worker_pool.stop()
+
+
 # 初始化 FastAPI 应用
 app = FastAPI(
+    lifespan=lifespan,
     title="Code Agent API",
     description="AI驱动的编程助手API",
     version="1.0.0",
@@ -57,9 +92,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "traceparent"],  # 前端可读取 trace ID 以关联日志和 trace
 )
 
 
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """
+    为每个 HTTP 请求创建根 span（请求头带 traceparent 时沿用调用方的 trace），
+    通过 X-Trace-Id 和 traceparent 响应头返回 trace ID，并按路由记录请求耗时
+    """
+    with start_span(f"{request.method} {request.url.path}", {
+        "http.request.method": request.method,
+        "url.path": request.url.path,
+    }, parent=request.headers.get("traceparent"), kind="server") as span:
+        start_time = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            # 以路由模板作为标签和 span 名称，避免会话 ID 等路径参数让取值无限增多；
+            # SSE 等流式响应只统计到响应头返回为止
+            route = request.scope.get("route")
+            route_path = route.path if route is not None and hasattr(route, "path") else "<unmatched>"
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start_time, (request.method, route_path, str(status_code))
+            )
+        span.set_attribute("http.response.status_code", status_code)
+        if span.recording:
+            span.name = f"{request.method} {route_path}"
+            response.headers["X-Trace-Id"] = span.trace_id
+            response.headers["traceparent"] = span.traceparent
+        return response
+
+
 # 添加请求验证错误处理
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -72,6 +139,21 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         }
     )
 
+
+# 并发超限时返回 429，并通过 Retry-After 告知客户端建议的重试间隔
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """处理准入控制拒绝的请求"""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={
+            "detail": exc.message,
+            "reason": exc.reason,
+            "retry_after": exc.retry_after
+        },
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # 存储活跃的 agent 实例（实际生产环境应使用 Redis 或数据库）
 active_agents: Dict[str, Any] = {}
 
@@ -87,15 +169,101 @@ permission_events: Dict[str, Dict[str, threading.Event]] = {}
 # 存储事件循环引用（用于在后台线程中推送SSE消息）
 event_loops: Dict[str, asyncio.AbstractEventLoop] = {}
 
+# WebSocket 消息超过该字节数时以二进制帧发送（UTF-8 编码的 JSON）
+WS_BINARY_THRESHOLD = int(os.getenv("WS_BINARY_THRESHOLD", str(64 * 1024)))
+
 # 存储上传的文件
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# 单个上传文件的大小上限（字节），在流式接收过程中检查
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(50 * 1024 * 1024)))
+
+# 按 SHA-256 内容寻址的上传存储，相同内容只保存一份
+blob_store = BlobStore(UPLOAD_DIR / "blobs", MAX_UPLOAD_SIZE)
+
+# Agent 工作进程数量：大于 0 时 agent 在独立的工作进程中执行，不占用 API 进程的事件循环；
+# 0 表示在 API 进程内执行（默认）
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "0"))
+
+# 每个工作进程同时执行的请求数上限，超出的请求在工作进程中排队
+AGENT_WORKER_CONCURRENCY = int(os.getenv("AGENT_WORKER_CONCURRENCY", "4"))
+
+worker_pool: Optional[AgentWorkerPool] = (
+    AgentWorkerPool(AGENT_WORKERS, AGENT_WORKER_CONCURRENCY) if AGENT_WORKERS > 0 else None
+)
+
+# Ollama 模型常驻池：CURSOR_AGENT_OLLAMA_WARM_POOL 指定的模型（以及
+# CURSOR_AGENT_OLLAMA_WARM_POOL_SIZE 个最常用的模型）保持加载，避免请求等待模型冷加载；未配置时不启用
+ollama_warm_pool: Optional[WarmPool] = WarmPool.from_env()
+
+# 准入控制：全局并发上限（超出的请求排队）、等待队列长度和排队超时（秒），
+# 以及每个会话、每个租户（X-API-Key / Authorization，缺省按客户端 IP）的并发上限；0 表示不限制
+admission = AdmissionController(
+    global_limit=int(os.getenv("ADMISSION_GLOBAL_LIMIT", "32")),
+    queue_size=int(os.getenv("ADMISSION_QUEUE_SIZE", "64")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+    session_limit=int(os.getenv("ADMISSION_SESSION_LIMIT", "2")),
+    tenant_limit=int(os.getenv("ADMISSION_TENANT_LIMIT", "8"))
+)
+
 # 存储会话工作目录（每个会话有独立的工作目录）
 WORKSPACE_BASE_DIR = Path("workspaces")
 WORKSPACE_BASE_DIR.mkdir(exist_ok=True)
 
 
+# ==================== 运行指标 ====================
+
+# 当前打开的 SSE / WebSocket 事件流（session_id -> 连接数）
+event_streams: Dict[str, int] = {}
+
+HTTP_REQUEST_SECONDS = METRICS.histogram(
+    "cursor_agent_http_request_duration_seconds",
+    "HTTP request latency per route",
+    ("method", "route", "status"),
+)
+METRICS.gauge("cursor_agent_active_sessions", "Sessions with an agent", lambda: len(active_agents))
+METRICS.gauge(
+    "cursor_agent_event_stream_subscribers", "Open SSE and WebSocket event streams",
+    lambda: sum(event_streams.values()),
+)
+METRICS.gauge(
+    "cursor_agent_event_queue_depth", "Events waiting in session event queues",
+    lambda: sum(queue.qsize() for queue in list(sse_queues.values())),
+)
+METRICS.gauge(
+    "cursor_agent_pending_permissions", "Permission requests waiting for an answer",
+    lambda: sum(len(requests) for requests in list(pending_permissions.values())),
+)
+METRICS.gauge("cursor_agent_admission_in_flight", "Requests holding an admission slot", lambda: admission.stats()["in_flight"])
+METRICS.gauge("cursor_agent_admission_queued", "Requests waiting for an admission slot", lambda: admission.stats()["queued"])
+if worker_pool is not None:
+    METRICS.gauge(
+        "cursor_agent_worker_queued", "Calls queued in each agent worker process",
+        lambda: {(str(w["worker_id"]),): w["queued"] for w in worker_pool.stats()["workers"]}, ("worker",),
+    )
+    METRICS.gauge(
+        "cursor_agent_worker_running", "Calls running in each agent worker process",
+        lambda: {(str(w["worker_id"]),): w["running"] for w in worker_pool.stats()["workers"]}, ("worker",),
+    )
+    # 模型请求、工具调用和权限等待发生在工作进程中，汇总其上报的快照
+    METRICS.add_snapshot_source(worker_pool.metrics_snapshots)
+
+
+def open_event_stream(session_id: str) -> None:
+    """记录会话新打开了一个 SSE / WebSocket 事件流"""
+    event_streams[session_id] = event_streams.get(session_id, 0) + 1
+
+
+def close_event_stream(session_id: str) -> None:
+    """记录会话的一个事件流已关闭"""
+    remaining = event_streams.get(session_id, 0) - 1
+    if remaining > 0:
+        event_streams[session_id] = remaining
+    else:
+        event_streams.pop(session_id, None)
+
+
 # ==================== 请求/响应模型 ====================
 
 class AgentConfig(BaseModel):
@@ -110,15 +278,43 @@ class PermissionConfig(BaseModel):
     yolo_mode: bool = Field(False, description="YOLO模式：自动批准操作")
     command_allowlist: List[str] = Field(default_factory=list, description="命令白名单")
     command_denylist: List[str] = Field(default_factory=list, description="命令黑名单")
+    path_allowlist: List[str] = Field(default_factory=list, description="路径白名单（glob 模式）")
+    path_denylist: List[str] = Field(default_factory=list, description="路径黑名单（glob 模式）")
     delete_file_protection: bool = Field(True, description="文件删除保护")
 
 
+def _env_limit(name: str) -> Optional[float]:
+    """读取预算上限环境变量，未设置或为 0 表示不限制"""
+    value = float(os.getenv(name, "0") or 0)
+    return value if value > 0 else None
+
+
+class BudgetConfig(BaseModel):
+    """会话预算配置：超出后拒绝新的对话轮次，进行中的轮次在下一次模型请求前停止"""
+    max_tokens: Optional[int] = Field(
+        default_factory=lambda: int(_env_limit("SESSION_MAX_TOKENS") or 0) or None, ge=1,
+        description="会话可使用的 token 总数（输入、缓存和输出）"
+    )
+    max_cost: Optional[float] = Field(
+        default_factory=lambda: _env_limit("SESSION_MAX_COST"), gt=0, description="会话的预估费用上限（美元）"
+    )
+    max_seconds: Optional[float] = Field(
+        default_factory=lambda: _env_limit("SESSION_MAX_SECONDS"), gt=0, description="会话等待模型响应的总时间上限（秒）"
+    )
+
+    def to_budget(self) -> Optional[UsageBudget]:
+        if self.max_tokens is None and self.max_cost is None and self.max_seconds is None:
+            return None
+        return UsageBudget(max_tokens=self.max_tokens, max_cost=self.max_cost, max_seconds=self.max_seconds)
+
+
 class SessionCreateRequest(BaseModel):
     """创建会话请求模型"""
     model: str = Field(..., description="模型名称")
     temperature: float = Field(0.0, ge=0.0, le=1.0, description="温度参数")
     timeout: int = Field(180, ge=1, description="超时时间（秒）")
     permission_config: PermissionConfig = Field(default_factory=PermissionConfig, description="权限配置")
+    budget: BudgetConfig = Field(default_factory=BudgetConfig, description="会话预算（默认取 SESSION_MAX_* 环境变量）")
     workspace_path: Optional[str] = Field(None, description="工作目录路径（可选，如果不提供则自动创建）")
 
 
@@ -136,6 +332,9 @@ class ChatResponse(BaseModel):
     thinking: Optional[str] = Field(None, description="思考过程")
     session_id: str = Field(..., description="会话ID")
     pending_permissions: List[Dict[str, Any]] = Field(default_factory=list, description="待处理的权限请求")
+    usage: Optional[Dict[str, Any]] = Field(None, description="本轮和整个会话的 token、耗时和费用统计")
+    trace_id: Optional[str] = Field(default_factory=current_trace_id, description="本次请求的 trace ID")
+    cancelled: bool = Field(False, description="本轮是否已被取消")
 
 
 class ImageQueryRequest(BaseModel):
@@ -172,6 +371,8 @@ def create_permission_options(config: PermissionConfig) -> PermissionOptions:
         yolo_mode=config.yolo_mode,
         command_allowlist=config.command_allowlist,
         command_denylist=config.command_denylist,
+        path_allowlist=config.path_allowlist,
+        path_denylist=config.path_denylist,
         delete_file_protection=config.delete_file_protection
     )
     logger.info(f"Created permission options: yolo_mode={permission_options.yolo_mode}, "
@@ -181,6 +382,147 @@ def create_permission_options(config: PermissionConfig) -> PermissionOptions:
     return permission_options
 
 
+def push_session_event(session_id: str, event: Dict[str, Any]) -> None:
+    """
+    线程安全地向会话事件队列推送事件（不阻塞调用线程）
+
+    事件队列同时被 SSE 和 WebSocket 通道消费；没有订阅者或队列已满时丢弃事件。
+    """
+    loop = event_loops.get(session_id)
+    queue = sse_queues.get(session_id)
+    if not loop or not queue or not loop.is_running():
+        return
+
+    with start_span("sse.push", {"session.id": session_id, "sse.event_type": event.get("type")}) as span:
+        def _put() -> None:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning(f"Event queue full for session {session_id}, dropping {event.get('type')} event")
+                span.add_event("dropped", {"reason": "queue_full"})
+
+        loop.call_soon_threadsafe(_put)
+
+
+def record_session_usage(session_id: str, response: Any) -> None:
+    """从 agent 响应中更新会话的累计用量和最近一轮用量（进程内和工作进程模式一致）"""
+    session = active_agents.get(session_id)
+    usage = response.get("usage") if isinstance(response, dict) else None
+    if session is None or not usage:
+        return
+    session["usage"] = usage["session"]
+    session["last_turn_usage"] = {"turn": usage["turn"], "calls": usage["calls"]}
+
+
+def check_session_budget(session_id: str) -> None:
+    """会话预算已用完时拒绝新的对话轮次（429）"""
+    session = active_agents[session_id]
+    budget: Optional[UsageBudget] = session.get("budget")
+    reason = budget.exceeded(session["usage"]) if budget else None
+    if reason:
+        raise HTTPException(status_code=429, detail=f"会话预算已用完: {reason}")
+
+
+def create_agent_event_callback(session_id: str):
+    """创建 Agent 事件回调（工具开始/结束等进度事件），转发到会话事件队列"""
+    def event_callback(event_type: str, data: Dict[str, Any]) -> None:
+        push_session_event(session_id, {"type": event_type, "data": data})
+
+    return event_callback
+
+
+def apply_grant_choice(permission_request: PermissionRequest, permission_data: Dict[str, Any]) -> None:
+    """用户批准时选择了"记住"：把授权范围交给 PermissionManager，后续同类请求不再询问"""
+    grant_scope = permission_data.get("grant_scope")
+    if permission_data.get("status") == PermissionStatus.GRANTED and grant_scope:
+        try:
+            permission_request.grant = grant_for_request(
+                permission_request, grant_scope, permission_data.get("grant_value")
+            )
+        except ValueError as e:
+            logger.warning(f"Ignoring grant for permission request {permission_data['request_id']}: {str(e)}")
+
+
+def create_web_permission_batch_callback(session_id: str):
+    """创建 Web 批量权限回调：一轮中多个工具调用的权限通过一个 SSE 事件推送，用户一次处理"""
+    def permission_batch_callback(permission_requests: List[PermissionRequest]) -> List[PermissionStatus]:
+        """
+        每个请求仍登记到 pending_permissions（可单独处理），整批通过 permission_batch_request 事件推送，
+        同步等待全部处理完毕或超时（未处理的视为拒绝）
+
+        Args:
+            permission_requests: 本轮需要确认的权限请求
+
+        Returns:
+            List[PermissionStatus]: 与请求一一对应的权限状态
+        """
+        batch_id = str(uuid.uuid4())
+        sync_event = threading.Event()
+        if session_id not in permission_events:
+            permission_events[session_id] = {}
+        items = []
+        for permission_request in permission_requests:
+            request_id = str(uuid.uuid4())
+            # 批内请求共用一个事件：任一请求被处理都会唤醒等待线程
+            permission_events[session_id][request_id] = sync_event
+            items.append({
+                "request_id": request_id,
+                "batch_id": batch_id,
+                "operation": permission_request.operation,
+                "details": permission_request.details,
+                "status": None,
+                "created_at": time.time()
+            })
+        pending_permissions.setdefault(session_id, []).extend(items)
+        logger.info(f"Permission batch {batch_id} stored with {len(items)} requests")
+
+        push_session_event(session_id, {
+            "type": "permission_batch_request",
+            "data": {
+                "batch_id": batch_id,
+                "requests": [
+                    {"request_id": item["request_id"], "operation": item["operation"], "details": item["details"]}
+                    for item in items
+                ]
+            }
+        })
+
+        # 循环等待前端处理全部请求（最多等待 30 秒）
+        deadline = time.time() + 30.0
+        while any(item["status"] is None for item in items) and time.time() < deadline:
+            sync_event.wait(timeout=0.1)
+            sync_event.clear()
+
+        statuses = []
+        for permission_request, item in zip(permission_requests, items):
+            if item["status"] is None:
+                item["status"] = PermissionStatus.DENIED
+                item["timeout"] = True
+                push_session_event(session_id, {
+                    "type": "permission_timeout",
+                    "data": {"request_id": item["request_id"], "batch_id": batch_id}
+                })
+            apply_grant_choice(permission_request, item)
+            statuses.append(item["status"])
+            permission_events.get(session_id, {}).pop(item["request_id"], None)
+
+        granted = sum(status == PermissionStatus.GRANTED for status in statuses)
+        logger.info(f"Permission batch {batch_id} resolved: {granted}/{len(statuses)} granted")
+        push_session_event(session_id, {
+            "type": "permission_batch_resolved",
+            "data": {
+                "batch_id": batch_id,
+                "statuses": {
+                    item["request_id"]: "granted" if item["status"] == PermissionStatus.GRANTED else "denied"
+                    for item in items
+                }
+            }
+        })
+        return statuses
+
+    return permission_batch_callback
+
+
 def create_web_permission_callback(session_id: str):
     """创建 Web 权限回调函数（异步，支持SSE推送）"""
     def permission_callback(permission_request: PermissionRequest) -> PermissionStatus:
@@ -295,6 +637,8 @@ def create_web_permission_callback(session_id: str):
         # 事件被触发，获取权限状态（正常响应路径）
         status = permission_data.get("status", PermissionStatus.DENIED)
         logger.info(f"Permission request {request_id} resolved: {status}")
+
+        apply_grant_choice(permission_request, permission_data)
         
         # 推送权限响应结果（在后台线程中）
         def push_permission_resolved():
@@ -329,7 +673,13 @@ def create_web_permission_callback(session_id: str):
     return permission_callback
 
 
-def get_or_create_agent(session_id: str, config: AgentConfig, permission_config: PermissionConfig, workspace_path: Optional[str] = None) -> Any:
+def get_or_create_agent(
+    session_id: str,
+    config: AgentConfig,
+    permission_config: PermissionConfig,
+    workspace_path: Optional[str] = None,
+    budget: Optional[UsageBudget] = None
+) -> Any:
     """获取或创建 Agent 实例"""
     if session_id not in active_agents:
         permission_options = create_permission_options(permission_config)
@@ -359,22 +709,51 @@ def get_or_create_agent(session_id: str, config: AgentConfig, permission_config:
             session_workspace.mkdir(parents=True, exist_ok=True)
             logger.info(f"Created auto-generated workspace directory for session {session_id}: {session_workspace}")
         
-        agent = create_agent(
-            model=config.model,
-            temperature=config.temperature,
-            timeout=config.timeout,
-            permissions=permission_options,  # 修复：使用正确的参数名 permissions
-            permission_callback=permission_callback
-        )
-        
-        # 注册默认工具
-        agent.register_default_tools()
+        if worker_pool is not None:
+            # 在工作进程中创建 agent；权限请求和工具事件由进程池转发回本进程的回调
+            agent = worker_pool.create_session(
+                session_id,
+                agent_kwargs={
+                    "model": config.model,
+                    "temperature": config.temperature,
+                    "timeout": config.timeout,
+                    "permissions": permission_options,
+                },
+                workspace_path=str(session_workspace.absolute()),
+                permission_callback=permission_callback,
+                event_callback=create_agent_event_callback(session_id),
+                permission_batch_callback=create_web_permission_batch_callback(session_id),
+                usage_budget=budget
+            )
+        else:
+            agent = create_agent(
+                model=config.model,
+                temperature=config.temperature,
+                timeout=config.timeout,
+                permissions=permission_options,  # 修复：使用正确的参数名 permissions
+                permission_callback=permission_callback
+            )
+            
+            # 注册默认工具
+            agent.register_default_tools()
+
+            # 一轮中多个工具调用的权限合并为一次确认
+            agent.permission_manager.batch_callback = create_web_permission_batch_callback(session_id)
+
+            # 工具进度事件通过 SSE / WebSocket 推送到前端
+            agent.set_event_callback(create_agent_event_callback(session_id))
+
+            # 会话预算：用完后 agent 拒绝继续请求模型
+            agent.set_usage_budget(budget)
         
         active_agents[session_id] = {
             "agent": agent,
             "config": config,
             "permission_config": permission_config,
-            "workspace_path": str(session_workspace.absolute())  # 保存工作目录路径
+            "workspace_path": str(session_workspace.absolute()),  # 保存工作目录路径
+            "budget": budget,
+            "usage": empty_usage(),  # 会话累计用量，每轮对话结束后从响应中更新
+            "last_turn_usage": None,
         }
         
         # 初始化权限请求列表
@@ -407,7 +786,11 @@ async def root():
             "POST /api/chat": "发送聊天消息",
             "POST /api/upload": "上传文件",
             "POST /api/image-query": "图像查询",
-            "GET /api/models": "获取支持的模型列表"
+            "GET /api/models": "获取支持的模型列表",
+            "POST /api/sessions/{session_id}/cancel": "取消正在执行的请求",
+            "GET /api/workers": "Agent 工作进程池状态（排队深度等指标）",
+            "GET /api/admission": "准入控制状态（并发数、排队等待时间等指标）",
+            "WS /api/ws/{session_id}": "WebSocket 双向通道（聊天、事件、权限响应、取消）"
         }
     }
 
@@ -424,8 +807,11 @@ async def create_session(request: SessionCreateRequest):
         timeout=request.timeout
     )
     
-    # 创建 agent 实例（传递工作目录路径）
-    get_or_create_agent(session_id, config, request.permission_config, workspace_path=request.workspace_path)
+    # 创建 agent 实例（传递工作目录路径和会话预算）
+    get_or_create_agent(
+        session_id, config, request.permission_config,
+        workspace_path=request.workspace_path, budget=request.budget.to_budget()
+    )
     
     from datetime import datetime
     
@@ -448,19 +834,47 @@ async def get_session(session_id: str):
         "model": session["config"].model,
         "temperature": session["config"].temperature,
         "permission_config": session["permission_config"].dict(),
-        "workspace_path": session.get("workspace_path", "未设置")
+        "workspace_path": session.get("workspace_path", "未设置"),
+        "budget": session["budget"].to_dict() if session.get("budget") else None,
     }
 
 
+@app.get("/api/sessions/{session_id}/usage")
+async def get_session_usage(session_id: str):
+    """会话的 token、模型耗时和预估费用：整个会话的累计值、最近一轮的明细和预算剩余"""
+    if session_id not in active_agents:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    session = active_agents[session_id]
+    budget: Optional[UsageBudget] = session.get("budget")
+    return {
+        "session_id": session_id,
+        "usage": session["usage"],
+        "last_turn": session["last_turn_usage"],
+        "budget": budget.to_dict() if budget else None,
+        "remaining": budget.remaining(session["usage"]) if budget else None,
+        "budget_exceeded": budget.exceeded(session["usage"]) if budget else None,
+    }
+
+
+def describe_blob(info: Dict[str, Any]) -> str:
+    """生成引用已存储文件的消息片段（只给出 ID 和路径，不内联文件内容）"""
+    return (
+        f"\n文件: {info.get('filename') or info['blob_id']} "
+        f"(ID: {info['blob_id']}, {info['size']} 字节, 类型: {info.get('content_type')})\n"
+        f"路径: {info['path']}"
+    )
+
+
 async def process_chat_with_files(
     session_id: str,
     message: str,
     user_info: Optional[Dict[str, Any]] = None,
-    files: List[UploadFile] = []
+    files: Optional[List[Dict[str, Any]]] = None
 ) -> ChatResponse:
-    """处理聊天请求的通用逻辑"""
+    """处理聊天请求的通用逻辑（files 为已存储文件的 blob 元数据）"""
     if session_id not in active_agents:
         raise HTTPException(status_code=404, detail="会话不存在，请先创建会话")
+    check_session_budget(session_id)
     
     agent = active_agents[session_id]["agent"]
     
@@ -476,48 +890,15 @@ async def process_chat_with_files(
     if "workspace_path" not in user_info:
         user_info["workspace_path"] = workspace_path
     
-    # 处理上传的文件
-    file_contents = {}
+    # 附件按 blob ID 和路径引用，agent 需要时用 read_file 工具读取内容
     if files:
-        logger.info(f"Processing {len(files)} files in process_chat_with_files")
-        for file in files:
-            if file.filename:
-                logger.debug(f"Reading file: {file.filename}, content_type: {file.content_type}")
-                # 读取文件内容
-                content = await file.read()
-                logger.debug(f"Read {len(content)} bytes from {file.filename}")
-                try:
-                    # 尝试解码为文本
-                    text_content = content.decode('utf-8')
-                    file_contents[file.filename] = {
-                        "content": text_content,
-                        "size": len(content),
-                        "type": file.content_type or "text/plain"
-                    }
-                except UnicodeDecodeError:
-                    # 二进制文件，保存为 base64
-                    import base64
-                    base64_content = base64.b64encode(content).decode('utf-8')
-                    file_contents[file.filename] = {
-                        "content": base64_content,
-                        "size": len(content),
-                        "type": file.content_type or "application/octet-stream",
-                        "encoding": "base64"
-                    }
-    
-    # 如果有文件，将文件内容添加到消息中
-    if file_contents:
-        file_info_parts = []
-        for filename, file_data in file_contents.items():
-            if file_data.get("encoding") == "base64":
-                file_info_parts.append(f"\n文件: {filename} (二进制文件, {file_data['size']} 字节)")
-            else:
-                file_info_parts.append(f"\n文件: {filename}\n内容:\n{file_data['content']}")
+        logger.info(f"Referencing {len(files)} stored files in chat message")
+        file_info_parts = [describe_blob(info) for info in files]
         
         if message:
-            message = message + "\n\n" + "\n".join(file_info_parts)
+            message = message + "\n\n附件（可使用 read_file 工具读取）:" + "\n".join(file_info_parts)
         else:
-            message = "请分析以下文件内容:\n" + "\n".join(file_info_parts)
+            message = "请分析以下文件（可使用 read_file 工具读取）:\n" + "\n".join(file_info_parts)
     
     # 切换到会话工作目录（临时）
     import os
@@ -548,8 +929,33 @@ async def process_chat_with_files(
         # 直接调用 agent.chat，权限控制完全由回调函数处理
         # 回调函数会推送SSE到前端，然后循环等待用户响应（30秒超时）
         try:
-            response = await agent.chat(message=message, user_info=user_info)
+            # 在子任务中执行本轮对话：/cancel 只取消该子任务，当前请求仍能正常返回响应
+            chat_task = asyncio.create_task(agent.chat(message=message, user_info=user_info))
+            try:
+                await asyncio.wait([chat_task])
+            finally:
+                # 请求本身被取消（如连接断开）时，确保 agent 停止执行
+                if not chat_task.done():
+                    agent.cancel()
+                    chat_task.cancel()
+            
+            if chat_task.cancelled():
+                logger.info(f"Chat turn cancelled for session {session_id}")
+                if session_id in sse_queues:
+                    try:
+                        sse_queues[session_id].put_nowait({"type": "chat_cancelled", "data": {}})
+                    except asyncio.QueueFull:
+                        pass
+                return ChatResponse(
+                    message="请求已取消",
+                    session_id=session_id,
+                    pending_permissions=[],
+                    cancelled=True
+                )
+            
+            response = chat_task.result()
             logger.info("Agent.chat completed")
+            record_session_usage(session_id, response)
             
             # 通过SSE推送最终结果（如果SSE队列存在）
             if session_id in sse_queues:
@@ -561,7 +967,8 @@ async def process_chat_with_files(
                             "type": "message",
                             "data": {
                                 "message": message_content,
-                                "tool_calls": response.get("tool_calls", [])
+                                "tool_calls": response.get("tool_calls", []),
+                                "usage": response.get("usage")
                             }
                         })
                     else:
@@ -572,7 +979,7 @@ async def process_chat_with_files(
                     # 推送完成消息
                     await sse_queues[session_id].put({
                         "type": "chat_complete",
-                        "data": {}
+                        "data": {"trace_id": current_trace_id()}
                     })
                 except Exception as e:
                     logger.error(f"Failed to push final result via SSE: {str(e)}")
@@ -608,7 +1015,8 @@ async def process_chat_with_files(
             tool_calls=response.get("tool_calls", []),
             thinking=response.get("thinking"),
             session_id=session_id,
-            pending_permissions=[]
+            pending_permissions=[],
+            usage=response.get("usage")
         )
     else:
         # 向后兼容字符串响应
@@ -621,14 +1029,19 @@ async def process_chat_with_files(
 
 @app.get("/api/chat/stream")
 async def chat_stream(
+    request: Request,
     session_id: str,
     message: str,
     user_info: Optional[str] = None
 ):
-    """SSE流式聊天端点"""
+    """SSE流式聊天端点（客户端断开连接时取消正在执行的请求）"""
     # logger.info(f"Chat stream request received for session: {session_id}, message: {message}")
     if session_id not in active_agents:
         raise HTTPException(status_code=404, detail="会话不存在，请先创建会话")
+    check_session_budget(session_id)
+    
+    # 准入控制：在开始推送 SSE 之前申请执行名额，超限时直接返回 429
+    ticket = await admission.acquire(session_id, tenant_key(request.headers, request.client.host if request.client else None))
     
     # 创建SSE队列（如果不存在）
     if session_id not in sse_queues:
@@ -656,6 +1069,7 @@ async def chat_stream(
             except RuntimeError:
                 current_loop = asyncio.get_event_loop()
                 event_loops[session_id] = current_loop
+        open_event_stream(session_id)
         try:
             # 解析user_info
             parsed_user_info = None
@@ -678,6 +1092,7 @@ async def chat_stream(
             # 切换到工作目录
             import os
             original_cwd = os.getcwd()
+            chat_task: Optional[asyncio.Task] = None
             try:
                 os.chdir(workspace_path)
                 
@@ -689,6 +1104,14 @@ async def chat_stream(
                 chat_task = asyncio.create_task(agent.chat(message=message, user_info=parsed_user_info))
                 
                 while True:
+                    # 客户端已断开（如关闭页面）→ 取消 agent 执行，避免继续运行工具和消耗 token
+                    if await request.is_disconnected():
+                        logger.info(f"Client disconnected from chat stream, cancelling session {session_id}")
+                        agent.cancel()
+                        chat_task.cancel()
+                        return
+                    
+
                     # 创建「获取队列消息」的临时任务（每次循环重建，避免重复使用）
                     queue_task = asyncio.create_task(sse_queues[session_id].get())
                     
@@ -710,8 +1133,9 @@ async def chat_stream(
                     if queue_task in done:
                         try:
                             item = await queue_task  # 获取队列消息
-                            logger.info(f"正常消费：Pushing item {item} via SSE")
-                            yield f"data: {json.dumps(item, default=str)}\n\n"  # 序列化容错
+                            logger.debug("正常消费：Pushing item %s via SSE", item)
+                            with start_span("sse.send", {"session.id": session_id, "sse.event_type": item.get("type")}):
+                                yield f"data: {json.dumps(item, default=str)}\n\n"  # 序列化容错
                         except Exception as e:
                             logger.error(f"消费队列消息失败：{str(e)}")
                     else:
@@ -723,36 +1147,54 @@ async def chat_stream(
                 while not sse_queues[session_id].empty():
                     try:
                         item = await asyncio.wait_for(sse_queues[session_id].get(), timeout=0.1)
-                        logger.info(f"剩余消费：Pushing item {item} via SSE")
-                        yield f"data: {json.dumps(item)}\n\n"
+                        logger.debug("剩余消费：Pushing item %s via SSE", item)
+                        with start_span("sse.send", {"session.id": session_id, "sse.event_type": item.get("type")}):
+                            yield f"data: {json.dumps(item)}\n\n"
                     except asyncio.TimeoutError:
                         break
                 
+                # 本轮已被取消（/cancel）：通知前端后结束流
+                if chat_task.cancelled():
+                    logger.info(f"Chat turn cancelled for session {session_id}")
+                    yield f"data: {json.dumps({'type': 'chat_cancelled', 'data': {}})}\n\n"
+                    return
+                
                 # 获取chat结果
-                response = await chat_task
+                response = chat_task.result()
+                record_session_usage(session_id, response)
                 
                 # 发送最终消息
                 if isinstance(response, dict):
-                    yield f"data: {json.dumps({'type': 'message', 'data': {'message': response.get('message', ''), 'tool_calls': response.get('tool_calls', [])}})}\n\n"
-                    logger.info(f"最终消息：Pushing message {response.get('message', '')} via SSE")
+                    yield f"data: {json.dumps({'type': 'message', 'data': {'message': response.get('message', ''), 'tool_calls': response.get('tool_calls', []), 'usage': response.get('usage')}})}\n\n"
+                    logger.debug("最终消息：Pushing message %s via SSE", response.get("message", ""))
                 else:
                     yield f"data: {json.dumps({'type': 'message', 'data': {'message': str(response)}})}\n\n"
-                    logger.info(f"最终消息：Pushing message {str(response)} via SSE")
+                    logger.debug("最终消息：Pushing message %s via SSE", response)
                 
-                # 发送完成消息
-                yield f"data: {json.dumps({'type': 'chat_complete', 'data': {}})}\n\n"
+                # 发送完成消息（附带 trace ID，便于前端关联本轮对话的 trace）
+                yield f"data: {json.dumps({'type': 'chat_complete', 'data': {'trace_id': current_trace_id()}})}\n\n"
                 logger.info(f"完成消息：Pushing chat complete via SSE")
                 
             finally:
+                # 生成器被提前关闭（连接断开）时，确保 agent 停止执行
+                if chat_task is not None and not chat_task.done():
+                    agent.cancel()
+                    chat_task.cancel()
                 os.chdir(original_cwd)
                 
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Error in chat_stream: {str(e)}")
             yield f"data: {json.dumps({'type': 'error', 'data': {'message': str(e)}})}\n\n"
+        finally:
+            close_event_stream(session_id)
+            ticket.release()
     
     return StreamingResponse(
         event_generator(),
         media_type="text/event-stream",
+        background=BackgroundTask(ticket.release),  # 生成器未能启动时也释放名额
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
@@ -766,17 +1208,20 @@ async def chat(
     request: Request
 ):
     """发送聊天消息（支持文件附件，兼容 JSON 和 FormData）"""
+    tenant = tenant_key(request.headers, request.client.host if request.client else None)
     try:
         content_type = request.headers.get("content-type", "")
         
         # 判断是 FormData 还是 JSON
         if "multipart/form-data" in content_type:
-            # FormData 格式（带文件）
-            form = await request.form()
-            session_id = form.get("session_id")
-            message = form.get("message", "")
-            user_info_str = form.get("user_info")
-            files = form.getlist("files")
+            # FormData 格式（带文件）：流式解析，文件直接写入 blob 存储
+            try:
+                fields, blobs = await blob_store.receive_multipart(content_type, request.stream())
+            except UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            session_id = (fields.get("session_id") or [None])[0]
+            message = (fields.get("message") or [""])[0]
+            user_info_str = (fields.get("user_info") or [None])[0]
             
             if not session_id:
                 raise HTTPException(status_code=400, detail="session_id 是必需的")
@@ -790,72 +1235,80 @@ async def chat(
                 except:
                     pass
             
-            # 处理文件
-            file_list = []
-            if files:
-                logger.info(f"Processing {len(files)} file items from FormData")
-                for file_item in files:
-                    # 检查是否是 UploadFile 对象
-                    if isinstance(file_item, UploadFile):
-                        logger.debug(f"Found UploadFile: {file_item.filename}, size: {file_item.size if hasattr(file_item, 'size') else 'unknown'}")
-                        file_list.append(file_item)
-                    elif hasattr(file_item, 'filename') and file_item.filename:
-                        logger.debug(f"Found file-like object: {file_item.filename}")
-                        file_list.append(file_item)
-                    else:
-                        logger.warning(f"Skipping invalid file item: {type(file_item)}")
+            # 引用之前通过 /api/upload 上传的文件（file_ids 字段，可重复或逗号分隔）
+            for file_ids in fields.get("file_ids", []):
+                for file_id in filter(None, (fid.strip() for fid in file_ids.split(","))):
+                    info = blob_store.get(file_id)
+                    if info is None:
+                        raise HTTPException(status_code=404, detail=f"文件不存在: {file_id}")
+                    blobs.append(info)
             
-            logger.info(f"Processed {len(file_list)} valid files from FormData request")
+            logger.info(f"Processed {len(blobs)} files from FormData request")
             
-            return await process_chat_with_files(
-                str(session_id),
-                str(message) if message else "",
-                user_info_dict,
-                file_list
-            )
+            async with admission.admit(str(session_id), tenant):
+                return await process_chat_with_files(
+                    str(session_id),
+                    str(message) if message else "",
+                    user_info_dict,
+                    blobs
+                )
         else:
             # JSON 格式（向后兼容）
             body = await request.json()
             chat_request = ChatRequest(**body)
-            return await process_chat_with_files(
-                chat_request.session_id,
-                chat_request.message,
-                chat_request.user_info,
-                []
-            )
-    except HTTPException:
+            async with admission.admit(chat_request.session_id, tenant):
+                return await process_chat_with_files(
+                    chat_request.session_id,
+                    chat_request.message,
+                    chat_request.user_info,
+                    []
+                )
+    except (HTTPException, AdmissionRejected):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"处理请求时出错: {str(e)}")
 
 
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """上传文件"""
+async def upload_file(request: Request):
+    """
+    上传文件（multipart/form-data，字段名 file）
+
+    请求体按块流式写入磁盘并计算 SHA-256，相同内容只存储一份；返回的 file_id 即内容哈希，
+    可在 /api/chat 的 file_ids 字段中引用。
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"文件超过大小限制 {MAX_UPLOAD_SIZE} 字节")
+    
+    content_type = request.headers.get("content-type", "")
+    if "multipart/form-data" not in content_type:
+        raise HTTPException(status_code=400, detail="需要 multipart/form-data 请求")
+    
     try:
-        # 生成唯一文件名
-        file_id = str(uuid.uuid4())
-        file_extension = Path(file.filename).suffix if file.filename else ""
-        saved_filename = f"{file_id}{file_extension}"
-        file_path = UPLOAD_DIR / saved_filename
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        return {
-            "file_id": file_id,
-            "filename": file.filename,
-            "saved_path": str(file_path),
-            "size": file_path.stat().st_size,
-            "message": "文件上传成功"
-        }
+        _, blobs = await blob_store.receive_multipart(content_type, request.stream())
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
+    
+    if not blobs:
+        raise HTTPException(status_code=400, detail="请求中没有文件")
+    
+    info = blobs[0]
+    return {
+        "file_id": info["blob_id"],
+        "filename": info.get("filename"),
+        "saved_path": info["path"],
+        "size": info["size"],
+        "sha256": info["blob_id"],
+        "deduplicated": info.get("deduplicated", False),
+        "message": "文件上传成功"
+    }
 
 
 @app.post("/api/image-query")
-async def image_query(request: ImageQueryRequest):
+async def image_query(request: ImageQueryRequest, http_request: Request):
     """图像查询"""
     if request.session_id not in active_agents:
         raise HTTPException(status_code=404, detail="会话不存在")
@@ -867,17 +1320,19 @@ async def image_query(request: ImageQueryRequest):
         if not Path(image_path).exists():
             raise HTTPException(status_code=404, detail=f"图像文件不存在: {image_path}")
     
-    try:
-        response = await agent.query_image(
-            image_paths=request.image_paths,
-            query=request.query
-        )
-        return {
-            "response": response,
-            "session_id": request.session_id
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"图像查询失败: {str(e)}")
+    tenant = tenant_key(http_request.headers, http_request.client.host if http_request.client else None)
+    async with admission.admit(request.session_id, tenant):
+        try:
+            response = await agent.query_image(
+                image_paths=request.image_paths,
+                query=request.query
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"图像查询失败: {str(e)}")
+    return {
+        "response": response,
+        "session_id": request.session_id
+    }
 
 
 @app.get("/api/models")
@@ -905,6 +1360,9 @@ async def delete_session(session_id: str):
     session_data = active_agents[session_id]
     workspace_path = session_data.get("workspace_path")
     
+    # 停止仍在执行的请求，并释放 agent 持有的资源（持久 shell 等）
+    session_data["agent"].close()
+    
     del active_agents[session_id]
     if session_id in pending_permissions:
         del pending_permissions[session_id]
@@ -930,6 +1388,50 @@ async def delete_session(session_id: str):
     }
 
 
+@app.post("/api/sessions/{session_id}/cancel")
+async def cancel_session_turn(session_id: str):
+    """取消会话中正在执行的请求（中止模型请求、终止运行中的终端命令）"""
+    if session_id not in active_agents:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    
+    cancelled = active_agents[session_id]["agent"].cancel()
+    
+    # 拒绝仍在等待的权限请求，让权限回调立即返回
+    for perm in pending_permissions.get(session_id, []):
+        if perm.get("status") is None:
+            perm["status"] = PermissionStatus.DENIED
+            event = permission_events.get(session_id, {}).get(perm["request_id"])
+            if event:
+                event.set()
+    
+    logger.info(f"Cancel requested for session {session_id}: {'cancelled' if cancelled else 'nothing running'}")
+    return {
+        "session_id": session_id,
+        "cancelled": cancelled,
+        "message": "已取消正在执行的请求" if cancelled else "当前没有正在执行的请求"
+    }
+
+
+@app.get("/api/workers")
+async def get_workers():
+    """Agent 工作进程池状态：各工作进程的会话数、排队深度、执行中请求数和排队等待时间"""
+    if worker_pool is None:
+        return {"enabled": False, "message": "未启用工作进程池（设置 AGENT_WORKERS 启用）"}
+    return {"enabled": True, **worker_pool.stats()}
+
+
+@app.get("/api/admission")
+async def get_admission_stats():
+    """准入控制状态：当前并发数、排队数、拒绝次数和排队等待时间分布"""
+    return admission.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 指标：请求耗时、会话和事件流、模型请求耗时与 token、工具调用耗时与错误、权限等待时间"""
+    return Response(content=METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/api/sessions/{session_id}/permissions")
 async def get_pending_permissions(session_id: str):
     """获取待处理的权限请求"""
@@ -942,6 +1444,7 @@ async def get_pending_permissions(session_id: str):
             if perm.get("status") is None:  # 还未处理
                 pending_perms.append({
                     "request_id": perm["request_id"],
+                    "batch_id": perm.get("batch_id"),
                     "operation": perm["operation"],
                     "details": perm["details"]
                 })
@@ -949,15 +1452,29 @@ async def get_pending_permissions(session_id: str):
     return {"pending_permissions": pending_perms}
 
 
-@app.post("/api/sessions/{session_id}/permissions/{request_id}")
-async def respond_to_permission(
+async def resolve_permission(
     session_id: str,
     request_id: str,
-    status: str = Form(...)
-):
-    """响应权限请求"""
+    status: str,
+    scope: Optional[str] = None,
+    prefix: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    处理权限响应（HTTP 和 WebSocket 通道共用）
+
+    Args:
+        scope: 批准时记住授权的范围："session"（本会话内同类操作）、"path"（该目录下的文件操作）
+               或 "command"（以该前缀开头的命令）；不传则只批准本次
+        prefix: 路径或命令前缀，默认取请求文件所在目录 / 命令名（及子命令）
+
+    Raises:
+        HTTPException: 会话或权限请求不存在，请求已处理/已超时，或授权范围无效
+    """
     if session_id not in active_agents:
         raise HTTPException(status_code=404, detail="会话不存在")
+
+    if scope and scope not in GRANT_SCOPES:
+        raise HTTPException(status_code=400, detail=f"无效的授权范围: {scope}（可选: {', '.join(GRANT_SCOPES)}）")
     
     if session_id not in pending_permissions:
         raise HTTPException(status_code=404, detail="没有待处理的权限请求")
@@ -989,6 +1506,9 @@ async def respond_to_permission(
     
     # 设置权限状态
     if status.lower() == "granted":
+        if scope:
+            permission_data["grant_scope"] = scope
+            permission_data["grant_value"] = prefix
         permission_data["status"] = PermissionStatus.GRANTED
         logger.info(f"Permission GRANTED for request {request_id}: {permission_data.get('operation')}")
     else:
@@ -1024,10 +1544,286 @@ async def respond_to_permission(
     }
 
 
+@app.post("/api/sessions/{session_id}/permissions/{request_id}")
+async def respond_to_permission(
+    session_id: str,
+    request_id: str,
+    status: str = Form(...),
+    scope: Optional[str] = Form(None),
+    prefix: Optional[str] = Form(None)
+):
+    """响应权限请求；scope 可选，用于记住授权（session / path / command）"""
+    return await resolve_permission(session_id, request_id, status, scope, prefix)
+
+
+async def resolve_permission_batch(
+    session_id: str,
+    batch_id: str,
+    approve: str,
+    scope: Optional[str] = None,
+    prefix: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    一次处理一批权限请求（HTTP 和 WebSocket 通道共用）
+
+    Args:
+        approve: "all"（全部批准）、"none"（全部拒绝）或逗号分隔的 request_id（批准这些，拒绝其余）
+        scope / prefix: 对批准的请求记住授权，同 resolve_permission
+
+    Raises:
+        HTTPException: 会话或批次不存在，或批次中没有待处理的请求
+    """
+    if session_id not in active_agents:
+        raise HTTPException(status_code=404, detail="会话不存在")
+
+    batch = [perm for perm in pending_permissions.get(session_id, []) if perm.get("batch_id") == batch_id]
+    if not batch:
+        raise HTTPException(status_code=404, detail="权限批次不存在")
+    unresolved = [perm for perm in batch if perm.get("status") is None]
+    if not unresolved:
+        raise HTTPException(status_code=400, detail="权限批次已处理或已超时")
+
+    if approve == "all":
+        approved = {perm["request_id"] for perm in unresolved}
+    elif approve == "none":
+        approved = set()
+    else:
+        approved = {request_id.strip() for request_id in approve.split(",") if request_id.strip()}
+        unknown = approved - {perm["request_id"] for perm in batch}
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"批次中不存在的请求: {', '.join(sorted(unknown))}")
+
+    statuses = {}
+    for perm in unresolved:
+        status = "granted" if perm["request_id"] in approved else "denied"
+        await resolve_permission(session_id, perm["request_id"], status, scope if status == "granted" else None, prefix)
+        statuses[perm["request_id"]] = status
+
+    return {"message": "权限批次已处理", "batch_id": batch_id, "statuses": statuses}
+
+
+@app.post("/api/sessions/{session_id}/permissions/batch/{batch_id}")
+async def respond_to_permission_batch(
+    session_id: str,
+    batch_id: str,
+    approve: str = Form(...),
+    scope: Optional[str] = Form(None),
+    prefix: Optional[str] = Form(None)
+):
+    """一次响应一批权限请求：approve 为 all、none 或逗号分隔的 request_id"""
+    return await resolve_permission_batch(session_id, batch_id, approve, scope, prefix)
+
+
+def get_permission_manager(session_id: str):
+    """获取会话的 PermissionManager（工作进程模式下 agent 在子进程中，不可直接访问）"""
+    if session_id not in active_agents:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    permission_manager = getattr(active_agents[session_id]["agent"], "permission_manager", None)
+    if permission_manager is None:
+        raise HTTPException(status_code=400, detail="工作进程模式下不支持查看或撤销授权")
+    return permission_manager
+
+
+@app.get("/api/sessions/{session_id}/grants")
+async def get_permission_grants(session_id: str, audit_limit: int = 100):
+    """获取会话中记住的授权及最近的权限审计日志"""
+    permission_manager = get_permission_manager(session_id)
+    return {
+        "grants": permission_manager.list_grants(),
+        "audit_log": permission_manager.audit_log(audit_limit),
+    }
+
+
+@app.delete("/api/sessions/{session_id}/grants/{grant_id}")
+async def revoke_permission_grant(session_id: str, grant_id: str):
+    """撤销一条记住的授权"""
+    if not get_permission_manager(session_id).revoke_grant(grant_id):
+        raise HTTPException(status_code=404, detail="授权不存在")
+    return {"message": "授权已撤销", "grant_id": grant_id}
+
+
+# ==================== WebSocket 通道 ====================
+
+async def send_ws_event(websocket: WebSocket, event: Dict[str, Any]) -> None:
+    """发送一个事件；超过 WS_BINARY_THRESHOLD 的消息使用二进制帧"""
+    payload = json.dumps(event, default=str)
+    if len(payload) > WS_BINARY_THRESHOLD:
+        await websocket.send_bytes(payload.encode("utf-8"))
+    else:
+        await websocket.send_text(payload)
+
+
+async def run_session_chat(session_id: str, message: str, user_info: Optional[Dict[str, Any]]) -> Any:
+    """在会话工作目录中执行一次 agent.chat"""
+    session_data = active_agents[session_id]
+    agent = session_data["agent"]
+    workspace_path = session_data.get("workspace_path", str(WORKSPACE_BASE_DIR.absolute()))
+
+    user_info = dict(user_info or {})
+    if "workspace_path" not in user_info:
+        user_info["workspace_path"] = workspace_path
+
+    original_cwd = os.getcwd()
+    try:
+        os.chdir(workspace_path)
+        response = await agent.chat(message=message, user_info=user_info)
+    finally:
+        os.chdir(original_cwd)
+    record_session_usage(session_id, response)
+    return response
+
+
+@app.websocket("/api/ws/{session_id}")
+async def websocket_session(websocket: WebSocket, session_id: str):
+    """
+    WebSocket 双向通道：在一个连接上复用聊天、工具进度事件、权限请求/响应和取消
+
+    客户端消息（JSON，文本或二进制帧）：
+        {"type": "chat", "message": "...", "user_info": {...}}
+        {"type": "permission_response", "request_id": "...", "status": "granted|denied",
+         "scope": "session|path|command"（可选，记住授权）, "prefix": "..."（可选）}
+        {"type": "permission_batch_response", "batch_id": "...", "approve": "all|none|<request_id>,...",
+         "scope": "..."（可选）, "prefix": "..."（可选）}
+        {"type": "cancel"}
+        {"type": "ping"}
+
+    服务端消息与 SSE 通道的事件格式一致：{"type": "...", "data": {...}}
+    """
+    if session_id not in active_agents:
+        await websocket.close(code=4404, reason="session not found")
+        return
+
+    await websocket.accept()
+
+    if session_id not in sse_queues:
+        sse_queues[session_id] = asyncio.Queue(maxsize=100)
+    queue = sse_queues[session_id]
+    event_loops[session_id] = asyncio.get_running_loop()
+
+    chat_task: Optional[asyncio.Task] = None
+    tenant = tenant_key(websocket.headers, websocket.client.host if websocket.client else None)
+
+    async def forward_events() -> None:
+        """将会话事件队列中的事件转发到 WebSocket"""
+        while True:
+            item = await queue.get()
+            await send_ws_event(websocket, item)
+
+    async def run_chat(message: str, user_info: Optional[Dict[str, Any]]) -> None:
+        """执行一次聊天，并将结果推送到事件队列"""
+        try:
+            check_session_budget(session_id)
+        except HTTPException as e:
+            await queue.put({"type": "budget_exceeded", "data": {"message": e.detail}})
+            return
+        try:
+            ticket = await admission.acquire(session_id, tenant)
+        except AdmissionRejected as e:
+            await queue.put({
+                "type": "rate_limited",
+                "data": {"message": e.message, "reason": e.reason, "retry_after": e.retry_after}
+            })
+            return
+        await queue.put({"type": "message_start", "data": {"message": "开始处理请求..."}})
+        try:
+            # WebSocket 消息不经过 HTTP 中间件，每轮聊天单独作为一条 trace 的根 span
+            with start_span("websocket chat", {"session.id": session_id}, kind="server") as span:
+                response = await run_session_chat(session_id, message, user_info)
+            if isinstance(response, dict):
+                await queue.put({
+                    "type": "message",
+                    "data": {
+                        "message": response.get("message", ""),
+                        "tool_calls": response.get("tool_calls", []),
+                        "usage": response.get("usage"),
+                    }
+                })
+            else:
+                await queue.put({"type": "message", "data": {"message": str(response)}})
+            await queue.put({"type": "chat_complete", "data": {"trace_id": span.trace_id or None}})
+        except asyncio.CancelledError:
+            try:
+                queue.put_nowait({"type": "chat_cancelled", "data": {}})
+            except asyncio.QueueFull:
+                pass
+            raise
+        except Exception as e:
+            logger.error(f"Error in websocket chat: {str(e)}")
+            await queue.put({"type": "error", "data": {"message": str(e)}})
+        finally:
+            ticket.release()
+
+    sender_task = asyncio.create_task(forward_events())
+    open_event_stream(session_id)
+    try:
+        while True:
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                break
+
+            raw = frame.get("text")
+            try:
+                if raw is None and frame.get("bytes") is not None:
+                    raw = frame["bytes"].decode("utf-8")
+                payload = json.loads(raw or "")
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                await send_ws_event(websocket, {"type": "error", "data": {"message": "无效的 JSON 消息"}})
+                continue
+            if not isinstance(payload, dict):
+                # 消息必须是 JSON 对象，数组、字符串等其他值不处理，也不断开连接
+                await send_ws_event(websocket, {"type": "error", "data": {"message": "消息必须是 JSON 对象"}})
+                continue
+
+            message_type = payload.get("type")
+            if message_type == "chat":
+                if chat_task and not chat_task.done():
+                    await send_ws_event(websocket, {"type": "error", "data": {"message": "当前会话已有正在执行的请求"}})
+                    continue
+                chat_task = asyncio.create_task(run_chat(payload.get("message", ""), payload.get("user_info")))
+            elif message_type == "permission_response":
+                try:
+                    result = await resolve_permission(
+                        session_id, payload.get("request_id", ""), payload.get("status", "denied"),
+                        payload.get("scope"), payload.get("prefix")
+                    )
+                    await send_ws_event(websocket, {"type": "permission_ack", "data": result})
+                except HTTPException as e:
+                    await send_ws_event(websocket, {"type": "error", "data": {"message": e.detail}})
+            elif message_type == "permission_batch_response":
+                try:
+                    result = await resolve_permission_batch(
+                        session_id, payload.get("batch_id", ""), payload.get("approve", "none"),
+                        payload.get("scope"), payload.get("prefix")
+                    )
+                    await send_ws_event(websocket, {"type": "permission_ack", "data": result})
+                except HTTPException as e:
+                    await send_ws_event(websocket, {"type": "error", "data": {"message": e.detail}})
+            elif message_type == "cancel":
+                if chat_task and not chat_task.done():
+                    active_agents[session_id]["agent"].cancel()
+                    chat_task.cancel()
+            elif message_type == "ping":
+                await send_ws_event(websocket, {"type": "pong", "data": {}})
+            else:
+                await send_ws_event(websocket, {"type": "error", "data": {"message": f"未知的消息类型: {message_type}"}})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        logger.info(f"WebSocket closed for session {session_id}")
+        close_event_stream(session_id)
+        sender_task.cancel()
+        if chat_task and not chat_task.done():
+            # 客户端断开连接 → 停止 agent 执行
+            if session_id in active_agents:
+                active_agents[session_id]["agent"].cancel()
+            chat_task.cancel()
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        reload=True,
+        ws_per_message_deflate=True  # WebSocket 逐消息压缩（permessage-deflate）
     )
\ No newline at end of file